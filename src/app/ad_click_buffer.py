@@ -0,0 +1,443 @@
+"""
+Buffered ingestion of ad landing-page clicks.
+
+ad_landing records a click by appending one JSON line to this process's
+spool segment on local disk and returns; it never touches the database. A
+background writer closes the segment every AD_CLICK_FLUSH_SECONDS (sooner
+once AD_CLICK_BATCH_SIZE clicks are waiting) and inserts its rows in one
+batch: COPY on Postgres, executemany elsewhere. A segment is deleted only
+after its insert commits, so clicks survive a worker crash or restart;
+segments left behind by a dead process are claimed and written by the next
+writer to start.
+
+The same thread runs campaign_rollup every AD_CLICK_ROLLUP_INTERVAL seconds,
+so it is started even when clicks are written synchronously.
+
+Conversions whose click is not written yet (attribution.mark_conversion for
+a click still in some process's spool) are spooled as well. Each flush
+retries them once its clicks are written, and keeps retrying for up to
+AD_CLICK_CONVERSION_TTL_HOURS until the click row exists.
+
+Rows the database rejects (an IntegrityError or DataError, or a value the
+driver refuses) would fail their segment on every retry and block the segments
+behind it. When a batch is rejected, its rows are written one by one instead,
+and the rows that still fail are moved to a `.failed` file in the spool for
+inspection.
+
+Backpressure: when the database is slow or down, segments queue up on disk
+and the writer retries with exponential backoff; clicks arriving meanwhile
+simply make the next batch larger. Once the queued spool reaches
+AD_CLICK_SPOOL_MAX_MB new clicks are dropped (and counted in the log)
+rather than slowing the landing page.
+
+Environment:
+    AD_CLICK_BUFFERED        set to 0 to insert clicks synchronously (default on)
+    AD_CLICK_SPOOL_DIR       spool directory (default <tempdir>/ad_click_spool)
+    AD_CLICK_FLUSH_SECONDS   seconds between writes (default 2)
+    AD_CLICK_BATCH_SIZE      waiting clicks that trigger an early write (default 500)
+    AD_CLICK_SPOOL_MAX_MB    spool size at which new clicks are dropped (default 100)
+    AD_CLICK_USE_COPY        set to 0 to use executemany on Postgres too (default on)
+    AD_CLICK_CONVERSION_TTL_HOURS  hours a conversion waits for its click (default 24)
+"""
+import io
+import os
+import csv
+import json
+import glob
+import atexit
+import logging
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+import campaign_rollup
+
+MAX_BACKOFF_SECONDS = 60
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_segment = None        # open file of the active segment
+_segment_path = None
+_segment_pid = None
+_segment_rows = 0
+_sequence = 0
+_spool_bytes = 0       # approximate size of active plus queued segments
+_dropped = 0
+
+_app = None
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def is_buffered():
+    return os.environ.get('AD_CLICK_BUFFERED', '1') != '0'
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+def spool_dir():
+    return os.environ.get('AD_CLICK_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'ad_click_spool'))
+
+
+def _segment_name(pid, sequence, suffix):
+    return os.path.join(spool_dir(), f"clicks-{pid}-{sequence:08d}.{suffix}")
+
+
+def _open_segment():
+    """Open a new active segment for this process (caller holds _lock)"""
+    global _segment, _segment_path, _segment_pid, _segment_rows, _sequence
+    os.makedirs(spool_dir(), exist_ok=True)
+    _sequence += 1
+    _segment_pid = os.getpid()
+    _segment_path = _segment_name(_segment_pid, _sequence, 'jsonl')
+    _segment = open(_segment_path, 'a', encoding='utf-8')
+    _segment_rows = 0
+
+
+def _write_directly(click):
+    from models import db, AdClick
+    try:
+        db.session.execute(AdClick.__table__.insert(), [click])
+        db.session.commit()
+    except Exception as e:
+        logging.error(f"Error recording ad click: {str(e)}")
+        db.session.rollback()
+
+
+def _fit_columns(click):
+    """Remove NUL characters and cut strings to their column's length, so one bad utm value cannot fail a batch"""
+    from models import AdClick
+    for name, value in click.items():
+        if not isinstance(value, str):
+            continue
+        value = value.replace('\x00', '')
+        column = AdClick.__table__.columns.get(name)
+        length = getattr(column.type, 'length', None) if column is not None else None
+        click[name] = value[:length] if length else value
+    return click
+
+
+def record(**click):
+    """Queue one click (AdClick column values) for writing; never waits on the database"""
+    _fit_columns(click)
+    click.setdefault('timestamp', datetime.utcnow())
+    click.setdefault('converted', False)
+    if not is_buffered():
+        _write_directly(click)
+        return
+    _append(json.dumps({**click, 'timestamp': click['timestamp'].isoformat()}) + '\n')
+
+
+def record_conversion(click_id, conversion_type, queued_at=None):
+    """Queue a conversion to apply once its click has been written"""
+    conversion = {'click_id': click_id, 'conversion_type': conversion_type,
+                  'queued_at': (queued_at or datetime.utcnow()).isoformat()}
+    _append(json.dumps({'conversion': conversion}) + '\n')
+
+
+def _append(line):
+    """Add one line to this process's active segment"""
+    global _spool_bytes, _dropped, _segment_rows
+    try:
+        with _lock:
+            if _spool_bytes >= _setting('AD_CLICK_SPOOL_MAX_MB', 100) * 1024 * 1024:
+                _dropped += 1
+                return
+            if _segment is None or _segment_pid != os.getpid():
+                _open_segment()
+            _segment.write(line)
+            # Into the OS page cache, so the click survives this process crashing
+            _segment.flush()
+            _spool_bytes += len(line)
+            _segment_rows += 1
+            full = _segment_rows >= _setting('AD_CLICK_BATCH_SIZE', 500)
+    except OSError as e:
+        logging.error(f"Could not spool ad click: {e}")
+        return
+    if full:
+        _wake.set()
+
+
+def _rotate():
+    """Close the active segment so it can be written; returns its ready path or None"""
+    global _segment, _segment_path
+    with _lock:
+        if _segment is None or _segment_pid != os.getpid() or _segment_rows == 0:
+            return None
+        _segment.close()
+        ready = _segment_path[:-len('jsonl')] + 'ready'
+        os.replace(_segment_path, ready)
+        _segment = None
+        _segment_path = None
+        return ready
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def claim_orphans():
+    """Take over segments left by processes that are no longer running; returns how many"""
+    global _spool_bytes, _sequence
+    claimed = 0
+    # .failed files hold rejected rows and are never replayed
+    paths = glob.glob(os.path.join(spool_dir(), 'clicks-*-*.jsonl')) + \
+        glob.glob(os.path.join(spool_dir(), 'clicks-*-*.ready'))
+    for path in sorted(paths):
+        try:
+            pid = int(os.path.basename(path).split('-')[1])
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        with _lock:
+            _sequence += 1
+            target = _segment_name(os.getpid(), _sequence, 'ready')
+        try:
+            # Rename is atomic, so only one process claims each segment
+            os.rename(path, target)
+        except OSError:
+            continue
+        with _lock:
+            _spool_bytes += os.path.getsize(target)
+        claimed += 1
+    if claimed:
+        logging.warning(f"Recovered {claimed} ad click spool segments from stopped processes")
+    return claimed
+
+
+def _read_segment(path):
+    """Return the (clicks, conversions) spooled in a segment"""
+    rows = []
+    conversions = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+                if 'conversion' in row:
+                    conversions.append(row['conversion'])
+                    continue
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by a crash mid-write
+                continue
+            rows.append(row)
+    return rows, conversions
+
+
+def _copy_rows(connection, table, columns, rows):
+    """Bulk-load rows with Postgres COPY, through a temporary table so replayed clicks are skipped"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row.get(c).isoformat() if isinstance(row.get(c), datetime) else row.get(c)
+                         for c in columns])
+    buffer.seek(0)
+    names = ', '.join(columns)
+    connection.exec_driver_sql(
+        f"CREATE TEMP TABLE ad_click_load ON COMMIT DROP AS SELECT {names} FROM {table.name} WITH NO DATA")
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY ad_click_load ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    connection.exec_driver_sql(
+        f"INSERT INTO {table.name} ({names}) SELECT {names} FROM ad_click_load ON CONFLICT (click_id) DO NOTHING")
+
+
+def _insert_statement(connection, table):
+    """INSERT that skips clicks already written, by click_id"""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return table.insert()
+    return insert(table).on_conflict_do_nothing(index_elements=['click_id'])
+
+
+def _insert(rows):
+    """Insert clicks in one transaction. Segments are written at least once (a worker can die
+    after the insert commits but before the segment is removed), so replayed clicks are skipped."""
+    from app import db
+    from models import AdClick
+    table = AdClick.__table__
+    # Segments spooled by an older release may lack newer columns
+    present = set().union(*rows)
+    columns = [c for c in table.columns.keys() if c in present]
+    rows = [{c: row.get(c) for c in columns} for row in rows]
+    with db.engine.begin() as connection:
+        use_copy = (connection.dialect.name == 'postgresql' and os.environ.get('AD_CLICK_USE_COPY', '1') != '0'
+                    and hasattr(connection.connection.dbapi_connection, 'cursor'))
+        if use_copy:
+            try:
+                with connection.begin_nested():
+                    _copy_rows(connection, table, columns, rows)
+                return
+            except Exception as e:
+                logging.warning(f"COPY of ad clicks failed, using executemany: {e}")
+        connection.execute(_insert_statement(connection, table), rows)
+
+
+def _apply_conversions(conversions):
+    """Apply spooled conversions, queueing again those whose click is still missing"""
+    import attribution
+    pending = attribution.apply_pending(conversions)
+    cutoff = datetime.utcnow() - timedelta(hours=_setting('AD_CLICK_CONVERSION_TTL_HOURS', 24))
+    waiting = [c for c in pending if datetime.fromisoformat(c['queued_at']) > cutoff]
+    if len(pending) > len(waiting):
+        logging.warning(f"Gave up on {len(pending) - len(waiting)} ad conversions whose click was never written")
+    for conversion in waiting:
+        _append(json.dumps({'conversion': conversion}) + '\n')
+
+
+def _is_rejected(e):
+    """Whether an insert failed because of the rows themselves, so retrying cannot succeed"""
+    if isinstance(e, (sa.exc.IntegrityError, sa.exc.DataError, ValueError, TypeError)):
+        return True
+    # Raised by the driver before the statement reaches the database, e.g. psycopg2 refusing NUL
+    return isinstance(e, sa.exc.StatementError) and not isinstance(e, sa.exc.DBAPIError)
+
+
+def _write_rows(path, rows):
+    """Insert a segment's clicks, moving rows the database rejects to a .failed file; returns clicks written"""
+    try:
+        _insert(rows)
+        return len(rows)
+    except Exception as e:
+        if not _is_rejected(e):
+            raise
+        logging.warning(f"Ad click batch {os.path.basename(path)} was rejected, writing it row by row: {e}")
+
+    failed = []
+    for row in rows:
+        try:
+            _insert([row])
+        except Exception as e:
+            if not _is_rejected(e):
+                raise
+            failed.append(row)
+    if failed:
+        failed_path = path[:-len('ready')] + 'failed'
+        with open(failed_path, 'a', encoding='utf-8') as f:
+            for row in failed:
+                f.write(json.dumps(row, default=lambda value: value.isoformat()) + '\n')
+        logging.error(f"Moved {len(failed)} ad clicks that could not be written to {failed_path}")
+    return len(rows) - len(failed)
+
+
+def flush():
+    """Write every queued segment of this process; returns the number of clicks written"""
+    with _flush_lock:
+        return _flush()
+
+
+def _flush():
+    global _spool_bytes, _dropped
+    _rotate()
+    with _lock:
+        dropped, _dropped = _dropped, 0
+    if dropped:
+        logging.warning(f"Dropped {dropped} ad clicks while the spool was full")
+
+    written = 0
+    for path in sorted(glob.glob(os.path.join(spool_dir(), f"clicks-{os.getpid()}-*.ready"))):
+        size = os.path.getsize(path)
+        rows, conversions = _read_segment(path)
+        # Both raise on failure so the segment stays queued for the next attempt
+        if rows:
+            written += _write_rows(path, rows)
+        if conversions:
+            _apply_conversions(conversions)
+        os.remove(path)
+        with _lock:
+            _spool_bytes = max(0, _spool_bytes - size)
+    return written
+
+
+def _run_forever():
+    backoff = 0
+    next_rollup = time.monotonic()
+    while True:
+        _wake.wait(backoff or _setting('AD_CLICK_FLUSH_SECONDS', 2))
+        _wake.clear()
+        try:
+            with _app.app_context():
+                flush()
+            backoff = 0
+        except Exception as e:
+            backoff = min(MAX_BACKOFF_SECONDS, max(1, backoff * 2))
+            logging.error(f"Could not write ad clicks, retrying in {backoff}s: {e}")
+            continue
+        interval = _setting('AD_CLICK_ROLLUP_INTERVAL', 60)
+        if interval > 0 and time.monotonic() >= next_rollup:
+            next_rollup = time.monotonic() + interval
+            try:
+                with _app.app_context():
+                    campaign_rollup.run_rollup()
+            except Exception as e:
+                logging.error(f"Error rolling up ad clicks: {e}")
+
+
+def _flush_at_exit():
+    if _app is not None and _thread_pid == os.getpid():
+        try:
+            with _app.app_context():
+                flush()
+        except Exception as e:
+            # The segments stay in the spool for the next process to claim
+            logging.error(f"Error writing ad clicks at exit: {e}")
+
+
+def start(app):
+    """Start the click writer for this process if it is not already running"""
+    global _app, _thread, _thread_pid, _spool_bytes
+    with _thread_lock:
+        # Threads do not survive a fork, so each worker process starts its own
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+        _app = app
+        with _lock:
+            _spool_bytes = 0
+        try:
+            claim_orphans()
+        except OSError as e:
+            logging.error(f"Could not recover ad click spool: {e}")
+        _thread = threading.Thread(target=_run_forever, name="ad-click-writer", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+atexit.register(_flush_at_exit)
+
+
+def init_app(app):
+    """Register the flush-ad-clicks and rollup-ad-clicks commands and start the writer on the first request"""
+    if 'ad_click_buffer' in app.extensions:
+        return
+    app.extensions['ad_click_buffer'] = True
+    campaign_rollup.init_app(app)
+
+    @app.cli.command('flush-ad-clicks')
+    def flush_ad_clicks_command():
+        """Write spooled ad clicks, including those left by stopped processes."""
+        claim_orphans()
+        print(f"{flush()} ad clicks written")
+
+    @app.before_request
+    def _start_click_writer():
+        if _thread_pid != os.getpid():
+            start(app)
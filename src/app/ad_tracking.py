@@ -3,9 +3,11 @@ Ad Tracking and Analytics module for campaign attribution and tracking
 """
 import logging
 from datetime import datetime
-from flask import Blueprint, render_template, request, session, redirect, url_for
-from models import db
-from models import AdClick
+from flask import Blueprint, render_template, request, session, jsonify, abort
+from flask_login import login_required, current_user
+import ad_click_buffer
+import attribution
+import campaign_rollup
 
 # Create blueprint
 ad_tracking = Blueprint('ad_tracking', __name__)
@@ -40,21 +42,20 @@ def ad_landing(campaign_id):
     session['ad_medium'] = medium
     session['ad_timestamp'] = datetime.utcnow().isoformat()
     
-    # Record click in database
-    try:
-        click = AdClick()
-        click.campaign_id = campaign_id
-        click.source = source
-        click.medium = medium
-        click.content = content
-        click.ip_address = request.remote_addr
-        click.user_agent = request.user_agent.string
-        click.timestamp = datetime.utcnow()
-        db.session.add(click)
-        db.session.commit()
-    except Exception as e:
-        logging.error(f"Error recording ad click: {str(e)}")
-        db.session.rollback()
+    # Registrations and upgrades from this session are attributed to the click by its id
+    click_id = attribution.new_click_id()
+    attribution.remember_click(click_id)
+    
+    # Queue the click; it is written to the database in batches off the request path
+    ad_click_buffer.record(
+        click_id=click_id,
+        campaign_id=campaign_id,
+        source=source,
+        medium=medium,
+        content=content,
+        ip_address=request.remote_addr,
+        user_agent=request.user_agent.string
+    )
     
     # Get ad message for this campaign
     ad_message = AD_MESSAGES.get(campaign_id, "Your AI-Powered Legal Assistant")
@@ -71,10 +72,22 @@ def ad_landing(campaign_id):
     return render_template('ad_landing.html', ad_message=ad_message)
 
 @ad_tracking.route('/admin/campaigns')
+@login_required
 def view_campaigns():
-    """Admin interface to view campaign performance"""
-    # Could be implemented later if needed
-    return redirect(url_for('home'))
+    """Campaign clicks and conversions from the hourly rollups (moderators only)"""
+    if not current_user.is_moderator():
+        abort(403)
+    
+    hours = max(1, request.args.get('hours', 168, type=int))
+    limit = max(1, request.args.get('limit', 20, type=int))
+    campaign_id = request.args.get('campaign') or None
+    group_by = [dimension for dimension in request.args.get('group_by', 'campaign,source,medium,hour').split(',')
+                if dimension in campaign_rollup.DIMENSIONS]
+    report = campaign_rollup.report(hours=hours, group_by=group_by, campaign_id=campaign_id, limit=limit)
+    
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify(report)
+    return render_template('campaigns.html', report=report)
 
 @ad_tracking.route('/ad-documentation')
 def ad_documentation():
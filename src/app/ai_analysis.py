@@ -5,13 +5,18 @@ import logging
 import random
 # Set logging level to DEBUG
 logging.basicConfig(level=logging.DEBUG)
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app as app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort, current_app as app
 from flask_login import login_required, current_user
 from models import Case, LegalAnalysis, Document
 from app import db
 from ai_helpers import analyze_case_description, recommend_documents
 import anthropic_helper
 import legal_knowledge_base as lkb
+import structured_output
+import rate_limits
+import ai_usage
+import provider_clients
+import tracing
 
 ai = Blueprint('ai', __name__)
 
@@ -208,6 +213,7 @@ def generate_fallback_documents(case):
     return {"document_recommendations": document_recommendations}
 
 
+@tracing.traced("fallback.generated")
 def generate_fallback_analysis(case):
     """
     Generate reliable fallback analysis data when API services fail.
@@ -425,8 +431,184 @@ def generate_fallback_analysis(case):
         "winning_strategy": winning_strategy
     }
 
+def default_winning_strategy(issue_type):
+    """Return a generic winning strategy for the case type, used when the AI result has none"""
+    if issue_type.lower() == "criminal":
+        return {
+            "primary_approach": "Strategic defense focusing on constitutional protections and procedural rights",
+            "attack_defense_tactics": [
+                "Challenge procedural errors in case processing",
+                "Focus on constitutional protections relevant to this specific case",
+                "Identify potential weaknesses in prosecution's evidence"
+            ],
+            "procedural_motions": [
+                "Motion for discovery of all relevant evidence",
+                "Targeted motions based on specific case facts"
+            ],
+            "evidence_challenges": "Carefully analyze all evidence for potential challenges to admissibility",
+            "hearing_objections": "Make timely objections during hearings to preserve issues for appeal",
+            "timing_strategy": "File strategically timed motions for maximum impact"
+        }
+    elif issue_type.lower() in ["civil", "personal_injury", "housing"]:
+        return {
+            "primary_approach": "Strategic civil litigation approach focusing on burden of proof and evidence",
+            "attack_defense_tactics": [
+                "Establish strong factual foundation through discovery",
+                "Focus on applicable statutory and case law",
+                "Develop compelling narrative supported by evidence"
+            ],
+            "procedural_motions": [
+                "Strategic discovery requests",
+                "Motions for summary judgment if applicable",
+                "Motions in limine to exclude harmful evidence"
+            ],
+            "evidence_challenges": "Ensure all evidence meets admissibility standards and authenticates properly",
+            "hearing_objections": "Strategic objections to preserve record and limit opposing evidence",
+            "timing_strategy": "Time filings strategically within procedural deadlines"
+        }
+    elif issue_type.lower() == "contract":
+        return {
+            "primary_approach": "Contract interpretation and enforcement strategy",
+            "attack_defense_tactics": [
+                "Focus on contract terms and interpretation principles",
+                "Establish performance or breach based on contract terms",
+                "Analyze applicable contract law and precedent"
+            ],
+            "procedural_motions": [
+                "Motion for production of all contract-related documents",
+                "Potential motion for summary judgment if terms are clear"
+            ],
+            "evidence_challenges": "Ensure all contract-related evidence is properly authenticated",
+            "hearing_objections": "Object to parol evidence if inconsistent with written terms",
+            "timing_strategy": "Strategic timing of filings based on contract dispute timeline"
+        }
+    elif issue_type.lower() == "family":
+        return {
+            "primary_approach": "Family law strategy focusing on equitable outcomes",
+            "attack_defense_tactics": [
+                "Focus on relevant family law standards",
+                "Build compelling case based on statutory factors",
+                "Consider mediation and negotiation strategies"
+            ],
+            "procedural_motions": [
+                "Motion for temporary orders if needed",
+                "Discovery motions for financial or parenting information"
+            ],
+            "evidence_challenges": "Ensure evidence meets relevance and admissibility standards",
+            "hearing_objections": "Strategic objections to inadmissible or prejudicial evidence",
+            "timing_strategy": "Time filings to address immediate needs while building long-term case"
+        }
+    elif issue_type.lower() == "bankruptcy":
+        return {
+            "primary_approach": "Strategic bankruptcy approach focusing on debt relief and asset protection",
+            "attack_defense_tactics": [
+                "Proper application of bankruptcy code provisions",
+                "Complete disclosure with strategic presentation",
+                "Address creditor challenges proactively"
+            ],
+            "procedural_motions": [
+                "Motion for automatic stay if contested",
+                "Motions to determine secured status of claims if applicable"
+            ],
+            "evidence_challenges": "Ensure all financial documentation is accurate and complete",
+            "hearing_objections": "Object to improper creditor claims or procedures",
+            "timing_strategy": "Strategic timing of filing and procedural steps"
+        }
+    elif issue_type.lower() == "immigration":
+        return {
+            "primary_approach": "Immigration advocacy strategy focusing on eligibility and procedural rights",
+            "attack_defense_tactics": [
+                "Focus on meeting eligibility requirements",
+                "Address procedural issues in proceedings",
+                "Build compelling equitable case if discretion applies"
+            ],
+            "procedural_motions": [
+                "Motion to present additional evidence if applicable",
+                "Motion for continuance if additional preparation needed"
+            ],
+            "evidence_challenges": "Ensure all supporting documentation is properly authenticated",
+            "hearing_objections": "Object to improper evidence or procedural errors",
+            "timing_strategy": "Meet all filing deadlines with complete submissions"
+        }
+    else:
+        # Default generic strategy
+        return {
+            "primary_approach": "Strategic legal approach tailored to your specific case",
+            "attack_defense_tactics": [
+                "Focus on applicable legal standards",
+                "Develop case-specific strategy based on facts and law",
+                "Build compelling narrative supported by evidence"
+            ],
+            "procedural_motions": [
+                "Strategic discovery requests",
+                "Case-appropriate motions based on specific issues"
+            ],
+            "evidence_challenges": "Ensure all evidence meets admissibility standards",
+            "hearing_objections": "Make timely and relevant objections during proceedings",
+            "timing_strategy": "Strategic timing of all procedural steps"
+        }
+
+@tracing.traced("db.save_case_law_analysis")
+def save_case_law_analysis(case, result):
+    """
+    Store a case law analysis as the case's current version and update the
+    case's precedents and winning strategy from it. Returns the analysis.
+    """
+    # Make sure result has the required structure
+    structured_output.apply_schema(result, 'case_law', defaults={
+        "winning_strategy": lambda: default_winning_strategy(case.issue_type)
+    })
+    logging.info(f"Storing case law analysis with structure: {list(result.keys())}")
+    
+    references = json.dumps(result)
+    # Save as a new version; earlier ones are kept as history and pruned by
+    # analysis_compactor
+    analysis = LegalAnalysis.create_analysis(
+        case_id=case.id,
+        analysis_type='case_law',
+        content="Comprehensive Legal Analysis generated by Due Process AI",
+        references=references,
+        confidence_score=0.95
+    )
+    
+    # Update case with precedent cases and the AI-calculated winning strategy
+    case.precedent_cases = references
+    if result.get('winning_strategy'):
+        case.legal_strategy = json.dumps(result.get('winning_strategy'))
+    db.session.commit()
+    return analysis
+
+@tracing.traced("db.save_document_recommendations")
+def save_document_recommendations(case, result):
+    """Store document recommendations as the case's current version; returns the analysis"""
+    logging.info(f"Storing document recommendations with {len(result.get('document_recommendations', []))} documents")
+    # Save as a new version; earlier ones are kept as history
+    return LegalAnalysis.create_analysis(
+        case_id=case.id,
+        analysis_type='document_recommendations',
+        content="Strategic document plan generated by Due Process AI",
+        references=json.dumps(result),
+        confidence_score=0.95
+    )
+
+@ai.route('/admin/ai-usage')
+@login_required
+def ai_usage_report():
+    """AI provider usage and estimated cost by feature, user, case and model (moderators only)"""
+    if not current_user.is_moderator():
+        abort(403)
+    
+    hours = max(1, request.args.get('hours', 24, type=int))
+    limit = max(1, request.args.get('limit', 20, type=int))
+    group_by = [dimension for dimension in request.args.get('group_by', 'feature,user,case,model').split(',')
+                if dimension in ai_usage.DIMENSIONS]
+    # Include this process's buffered calls
+    ai_usage.flush()
+    return jsonify(ai_usage.report(hours=hours, group_by=group_by, limit=limit))
+
 @ai.route('/case/<int:case_id>/ai-analysis', methods=['GET', 'POST'])
 @login_required
+@rate_limits.ai_limited(methods=('POST',))
 def case_ai_analysis(case_id):
     """Generate AI-powered legal analysis for a case"""
     case = Case.get_case_by_id(case_id)
@@ -439,8 +621,8 @@ def case_ai_analysis(case_id):
         return redirect(url_for('cases.dashboard'))
     
     # Check if analysis already exists
-    case_law_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'case_law')
-    doc_recommendations = LegalAnalysis.get_by_case_and_type(case_id, 'document_recommendations')
+    case_law_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'case_law', with_payload=True)
+    doc_recommendations = LegalAnalysis.get_by_case_and_type(case_id, 'document_recommendations', with_payload=True)
     
     # Initialize default values
     case_law_data = {}
@@ -555,156 +737,7 @@ def case_ai_analysis(case_id):
                         flash('AI services are not configured. We\'ve generated a basic analysis instead.', 'warning')
                 
                 # Store the complete analysis result as structured data
-                # Make sure result has the required structure
-                if "rights_assessment" not in result:
-                    result["rights_assessment"] = []
-                if "case_law_suggestions" not in result:
-                    result["case_law_suggestions"] = []
-                if "winning_strategy" not in result:
-                    # Generate strategy based on case type
-                    if case.issue_type.lower() == "criminal":
-                        result["winning_strategy"] = {
-                            "primary_approach": "Strategic defense focusing on constitutional protections and procedural rights",
-                            "attack_defense_tactics": [
-                                "Challenge procedural errors in case processing",
-                                "Focus on constitutional protections relevant to this specific case",
-                                "Identify potential weaknesses in prosecution's evidence"
-                            ],
-                            "procedural_motions": [
-                                "Motion for discovery of all relevant evidence",
-                                "Targeted motions based on specific case facts"
-                            ],
-                            "evidence_challenges": "Carefully analyze all evidence for potential challenges to admissibility",
-                            "hearing_objections": "Make timely objections during hearings to preserve issues for appeal",
-                            "timing_strategy": "File strategically timed motions for maximum impact"
-                        }
-                    elif case.issue_type.lower() in ["civil", "personal_injury", "housing"]:
-                        result["winning_strategy"] = {
-                            "primary_approach": "Strategic civil litigation approach focusing on burden of proof and evidence",
-                            "attack_defense_tactics": [
-                                "Establish strong factual foundation through discovery",
-                                "Focus on applicable statutory and case law",
-                                "Develop compelling narrative supported by evidence"
-                            ],
-                            "procedural_motions": [
-                                "Strategic discovery requests",
-                                "Motions for summary judgment if applicable",
-                                "Motions in limine to exclude harmful evidence"
-                            ],
-                            "evidence_challenges": "Ensure all evidence meets admissibility standards and authenticates properly",
-                            "hearing_objections": "Strategic objections to preserve record and limit opposing evidence",
-                            "timing_strategy": "Time filings strategically within procedural deadlines"
-                        }
-                    elif case.issue_type.lower() == "contract":
-                        result["winning_strategy"] = {
-                            "primary_approach": "Contract interpretation and enforcement strategy",
-                            "attack_defense_tactics": [
-                                "Focus on contract terms and interpretation principles",
-                                "Establish performance or breach based on contract terms",
-                                "Analyze applicable contract law and precedent"
-                            ],
-                            "procedural_motions": [
-                                "Motion for production of all contract-related documents",
-                                "Potential motion for summary judgment if terms are clear"
-                            ],
-                            "evidence_challenges": "Ensure all contract-related evidence is properly authenticated",
-                            "hearing_objections": "Object to parol evidence if inconsistent with written terms",
-                            "timing_strategy": "Strategic timing of filings based on contract dispute timeline"
-                        }
-                    elif case.issue_type.lower() == "family":
-                        result["winning_strategy"] = {
-                            "primary_approach": "Family law strategy focusing on equitable outcomes",
-                            "attack_defense_tactics": [
-                                "Focus on relevant family law standards",
-                                "Build compelling case based on statutory factors",
-                                "Consider mediation and negotiation strategies"
-                            ],
-                            "procedural_motions": [
-                                "Motion for temporary orders if needed",
-                                "Discovery motions for financial or parenting information"
-                            ],
-                            "evidence_challenges": "Ensure evidence meets relevance and admissibility standards",
-                            "hearing_objections": "Strategic objections to inadmissible or prejudicial evidence",
-                            "timing_strategy": "Time filings to address immediate needs while building long-term case"
-                        }
-                    elif case.issue_type.lower() == "bankruptcy":
-                        result["winning_strategy"] = {
-                            "primary_approach": "Strategic bankruptcy approach focusing on debt relief and asset protection",
-                            "attack_defense_tactics": [
-                                "Proper application of bankruptcy code provisions",
-                                "Complete disclosure with strategic presentation",
-                                "Address creditor challenges proactively"
-                            ],
-                            "procedural_motions": [
-                                "Motion for automatic stay if contested",
-                                "Motions to determine secured status of claims if applicable"
-                            ],
-                            "evidence_challenges": "Ensure all financial documentation is accurate and complete",
-                            "hearing_objections": "Object to improper creditor claims or procedures",
-                            "timing_strategy": "Strategic timing of filing and procedural steps"
-                        }
-                    elif case.issue_type.lower() == "immigration":
-                        result["winning_strategy"] = {
-                            "primary_approach": "Immigration advocacy strategy focusing on eligibility and procedural rights",
-                            "attack_defense_tactics": [
-                                "Focus on meeting eligibility requirements",
-                                "Address procedural issues in proceedings",
-                                "Build compelling equitable case if discretion applies"
-                            ],
-                            "procedural_motions": [
-                                "Motion to present additional evidence if applicable",
-                                "Motion for continuance if additional preparation needed"
-                            ],
-                            "evidence_challenges": "Ensure all supporting documentation is properly authenticated",
-                            "hearing_objections": "Object to improper evidence or procedural errors",
-                            "timing_strategy": "Meet all filing deadlines with complete submissions"
-                        }
-                    else:
-                        # Default generic strategy
-                        result["winning_strategy"] = {
-                            "primary_approach": "Strategic legal approach tailored to your specific case",
-                            "attack_defense_tactics": [
-                                "Focus on applicable legal standards",
-                                "Develop case-specific strategy based on facts and law",
-                                "Build compelling narrative supported by evidence"
-                            ],
-                            "procedural_motions": [
-                                "Strategic discovery requests",
-                                "Case-appropriate motions based on specific issues"
-                            ],
-                            "evidence_challenges": "Ensure all evidence meets admissibility standards",
-                            "hearing_objections": "Make timely and relevant objections during proceedings",
-                            "timing_strategy": "Strategic timing of all procedural steps"
-                    }
-                
-                # Log the structure before storing
-                logging.info(f"Storing case law analysis with structure: {list(result.keys())}")
-                
-                # Format as JSON string
-                references = json.dumps(result)
-                content = "Comprehensive Legal Analysis generated by Due Process AI"
-                
-                # Delete any existing analysis of this type
-                existing_analysis = LegalAnalysis.query.filter_by(
-                    case_id=case_id, 
-                    analysis_type='case_law'
-                ).all()
-                for analysis in existing_analysis:
-                    db.session.delete(analysis)
-                db.session.commit()
-                
-                # Create new analysis record
-                case_law_analysis = LegalAnalysis.create_analysis(
-                    case_id=case_id,
-                    analysis_type='case_law',
-                    content=content,
-                    references=references,
-                    confidence_score=0.95
-                )
-                
-                # Update case with precedent cases
-                case.precedent_cases = references
-                db.session.commit()
+                case_law_analysis = save_case_law_analysis(case, result)
                 
                 # Check if we have rights violations
                 if result.get('rights_assessment'):
@@ -716,12 +749,6 @@ def case_ai_analysis(case_id):
                 else:
                     flash('Case law analysis generated successfully!', 'success')
                     
-                # Check if we have a winning strategy
-                if result.get('winning_strategy'):
-                    # Update case with the AI-calculated winning strategy
-                    winning_strategy = json.dumps(result.get('winning_strategy'))
-                    case.legal_strategy = winning_strategy
-                    db.session.commit()
                 
             elif analysis_type == 'document_recommendations':
                 # Default empty result in case all attempts fail
@@ -793,30 +820,8 @@ def case_ai_analysis(case_id):
                         if fallback_docs["document_recommendations"]:
                             result["document_recommendations"][i] = fallback_docs["document_recommendations"][0]
                 
-                # Log the structure before storing
-                logging.info(f"Storing document recommendations with {len(result.get('document_recommendations', []))} documents")
-                
                 # Store the complete document strategy as structured data
-                references = json.dumps(result)
-                content = "Strategic document plan generated by Due Process AI"
-                
-                # Delete any existing recommendations of this type
-                existing_recommendations = LegalAnalysis.query.filter_by(
-                    case_id=case_id, 
-                    analysis_type='document_recommendations'
-                ).all()
-                for recommendation in existing_recommendations:
-                    db.session.delete(recommendation)
-                db.session.commit()
-                
-                # Create analysis record
-                doc_recommendations = LegalAnalysis.create_analysis(
-                    case_id=case_id,
-                    analysis_type='document_recommendations',
-                    content=content,
-                    references=references,
-                    confidence_score=0.95
-                )
+                doc_recommendations = save_document_recommendations(case, result)
                 
                 # Count critical documents
                 doc_count = len(result.get('document_recommendations', []))
@@ -833,7 +838,7 @@ def case_ai_analysis(case_id):
             app.logger.error(traceback.format_exc())
             
             # Check API keys status
-            openai_configured = bool(os.environ.get("OPENAI_API_KEY"))
+            openai_configured = bool(provider_clients.get_api_key("openai"))
             anthropic_configured = anthropic_helper.is_available()
             
             if not openai_configured and not anthropic_configured:
@@ -869,12 +874,8 @@ def case_ai_analysis(case_id):
             # Log the actual data before parsing
             logging.debug(f"Raw case_law_analysis.references: {case_law_analysis.references}")
             
-            # Try to parse JSON (handle string or dict)
-            case_law_data_parsed = None
-            if isinstance(case_law_analysis.references, str):
-                case_law_data_parsed = json.loads(case_law_analysis.references)
-            elif isinstance(case_law_analysis.references, dict):
-                case_law_data_parsed = case_law_analysis.references
+            # Parsed once per analysis version; copied because placeholders are patched below
+            case_law_data_parsed = case_law_analysis.get_data(copy_result=True)
                 
             logging.debug(f"Parsed case_law_data structure: {type(case_law_data_parsed)}")
             
@@ -1038,12 +1039,8 @@ def case_ai_analysis(case_id):
             # Log the actual data before parsing
             logging.debug(f"Raw doc_recommendations.references: {doc_recommendations.references}")
             
-            # Try to parse JSON (handle string or dict)
-            doc_data_parsed = None
-            if isinstance(doc_recommendations.references, str):
-                doc_data_parsed = json.loads(doc_recommendations.references)
-            elif isinstance(doc_recommendations.references, dict):
-                doc_data_parsed = doc_recommendations.references
+            # Parsed once per analysis version; copied because the structure is patched below
+            doc_data_parsed = doc_recommendations.get_data(copy_result=True)
                 
             logging.debug(f"Parsed doc_recommendations_data structure: {type(doc_data_parsed)}")
             
@@ -1088,6 +1085,7 @@ def case_ai_analysis(case_id):
 
 @ai.route('/api/case/<int:case_id>/generate-document-strategy', methods=['POST'])
 @login_required
+@rate_limits.ai_limited()
 def generate_document_strategy(case_id):
     """AJAX endpoint to generate an AI document strategy for a specific document type"""
     app.logger.info(f"Document strategy generation requested for case {case_id}")
@@ -1133,18 +1131,18 @@ def generate_document_strategy(case_id):
     # Try to generate strategy
     strategy = None
     try:
-        import openai
         import json
         import os
+        import provider_clients
         
         # Try OpenAI first if available
-        openai_api_key = os.environ.get('OPENAI_API_KEY')
+        openai_api_key = provider_clients.get_api_key('openai')
         if openai_api_key:
             try:
                 app.logger.info(f"Generating document strategy with OpenAI for {doc_type}")
                 
-                # Initialize OpenAI client
-                client = openai.OpenAI(api_key=openai_api_key)
+                # Use the shared, pooled OpenAI client
+                client = provider_clients.get_openai_client()
                 
                 # Create a focused prompt for this specific document type
                 prompt = f"""Generate a detailed legal strategy for creating a {doc_type} for a {issue_type} case in {court_type}.
@@ -1312,6 +1310,7 @@ Format the information in a clear, structured way with headers for each section.
 
 @ai.route('/api/case/<int:case_id>/generate-advanced-strategy', methods=['POST'])
 @login_required
+@rate_limits.ai_limited(cost=2)
 def advanced_strategy_api(case_id):
     """Generate advanced legal strategy (premium feature)"""
     app.logger.info(f"Received advanced strategy request for case {case_id}")
@@ -1470,6 +1469,7 @@ def advanced_strategy_api(case_id):
 
 @ai.route('/api/case/<int:case_id>/calculate-success-probability', methods=['POST'])
 @login_required
+@rate_limits.ai_limited()
 def success_probability_api(case_id):
     """Calculate success probability (premium feature)"""
     app.logger.info(f"Received success probability request for case {case_id}")
@@ -1502,8 +1502,9 @@ def success_probability_api(case_id):
                 court_type=case.court_type
             )
             
-            # Calculate probability percentage
-            probability = probability_result.get('success_probability', 0.5) * 100
+            # Providers answer on either scale; normalize to 0-1 before converting to a percentage
+            structured_output.apply_schema(probability_result, 'success_probability')
+            probability = probability_result['success_probability'] * 100
             confidence = probability_result.get('confidence_level', 'Medium')
             factors = probability_result.get('key_factors', [])
             suggestions = probability_result.get('improvement_suggestions', [])
@@ -13,16 +13,31 @@ logging.basicConfig(level=logging.INFO)
 # Import Anthropic helper for fallback
 import anthropic_helper
 
-# Configure OpenAI
+# OpenAI clients come from the shared registry so connections are pooled
+import provider_clients
+import prompt_budget
+import structured_output
+import tracing
+
 try:
-    from openai import OpenAI
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    import openai
     MODEL = "gpt-4o"  # Using the most capable model
 except ImportError:
     logging.warning("OpenAI SDK not found, some AI features may be limited")
-    client = None
     MODEL = None
 
+# Tokens reserved for the fixed instructions surrounding the case description
+INSTRUCTION_RESERVE_TOKENS = 1500
+
+def fit_description(description, model=None):
+    """Shorten a case description so the full prompt stays within the token budget"""
+    return prompt_budget.truncate_to_tokens(
+        description,
+        prompt_budget.MAX_INPUT_TOKENS - INSTRUCTION_RESERVE_TOKENS,
+        model or MODEL or prompt_budget.DEFAULT_MODEL
+    )
+
+@tracing.traced("fallback.anthropic")
 def fallback_to_anthropic(description, issue_type, court_type):
     """
     Try to use Anthropic's Claude as a fallback when OpenAI is unavailable or fails
@@ -99,6 +114,7 @@ def fallback_to_anthropic(description, issue_type, court_type):
         }
     }
 
+@tracing.traced("ai.analyze_case_description")
 def analyze_case_description(description, issue_type, court_type):
     """
     Analyze a case description and suggest relevant case law.
@@ -127,6 +143,8 @@ def analyze_case_description(description, issue_type, court_type):
             }
         }
     
+    description = fit_description(description)
+    
     try:
         # For tribal court cases, check for special considerations
         if 'tribal' in court_type.lower() or 'cfr' in court_type.lower():
@@ -142,8 +160,10 @@ def analyze_case_description(description, issue_type, court_type):
                 logging.warning("Tribal court helper not available, using standard analysis")
         
         # Check if OpenAI is configured
+        client = provider_clients.get_openai_client() if MODEL else None
         if not client or not MODEL:
             logging.error("OpenAI API not configured")
+            tracing.set_attribute("ai.fallback_reason", "openai_not_configured")
             return fallback_to_anthropic(description, issue_type, court_type)
         
         # Customize prompt based on case type
@@ -221,28 +241,34 @@ def analyze_case_description(description, issue_type, court_type):
                     {"role": "user", "content": prompt}
                 ],
                 response_format={"type": "json_object"},
-                temperature=0.2
+                temperature=0.2,
+                max_tokens=prompt_budget.max_tokens_for(prompt, MODEL, 2000)
             )
             
             content = response.choices[0].message.content
             if content:
                 try:
-                    result = json.loads(content)
+                    with tracing.span("parse.openai_json"):
+                        result = json.loads(content)
                     return result
                 except json.JSONDecodeError:
                     logging.error("Failed to parse OpenAI response as JSON")
+                    tracing.set_attribute("ai.fallback_reason", "invalid_json")
                     return fallback_to_anthropic(description, issue_type, court_type)
             else:
+                tracing.set_attribute("ai.fallback_reason", "empty_response")
                 return fallback_to_anthropic(description, issue_type, court_type)
                 
-        except Exception:
+        except Exception as e:
             logging.error("OpenAI API error")
+            tracing.set_attribute("ai.fallback_reason", type(e).__name__)
             return fallback_to_anthropic(description, issue_type, court_type)
             
     except Exception as e:
         logging.error(f"Error in analyze_case_description: {str(e)}")
         return fallback_to_anthropic(description, issue_type, court_type)
 
+@tracing.traced("ai.recommend_documents")
 def recommend_documents(description, issue_type, court_type):
     """
     Recommend documents for a case based on its description.
@@ -265,6 +291,8 @@ def recommend_documents(description, issue_type, court_type):
             ]
         }
     
+    description = fit_description(description)
+    
     try:
         # For tribal cases, use specialized recommendations
         if 'tribal' in court_type.lower() or 'cfr' in court_type.lower():
@@ -277,6 +305,7 @@ def recommend_documents(description, issue_type, court_type):
                 logging.warning("Tribal court helper not available, using standard recommendations")
         
         # Check if OpenAI is configured
+        client = provider_clients.get_openai_client() if MODEL else None
         if not client or not MODEL:
             logging.error("OpenAI API not configured for document recommendations")
             # Try fallback
@@ -392,7 +421,8 @@ def recommend_documents(description, issue_type, court_type):
                 {"role": "user", "content": prompt}
             ],
             response_format={"type": "json_object"},
-            temperature=0.2
+            temperature=0.2,
+            max_tokens=prompt_budget.max_tokens_for(prompt, MODEL, 2000)
         )
         
         content = response.choices[0].message.content
@@ -443,15 +473,12 @@ def generate_legal_strategy(case_id, description, issue_type, court_type, eviden
         # Import legal knowledge base here to avoid circular imports
         import legal_knowledge_base as lkb
         
+        description = fit_description(description)
+        
         # Try OpenAI first
-        if os.environ.get('OPENAI_API_KEY'):
+        if provider_clients.get_api_key('openai'):
             try:
-                import openai
-                from openai import OpenAI
-
-                client = OpenAI(
-                    api_key=os.environ.get('OPENAI_API_KEY')
-                )
+                client = provider_clients.get_openai_client()
                 
                 # Adapt strategy prompt based on case type
                 if issue_type.lower() == 'criminal':
@@ -498,7 +525,8 @@ and aggressive defense/offense tactics specifically tailored to this type of cas
                         {"role": "user", "content": user_prompt}
                     ],
                     response_format={"type": "json_object"},
-                    temperature=0.7
+                    temperature=0.7,
+                    max_tokens=prompt_budget.max_tokens_for(user_prompt, "gpt-4o", 2000, system_prompt)
                 )
                 
                 content = response.choices[0].message.content
@@ -629,15 +657,12 @@ def calculate_success_probability(case_id, description, issue_type, court_type,
         # Import here to avoid circular imports
         import legal_knowledge_base as lkb
         
+        description = fit_description(description)
+        
         # Try OpenAI first
-        if os.environ.get('OPENAI_API_KEY'):
+        if provider_clients.get_api_key('openai'):
             try:
-                import openai
-                from openai import OpenAI
-
-                client = OpenAI(
-                    api_key=os.environ.get('OPENAI_API_KEY')
-                )
+                client = provider_clients.get_openai_client()
                 
                 # Create detailed prompt for probability assessment
                 user_prompt = f"""For the following case, calculate the probability of success:
@@ -667,7 +692,8 @@ and typical outcomes for similar cases in this jurisdiction.
                         {"role": "user", "content": user_prompt}
                     ],
                     response_format={"type": "json_object"},
-                    temperature=0.4
+                    temperature=0.4,
+                    max_tokens=prompt_budget.max_tokens_for(user_prompt, "gpt-4o", 1000)
                 )
                 
                 content = response.choices[0].message.content
@@ -683,20 +709,13 @@ and typical outcomes for similar cases in this jurisdiction.
                 except json.JSONDecodeError:
                     logging.error("Failed to parse OpenAI probability JSON response")
                     # Try to extract JSON from the response if it contains markdown or explanatory text
-                    import re
-                    # Make sure content is a string for regex
-                    if content and isinstance(content, str):
-                        json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-                        if json_match:
-                            try:
-                                probability_result = json.loads(json_match.group(1))
-                                return probability_result
-                            except:
-                                pass
+                    probability_result = structured_output.extract_json(content)
+                    if probability_result is not None:
+                        return probability_result
                     
                     # Return structured result if parsing fails
                     return {
-                        "success_probability": 50,
+                        "success_probability": 0.5,
                         "confidence": "Medium",
                         "probability_factors": [
                             "Based on case description and evidence",
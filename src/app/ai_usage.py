@@ -0,0 +1,582 @@
+"""
+Accounting for AI provider calls.
+
+Every call made through the shared provider clients is recorded with the
+feature that made it, the model, uncached input, output and cached tokens,
+latency, outcome (ok, truncated or error), the providers tried so far for the
+same piece of work (e.g. 'openai>anthropic' for an Anthropic fallback) and an
+estimated cost.
+Streamed Anthropic calls (messages.stream) are recorded when the stream is
+closed; one closed early has its output tokens counted from the text received.
+
+Attribution: the feature defaults to the Flask endpoint handling the request,
+and the user and case to the logged-in user and the route's case_id. Work
+outside a request, or wanting a more specific name, runs inside
+`with ai_usage.feature(name, case_id=..., user_id=...)`. Functions handed to
+other threads keep the caller's attribution when wrapped with bind().
+
+Writing: events go to an in-memory buffer that a background thread writes to
+ai_usage_event in batches, so recording never adds a database round trip to a
+request. Events still buffered when a process is killed are lost.
+
+Rollups: once an hour has closed, its events are summed into ai_usage_rollup
+by feature, user, case and model. Events are counted by id: the single
+ai_usage_rollup_state row records the id and the hour the rollups have
+counted through, and each run counts only events not covered by both. An
+event written late for an hour already rolled up (e.g. by a worker that was
+unable to reach the database) is added to that hour by the next run, as extra
+rollup rows. Batches from several writers can commit out of id order, so the
+highest id seen by a run is only counted by a run AI_USAGE_ROLLUP_DELAY
+seconds later. Raw events are kept for AI_USAGE_RETENTION_DAYS and only
+deleted once counted. `flask rollup-ai-usage` runs the rollup on demand and
+report() combines rollups with the raw events not yet counted for the admin
+endpoint.
+
+Each call also gets a tracing span with the provider, model, token counts
+and outcome.
+
+Environment:
+    AI_USAGE_ENABLED            set to 0 to stop recording (default on)
+    AI_USAGE_FLUSH_SECONDS      seconds between buffer writes (default 5)
+    AI_USAGE_BATCH_SIZE         buffered events that trigger an early write (default 100)
+    AI_USAGE_MAX_BUFFER         events kept if the database is unavailable (default 10000)
+    AI_USAGE_ROLLUP_INTERVAL    seconds between rollups, 0 disables (default 900)
+    AI_USAGE_ROLLUP_DELAY       seconds after an hour closes, or an event is written, before it is rolled up (default 300)
+    AI_USAGE_RETENTION_DAYS     days raw events are kept (default 30)
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+
+import sqlalchemy as sa
+
+import prompt_budget
+import tracing
+
+# USD per million tokens: (input, output, cache read, cache write), matched by
+# longest model name prefix. Update when provider pricing changes.
+PRICES = {
+    'gpt-4o-mini': (0.15, 0.60, 0.075, 0.15),
+    'gpt-4o': (2.50, 10.00, 1.25, 2.50),
+    'claude-3-5-haiku': (0.80, 4.00, 0.08, 1.00),
+    'claude-3-5-sonnet': (3.00, 15.00, 0.30, 3.75)
+}
+
+# Client methods that call a provider, by provider
+TRACKED_METHODS = {
+    'openai': ('chat.completions.create', 'audio.transcriptions.create'),
+    'anthropic': ('messages.create', 'messages.stream')
+}
+
+# report() dimension -> column
+DIMENSIONS = {
+    'feature': 'feature',
+    'user': 'user_id',
+    'case': 'case_id',
+    'model': 'model',
+    'provider': 'provider',
+    'hour': 'hour'
+}
+METRICS = ('requests', 'errors', 'fallbacks', 'input_tokens', 'output_tokens',
+           'cache_read_tokens', 'cache_write_tokens', 'latency_ms', 'cost_usd')
+
+# Arbitrary constant identifying the rollup's Postgres advisory lock
+ADVISORY_LOCK_KEY = 0x4149_5553
+STATE_ID = 1
+
+_attribution = contextvars.ContextVar('ai_usage_attribution', default=None)
+
+_buffer = []
+_buffer_lock = threading.Lock()
+_wake = threading.Event()
+_dropped = 0
+
+_app = None
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def is_enabled():
+    return os.environ.get('AI_USAGE_ENABLED', '1') != '0'
+
+
+def _setting(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _request_attribution():
+    """Attribution for the current request, shared by every call it makes"""
+    try:
+        from flask import has_request_context, request, g
+        if not has_request_context():
+            return None
+        attribution = g.get('ai_usage_attribution')
+        if attribution is None:
+            from flask_login import current_user
+            user_id = current_user.id if current_user and current_user.is_authenticated else None
+            attribution = {
+                "feature": request.endpoint or request.path,
+                "user_id": user_id,
+                "case_id": (request.view_args or {}).get('case_id'),
+                "path": []
+            }
+            g.ai_usage_attribution = attribution
+        return attribution
+    except Exception as e:
+        logging.debug(f"Could not attribute AI usage to the request: {e}")
+        return None
+
+
+def current_attribution():
+    """Return the feature, user and case calls made now are attributed to"""
+    return _attribution.get() or _request_attribution() or \
+        {"feature": "background", "user_id": None, "case_id": None, "path": []}
+
+
+@contextmanager
+def feature(name, case_id=None, user_id=None):
+    """Attribute provider calls made inside the block to a named feature"""
+    parent = current_attribution()
+    token = _attribution.set({
+        "feature": name,
+        "user_id": user_id if user_id is not None else parent["user_id"],
+        "case_id": case_id if case_id is not None else parent["case_id"],
+        "path": []
+    })
+    try:
+        yield
+    finally:
+        _attribution.reset(token)
+
+
+def bind(fn):
+    """
+    Wrap fn so calls it makes on another thread keep the current attribution
+    and the rest of the caller's context, such as its tracing span
+    """
+    attribution = current_attribution()
+    context = contextvars.copy_context()
+
+    def call(*args, **kwargs):
+        _attribution.set(attribution)
+        return fn(*args, **kwargs)
+
+    @wraps(fn)
+    def bound(*args, **kwargs):
+        # A fresh copy per call, since one context cannot be entered by two threads at once
+        return context.copy().run(call, *args, **kwargs)
+    return bound
+
+
+def token_counts(provider, response):
+    """Token counts from a response, with cached input separated from uncached"""
+    counts = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0}
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return counts
+    if provider == 'anthropic':
+        counts["input_tokens"] = getattr(usage, 'input_tokens', None) or 0
+        counts["output_tokens"] = getattr(usage, 'output_tokens', None) or 0
+        counts["cache_read_tokens"] = getattr(usage, 'cache_read_input_tokens', None) or 0
+        counts["cache_write_tokens"] = getattr(usage, 'cache_creation_input_tokens', None) or 0
+    else:
+        # OpenAI counts cached tokens inside prompt_tokens
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached = (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+        counts["input_tokens"] = (getattr(usage, 'prompt_tokens', None) or 0) - cached
+        counts["output_tokens"] = getattr(usage, 'completion_tokens', None) or 0
+        counts["cache_read_tokens"] = cached
+    return counts
+
+
+def _truncated(provider, response):
+    """True if the response stopped at its max_tokens limit"""
+    if provider == 'anthropic':
+        return getattr(response, 'stop_reason', None) == 'max_tokens'
+    choices = getattr(response, 'choices', None)
+    return bool(choices) and getattr(choices[0], 'finish_reason', None) == 'length'
+
+
+def estimate_cost(model, counts):
+    """Estimated USD cost of a call's tokens; 0 for models without a price"""
+    for prefix in sorted(PRICES, key=len, reverse=True):
+        if model and model.startswith(prefix):
+            input_price, output_price, read_price, write_price = PRICES[prefix]
+            return (counts["input_tokens"] * input_price + counts["output_tokens"] * output_price +
+                    counts["cache_read_tokens"] * read_price + counts["cache_write_tokens"] * write_price) / 1_000_000
+    return 0.0
+
+
+def record(provider, model, response, latency, outcome='ok', error=None):
+    """Buffer one provider call for writing"""
+    global _dropped
+    if not is_enabled():
+        return
+    attribution = current_attribution()
+    path = attribution["path"]
+    if not path or path[-1] != provider:
+        path.append(provider)
+
+    model = model or getattr(response, 'model', None)
+    counts = token_counts(provider, response)
+    if outcome == 'ok' and response is not None and _truncated(provider, response):
+        outcome = 'truncated'
+    now = datetime.utcnow()
+    event = dict(
+        counts,
+        created_at=now,
+        hour=now.replace(minute=0, second=0, microsecond=0),
+        feature=str(attribution["feature"])[:100],
+        provider=provider,
+        model=model,
+        user_id=attribution["user_id"],
+        case_id=attribution["case_id"],
+        latency_ms=int(latency * 1000),
+        outcome=outcome,
+        error=error,
+        fallback_path='>'.join(path)[:100],
+        cost_usd=estimate_cost(model, counts)
+    )
+
+    max_buffer = _setting('AI_USAGE_MAX_BUFFER', 10000)
+    with _buffer_lock:
+        if len(_buffer) >= max_buffer:
+            _buffer.pop(0)
+            _dropped += 1
+        _buffer.append(event)
+        full = len(_buffer) >= _setting('AI_USAGE_BATCH_SIZE', 100)
+    if full:
+        _wake.set()
+
+
+class _Call:
+    response = None
+
+
+@contextmanager
+def track(provider, model=None):
+    """Time and record a provider call; set .response on the yielded object to record its usage"""
+    call = _Call()
+    with tracing.span(f"{provider}.call", {"ai.provider": provider, "ai.model": model}) as span:
+        start = time.perf_counter()
+        outcome, error = 'ok', None
+        try:
+            yield call
+        except Exception as e:
+            outcome, error = 'error', type(e).__name__[:100]
+            raise
+        finally:
+            record(provider, model, call.response, time.perf_counter() - start, outcome, error)
+            if call.response is not None:
+                counts = token_counts(provider, call.response)
+                span.set_attributes({f"ai.{name}": value for name, value in counts.items()})
+                span.set_attribute("ai.model", model or getattr(call.response, 'model', None))
+                span.set_attribute("ai.truncated", _truncated(provider, call.response))
+            span.set_attribute("ai.fallback_path", '>'.join(current_attribution()["path"]))
+
+
+def _tracked(create, provider):
+    @wraps(create)
+    def tracked_create(*args, **kwargs):
+        with track(provider, kwargs.get('model')) as call:
+            call.response = create(*args, **kwargs)
+            return call.response
+    return tracked_create
+
+
+def _stream_message(message_stream, model):
+    """
+    The message a stream has accumulated. A stream closed before the provider
+    reported its final usage has its output tokens counted from the text received.
+    """
+    try:
+        message = message_stream.current_message_snapshot
+    except Exception:
+        return None
+    if getattr(message, 'stop_reason', None) is None and getattr(message, 'usage', None) is not None:
+        text = "".join(getattr(block, 'text', '') for block in getattr(message, 'content', None) or [])
+        message.usage.output_tokens = max(message.usage.output_tokens or 0,
+                                          prompt_budget.count_tokens(text, model or message.model))
+    return message
+
+
+def _tracked_stream(stream, provider):
+    @wraps(stream)
+    @contextmanager
+    def tracked_stream(*args, **kwargs):
+        with track(provider, kwargs.get('model')) as call:
+            with stream(*args, **kwargs) as message_stream:
+                try:
+                    yield message_stream
+                finally:
+                    call.response = _stream_message(message_stream, kwargs.get('model'))
+    return tracked_stream
+
+
+def instrument(client, provider):
+    """Record every call made through a provider client's API methods"""
+    for path in TRACKED_METHODS.get(provider, ()):
+        *parents, name = path.split('.')
+        tracked = _tracked_stream if name == 'stream' else _tracked
+        try:
+            owner = client
+            for attr in parents:
+                owner = getattr(owner, attr)
+            setattr(owner, name, tracked(getattr(owner, name), provider))
+        except AttributeError as e:
+            logging.warning(f"Cannot track {provider} {path}: {e}")
+    return client
+
+
+def _tables():
+    from models import AIUsageEvent, AIUsageRollup
+    return AIUsageEvent.__table__, AIUsageRollup.__table__
+
+
+def _state_table():
+    from models import AIUsageRollupState
+    return AIUsageRollupState.__table__
+
+
+def _state(connection, create=True):
+    """The watermark row, created on the first run"""
+    states = _state_table()
+    row = connection.execute(sa.select(states).where(states.c.id == STATE_ID)).first()
+    if row is None:
+        if not create:
+            return None
+        connection.execute(states.insert(), [{'id': STATE_ID, 'last_event_id': 0}])
+        row = connection.execute(sa.select(states).where(states.c.id == STATE_ID)).first()
+    return row._mapping
+
+
+def _rolled_up(events, state):
+    """Condition matching the events already counted into the rollups"""
+    if state is None or state['rolled_through'] is None:
+        return sa.false()
+    return sa.and_(events.c.id <= state['last_event_id'], events.c.hour < state['rolled_through'])
+
+
+def flush(connection=None):
+    """Write buffered events; returns the number written. Uses the app's engine if no connection is given."""
+    global _dropped
+    with _buffer_lock:
+        rows = _buffer[:]
+        _buffer.clear()
+        dropped, _dropped = _dropped, 0
+    if dropped:
+        logging.warning(f"Dropped {dropped} AI usage events while the buffer was full")
+    if not rows:
+        return 0
+
+    events, _ = _tables()
+    try:
+        if connection is not None:
+            connection.execute(events.insert(), rows)
+        else:
+            from app import db
+            with db.engine.begin() as conn:
+                conn.execute(events.insert(), rows)
+    except Exception as e:
+        logging.error(f"Could not write {len(rows)} AI usage events: {e}")
+        # Keep them for the next attempt, oldest first, within the buffer limit
+        with _buffer_lock:
+            room = max(0, _setting('AI_USAGE_MAX_BUFFER', 10000) - len(_buffer))
+            _buffer[:0] = rows[-room:] if room else []
+        return 0
+    return len(rows)
+
+
+def _hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _metric_columns(table, rolled_up):
+    """Summed metric columns for an event or rollup table"""
+    if rolled_up:
+        return [sa.func.sum(table.c[name]).label(name) for name in METRICS]
+    return [
+        sa.func.count().label('requests'),
+        sa.func.sum(sa.case((table.c.outcome == 'error', 1), else_=0)).label('errors'),
+        sa.func.sum(sa.case((table.c.fallback_path.contains('>'), 1), else_=0)).label('fallbacks'),
+        *[sa.func.sum(table.c[name]).label(name) for name in METRICS[3:]]
+    ]
+
+
+def rollup(connection, now=None, delay=None, retention_days=None):
+    """Roll up events of closed hours not yet counted and prune old events; returns rollup rows written"""
+    events, rollups = _tables()
+    states = _state_table()
+    now = now or datetime.utcnow()
+    delay = _setting('AI_USAGE_ROLLUP_DELAY', 300) if delay is None else delay
+    retention_days = _setting('AI_USAGE_RETENTION_DAYS', 30) if retention_days is None else retention_days
+
+    state = _state(connection)
+    # Hours before this one are complete
+    closed = _hour(now - timedelta(seconds=delay))
+    through = max(closed, state['rolled_through']) if state['rolled_through'] else closed
+    settled = state['last_event_id']
+    pending_settled = state['pending_event_id'] is not None and state['pending_at'] <= now - timedelta(seconds=delay)
+    if pending_settled:
+        settled = max(settled, state['pending_event_id'])
+
+    dimensions = [events.c[column] for column in ('hour', 'feature', 'provider', 'model', 'user_id', 'case_id')]
+    query = sa.select(*dimensions, *_metric_columns(events, rolled_up=False)) \
+        .where(events.c.id <= settled).where(events.c.hour < through) \
+        .where(sa.not_(_rolled_up(events, state))) \
+        .group_by(*dimensions)
+    result = connection.execute(rollups.insert().from_select(
+        [c.name for c in dimensions] + list(METRICS), query))
+    written = result.rowcount
+
+    values = {'last_event_id': settled, 'rolled_through': through, 'updated_at': now}
+    if pending_settled or state['pending_event_id'] is None:
+        # Count everything written so far once it has settled
+        highest = connection.execute(sa.select(sa.func.max(events.c.id))).scalar() or 0
+        values.update(pending_event_id=highest if highest > settled else None, pending_at=now)
+    connection.execute(states.update().where(states.c.id == STATE_ID).values(**values))
+
+    # Only events that have been rolled up are pruned
+    cutoff = _hour(now - timedelta(days=retention_days))
+    connection.execute(events.delete().where(events.c.hour < cutoff)
+                       .where(_rolled_up(events, {**state, **values})))
+    return written
+
+
+def _try_lock(connection):
+    """Take the rollup's advisory lock for this transaction (always succeeds off Postgres)"""
+    if connection.dialect.name != 'postgresql':
+        return True
+    return connection.execute(sa.select(sa.func.pg_try_advisory_xact_lock(ADVISORY_LOCK_KEY))).scalar()
+
+
+def run_rollup(now=None):
+    """Flush this process's buffer and roll up closed hours; returns rollup rows written"""
+    from app import db
+    flush()
+    with db.engine.begin() as connection:
+        if not _try_lock(connection):
+            logging.info("AI usage rollup already running in another process")
+            return 0
+        written = rollup(connection, now)
+    if written:
+        logging.info(f"AI usage rollup: {written} rows written")
+    return written
+
+
+def report(hours=24, group_by=('feature', 'user', 'case', 'model'), limit=20, now=None):
+    """
+    Usage totals for the last `hours` hours, overall and grouped by each
+    dimension in group_by, most expensive first (hours in order). Events
+    already counted come from the rollups and the rest from raw events.
+    """
+    from app import db
+    events, rollups = _tables()
+    now = now or datetime.utcnow()
+    since = _hour(now - timedelta(hours=hours))
+
+    with db.engine.connect() as connection:
+        state = _state(connection, create=False)
+        last = state['rolled_through'] - timedelta(hours=1) if state and state['rolled_through'] else None
+        # Rollups plus the events they have not counted yet, including late ones for rolled up hours
+        sources = [(rollups, True, rollups.c.hour >= since),
+                   (events, False, sa.and_(events.c.hour >= since, sa.not_(_rolled_up(events, state))))]
+
+        def totals_by(dimension):
+            merged = {}
+            for table, rolled_up, condition in sources:
+                columns = [table.c[DIMENSIONS[dimension]]] if dimension else []
+                query = sa.select(*columns, *_metric_columns(table, rolled_up)).where(condition)
+                if dimension:
+                    query = query.group_by(*columns)
+                for row in connection.execute(query):
+                    key = row[0] if dimension else None
+                    entry = merged.setdefault(key, dict.fromkeys(METRICS, 0))
+                    for name in METRICS:
+                        entry[name] += row._mapping[name] or 0
+            return merged
+
+        def summarize(key, entry, dimension):
+            summary = {dimension: key.isoformat() if isinstance(key, datetime) else key} if dimension else {}
+            summary.update({name: entry[name] for name in METRICS if name not in ('latency_ms', 'cost_usd')})
+            summary["avg_latency_ms"] = round(entry["latency_ms"] / entry["requests"]) if entry["requests"] else 0
+            summary["cost_usd"] = round(entry["cost_usd"], 4)
+            return summary
+
+        totals = totals_by(None).get(None, dict.fromkeys(METRICS, 0))
+        result = {
+            "since": since.isoformat(),
+            "hours": hours,
+            "rolled_up_through": last.isoformat() if last else None,
+            "totals": summarize(None, totals, None)
+        }
+        for dimension in group_by:
+            grouped = totals_by(dimension)
+            if dimension == 'hour':
+                ordered = sorted(grouped.items(), key=lambda item: item[0])
+            else:
+                ordered = sorted(grouped.items(), key=lambda item: (item[1]["cost_usd"], item[1]["requests"]),
+                                 reverse=True)[:limit]
+            result[f"by_{dimension}"] = [summarize(key, entry, dimension) for key, entry in ordered]
+    return result
+
+
+def _run_forever():
+    next_rollup = time.monotonic()
+    while True:
+        _wake.wait(_setting('AI_USAGE_FLUSH_SECONDS', 5))
+        _wake.clear()
+        try:
+            with _app.app_context():
+                flush()
+                interval = _setting('AI_USAGE_ROLLUP_INTERVAL', 900)
+                if interval > 0 and time.monotonic() >= next_rollup:
+                    next_rollup = time.monotonic() + interval
+                    run_rollup()
+        except Exception as e:
+            logging.error(f"Error writing AI usage: {e}")
+
+
+def _flush_at_exit():
+    if _app is not None and _thread_pid == os.getpid():
+        try:
+            with _app.app_context():
+                flush()
+        except Exception as e:
+            logging.error(f"Error writing AI usage at exit: {e}")
+
+
+def start(app):
+    """Start the usage writer for this process if it is not already running"""
+    global _app, _thread, _thread_pid
+    with _thread_lock:
+        # Threads do not survive a fork, so each worker process starts its own
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+        _app = app
+        _thread = threading.Thread(target=_run_forever, name="ai-usage-writer", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+atexit.register(_flush_at_exit)
+
+
+def init_app(app):
+    """Register the rollup-ai-usage command and start the writer on the first request"""
+    @app.cli.command('rollup-ai-usage')
+    def rollup_ai_usage_command():
+        """Write buffered AI usage and roll up closed hours now."""
+        print(f"{run_rollup()} rollup rows written")
+
+    @app.before_request
+    def _start_usage_writer():
+        if _thread_pid != os.getpid():
+            start(app)
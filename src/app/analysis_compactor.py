@@ -0,0 +1,271 @@
+"""
+Retention compaction for LegalAnalysis history.
+
+Saving an analysis appends a new LegalAnalysis version and moves the
+CurrentAnalysis pointer to it, so superseded versions accumulate. The
+compactor applies the retention policy to versions that are no longer current
+(current versions are never touched):
+
+- versions older than ANALYSIS_COMPACT_AFTER_DAYS are compacted: the text is
+  recompressed at a higher zstd level with the newest dictionary for its
+  analysis type
+- versions beyond the newest ANALYSIS_KEEP_VERSIONS per case and type, or
+  older than ANALYSIS_RETENTION_DAYS, are deleted
+
+Each run first trains a compression dictionary for every analysis type that
+has none yet once it has ANALYSIS_DICTIONARY_MIN_ROWS versions, so new types
+do not stay on dictionary-less compression after the migration that trained
+the first ones. `flask train-analysis-dictionaries [TYPE...]` trains new
+dictionaries on demand, e.g. after the shape of an analysis type changes; new
+writes use them at once and compaction moves old versions onto them.
+
+It runs in a background thread in each process, started on the first request,
+and on demand with `flask compact-analyses`. On Postgres an advisory lock
+ensures only one process compacts or trains at a time.
+
+Environment:
+    ANALYSIS_KEEP_VERSIONS          superseded versions kept per case and type (default 10)
+    ANALYSIS_RETENTION_DAYS         superseded versions older than this are deleted (default 180)
+    ANALYSIS_COMPACT_AFTER_DAYS     superseded versions older than this are compacted (default 7)
+    ANALYSIS_COMPACT_LEVEL          zstd level used when compacting (default 19)
+    ANALYSIS_COMPACT_BATCH          rows per transaction (default 200)
+    ANALYSIS_COMPACT_INTERVAL       seconds between background runs, 0 disables (default 3600)
+    ANALYSIS_DICTIONARY_MIN_ROWS    versions a type needs before a dictionary is trained for it (default 200)
+    ANALYSIS_DICTIONARY_SAMPLES     newest versions per type a dictionary is trained on (default 2000)
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import click
+import sqlalchemy as sa
+
+import compression
+
+# Arbitrary constant identifying the compactor's Postgres advisory lock
+ADVISORY_LOCK_KEY = 0x4C41_4331
+
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def get_policy():
+    """Return the retention policy from the environment"""
+    return {
+        "keep_versions": int(os.environ.get('ANALYSIS_KEEP_VERSIONS', 10)),
+        "retention_days": int(os.environ.get('ANALYSIS_RETENTION_DAYS', 180)),
+        "compact_after_days": int(os.environ.get('ANALYSIS_COMPACT_AFTER_DAYS', 7)),
+        "compact_level": int(os.environ.get('ANALYSIS_COMPACT_LEVEL', 19)),
+        "batch_size": int(os.environ.get('ANALYSIS_COMPACT_BATCH', 200)),
+        "dictionary_min_rows": int(os.environ.get('ANALYSIS_DICTIONARY_MIN_ROWS', 200)),
+        "dictionary_samples": int(os.environ.get('ANALYSIS_DICTIONARY_SAMPLES', 2000))
+    }
+
+
+def _tables():
+    """Return the LegalAnalysis table, a raw-bytes view of it, and the pointer table"""
+    from models import LegalAnalysis, CurrentAnalysis
+    analysis = LegalAnalysis.__table__
+    # Same table with the compressed columns as plain bytes, for writing
+    # values that were compressed here
+    raw = sa.table(
+        'legal_analysis',
+        sa.column('id', sa.Integer),
+        sa.column('content', sa.LargeBinary),
+        sa.column('references', sa.LargeBinary),
+        sa.column('compacted_at', sa.DateTime),
+    )
+    return analysis, raw, CurrentAnalysis.__table__
+
+
+def _superseded(analysis, current):
+    """Condition matching versions that are not the current one for their case and type"""
+    return analysis.c.id.notin_(sa.select(current.c.analysis_id))
+
+
+def prune(connection, policy, now):
+    """Delete one batch of superseded versions outside the retention policy; returns rows deleted"""
+    analysis, _, current = _tables()
+    ranked = sa.select(
+        analysis.c.id,
+        analysis.c.generated_at,
+        sa.func.row_number().over(
+            partition_by=(analysis.c.case_id, analysis.c.analysis_type),
+            order_by=(analysis.c.generated_at.desc(), analysis.c.id.desc())
+        ).label('rank')
+    ).where(_superseded(analysis, current)).subquery()
+
+    cutoff = now - timedelta(days=policy["retention_days"])
+    ids = [row.id for row in connection.execute(
+        sa.select(ranked.c.id)
+        .where(sa.or_(ranked.c.rank > policy["keep_versions"], ranked.c.generated_at < cutoff))
+        .limit(policy["batch_size"])
+    )]
+    if ids:
+        connection.execute(analysis.delete().where(analysis.c.id.in_(ids)))
+    return len(ids)
+
+
+def compact(connection, policy, now):
+    """Compact one batch of old superseded versions; returns rows compacted"""
+    analysis, raw, current = _tables()
+    cutoff = now - timedelta(days=policy["compact_after_days"])
+    rows = connection.execute(
+        sa.select(analysis.c.id, analysis.c.analysis_type, analysis.c.content, analysis.c.references)
+        .where(analysis.c.compacted_at.is_(None))
+        .where(analysis.c.generated_at < cutoff)
+        .where(_superseded(analysis, current))
+        .order_by(analysis.c.id)
+        .limit(policy["batch_size"])
+    ).fetchall()
+
+    for row in rows:
+        dictionary = compression.get_dictionary(compression.analysis_dictionary_name(row.analysis_type))
+        values = {"compacted_at": now}
+        for column in ('content', 'references'):
+            text = getattr(row, column)
+            if text is not None:
+                values[column] = compression.compress(text, dictionary, level=policy["compact_level"])
+        connection.execute(raw.update().where(raw.c.id == row.id).values(**values))
+    return len(rows)
+
+
+def train_dictionaries(connection, policy, analysis_types=None, missing_only=False):
+    """
+    Train and store a compression dictionary for each analysis type (every type
+    in the table by default) from its newest versions. With missing_only, only
+    types without a dictionary and with at least dictionary_min_rows versions are
+    trained. Returns the dictionary names stored.
+    """
+    analysis, _, _ = _tables()
+    counts = dict(connection.execute(
+        sa.select(analysis.c.analysis_type, sa.func.count()).group_by(analysis.c.analysis_type)
+    ).fetchall())
+
+    stored = []
+    for analysis_type in analysis_types or sorted(counts):
+        name = compression.analysis_dictionary_name(analysis_type)
+        if missing_only and (counts.get(analysis_type, 0) < policy["dictionary_min_rows"]
+                             or compression.get_dictionary(name) is not None):
+            continue
+        samples = []
+        for row in connection.execute(
+            sa.select(analysis.c.content, analysis.c.references)
+            .where(analysis.c.analysis_type == analysis_type)
+            .order_by(analysis.c.id.desc())
+            .limit(policy["dictionary_samples"])
+        ):
+            samples.extend(value for value in row if value)
+        if compression.store_dictionary(connection, name, samples) is not None:
+            stored.append(name)
+    return stored
+
+
+def _try_lock(connection):
+    """Take the compactor's advisory lock for this transaction (always succeeds off Postgres)"""
+    if connection.dialect.name != 'postgresql':
+        return True
+    return connection.execute(sa.select(sa.func.pg_try_advisory_xact_lock(ADVISORY_LOCK_KEY))).scalar()
+
+
+def retrain(analysis_types=None, policy=None):
+    """Train new dictionaries for the given analysis types (all by default); returns the names stored"""
+    from app import db
+    policy = policy or get_policy()
+    with db.engine.begin() as connection:
+        if not _try_lock(connection):
+            logging.info("Analysis compaction already running in another process")
+            return []
+        stored = train_dictionaries(connection, policy, analysis_types)
+    # Reload only after the commit so writes never reference an uncommitted dictionary
+    compression.load_dictionaries(force=True)
+    return stored
+
+
+def run_once(policy=None, now=None):
+    """
+    Train missing dictionaries, then apply the retention policy to all superseded
+    versions; returns counts of dictionaries trained and rows pruned and compacted
+    """
+    from app import db
+    policy = policy or get_policy()
+    now = now or datetime.utcnow()
+    totals = {"trained": 0, "pruned": 0, "compacted": 0}
+
+    if compression.zstandard is not None:
+        with db.engine.begin() as connection:
+            if not _try_lock(connection):
+                logging.info("Analysis compaction already running in another process")
+                return totals
+            trained = train_dictionaries(connection, policy, missing_only=True)
+        if trained:
+            compression.load_dictionaries(force=True)
+            logging.info(f"Trained compression dictionaries: {', '.join(trained)}")
+        totals["trained"] = len(trained)
+
+    for step, name in ((prune, "pruned"), (compact, "compacted")):
+        while True:
+            # One transaction per batch keeps locks short
+            with db.engine.begin() as connection:
+                if not _try_lock(connection):
+                    logging.info("Analysis compaction already running in another process")
+                    return totals
+                count = step(connection, policy, now)
+            totals[name] += count
+            if count < policy["batch_size"]:
+                break
+
+    if totals["pruned"] or totals["compacted"]:
+        logging.info(f"Analysis compaction: {totals['pruned']} versions pruned, {totals['compacted']} compacted")
+    return totals
+
+
+def _run_forever(app, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with app.app_context():
+                run_once()
+        except Exception as e:
+            logging.error(f"Error compacting analysis history: {e}")
+
+
+def start(app):
+    """Start the background compactor for this process if it is not already running"""
+    global _thread, _thread_pid
+    interval = int(os.environ.get('ANALYSIS_COMPACT_INTERVAL', 3600))
+    if interval <= 0:
+        return
+    with _thread_lock:
+        # Threads do not survive a fork, so each worker process starts its own
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+        _thread = threading.Thread(target=_run_forever, args=(app, interval),
+                                   name="analysis-compactor", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def init_app(app):
+    """Register the compact-analyses and train-analysis-dictionaries commands and start the compactor on the first request"""
+    @app.cli.command('compact-analyses')
+    def compact_analyses_command():
+        """Prune and compact superseded analysis versions now."""
+        totals = run_once()
+        print(f"{totals['trained']} dictionaries trained, {totals['pruned']} versions pruned, "
+              f"{totals['compacted']} compacted")
+
+    @app.cli.command('train-analysis-dictionaries')
+    @click.argument('analysis_types', nargs=-1)
+    def train_analysis_dictionaries_command(analysis_types):
+        """Train new compression dictionaries for the given analysis types (all by default)."""
+        stored = retrain(analysis_types or None)
+        print(f"{len(stored)} dictionaries trained" + (f": {', '.join(stored)}" if stored else ""))
+
+    @app.before_request
+    def _start_compactor():
+        if _thread_pid != os.getpid():
+            start(app)
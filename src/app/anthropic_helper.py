@@ -2,65 +2,166 @@ import os
 import sys
 import json
 import logging
-from anthropic import Anthropic
-
-# Initialize the client
-anthropic_key = os.environ.get('ANTHROPIC_API_KEY')
-client = None
-
-if anthropic_key:
-    client = Anthropic(api_key=anthropic_key)
+import legal_knowledge_base as lkb
+import provider_clients
+import prompt_budget
+import structured_output
+import tracing
 
 # The newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024
 DEFAULT_MODEL = "claude-3-5-sonnet-20241022"
+DEFAULT_MAX_TOKENS = 1500
+
+# Prompt caching: the system prefix (role + legal reference material + task
+# instructions) is identical across calls, so it is marked with cache_control
+# and only the case-specific user message is billed at the full input rate.
+# Set ANTHROPIC_PROMPT_CACHING=0 to send the same requests without
+# cache_control, so nothing is cached.
+PROMPT_CACHING = os.environ.get('ANTHROPIC_PROMPT_CACHING', '1') != '0'
+CACHE_CONTROL = {"type": "ephemeral"}
+
+SYSTEM_MESSAGE = "You are a highly skilled legal assistant analyzing case details and providing accurate, helpful legal information."
+JSON_INSTRUCTION = "Respond with a valid JSON object only."
+
+def build_legal_context():
+    """Render the static legal reference material shared by every analysis prompt"""
+    lines = ["LEGAL REFERENCE MATERIAL", ""]
+    
+    lines.append("CONSTITUTIONAL RIGHTS:")
+    for right in lkb.LEGAL_RIGHTS.values():
+        lines.append(f"{right['name']}: {right['description']}")
+        lines.append("  Key questions: " + "; ".join(right["key_questions"]))
+        lines.append("  Common violations: " + "; ".join(right["common_violations"]))
+    
+    lines.append("")
+    lines.append("CASE LAW:")
+    for category, cases in lkb.CASE_LAW_DATABASE.items():
+        for case_info in cases:
+            lines.append(f"- {case_info['case']}, {case_info['citation']} ({category.replace('_', ' ')}): "
+                         f"{case_info['holding']}. {case_info['application']}.")
+    for domain in lkb.LEGAL_DOMAINS.values():
+        for landmark in domain.get("landmark_cases", []):
+            lines.append(f"- {landmark['name']} ({landmark['year']}): {landmark['significance']}")
+    
+    lines.append("")
+    lines.append("EVIDENCE ADMISSIBILITY CHALLENGES:")
+    for challenge in lkb.get_evidence_challenges():
+        lines.append(f"- {challenge['ground']}: {challenge['strategy']}")
+    
+    lines.append("")
+    lines.append("DOCUMENT STRATEGIES:")
+    for case_type, stages in lkb.DOCUMENT_STRATEGIES.items():
+        lines.append(f"{case_type.replace('_', ' ').title()}:")
+        for stage, docs in stages.items():
+            for doc in docs:
+                lines.append(f"  [{stage.replace('_', ' ')}] {doc['document']}: {doc['purpose']} (timing: {doc['timing']})")
+    
+    return "\n".join(lines)
+
+# Built once at import so the cached prefix is byte-identical on every request
+LEGAL_CONTEXT = build_legal_context()
+
+def build_system_blocks(json_format=False, instructions=None):
+    """
+    Build the system prompt as content blocks ordered from most to least shared.
+    The shared role and legal context come first, followed by the per-task
+    instructions, so that each block boundary is a reusable cache prefix.
+    The content is the same with caching off; only cache_control is left out.
+    """
+    shared_block = {"type": "text", "text": f"{SYSTEM_MESSAGE}\n\n{LEGAL_CONTEXT}"}
+    blocks = [shared_block]
+    
+    task_text = instructions.strip() if instructions else ""
+    if json_format:
+        task_text = f"{task_text}\n\n{JSON_INSTRUCTION}" if task_text else JSON_INSTRUCTION
+    if task_text:
+        blocks.append({"type": "text", "text": task_text})
+    
+    if PROMPT_CACHING:
+        shared_block["cache_control"] = CACHE_CONTROL
+        if instructions:
+            blocks[-1]["cache_control"] = CACHE_CONTROL
+    
+    return blocks
+
+def build_message_request(prompt, json_format=False, instructions=None, model=None, max_tokens=DEFAULT_MAX_TOKENS):
+    """Build the keyword arguments for a messages.create call"""
+    return {
+        "model": model or DEFAULT_MODEL,
+        "system": build_system_blocks(json_format, instructions),
+        "max_tokens": max_tokens,
+        "temperature": 0.2,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+def _extract_text(response):
+    """Extract the first text block from a messages response"""
+    if hasattr(response, 'content') and isinstance(response.content, list):
+        for item in response.content:
+            if hasattr(item, 'type') and item.type == 'text':
+                return item.text
+    return ""
+
+def _send(client, request, json_format):
+    """
+    Send a request; returns (content, parser). JSON-format requests are streamed
+    through a StreamingJSONParser and the stream is closed as soon as a valid
+    object is complete, so prose the model adds after it is never generated.
+    parser is None for plain requests.
+    """
+    if not json_format:
+        response = client.messages.create(**request)
+        # If we couldn't get content, use the string representation
+        return _extract_text(response) or str(response), None
+
+    parser = structured_output.StreamingJSONParser()
+    chunks = []
+    with client.messages.stream(**request) as stream:
+        for text in stream.text_stream:
+            chunks.append(text)
+            # Braces in prose before the JSON can close an invalid object; read on then
+            if parser.feed(text) and parser.result() is not None:
+                break
+    return "".join(chunks), parser
+
 
 def is_available():
     """Check if Anthropic API is configured and available"""
-    return client is not None
+    return provider_clients.get_anthropic_client() is not None
 
-def analyze_case_text(prompt, json_format=False):
-    """Analyze text using Anthropic's Claude"""
+@tracing.traced("anthropic.analyze_case_text")
+def analyze_case_text(prompt, json_format=False, instructions=None, max_tokens=None):
+    """
+    Analyze text using Anthropic's Claude.
+    
+    Static task guidance should be passed as `instructions` so it becomes part of
+    the cached system prefix; `prompt` should only carry the case-specific details.
+    When max_tokens is not given it is sized from the prompt length.
+    """
     if not is_available():
         logging.error("Anthropic API is not available - missing API key")
         return None
     
     try:
-        system_message = "You are a highly skilled legal assistant analyzing case details and providing accurate, helpful legal information."
-        
-        if json_format:
-            system_message += " Respond with a valid JSON object only."
-        
-        # Ensure client is initialized
+        # Use the shared, pooled client
+        client = provider_clients.get_anthropic_client()
         if client is None:
             logging.error("Anthropic client is None - cannot make API call")
             return None
             
         logging.debug(f"Calling Anthropic API with model: {DEFAULT_MODEL}")
         
+        if max_tokens is None:
+            max_tokens = prompt_budget.max_tokens_for(prompt, DEFAULT_MODEL, DEFAULT_MAX_TOKENS, instructions)
+        
         try:
             # Call the Anthropic API
-            response = client.messages.create(
-                model=DEFAULT_MODEL,
-                system=system_message,
-                max_tokens=1500,
-                temperature=0.2,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
+            content, parser = _send(
+                client, build_message_request(prompt, json_format, instructions, max_tokens=max_tokens), json_format
             )
             
-            # Extract the text content from the response
-            content = ""
-            if hasattr(response, 'content') and isinstance(response.content, list):
-                for item in response.content:
-                    if hasattr(item, 'type') and item.type == 'text':
-                        content = item.text
-                        break
-            
-            # If we couldn't get content, use the string representation
-            if not content:
-                content = str(response)
-                
             logging.debug("Successfully received content from Anthropic API")
             
         except Exception as api_error:
@@ -73,28 +174,11 @@ def analyze_case_text(prompt, json_format=False):
                 logging.warning(f"Trying fallback model: {fallback_model}")
                 
                 try:
-                    response = client.messages.create(
-                        model=fallback_model,
-                        system=system_message,
-                        max_tokens=1500,
-                        temperature=0.2,
-                        messages=[
-                            {"role": "user", "content": prompt}
-                        ]
+                    content, parser = _send(
+                        client, build_message_request(prompt, json_format, instructions, model=fallback_model,
+                                                      max_tokens=max_tokens), json_format
                     )
                     
-                    # Extract content from the fallback response
-                    content = ""
-                    if hasattr(response, 'content') and isinstance(response.content, list):
-                        for item in response.content:
-                            if hasattr(item, 'type') and item.type == 'text':
-                                content = item.text
-                                break
-                    
-                    # If still no content, use string representation
-                    if not content:
-                        content = str(response)
-                        
                     logging.info("Successfully received content using fallback model")
                     
                 except Exception as fallback_error:
@@ -106,24 +190,25 @@ def analyze_case_text(prompt, json_format=False):
         
         # Process the content if JSON format was requested
         if json_format and content:
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                # Try to extract a JSON object from the content
-                import re
-                json_match = re.search(r'(\{.*\})', content, re.DOTALL)
-                if json_match:
-                    try:
-                        return json.loads(json_match.group(1))
-                    except:
-                        logging.warning("Could not parse extracted JSON-like content")
-                
-                # If we still don't have valid JSON, return a structured error
-                logging.warning("Failed to parse content as JSON")
-                return {
-                    "error": "Invalid JSON response",
-                    "raw_content": content[:200] if len(content) > 200 else content
-                }
+            # Handles bare JSON as well as JSON wrapped in prose or code fences
+            parsed = parser.result()
+            if parsed is None:
+                parsed = structured_output.extract_json(content)
+            if parsed is not None:
+                return parsed
+            
+            # A response cut off by max_tokens still has its completed fields
+            partial = parser.partial()
+            if partial:
+                logging.warning(f"JSON response was incomplete; using {parser.fields_completed} completed fields")
+                return partial
+            
+            # If we still don't have valid JSON, return a structured error
+            logging.warning("Failed to parse content as JSON")
+            return {
+                "error": "Invalid JSON response",
+                "raw_content": content[:200] if len(content) > 200 else content
+            }
         
         return content
         
@@ -132,6 +217,151 @@ def analyze_case_text(prompt, json_format=False):
         return None
 
 
+# Static task instructions for each analysis. These are sent as the second
+# cached system block, so only the case details vary between requests.
+RIGHTS_VIOLATIONS_INSTRUCTIONS = """
+Analyze the legal case description provided by the user and identify any potential violations of rights related to probable cause issues
+and Fourth Amendment protections. Create analysis so simple that ANYONE can use it to defend themselves without 
+relying on public defenders who are paid by the same entity as prosecutors and judges.
+Format your response as JSON with the following structure:
+
+{
+    "rights_violations": [
+        {
+            "right_violated": "Name of the specific right (focus on probable cause and 4th Amendment issues)",
+            "explanation": "Brief description of the potential violation showing why probable cause may be invalid",
+            "supporting_legal_principle": "Constitutional amendment, statute, or case law basis related to probable cause standards",
+            "severity": "High/Medium/Low"
+        }
+    ]
+}
+
+If you don't identify any potential rights violations, return an empty array for "rights_violations".
+"""
+
+DOCUMENT_RECOMMENDATION_INSTRUCTIONS = """
+Based on the legal case description provided by the user, recommend the most effective legal documents 
+that attack BOTH probable cause AND speedy trial rights violations to get a criminal case dismissed.
+Create document instructions so simple and straightforward that even someone with no legal 
+training could successfully prepare and file them. Format your response as JSON with the following structure:
+
+{
+    "recommended_documents": [
+        {
+            "document_type": "Name of the document",
+            "purpose": "What this document aims to accomplish",
+            "strategic_value": "Why this document is important for the case",
+            "timing": "When this should be filed for maximum effect",
+            "key_elements": ["Important elements to include in this document"],
+            "priority": "High/Medium/Low"
+        }
+    ]
+}
+"""
+
+CASE_LAW_INSTRUCTIONS = """
+Analyze the legal case provided by the user and suggest the most powerful case law precedents related to
+BOTH probable cause challenges AND speedy trial rights violations that could help dismiss a criminal case.
+Focus on landmark Supreme Court decisions that any defendant could easily cite to win their case.
+Explain these cases in simple terms that anyone could understand and use in court.
+Format your response as JSON with the following structure:
+
+{
+    "relevant_cases": [
+        {
+            "case_name": "Full case citation",
+            "key_holding": "The main legal principle established by this case",
+            "relevance": "Specifically how this applies to the current case",
+            "jurisdiction": "The court that decided this case",
+            "strength": "How strongly this supports the client's position (Strong/Moderate/Limited)"
+        }
+    ]
+}
+"""
+
+EVIDENCE_RELEVANCE_INSTRUCTIONS = """
+You are an expert legal evidence analyst tasked with identifying opportunities to SUPPRESS EVIDENCE
+using the "fruit of the poisonous tree" doctrine. Create step-by-step instructions so simple that
+ANYONE can get evidence thrown out without legal training.
+
+For each piece of evidence in the user's case, assess:
+1. Whether it's suppressible under "fruit of the poisonous tree" doctrine (High/Medium/Low likelihood)
+2. The exact initial "poisonous tree" violation that makes this evidence illegal
+3. Precise language to use in a motion to suppress this evidence
+4. How this evidence connects to other evidence that should also be suppressed as "fruit"
+5. Supreme Court cases supporting suppression that anyone can cite without a lawyer
+
+Format your response as a JSON object structured like this:
+{
+  "evidence_analysis": [
+    {
+      "evidence_id": 1,
+      "relevance_score": "High",
+      "key_points": [
+        "This evidence directly supports the plaintiff's claim of damages",
+        "Establishes timeline of events crucial to determining liability",
+        "Contains specific information that contradicts defendant's statements"
+      ],
+      "strategic_value": "Use this evidence to establish the factual basis for your claim",
+      "presentation_recommendations": "Present early to establish context for the case"
+    }
+  ]
+}
+
+Provide detailed, legally sound analysis for each piece of evidence that could help strengthen the case.
+"""
+
+EXHIBIT_ORGANIZATION_INSTRUCTIONS = """
+You are an expert legal strategist creating a battle plan anyone can use to win their case without a lawyer.
+Organize evidence to expose the inherent conflict of interest in a system where public defenders,
+prosecutors and judges are all paid by the same entity.
+
+Using the case details and evidence relevance analysis provided by the user, create a simple step-by-step
+plan that ANYONE can follow to win their case by:
+1. Organizing evidence into groups that attack BOTH probable cause AND speedy trial violations
+2. Creating a presentation order so compelling even a child could understand it
+3. Providing exact wording to use when introducing each exhibit in court
+4. Explaining how each evidence group exposes the system's built-in conflicts of interest
+5. Showing exactly how to present timeline evidence to prove speedy trial violations
+
+Format your response as a JSON object structured like this:
+{
+  "exhibit_plan": [
+    {
+      "exhibit_group": "A: Timeline Evidence",
+      "strategic_purpose": "Establishes clear chronology of events leading to the dispute",
+      "evidence_items": [3, 1, 5],
+      "presentation_order": "Chronological",
+      "introduction_strategy": "Begin with these exhibits to create a foundation for the case narrative",
+      "key_points_to_emphasize": [
+        "Note the timestamps on documents",
+        "Highlight the sequence of communications",
+        "Emphasize time between incidents and responses"
+      ]
+    },
+    ...additional exhibit groups...
+  ]
+}
+
+Create a comprehensive, strategic exhibit organization that would maximize persuasiveness and clarity in court.
+"""
+
+def build_case_prompt(description, issue_type, court_type, section_title=None, section_body=None,
+                      section_compact=None):
+    """
+    Build the case-specific user message that follows the cached system prefix.
+    The extra section is shortened before the description if the prompt is over budget.
+    """
+    builder = prompt_budget.PromptBuilder(model=DEFAULT_MODEL, output_tokens=DEFAULT_MAX_TOKENS)
+    builder.add("case", f"CASE DETAILS:\nIssue Type: {issue_type}\nCourt Type: {court_type}", required=True)
+    builder.add("description", f"Description: {description}", priority=2, min_tokens=200)
+    if section_title:
+        builder.add("section", f"{section_title}:\n{section_body}", priority=1,
+                    compact=f"{section_title}:\n{section_compact}" if section_compact else None)
+    return builder.build()
+
+
+@tracing.traced("anthropic.analyze_rights_violations")
 def analyze_rights_violations(description, issue_type, court_type):
     """Analyze potential rights violations in a case"""
     if not description or not issue_type or not court_type:
@@ -147,53 +377,25 @@ def analyze_rights_violations(description, issue_type, court_type):
             ]
         }
     
-    prompt = f"""
-    Analyze this legal case description and identify any potential violations of rights related to probable cause issues
-    and Fourth Amendment protections. Create analysis so simple that ANYONE can use it to defend themselves without 
-    relying on public defenders who are paid by the same entity as prosecutors and judges.
-    Format your response as JSON with the following structure:
-    
-    {{
-        "rights_violations": [
-            {{
-                "right_violated": "Name of the specific right (focus on probable cause and 4th Amendment issues)",
-                "explanation": "Brief description of the potential violation showing why probable cause may be invalid",
-                "supporting_legal_principle": "Constitutional amendment, statute, or case law basis related to probable cause standards",
-                "severity": "High/Medium/Low"
-            }}
-        ]
-    }}
-    
-    Case details:
-    Issue type: {issue_type}
-    Court type: {court_type}
-    Description: {description}
-    
-    If you don't identify any potential rights violations, return an empty array for "rights_violations".
-    """
-    
+    prompt = build_case_prompt(description, issue_type, court_type)
+
     try:
-        result = analyze_case_text(prompt, json_format=True)
+        result = analyze_case_text(prompt, json_format=True, instructions=RIGHTS_VIOLATIONS_INSTRUCTIONS)
         
         # Ensure we return a dict with the expected structure even if API call fails
         if not result or not isinstance(result, dict):
             logging.error("Rights violation analysis returned invalid result")
             return {"rights_violations": []}
         
-        # If the result doesn't have the expected format, return an empty structure
-        if "rights_violations" not in result:
-            logging.warning("Rights violation response missing expected key 'rights_violations'")
-            # Try to adjust the structure if needed (Claude might return a different format)
-            if "violations" in result:
-                result["rights_violations"] = result.pop("violations")
-            else:
-                result["rights_violations"] = []
+        # Fill in the expected structure (Claude sometimes uses different key names)
+        structured_output.apply_schema(result, "rights_violations")
         
         return result
     except Exception as e:
         logging.error(f"Error in analyze_rights_violations: {str(e)}")
         return {"rights_violations": []}
 
+@tracing.traced("anthropic.recommend_documents")
 def recommend_documents(description, issue_type, court_type):
     """Recommend documents for a case"""
     if not description or not issue_type or not court_type:
@@ -211,53 +413,25 @@ def recommend_documents(description, issue_type, court_type):
             ]
         }
         
-    prompt = f"""
-    Based on this legal case description, recommend the most effective legal documents 
-    that attack BOTH probable cause AND speedy trial rights violations to get a criminal case dismissed.
-    Create document instructions so simple and straightforward that even someone with no legal 
-    training could successfully prepare and file them. Format your response as JSON with the following structure:
-    
-    {{
-        "recommended_documents": [
-            {{
-                "document_type": "Name of the document",
-                "purpose": "What this document aims to accomplish",
-                "strategic_value": "Why this document is important for the case",
-                "timing": "When this should be filed for maximum effect",
-                "key_elements": ["Important elements to include in this document"],
-                "priority": "High/Medium/Low"
-            }}
-        ]
-    }}
-    
-    Case details:
-    Issue type: {issue_type}
-    Court type: {court_type}
-    Description: {description}
-    """
+    prompt = build_case_prompt(description, issue_type, court_type)
     
     try:
-        result = analyze_case_text(prompt, json_format=True)
+        result = analyze_case_text(prompt, json_format=True, instructions=DOCUMENT_RECOMMENDATION_INSTRUCTIONS)
         
         # Ensure we return a dict with the expected structure even if API call fails
         if not result or not isinstance(result, dict):
             logging.error("Document recommendation analysis returned invalid result")
             return {"recommended_documents": []}
         
-        # If the result doesn't have the expected format, return an empty structure
-        if "recommended_documents" not in result:
-            logging.warning("Document recommendation response missing expected key 'recommended_documents'")
-            # Try to adjust the structure if needed (Claude might return a different format)
-            if "documents" in result:
-                result["recommended_documents"] = result.pop("documents")
-            else:
-                result["recommended_documents"] = []
+        # Fill in the expected structure (Claude sometimes uses different key names)
+        structured_output.apply_schema(result, "recommended_documents")
         
         return result
     except Exception as e:
         logging.error(f"Error in recommend_documents: {str(e)}")
         return {"recommended_documents": []}
 
+@tracing.traced("anthropic.suggest_case_law")
 def suggest_case_law(description, issue_type, court_type):
     """Suggest relevant case law"""
     if not description or not issue_type or not court_type:
@@ -274,49 +448,18 @@ def suggest_case_law(description, issue_type, court_type):
             ]
         }
         
-    prompt = f"""
-    Analyze this legal case and suggest the most powerful case law precedents related to
-    BOTH probable cause challenges AND speedy trial rights violations that could help dismiss a criminal case.
-    Focus on landmark Supreme Court decisions that any defendant could easily cite to win their case.
-    Explain these cases in simple terms that anyone could understand and use in court.
-    Format your response as JSON with the following structure:
-    
-    {{
-        "relevant_cases": [
-            {{
-                "case_name": "Full case citation",
-                "key_holding": "The main legal principle established by this case",
-                "relevance": "Specifically how this applies to the current case",
-                "jurisdiction": "The court that decided this case",
-                "strength": "How strongly this supports the client's position (Strong/Moderate/Limited)"
-            }}
-        ]
-    }}
-    
-    Case details:
-    Issue type: {issue_type}
-    Court type: {court_type}
-    Description: {description}
-    """
+    prompt = build_case_prompt(description, issue_type, court_type)
     
     try:
-        result = analyze_case_text(prompt, json_format=True)
+        result = analyze_case_text(prompt, json_format=True, instructions=CASE_LAW_INSTRUCTIONS)
         
         # Ensure we return a dict with the expected structure even if API call fails
         if not result or not isinstance(result, dict):
             logging.error("Case law suggestion analysis returned invalid result")
             return {"relevant_cases": []}
         
-        # If the result doesn't have the expected format, return an empty structure
-        if "relevant_cases" not in result:
-            logging.warning("Case law suggestion response missing expected key 'relevant_cases'")
-            # Try to adjust the structure if needed (Claude might return a different format)
-            if "cases" in result:
-                result["relevant_cases"] = result.pop("cases")
-            elif "case_law" in result:
-                result["relevant_cases"] = result.pop("case_law")
-            else:
-                result["relevant_cases"] = []
+        # Fill in the expected structure (Claude sometimes uses different key names)
+        structured_output.apply_schema(result, "relevant_cases")
         
         return result
     except Exception as e:
@@ -337,62 +480,22 @@ def analyze_evidence_relevance(description, issue_type, court_type, evidence_des
             ]
         }
         
-    prompt = f"""
-    You are an expert legal evidence analyst tasked with identifying opportunities to SUPPRESS EVIDENCE
-    using the "fruit of the poisonous tree" doctrine. Create step-by-step instructions so simple that
-    ANYONE can get evidence thrown out without legal training.
-    
-    CASE DETAILS:
-    Description: {description}
-    Issue Type: {issue_type}
-    Court Type: {court_type}
-    
-    EVIDENCE ITEMS:
-    {json.dumps(evidence_descriptions, indent=2)}
-    
-    For each piece of evidence, assess:
-    1. Whether it's suppressible under "fruit of the poisonous tree" doctrine (High/Medium/Low likelihood)
-    2. The exact initial "poisonous tree" violation that makes this evidence illegal
-    3. Precise language to use in a motion to suppress this evidence
-    4. How this evidence connects to other evidence that should also be suppressed as "fruit"
-    5. Supreme Court cases supporting suppression that anyone can cite without a lawyer
-    
-    Format your response as a JSON object structured like this:
-    {{
-      "evidence_analysis": [
-        {{
-          "evidence_id": 1,
-          "relevance_score": "High",
-          "key_points": [
-            "This evidence directly supports the plaintiff's claim of damages",
-            "Establishes timeline of events crucial to determining liability",
-            "Contains specific information that contradicts defendant's statements"
-          ],
-          "strategic_value": "Use this evidence to establish the factual basis for your claim",
-          "presentation_recommendations": "Present early to establish context for the case"
-        }}
-      ]
-    }}
-    
-    Provide detailed, legally sound analysis for each piece of evidence that could help strengthen the case.
-    """
+    prompt = build_case_prompt(
+        description, issue_type, court_type,
+        "EVIDENCE ITEMS", json.dumps(evidence_descriptions, indent=2),
+        prompt_budget.compact_json(evidence_descriptions)
+    )
     
     try:
-        result = analyze_case_text(prompt, json_format=True)
+        result = analyze_case_text(prompt, json_format=True, instructions=EVIDENCE_RELEVANCE_INSTRUCTIONS)
         
         # Ensure we return a dict with the expected structure even if API call fails
         if not result or not isinstance(result, dict):
             logging.error("Evidence analysis returned invalid result")
             return {"evidence_analysis": []}
         
-        # If the result doesn't have the expected format, return an empty structure
-        if "evidence_analysis" not in result:
-            logging.warning("Evidence analysis response missing expected key 'evidence_analysis'")
-            # Try to adjust the structure if needed (Claude might return a different format)
-            if "analysis" in result:
-                result["evidence_analysis"] = result.pop("analysis")
-            else:
-                result["evidence_analysis"] = []
+        # Fill in the expected structure (Claude sometimes uses different key names)
+        structured_output.apply_schema(result, "evidence_relevance")
         
         return result
     except Exception as e:
@@ -415,66 +518,22 @@ def organize_exhibits(description, issue_type, court_type, relevance_analysis):
             ]
         }
         
-    prompt = f"""
-    You are an expert legal strategist creating a battle plan anyone can use to win their case without a lawyer.
-    Organize evidence to expose the inherent conflict of interest in a system where public defenders,
-    prosecutors and judges are all paid by the same entity.
-    
-    CASE DETAILS:
-    Description: {description}
-    Issue Type: {issue_type}
-    Court Type: {court_type}
-    
-    EVIDENCE RELEVANCE ANALYSIS:
-    {json.dumps(relevance_analysis, indent=2)}
-    
-    Create a simple step-by-step plan that ANYONE can follow to win their case by:
-    1. Organizing evidence into groups that attack BOTH probable cause AND speedy trial violations
-    2. Creating a presentation order so compelling even a child could understand it
-    3. Providing exact wording to use when introducing each exhibit in court
-    4. Explaining how each evidence group exposes the system's built-in conflicts of interest
-    5. Showing exactly how to present timeline evidence to prove speedy trial violations
-    
-    Format your response as a JSON object structured like this:
-    {{
-      "exhibit_plan": [
-        {{
-          "exhibit_group": "A: Timeline Evidence",
-          "strategic_purpose": "Establishes clear chronology of events leading to the dispute",
-          "evidence_items": [3, 1, 5],
-          "presentation_order": "Chronological",
-          "introduction_strategy": "Begin with these exhibits to create a foundation for the case narrative",
-          "key_points_to_emphasize": [
-            "Note the timestamps on documents",
-            "Highlight the sequence of communications",
-            "Emphasize time between incidents and responses"
-          ]
-        }},
-        ...additional exhibit groups...
-      ]
-    }}
-    
-    Create a comprehensive, strategic exhibit organization that would maximize persuasiveness and clarity in court.
-    """
+    prompt = build_case_prompt(
+        description, issue_type, court_type,
+        "EVIDENCE RELEVANCE ANALYSIS", json.dumps(relevance_analysis, indent=2),
+        prompt_budget.compact_json(relevance_analysis)
+    )
     
     try:
-        result = analyze_case_text(prompt, json_format=True)
+        result = analyze_case_text(prompt, json_format=True, instructions=EXHIBIT_ORGANIZATION_INSTRUCTIONS)
         
         # Ensure we return a dict with the expected structure even if API call fails
         if not result or not isinstance(result, dict):
             logging.error("Exhibit organization returned invalid result")
             return {"exhibit_plan": []}
         
-        # If the result doesn't have the expected format, return an empty structure
-        if "exhibit_plan" not in result:
-            logging.warning("Exhibit organization response missing expected key 'exhibit_plan'")
-            # Try to adjust the structure if needed (Claude might return a different format)
-            if "exhibits" in result:
-                result["exhibit_plan"] = result.pop("exhibits")
-            elif "plan" in result:
-                result["exhibit_plan"] = result.pop("plan")
-            else:
-                result["exhibit_plan"] = []
+        # Fill in the expected structure (Claude sometimes uses different key names)
+        structured_output.apply_schema(result, "exhibit_organization")
         
         return result
     except Exception as e:
@@ -1,5 +1,14 @@
 from flask import Flask, render_template
 import logging
+import metrics
+import tracing
+import provider_clients
+import ai_usage
+import rate_limits
+import prefetch
+import sql_profiler
+import analysis_compactor
+import ad_click_buffer
 
 def create_app():
     app = Flask(__name__)
@@ -7,6 +16,26 @@ def create_app():
     # Configure logging
     logging.basicConfig(level=logging.DEBUG)
 
+    # Request latency, in-flight and query metrics on /metrics
+    metrics.init_app(app)
+    # Root tracing span per request
+    tracing.init_app(app)
+    # Per-request SQL statement profiling
+    sql_profiler.init_app(app)
+    # Interactive request tracking, so prefetch jobs only run while idle
+    prefetch.init_app(app)
+    # Usage accounting writer and rollups, flask rollup-ai-usage
+    ai_usage.init_app(app)
+    # Analysis history retention and dictionary training, flask compact-analyses
+    analysis_compactor.init_app(app)
+    # Spooled ad click writer and campaign rollups, flask flush-ad-clicks
+    ad_click_buffer.init_app(app)
+
+    # Every provider call is recorded for usage accounting, then waits its
+    # turn in the fair queue (outermost, so recorded latency excludes the wait)
+    provider_clients.add_instrumentation(ai_usage.instrument)
+    provider_clients.add_instrumentation(rate_limits.instrument)
+
     # Register routes
     @app.route("/")
     def home():
@@ -0,0 +1,113 @@
+"""
+Conversion attribution for ad clicks.
+
+ad_landing gives every click a random first-party click id, stores it on the
+AdClick row (click_id, unique index) and in the visitor's session. When that
+session later registers or upgrades to premium, mark_conversion() marks the
+click with one UPDATE by click_id, so attribution never searches clicks by
+IP address or user agent.
+
+A click converts once: conversion_timestamp is set on its first conversion
+and kept, so campaign_rollup counts each converting click exactly once, in the
+hour it was clicked. A later, more valuable conversion (premium after
+registration) only upgrades conversion_type.
+
+Clicks are written in batches by ad_click_buffer, so a visitor who converts
+within seconds of landing, or while the click writers are backing off, may not
+have a row yet. The conversion is then spooled with ad_click_buffer, whose
+writer retries it until the click row lands.
+
+conversion_timestamp is taken just before the update, not when the
+conversion was first attempted, so it is never behind campaign_rollup's
+conversion watermark.
+"""
+import uuid
+import logging
+from datetime import datetime
+
+from flask import session, has_request_context
+import sqlalchemy as sa
+
+import ad_click_buffer
+
+SESSION_KEY = 'ad_click_id'
+
+# Conversion types, least valuable first; a click only moves up this list
+CONVERSION_TYPES = ('registration', 'premium')
+
+
+def new_click_id():
+    """A random first-party id for one ad click"""
+    return uuid.uuid4().hex
+
+
+def remember_click(click_id):
+    """Attribute this session's later conversions to click_id"""
+    session[SESSION_KEY] = click_id
+
+
+def current_click_id():
+    return session.get(SESSION_KEY) if has_request_context() else None
+
+
+def _mark(click_id, conversion_type):
+    """Mark or upgrade the click's conversion; returns the number of rows updated"""
+    from app import db
+    from models import AdClick
+    clicks = AdClick.__table__
+    lower_types = CONVERSION_TYPES[:CONVERSION_TYPES.index(conversion_type)]
+    statement = clicks.update() \
+        .where(clicks.c.click_id == click_id) \
+        .where(sa.or_(clicks.c.converted.isnot(True), clicks.c.conversion_type.in_(lower_types))) \
+        .values(converted=True, conversion_type=conversion_type,
+                conversion_timestamp=sa.func.coalesce(clicks.c.conversion_timestamp, datetime.utcnow()))
+    with db.engine.begin() as connection:
+        return connection.execute(statement).rowcount
+
+
+def _click_exists(click_id):
+    from app import db
+    from models import AdClick
+    return db.session.query(AdClick.id).filter(AdClick.click_id == click_id).first() is not None
+
+
+def mark_conversion(conversion_type, click_id=None):
+    """
+    Mark the click that brought this session in as converted; returns True if
+    a click was marked or upgraded, or the conversion was queued for a click
+    not written yet. Sessions without an ad click are ignored.
+    """
+    if conversion_type not in CONVERSION_TYPES:
+        raise ValueError(f"Unknown conversion type: {conversion_type}")
+    click_id = click_id or current_click_id()
+    if not click_id:
+        return False
+    try:
+        if _mark(click_id, conversion_type):
+            return True
+        if _click_exists(click_id) or not ad_click_buffer.is_buffered():
+            # Already converted at least this far, or a click that was never spooled
+            return False
+    except Exception as e:
+        # Attribution must never break registration or checkout
+        logging.error(f"Error recording {conversion_type} conversion for ad click {click_id}: {str(e)}")
+        if not ad_click_buffer.is_buffered():
+            return False
+    # The click is still waiting in a spool, or the database is unavailable
+    ad_click_buffer.record_conversion(click_id, conversion_type)
+    return True
+
+
+def apply_pending(conversions):
+    """
+    Apply conversions spooled by mark_conversion; returns those whose click
+    has not been written yet. Database errors propagate so they are retried.
+    """
+    waiting = []
+    for conversion in conversions:
+        click_id, conversion_type = conversion['click_id'], conversion['conversion_type']
+        if conversion_type not in CONVERSION_TYPES:
+            continue
+        if not _mark(click_id, conversion_type) and not _click_exists(click_id):
+            waiting.append(conversion)
+    return waiting
@@ -3,20 +3,21 @@ Audio processing module for evidence transcription and analysis
 """
 import os
 import json
-from openai import OpenAI
-from anthropic import Anthropic
+import copy
 from datetime import datetime
+import provider_clients
+import structured_output
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+# OpenAI is used for transcription and analysis, with Anthropic as a fallback.
+# Both clients come from the shared registry and are created on first use.
 
-# Initialize the Anthropic client as a fallback
-try:
-    anthropic_client = Anthropic(api_key=os.environ.get('ANTHROPIC_API_KEY'))
-    anthropic_available = True
-except Exception as e:
-    print(f"Warning: Anthropic client initialization failed: {e}")
-    anthropic_available = False
+# Returned when the model's response contains no parseable JSON
+PARSE_ERROR_ANALYSIS = {
+    "key_points": ["Error parsing analysis"],
+    "legal_claims": ["Could not extract legal claims"],
+    "relevance": "The system encountered an error analyzing this transcript.",
+    "actionable_insights": "Please try regenerating the analysis or contact support if the issue persists."
+}
 
 def transcribe_audio(file_path):
     """
@@ -35,6 +36,9 @@ def transcribe_audio(file_path):
     try:
         # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
+        client = provider_clients.get_openai_client()
+        if client is None:
+            raise RuntimeError("OpenAI API key is not configured")
         with open(file_path, "rb") as audio_file:
             transcription = client.audio.transcriptions.create(
                 model="whisper-1",
@@ -92,6 +96,9 @@ Return ONLY a properly formatted JSON object with key_points, legal_claims, rele
         try:
             # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
             # do not change this unless explicitly requested by the user
+            client = provider_clients.get_openai_client()
+            if client is None:
+                raise RuntimeError("OpenAI API key is not configured")
             response = client.chat.completions.create(
                 model="gpt-4o",
                 messages=[
@@ -101,32 +108,15 @@ Return ONLY a properly formatted JSON object with key_points, legal_claims, rele
                 response_format={"type": "json_object"}
             )
             
-            analysis_json = response.choices[0].message.content
-            try:
-                analysis = json.loads(analysis_json)
-                # Ensure we have all required fields with defaults if missing
-                if "key_points" not in analysis:
-                    analysis["key_points"] = ["No key points identified"]
-                if "legal_claims" not in analysis:
-                    analysis["legal_claims"] = ["No specific legal claims identified"]
-                if "relevance" not in analysis:
-                    analysis["relevance"] = "The relevance to the case could not be determined."
-                if "actionable_insights" not in analysis:
-                    analysis["actionable_insights"] = "No specific actionable insights could be determined."
-                return analysis
-            except json.JSONDecodeError:
-                # If we can't parse the JSON, create a structured response anyway
-                return {
-                    "key_points": ["Error parsing analysis"],
-                    "legal_claims": ["Could not extract legal claims"],
-                    "relevance": "The system encountered an error analyzing this transcript.",
-                    "actionable_insights": "Please try regenerating the analysis or contact support if the issue persists."
-                }
+            # Parse and fill in any missing fields with defaults
+            analysis = structured_output.parse_response(response.choices[0].message.content, "transcript_analysis")
+            return analysis if analysis is not None else copy.deepcopy(PARSE_ERROR_ANALYSIS)
         except Exception as openai_error:
             print(f"OpenAI analysis failed, trying Anthropic fallback: {str(openai_error)}")
             
             # Fallback to Anthropic if available
-            if anthropic_available:
+            anthropic_client = provider_clients.get_anthropic_client()
+            if anthropic_client is not None:
                 # the newest Anthropic model is "claude-3-5-sonnet-20241022" which was released October 22, 2024.
                 # do not change this unless explicitly requested by the user
                 response = anthropic_client.messages.create(
@@ -138,27 +128,9 @@ Return ONLY a properly formatted JSON object with key_points, legal_claims, rele
                     ]
                 )
                 
-                try:
-                    # Try to parse as JSON
-                    analysis = json.loads(response.content[0].text)
-                    # Ensure we have all required fields with defaults if missing
-                    if "key_points" not in analysis:
-                        analysis["key_points"] = ["No key points identified"]
-                    if "legal_claims" not in analysis:
-                        analysis["legal_claims"] = ["No specific legal claims identified"]
-                    if "relevance" not in analysis:
-                        analysis["relevance"] = "The relevance to the case could not be determined."
-                    if "actionable_insights" not in analysis:
-                        analysis["actionable_insights"] = "No specific actionable insights could be determined."
-                    return analysis
-                except json.JSONDecodeError:
-                    # If we can't parse the JSON, create a structured response anyway
-                    return {
-                        "key_points": ["Error parsing analysis"],
-                        "legal_claims": ["Could not extract legal claims"],
-                        "relevance": "The system encountered an error analyzing this transcript.",
-                        "actionable_insights": "Please try regenerating the analysis or contact support if the issue persists."
-                    }
+                # Claude may wrap the JSON in prose, so extract it before applying defaults
+                analysis = structured_output.parse_response(response.content[0].text, "transcript_analysis")
+                return analysis if analysis is not None else copy.deepcopy(PARSE_ERROR_ANALYSIS)
             
             # If we got here, both OpenAI and Anthropic failed
             return {
@@ -1,4 +1,9 @@
+from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask_login import login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
+from forms import LoginForm, RegistrationForm
+from models import User
+import attribution
 
 db = SQLAlchemy()
 
@@ -34,6 +39,7 @@ def register():
             email=form.email.data,
             password=form.password.data
         )
+        attribution.mark_conversion('registration')
         flash(f'Account created for {form.username.data}! You can now log in.', 'success')
         return redirect(url_for('auth.login'))
     
@@ -0,0 +1 @@
+"""Performance benchmarks. Run from src/app, e.g. `python -m benchmarks.prompt_cache`."""
@@ -0,0 +1,84 @@
+"""
+Flask app for the benchmarks that need the models or the views.
+
+Run from src/app, `import flask` finds src/app/flask.py instead of Flask, and
+there is no `app` module for the models' and blueprints' `from app import db`.
+create_app() imports the installed Flask, builds the app with
+app_factory.create_app(), adds Flask-SQLAlchemy, Flask-Login and the
+blueprints, and installs the result as the `app` module before anything
+imports it.
+
+Environment:
+    DATABASE_URL    database to run against (default a SQLite file in the
+                    temp directory); missing tables are created
+"""
+import importlib
+import os
+import sys
+import tempfile
+import types
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BLUEPRINTS = (
+    ("auth", "auth"),
+    ("cases", "cases"),
+    ("ai_analysis", "ai"),
+    ("evidence_analysis", "evidence_ai"),
+    ("case_timeline", "timeline"),
+    ("documents", "documents"),
+    ("legal_jargon", "legal_jargon"),
+    ("client_interview", "client_interview"),
+    ("court_script", "court_script"),
+    ("settings", "settings_bp"),
+    ("subscriptions", "subscriptions_bp"),
+    ("stripe_integration", "stripe_bp"),
+    ("ad_tracking", "ad_tracking"),
+)
+
+
+def import_flask():
+    """Import the installed Flask package rather than src/app/flask.py"""
+    if hasattr(sys.modules.get("flask"), "Flask"):
+        return
+    sys.modules.pop("flask", None)
+    saved = sys.path[:]
+    sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != APP_DIR]
+    try:
+        importlib.import_module("flask")
+    finally:
+        sys.path[:] = saved
+
+
+def create_app():
+    """Return (app, db), the same objects `from app import app, db` gives the rest of the code"""
+    existing = sys.modules.get("app")
+    if hasattr(existing, "db"):
+        return existing.app, existing.db
+
+    import_flask()
+    from flask_login import LoginManager
+    from flask_sqlalchemy import SQLAlchemy
+    import app_factory
+
+    app = app_factory.create_app()
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "benchmark")
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "benchmarks.db"))
+    db = SQLAlchemy(app)
+
+    module = types.ModuleType("app")
+    module.app, module.db = app, db
+    sys.modules["app"] = module
+
+    from models import User
+    login_manager = LoginManager(app)
+    login_manager.login_view = "auth.login"
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+
+    for module_name, attribute in BLUEPRINTS:
+        app.register_blueprint(getattr(importlib.import_module(module_name), attribute))
+
+    with app.app_context():
+        db.create_all()
+    return app, db
@@ -0,0 +1,159 @@
+"""
+Dashboard and case summary rendering benchmark.
+
+Seeds a user with several cases, one of which has 200 evidence items carrying
+large transcripts and AI output, then renders dashboard.html and
+case_summary.html the way the cases views do. Each view is measured with the
+heavy columns deferred (the models' default) and with them eagerly loaded (the
+previous behaviour), reporting latency and peak Python memory per render.
+
+All rows are created inside a transaction that is rolled back at the end, so
+the benchmark can be pointed at a development database without leaving data
+behind. Every iteration starts from an empty session so nothing is served from
+the identity map.
+
+Usage (from src/app):
+    python -m benchmarks.case_views [--evidence 200] [--cases 20] [--transcript-kb 64] [--iterations 10]
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from benchmarks.bench_app import create_app
+
+app, db = create_app()
+
+from flask import render_template
+from flask_login import login_user
+from sqlalchemy.orm import defaultload, undefer_group
+
+from models import Case, Evidence, User, ROLE_PREMIUM
+
+
+def filler(kb, label):
+    """Return about kb kilobytes of transcript-like text"""
+    sentence = f"{label}: the officer stated that the search was conducted without a warrant. "
+    return (sentence * (kb * 1024 // len(sentence) + 1))[:kb * 1024]
+
+
+def seed(cases, evidence, transcript_kb):
+    """Create a user, its cases and the evidence of the first case; returns (user, case)"""
+    suffix = uuid.uuid4().hex[:8]
+    user = User(username=f"bench_{suffix}", email=f"bench_{suffix}@example.com", password=suffix,
+                role=ROLE_PREMIUM)
+    db.session.add(user)
+    db.session.flush()
+
+    ai_text = filler(transcript_kb, "Analysis")
+    created = []
+    for i in range(cases):
+        case = Case(user_id=user.id, title=f"Benchmark case {i}", court_type="state",
+                    issue_type="criminal", description=f"Traffic stop and search, case {i}.")
+        case.ai_analysis = case.legal_strategy = case.precedent_cases = ai_text
+        db.session.add(case)
+        created.append(case)
+    db.session.flush()
+
+    case = created[0]
+    transcript = filler(transcript_kb, "Transcript")
+    analysis = json.dumps({"key_points": [filler(4, "Point")] * 8, "relevance": filler(4, "Relevance")})
+    for i in range(evidence):
+        item = Evidence(filename=f"bench_{suffix}_{i}.mp3", original_filename=f"recording_{i}.mp3",
+                        file_type="audio", evidence_type="file",
+                        description=f"Recording {i}", transcript=transcript,
+                        transcript_status="completed", transcript_analysis=analysis)
+        db.session.add(item)
+        case.evidence_items.append(item)
+    db.session.flush()
+    return user, case
+
+
+def render_dashboard(user_id, eager):
+    if eager:
+        user_cases = Case.query.options(undefer_group('ai_output')).filter_by(user_id=user_id).all()
+    else:
+        user_cases = Case.get_cases_by_user(user_id)
+    return render_template('dashboard.html', cases=user_cases)
+
+
+def render_case_summary(case_id, eager):
+    if eager:
+        case = (Case.query
+                .options(undefer_group('ai_output'),
+                         defaultload(Case.evidence_items).undefer_group('transcript'))
+                .filter_by(id=case_id).first())
+    else:
+        case = Case.get_case_by_id(case_id)
+    return render_template('case_summary.html', case=case, evidence=case.get_evidence())
+
+
+def measure(render, user_id, iterations):
+    """Render repeatedly from an empty session; returns latency and peak memory stats"""
+    timings = []
+    peaks = []
+    for _ in range(iterations):
+        db.session.expunge_all()
+        # Log the user in again, as a new request would
+        login_user(User.query.get(user_id))
+        tracemalloc.start()
+        started = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {
+        "latency_ms_p50": round(statistics.median(timings) * 1000, 2),
+        "latency_ms_mean": round(statistics.mean(timings) * 1000, 2),
+        "peak_memory_mb": round(statistics.median(peaks) / (1024 * 1024), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--evidence", type=int, default=200, help="evidence items on the summarized case")
+    parser.add_argument("--cases", type=int, default=20, help="cases shown on the dashboard")
+    parser.add_argument("--transcript-kb", type=int, default=64, help="size of each transcript and AI field")
+    parser.add_argument("--iterations", type=int, default=10, help="renders per view and mode")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with app.test_request_context():
+        try:
+            user, case = seed(args.cases, args.evidence, args.transcript_kb)
+            user_id, case_id = user.id, case.id
+
+            for view, render in (("dashboard", lambda eager: render_dashboard(user_id, eager)),
+                                 ("case_summary", lambda eager: render_case_summary(case_id, eager))):
+                for mode in ("eager", "deferred"):
+                    results[f"{view}/{mode}"] = measure(lambda: render(mode == "eager"), user_id,
+                                                          args.iterations)
+        finally:
+            db.session.rollback()
+
+    for view in ("dashboard", "case_summary"):
+        eager, deferred = results[f"{view}/eager"], results[f"{view}/deferred"]
+        results[f"{view}/savings"] = {
+            "latency_p50_pct": round(100 * (1 - deferred["latency_ms_p50"] / eager["latency_ms_p50"]), 1),
+            "peak_memory_pct": round(100 * (1 - deferred["peak_memory_mb"] / eager["peak_memory_mb"]), 1),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'view':<14}{'mode':<10}{'p50':>10}{'mean':>10}{'peak mem':>12}")
+    for view in ("dashboard", "case_summary"):
+        for mode in ("eager", "deferred"):
+            r = results[f"{view}/{mode}"]
+            print(f"{view:<14}{mode:<10}{r['latency_ms_p50']:>8.1f}ms{r['latency_ms_mean']:>8.1f}ms"
+                  f"{r['peak_memory_mb']:>10.2f}MB")
+        savings = results[f"{view}/savings"]
+        print(f"{'':<14}{'savings':<10}{savings['latency_p50_pct']:>9}%{'':>10}{savings['peak_memory_pct']:>11}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Micro-benchmarks for the pure-Python helpers that run on every request.
+
+Times each function on realistic inputs (2,000-character case descriptions,
+100KB model outputs) in the style of pytest-benchmark: rounds are calibrated
+so each benchmark runs for about --min-time seconds, and min, median, mean,
+standard deviation and operations per second are reported.
+
+    generate_document/<form>       utils.generate_document for every form type
+    generate_documents/all_forms   utils.generate_documents, every form for one case in one pass
+    generate_fallback_analysis     ai_analysis.generate_fallback_analysis
+    enhance_prompt                 legal_knowledge_base.enhance_ai_prompt_with_legal_knowledge
+    comprehensive_strategy         legal_knowledge_base.format_comprehensive_strategy
+    fee_waiver_percentage          fee_waiver_calculator.calculate_fee_waiver_percentage
+    extract_json/<shape>           structured_output.extract_json, the parser behind
+                                   anthropic_helper.analyze_case_text, on 100KB outputs
+
+Every run is saved under --storage (default .benchmarks/hot_functions) and
+compared with the previous saved run, or with the run given to --compare.
+A median slower than the baseline by more than --threshold percent is
+reported as a regression and makes the command exit non-zero.
+
+Usage (from src/app):
+    python -m benchmarks.hot_functions [--min-time 0.5] [--filter extract_json]
+        [--compare path/to/run.json] [--threshold 10] [--no-save]
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+FORM_TYPES = ("motion_to_quash", "civil_cover_sheet", "section_1983", "habeas_corpus",
+              "discovery_request", "motion_to_dismiss", "answer_complaint")
+DESCRIPTION_CHARS = 2000
+MODEL_OUTPUT_BYTES = 100 * 1024
+
+
+def make_description(chars=DESCRIPTION_CHARS):
+    """A case description of about chars characters that triggers the keyword checks"""
+    sentence = ("On March 3 officers stopped my car without a warrant, searched it over my objection and "
+                "questioned me in custody without Miranda warnings; my attorney requested a speedy trial "
+                "but the court granted six continuances and set excessive bail. ")
+    return (sentence * (chars // len(sentence) + 1))[:chars]
+
+
+def make_case(issue_type="criminal"):
+    return SimpleNamespace(id=1, title="State v. Doe - Traffic Stop Search", issue_type=issue_type,
+                           court_type="state", description=make_description())
+
+
+def make_model_output(size=MODEL_OUTPUT_BYTES, fenced=False):
+    """A case law analysis JSON of about size bytes, wrapped in prose (and a code fence)"""
+    entry = {"case_name": "Barker v. Wingo", "year": "1972", "court": "Supreme Court",
+             "relevance": "Four-factor speedy trial balancing test. " * 4,
+             "key_quotes": ["The right to a speedy trial is generically different."] * 3,
+             "strategic_application": "Argue length of delay, reason, assertion and prejudice {in order}."}
+    entries = []
+    while len(json.dumps(entries)) < size:
+        entries.append(dict(entry, year=str(1900 + len(entries) % 120)))
+    body = json.dumps({"relevant_cases": entries}, indent=2)
+    if fenced:
+        body = f"```json\n{body}\n```"
+    return f"Here is the analysis of the case you provided:\n\n{body}\n\nLet me know if you need more detail."
+
+
+def build_benchmarks():
+    """Return {name: zero-argument callable} for every benchmark"""
+    import utils
+    import legal_knowledge_base as lkb
+    import structured_output
+    from fee_waiver_calculator import calculate_fee_waiver_percentage
+    from ai_analysis import generate_fallback_analysis
+
+    case = make_case()
+    deadline = date.today() + timedelta(days=14)
+    prompt = f"Analyze the constitutional rights issues in this case:\n{case.description}"
+    plain_output = make_model_output()
+    fenced_output = make_model_output(fenced=True)
+    # Income and household size pairs on both sides of the poverty line
+    households = [(12000 + 3000 * i, 1 + i % 10) for i in range(100)]
+
+    benchmarks = {}
+    for form_type in FORM_TYPES:
+        benchmarks[f"generate_document/{form_type}"] = (
+            lambda form_type=form_type: utils.generate_document(form_type, case, "CA", "state_trial", deadline))
+    benchmarks["generate_documents/all_forms"] = (
+        lambda: utils.generate_documents(FORM_TYPES, case, "CA", "state_trial", deadline))
+    benchmarks["generate_fallback_analysis"] = lambda: generate_fallback_analysis(case)
+    benchmarks["enhance_prompt"] = (
+        lambda: lkb.enhance_ai_prompt_with_legal_knowledge(prompt, "criminal_defense", "criminal_law"))
+    benchmarks["comprehensive_strategy"] = (
+        lambda: lkb.format_comprehensive_strategy("criminal_defense", list(lkb.LEGAL_RIGHTS)))
+    benchmarks["fee_waiver_percentage/100_households"] = (
+        lambda: [calculate_fee_waiver_percentage(income, size) for income, size in households])
+    benchmarks["extract_json/100kb_prose"] = lambda: structured_output.extract_json(plain_output)
+    benchmarks["extract_json/100kb_fenced"] = lambda: structured_output.extract_json(fenced_output)
+    return benchmarks
+
+
+def measure(fn, min_time, max_rounds=100000):
+    """Time fn in calibrated rounds until about min_time seconds have been spent"""
+    fn()  # warm up
+    started = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - started, 1e-7)
+    # Batch very fast calls so timer resolution does not dominate
+    iterations = max(1, int(0.001 / single))
+    rounds = max(5, min(max_rounds, int(min_time / (single * iterations))))
+
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - started) / iterations)
+    median = statistics.median(timings)
+    return {
+        "rounds": rounds,
+        "iterations": iterations,
+        "min_us": round(min(timings) * 1e6, 3),
+        "median_us": round(median * 1e6, 3),
+        "mean_us": round(statistics.mean(timings) * 1e6, 3),
+        "stddev_us": round(statistics.stdev(timings) * 1e6, 3) if len(timings) > 1 else 0.0,
+        "ops": round(1 / median, 1),
+    }
+
+
+def latest_run(storage):
+    """Path of the most recent saved run, or None"""
+    runs = sorted(glob.glob(os.path.join(storage, "*.json")))
+    return runs[-1] if runs else None
+
+
+def compare(results, baseline, threshold):
+    """Return (name, baseline median, median, change %, regressed) for every benchmark in both runs"""
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous and previous["median_us"] > 0:
+            change = 100 * (current["median_us"] / previous["median_us"] - 1)
+            rows.append((name, previous["median_us"], current["median_us"], change, change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend on each benchmark")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--storage", default=os.path.join(".benchmarks", "hot_functions"),
+                        help="directory runs are saved in")
+    parser.add_argument("--no-save", action="store_true", help="do not save this run")
+    parser.add_argument("--compare", help="saved run to compare with (default the previous run)")
+    parser.add_argument("--threshold", type=float, default=10.0, help="median slowdown in percent that fails")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # ai_analysis needs the app to import
+    from benchmarks.bench_app import create_app
+    app, _ = create_app()
+
+    with app.app_context():
+        benchmarks = build_benchmarks()
+        results = {name: measure(fn, args.min_time) for name, fn in benchmarks.items() if args.filter in name}
+
+    baseline_path = args.compare or latest_run(args.storage)
+    run = {"saved_at": datetime.utcnow().isoformat(), "min_time": args.min_time, "benchmarks": results}
+    if not args.no_save:
+        os.makedirs(args.storage, exist_ok=True)
+        path = os.path.join(args.storage, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+        with open(path, "w") as f:
+            json.dump(run, f, indent=2)
+
+    rows = []
+    if baseline_path:
+        with open(baseline_path) as f:
+            rows = compare(results, json.load(f).get("benchmarks", {}), args.threshold)
+    regressions = [row for row in rows if row[4]]
+
+    if args.json:
+        run["baseline"] = baseline_path
+        run["regressions"] = [{"name": name, "baseline_median_us": before, "median_us": after, "change_pct": round(change, 1)}
+                              for name, before, after, change, _ in regressions]
+        print(json.dumps(run, indent=2))
+    else:
+        print(f"{'benchmark':<40}{'min':>11}{'median':>11}{'mean':>11}{'stddev':>11}{'ops':>11}{'rounds':>8}")
+        for name, r in results.items():
+            print(f"{name:<40}{r['min_us']:>9.1f}us{r['median_us']:>9.1f}us{r['mean_us']:>9.1f}us"
+                  f"{r['stddev_us']:>9.1f}us{r['ops']:>11.1f}{r['rounds']:>8}")
+        if rows:
+            print(f"\nCompared with {baseline_path}:")
+            for name, before, after, change, regressed in rows:
+                print(f"  {name:<40}{before:>10.1f}us -> {after:>10.1f}us {change:>+7.1f}%"
+                      + ("  REGRESSION" if regressed else ""))
+
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
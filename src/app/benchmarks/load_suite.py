@@ -0,0 +1,271 @@
+"""
+End-to-end load test of the main user journeys.
+
+Seeds users into the configured database, starts the mock AI provider
+(benchmarks/mock_provider.py) and points the app at it, then runs --users
+virtual users through this journey, --concurrency at a time, each with its
+own session through the full Flask stack:
+
+    register (new users) or login (seeded users), new_case, upload_evidence
+    with an audio file (transcribed by the mock Whisper), case_ai_analysis,
+    evidence_analysis, timeline add-event and events, filing_toolkit then
+    download_document (the rendered PDF), and translator search suggestions
+
+For each step it reports throughput, p50/p95/p99 latency and the error rate
+(any 4xx/5xx, or a response that did not redirect where the step expects).
+Results can be written as JSON with --output and compared with an earlier
+run with --compare, which exits non-zero when a step's p95 or error rate
+regressed by more than --threshold / --error-threshold.
+
+Every run creates users, cases and documents, so point DATABASE_URL at a
+scratch database. Rate limiting is turned off unless --rate-limits is given
+so the suite measures the app rather than the limiter.
+
+Usage (from src/app):
+    python -m benchmarks.load_suite [--users 20] [--concurrency 5] [--seeded 10]
+        [--mock-latency fixed:200] [--mock-error-rate 0] [--output run.json]
+        [--compare baseline.json] [--threshold 20] [--error-threshold 0.01]
+"""
+import argparse
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+STEPS = ("register", "login", "new_case", "upload_evidence", "case_ai_analysis", "evidence_analysis",
+         "timeline_add_event", "timeline_events", "filing_toolkit", "download_document", "search_suggestions")
+PASSWORD = "load-test-password"
+# Enough of an MP3 for the upload checks; the mock transcribes anything
+AUDIO = b"ID3\x03\x00\x00\x00\x00\x00\x00" + b"\x00" * 4096
+DESCRIPTION = ("I was stopped for weaving, refused consent to a search and the officer searched my car anyway. "
+               "My trial has been continued six times over fourteen months.")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """Collects (latency, ok) samples per step from all virtual users"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.failures = {}
+
+    def record(self, step, latency, ok, detail=None):
+        with self._lock:
+            self.samples.setdefault(step, []).append((latency, ok))
+            if not ok and detail and len(self.failures.setdefault(step, [])) < 5:
+                self.failures[step].append(detail)
+
+    def summary(self, elapsed):
+        results = {}
+        for step in STEPS:
+            samples = self.samples.get(step)
+            if not samples:
+                continue
+            latencies = [latency * 1000 for latency, _ in samples]
+            errors = sum(1 for _, ok in samples if not ok)
+            results[step] = {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(errors / len(samples), 4),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "latency_ms_p50": round(percentile(latencies, 50), 2),
+                "latency_ms_p95": round(percentile(latencies, 95), 2),
+                "latency_ms_p99": round(percentile(latencies, 99), 2),
+                "latency_ms_max": round(max(latencies), 2),
+            }
+            if self.failures.get(step):
+                results[step]["sample_failures"] = self.failures[step]
+        return results
+
+
+class VirtualUser:
+    """One user's session walking through the journey"""
+
+    def __init__(self, app, recorder, email, username=None):
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.email = email
+        self.username = username
+
+    def step(self, name, method, url, expect_location=None, **kwargs):
+        """Make a request and record it; returns the response, or None if the step failed"""
+        started = time.perf_counter()
+        try:
+            response = self.client.open(url, method=method, **kwargs)
+        except Exception as e:
+            self.recorder.record(name, time.perf_counter() - started, False, f"{type(e).__name__}: {e}")
+            return None
+        latency = time.perf_counter() - started
+        location = response.headers.get("Location", "")
+        ok = response.status_code < 400 and (expect_location is None or re.search(expect_location, location))
+        detail = None if ok else f"HTTP {response.status_code} {location}".strip()
+        self.recorder.record(name, latency, bool(ok), detail)
+        return response if ok else None
+
+    def run(self):
+        if self.username:
+            self.step("register", "POST", "/register", r"/login", data={
+                "username": self.username, "email": self.email,
+                "password": PASSWORD, "confirm_password": PASSWORD})
+        if not self.step("login", "POST", "/login", r"/dashboard", data={"email": self.email, "password": PASSWORD}):
+            return
+
+        response = self.step("new_case", "POST", "/case/new", r"/case/\d+", data={
+            "title": f"Load test {uuid.uuid4().hex[:8]}", "court_type": "state",
+            "issue_type": "criminal", "description": DESCRIPTION})
+        if response is None:
+            return
+        case_id = int(re.search(r"/case/(\d+)", response.headers["Location"]).group(1))
+
+        self.step("upload_evidence", "POST", f"/case/{case_id}/evidence/upload", content_type="multipart/form-data",
+                  data={"evidence_type": "file", "description": "Dashcam audio",
+                        "file": (io.BytesIO(AUDIO), "traffic_stop.mp3")})
+        self.step("case_ai_analysis", "POST", f"/case/{case_id}/ai-analysis", data={"analysis_type": "case_law"})
+        self.step("evidence_analysis", "POST", f"/case/{case_id}/evidence/analysis",
+                  data={"analysis_type": "evidence_relevance"})
+        self.step("timeline_add_event", "POST", f"/case/{case_id}/timeline/add-event", data={
+            "title": "Arraignment", "date": (date.today() - timedelta(days=30)).isoformat(), "type": "court"})
+        self.step("timeline_events", "GET", f"/case/{case_id}/timeline/events")
+
+        response = self.step("filing_toolkit", "POST", "/filing-toolkit", r"/download/\d+", data={
+            "case_id": str(case_id), "state": "CA", "court_type": "state_trial", "form_type": "motion_to_quash",
+            "deadline_date": (date.today() + timedelta(days=14)).isoformat()})
+        if response is not None:
+            # The redirect goes to the preview page; download the rendered file itself
+            self.step("download_document", "GET", response.headers["Location"].rstrip("/") + "/pdf")
+
+        self.step("search_suggestions", "GET", "/api/search-suggestions?q=hab")
+
+
+def seed_users(count, run_id):
+    """Create users for the login journey; returns their emails"""
+    from models import User
+    emails = []
+    for i in range(count):
+        email = f"load_{run_id}_{i}@example.com"
+        User.create_user(username=f"load_{run_id}_{i}", email=email, password=PASSWORD)
+        emails.append(email)
+    return emails
+
+
+def compare(results, baseline, threshold, error_threshold):
+    """Return regressions of p95 latency or error rate against a baseline run"""
+    regressions = []
+    for step, current in results["steps"].items():
+        previous = baseline.get("steps", {}).get(step)
+        if not previous:
+            continue
+        if previous["latency_ms_p95"] > 0:
+            change = 100 * (current["latency_ms_p95"] / previous["latency_ms_p95"] - 1)
+            if change > threshold:
+                regressions.append(f"{step}: p95 {previous['latency_ms_p95']}ms -> {current['latency_ms_p95']}ms "
+                                   f"(+{change:.0f}%)")
+        if current["error_rate"] > previous["error_rate"] + error_threshold:
+            regressions.append(f"{step}: error rate {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="virtual users to run through the journey")
+    parser.add_argument("--concurrency", type=int, default=5, help="virtual users running at once")
+    parser.add_argument("--seeded", type=int, default=None,
+                        help="users created up front who log in; the rest register (default half)")
+    parser.add_argument("--mock-latency", default="fixed:200", help="mock provider latency distribution")
+    parser.add_argument("--mock-error-rate", type=float, default=0.0, help="share of mock provider calls failing")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the AI rate limits on")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=20.0, help="allowed p95 latency increase in percent")
+    parser.add_argument("--error-threshold", type=float, default=0.01, help="allowed error rate increase (0.01 = 1 point)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    from benchmarks.mock_provider import start_server
+    mock = start_server(latency=args.mock_latency, chunk_ms=5, error_rate=args.mock_error_rate)
+    # Set before the app is imported so every provider client uses the mock
+    os.environ["AI_MOCK_URL"] = mock.url
+    if not args.rate_limits:
+        os.environ["RATE_LIMIT_ENABLED"] = "0"
+
+    from benchmarks.bench_app import create_app
+    app, _ = create_app()
+
+    app.config["WTF_CSRF_ENABLED"] = False
+    app.config.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp(prefix="load_suite_"))
+    run_id = uuid.uuid4().hex[:8]
+    seeded = args.users // 2 if args.seeded is None else min(args.seeded, args.users)
+    with app.app_context():
+        emails = seed_users(seeded, run_id)
+
+    recorder = Recorder()
+    users = [VirtualUser(app, recorder, email) for email in emails]
+    users += [VirtualUser(app, recorder, f"load_{run_id}_new_{i}@example.com", f"load_{run_id}_new_{i}")
+              for i in range(args.users - seeded)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+        for future in [executor.submit(user.run) for user in users]:
+            future.result()
+    elapsed = time.perf_counter() - started
+    mock.shutdown()
+
+    results = {
+        "run": {
+            "run_id": run_id,
+            "started_at": datetime.utcnow().isoformat(),
+            "users": args.users,
+            "seeded_users": seeded,
+            "concurrency": args.concurrency,
+            "mock_latency": args.mock_latency,
+            "mock_error_rate": args.mock_error_rate,
+            "rate_limits": args.rate_limits,
+            "elapsed_s": round(elapsed, 2),
+            "mock_requests": mock.requests,
+        },
+        "steps": recorder.summary(elapsed),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.error_threshold)
+        results["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{args.users} users, concurrency {args.concurrency}, {elapsed:.1f}s, "
+              f"{mock.requests} mock provider calls\n")
+        print(f"{'step':<20}{'reqs':>6}{'err%':>7}{'rps':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+        for step, r in results["steps"].items():
+            print(f"{step:<20}{r['requests']:>6}{r['error_rate'] * 100:>6.1f}%{r['throughput_rps']:>8.2f}"
+                  f"{r['latency_ms_p50']:>8.1f}ms{r['latency_ms_p95']:>8.1f}ms{r['latency_ms_p99']:>8.1f}ms")
+        for step, failures in recorder.failures.items():
+            print(f"\n{step} failures (first {len(failures)}): " + "; ".join(failures))
+        if args.compare:
+            print("\nRegressions:\n  " + "\n  ".join(regressions) if regressions else "\nNo regressions.")
+
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""
+Deterministic local stand-in for the OpenAI and Anthropic APIs.
+
+Speaks the wire formats the app's SDK clients use, including streaming:
+    POST /v1/chat/completions        OpenAI chat (JSON or server-sent events)
+    POST /v1/audio/transcriptions    OpenAI Whisper (json, text, srt/vtt or verbose_json)
+    POST /v1/messages                Anthropic messages (JSON or server-sent events)
+    GET  /health
+
+Replies are canned per analysis type. The type is detected from the JSON field
+names the prompt asks for (e.g. "asserting_rights" selects the court script
+rights section), so every AI path in the app receives data shaped like a real
+answer; requests that do not ask for JSON get plain text. Canned replies can be
+replaced or extended with --responses, a JSON file mapping analysis type to
+reply object (types are the keys of structured_output.SCHEMAS).
+
+Latency before the first byte follows a configurable distribution, streamed
+replies are split into chunks spaced --chunk-ms apart, and a share of requests
+can fail with a provider error or a 429. With the same --seed, the same
+sequence of requests sees the same latencies and errors.
+
+Point the app at it with AI_MOCK_URL (see provider_clients):
+    AI_MOCK_URL=http://127.0.0.1:8100
+
+Usage (from src/app):
+    python -m benchmarks.mock_provider [--port 8100] [--latency lognormal:800:0.5]
+        [--error-rate 0.02] [--rate-limit-rate 0.01] [--chunk-ms 20] [--seed 1]
+        [--responses replies.json]
+
+Latency distributions (milliseconds):
+    fixed:MS  uniform:LOW:HIGH  normal:MEAN:STDDEV  lognormal:MEDIAN:SIGMA
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from structured_output import SCHEMAS
+
+CANNED_TRANSCRIPT = ("Officer: Step out of the vehicle. Driver: Am I being detained? "
+                     "Officer: You were weaving. Driver: I do not consent to any searches.")
+CANNED_TEXT = "This is a deterministic mock response for load testing."
+# Characters per chunk of a streamed reply
+CHUNK_CHARS = 40
+
+# Sample entry for list fields, by field name
+LIST_ITEMS = {
+    "rights_violations": {"right_violated": "Fourth Amendment - unreasonable search",
+                          "explanation": "The vehicle was searched without a warrant or consent.",
+                          "severity": "High", "supporting_legal_principle": "Mapp v. Ohio, 367 U.S. 643 (1961)"},
+    "relevant_cases": {"case_name": "Barker v. Wingo", "year": "1972", "court": "Supreme Court",
+                       "key_holding": "Speedy trial claims are weighed on four factors.",
+                       "relevance": "Trial has been delayed repeatedly.", "jurisdiction": "Federal",
+                       "strength": "Strong"},
+    "recommended_documents": {"document_type": "Motion to Dismiss", "purpose": "Dismiss for speedy trial violation",
+                              "strategic_value": "Ends the case if granted", "timing": "Before trial",
+                              "key_elements": ["Timeline of delays", "Prejudice to the defense"], "priority": "High"},
+    "evidence_analysis": {"evidence_id": 1, "relevance": "High", "suppression_argument": "Obtained without a warrant",
+                          "steps": ["File a motion to suppress"]},
+    "exhibit_plan": {"exhibit": "A", "title": "Dashcam footage", "purpose": "Shows no traffic violation occurred"},
+    "asserting_rights": {"right": "Right to a speedy trial", "when_to_assert": "At arraignment",
+                         "what_to_say": "Your Honor, I assert my right to a speedy trial.",
+                         "possible_responses": "The court notes the assertion on the record."},
+    "potential_challenges": {"challenge": "The prosecutor asks for a continuance",
+                             "response": "Object and ask that the delay be charged to the state."},
+    "preparation": {"step": "Gather the docket history", "details": "Print every continuance order",
+                    "importance": "Shows the length and cause of each delay"},
+    "constitutional_violations": {"violation": "Search without consent", "details": "Consent was refused",
+                                  "severity": "High"},
+    "speedy_trial_violations": {"violation": "Repeated continuances", "details": "14 months without trial",
+                                "severity": "High"},
+    "key_factors": {"factor": "Warrantless search", "impact": "positive"},
+    "improvement_suggestions": {"suggestion": "File a motion to suppress early"},
+}
+LIST_ITEMS["rights_assessment"] = LIST_ITEMS["rights_violations"]
+LIST_ITEMS["case_law_suggestions"] = LIST_ITEMS["relevant_cases"]
+LIST_ITEMS["document_recommendations"] = LIST_ITEMS["recommended_documents"]
+DEFAULT_LIST_ITEM = {"title": "Mock entry", "details": "Deterministic mock response"}
+DICT_VALUES = {
+    "winning_strategy": {"primary_approach": "Challenge the stop and the delay",
+                         "attack_defense_tactics": ["Move to suppress", "Move to dismiss"],
+                         "procedural_motions": ["Motion to suppress"], "evidence_challenges": "Warrantless search",
+                         "hearing_objections": "Object to hearsay", "timing_strategy": "File before trial"},
+    "defense_strategy": {"primary_approach": "Suppress the search", "key_motions": ["Motion to suppress"]},
+}
+
+
+def build_canned_responses():
+    """Build one reply per structured_output schema, filled with sample values"""
+    responses = {}
+    for analysis_type, fields in SCHEMAS.items():
+        reply = {}
+        for name, field in fields.items():
+            if field.type is list:
+                reply[name] = [dict(LIST_ITEMS.get(name, DEFAULT_LIST_ITEM))]
+            elif field.type is dict:
+                reply[name] = dict(DICT_VALUES.get(name, {}))
+            elif field.type is float:
+                reply[name] = 0.65
+            else:
+                reply[name] = field.get_default() or "Mock value"
+        responses[analysis_type] = reply
+    return responses
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def parse_latency(spec):
+    """Turn a latency spec into a function drawing milliseconds from a random.Random"""
+    kind, *params = spec.split(":")
+    params = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockProviderServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the mock's settings and random state"""
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0", chunk_ms=0.0, error_rate=0.0, rate_limit_rate=0.0,
+                 seed=1, responses=None):
+        super().__init__(address, MockProviderHandler)
+        self.latency = parse_latency(latency)
+        self.chunk_ms = chunk_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.responses = build_canned_responses()
+        self.responses.update(responses or {})
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        """Return (latency seconds, outcome) for the next request"""
+        with self._rng_lock:
+            self.requests += 1
+            latency = self.latency(self._rng) / 1000.0
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return latency, "error"
+        if roll < self.error_rate + self.rate_limit_rate:
+            return latency, "rate_limited"
+        return latency, "ok"
+
+    def detect(self, text):
+        """Return the analysis type whose fields the prompt asks for best, or None"""
+        best, best_score = None, (0.0, 0)
+        for analysis_type, reply in self.responses.items():
+            matched = sum(1 for name in reply if re.search(rf"\b{re.escape(name)}\b", text))
+            score = (matched / len(reply), matched) if reply else (0.0, 0)
+            if matched and score > best_score:
+                best, best_score = analysis_type, score
+        return best
+
+    def reply_text(self, text, wants_json):
+        """Canned reply for a prompt: the detected analysis as JSON, or plain text"""
+        analysis_type = self.detect(text) if wants_json or "json" in text.lower() else None
+        if analysis_type is None:
+            return json.dumps({"result": CANNED_TEXT}) if wants_json else CANNED_TEXT
+        return json.dumps(self.responses[analysis_type])
+
+
+def _chunks(text):
+    return [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or [""]
+
+
+def _message_text(content):
+    """Flatten OpenAI or Anthropic message content to text"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return ""
+
+
+class MockProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/health":
+            self._json(200, {"status": "ok", "requests": self.server.requests})
+        else:
+            self._json(404, {"error": {"message": "Not found", "type": "not_found_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        path = self.path.split("?")[0].rstrip("/")
+        routes = {
+            "/v1/chat/completions": self._chat_completions,
+            "/v1/audio/transcriptions": self._transcriptions,
+            "/v1/messages": self._messages,
+        }
+        if path not in routes:
+            self._json(404, {"error": {"message": f"Unknown path {path}", "type": "not_found_error"}})
+            return
+
+        latency, outcome = self.server.draw()
+        time.sleep(latency)
+        anthropic = path == "/v1/messages"
+        if outcome == "rate_limited":
+            self._error(429, "rate_limit_error", "Mock rate limit", anthropic, {"Retry-After": "1"})
+        elif outcome == "error":
+            if anthropic:
+                self._error(529, "overloaded_error", "Mock overload", anthropic)
+            else:
+                self._error(500, "server_error", "Mock server error", anthropic)
+        else:
+            routes[path](raw)
+
+    # OpenAI
+
+    def _chat_completions(self, raw):
+        body = json.loads(raw or b"{}")
+        text = " ".join(_message_text(m.get("content")) for m in body.get("messages", []))
+        wants_json = (body.get("response_format") or {}).get("type") in ("json_object", "json_schema")
+        reply = self.server.reply_text(text, wants_json)
+        usage = {"prompt_tokens": estimate_tokens(text), "completion_tokens": estimate_tokens(reply)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        base = {"id": completion_id, "created": int(time.time()), "model": body.get("model", "gpt-4o")}
+
+        if not body.get("stream"):
+            self._json(200, dict(base, object="chat.completion", usage=usage, choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": reply}}]))
+            return
+
+        self._start_stream()
+        chunk = dict(base, object="chat.completion.chunk")
+        self._data(dict(chunk, choices=[{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                         "finish_reason": None}]))
+        for piece in _chunks(reply):
+            self._pause()
+            self._data(dict(chunk, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+        self._data(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._data(dict(chunk, choices=[], usage=usage))
+        self._write(b"data: [DONE]\n\n")
+        self._end_stream()
+
+    def _transcriptions(self, raw):
+        # Only the response_format form field matters; the audio is ignored
+        match = re.search(rb'name="response_format"\r\n\r\n([a-z_]+)', raw)
+        response_format = match.group(1).decode() if match else "json"
+        if response_format == "text":
+            self._send(200, CANNED_TRANSCRIPT.encode(), "text/plain")
+        elif response_format in ("srt", "vtt"):
+            header = "WEBVTT\n\n" if response_format == "vtt" else "1\n"
+            self._send(200, f"{header}00:00:00.000 --> 00:00:08.000\n{CANNED_TRANSCRIPT}\n".encode(), "text/plain")
+        elif response_format == "verbose_json":
+            self._json(200, {"task": "transcribe", "language": "english", "duration": 8.0, "text": CANNED_TRANSCRIPT,
+                             "segments": [{"id": 0, "start": 0.0, "end": 8.0, "text": CANNED_TRANSCRIPT}]})
+        else:
+            self._json(200, {"text": CANNED_TRANSCRIPT})
+
+    # Anthropic
+
+    def _messages(self, raw):
+        body = json.loads(raw or b"{}")
+        system = body.get("system") or ""
+        text = _message_text(system) + " " + " ".join(_message_text(m.get("content"))
+                                                      for m in body.get("messages", []))
+        reply = self.server.reply_text(text, wants_json=False)
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant",
+            "model": body.get("model"), "stop_reason": None, "stop_sequence": None,
+            "usage": {"input_tokens": estimate_tokens(text), "output_tokens": 1,
+                      "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0},
+        }
+        output_tokens = estimate_tokens(reply)
+
+        if not body.get("stream"):
+            message.update(content=[{"type": "text", "text": reply}], stop_reason="end_turn")
+            message["usage"]["output_tokens"] = output_tokens
+            self._json(200, message)
+            return
+
+        self._start_stream()
+        message["content"] = []
+        self._event("message_start", {"type": "message_start", "message": message})
+        self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                            "content_block": {"type": "text", "text": ""}})
+        for piece in _chunks(reply):
+            self._pause()
+            self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": piece}})
+        self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._event("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": output_tokens}})
+        self._event("message_stop", {"type": "message_stop"})
+        self._end_stream()
+
+    # Responses
+
+    def _error(self, status, error_type, message, anthropic, headers=None):
+        if anthropic:
+            payload = {"type": "error", "error": {"type": error_type, "message": message}}
+        else:
+            payload = {"error": {"message": message, "type": error_type, "code": error_type}}
+        self._json(status, payload, headers)
+
+    def _json(self, status, payload, headers=None):
+        self._send(status, json.dumps(payload).encode("utf-8"), "application/json", headers)
+
+    def _send(self, status, payload, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write(self, data):
+        # One HTTP chunk per event so clients see it immediately
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _data(self, payload):
+        self._write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _event(self, name, payload):
+        self._write(f"event: {name}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _pause(self):
+        if self.server.chunk_ms:
+            time.sleep(self.server.chunk_ms / 1000.0)
+
+
+def start_server(port=0, **settings):
+    """Start a mock provider on a background thread; returns the server (its URL is server.url)"""
+    server = MockProviderServer(("127.0.0.1", port), **settings)
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="lognormal:800:0.5", help="time to first byte distribution")
+    parser.add_argument("--chunk-ms", type=float, default=20.0, help="delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with 500/529")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests failing with 429")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--responses", help="JSON file mapping analysis type to canned reply")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+
+    server = MockProviderServer((args.host, args.port), latency=args.latency, chunk_ms=args.chunk_ms,
+                                error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+                                seed=args.seed, responses=responses)
+    print(f"Mock provider listening on http://{args.host}:{server.server_port} "
+          f"(set AI_MOCK_URL to this address)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Prompt caching benchmark for anthropic_helper.
+
+Starts a local mock of the Anthropic Messages API that simulates prompt caching
+(prefix hashing at each cache_control breakpoint, prefill time proportional to
+uncached input tokens) and streams the five case analyses through the real SDK
+with caching enabled and disabled. Reports time to first token and billed input
+tokens for each mode.
+
+Usage (from src/app):
+    python -m benchmarks.prompt_cache [--rounds 5] [--ms-per-1k-tokens 40]
+"""
+import argparse
+import hashlib
+import json
+import statistics
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from anthropic import Anthropic
+
+import ai_usage
+import anthropic_helper
+
+# Cached reads are billed at a fraction of the base rate and skip most prefill
+CACHE_READ_COST = 0.1
+CACHE_WRITE_COST = 1.25
+CANNED_REPLY = '{"result": "ok"}'
+
+
+def estimate_tokens(text):
+    """Rough token estimate used by the mock server (about 4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class MockAnthropicServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the simulated prompt cache"""
+    daemon_threads = True
+
+    def __init__(self, address, ms_per_1k_tokens):
+        super().__init__(address, MockMessagesHandler)
+        self.ms_per_1k_tokens = ms_per_1k_tokens
+        self.cache = set()
+        self.cache_lock = threading.Lock()
+
+    def account(self, body):
+        """Split the request's input tokens into uncached, cache-write and cache-read"""
+        system = body.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+
+        digest = hashlib.sha256()
+        prefix_tokens = 0
+        cached_through = 0
+        breakpoints = []
+        for block in system:
+            digest.update(block.get("text", "").encode("utf-8"))
+            prefix_tokens += estimate_tokens(block.get("text", ""))
+            if block.get("cache_control"):
+                breakpoints.append((digest.hexdigest(), prefix_tokens))
+
+        message_tokens = sum(
+            estimate_tokens(m["content"] if isinstance(m["content"], str) else json.dumps(m["content"]))
+            for m in body.get("messages", [])
+        )
+
+        with self.cache_lock:
+            # The longest breakpoint already in the cache is read; later ones are written
+            for key, tokens in breakpoints:
+                if key in self.cache:
+                    cached_through = tokens
+            written_through = cached_through
+            for key, tokens in breakpoints:
+                if tokens > cached_through:
+                    self.cache.add(key)
+                    written_through = tokens
+
+        return {
+            "input_tokens": prefix_tokens - written_through + message_tokens,
+            "cache_creation_input_tokens": written_through - cached_through,
+            "cache_read_input_tokens": cached_through,
+        }
+
+
+class MockMessagesHandler(BaseHTTPRequestHandler):
+    """Handles POST /v1/messages in both plain and streaming modes"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        usage = self.server.account(body)
+
+        # Prefill cost: full rate for uncached tokens, reduced for cached reads
+        prefill_tokens = (usage["input_tokens"] + usage["cache_creation_input_tokens"]
+                          + usage["cache_read_input_tokens"] * CACHE_READ_COST)
+        time.sleep(prefill_tokens / 1000.0 * self.server.ms_per_1k_tokens / 1000.0)
+
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model"),
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": dict(usage, output_tokens=1),
+        }
+        output_tokens = estimate_tokens(CANNED_REPLY)
+
+        if not body.get("stream"):
+            message["content"] = [{"type": "text", "text": CANNED_REPLY}]
+            message["stop_reason"] = "end_turn"
+            message["usage"]["output_tokens"] = output_tokens
+            payload = json.dumps(message).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        message["content"] = []
+        self._event("message_start", {"type": "message_start", "message": message})
+        self._event("content_block_start", {"type": "content_block_start", "index": 0,
+                                            "content_block": {"type": "text", "text": ""}})
+        self._event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": CANNED_REPLY}})
+        self._event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        self._event("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": output_tokens}})
+        self._event("message_stop", {"type": "message_stop"})
+
+    def _event(self, name, data):
+        self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def build_workload(rounds):
+    """Build (instructions, prompt) pairs for the five analyses over several distinct cases"""
+    workload = []
+    for i in range(rounds):
+        description = (f"Case {i}: the defendant was arrested after a traffic stop without a warrant. "
+                       f"Trial has been continued {i + 3} times over {14 + i} months.")
+        evidence = json.dumps([{"id": n, "title": f"Exhibit {n}", "description": "Dashcam footage"}
+                               for n in range(1, 4)], indent=2)
+        workload.extend([
+            (anthropic_helper.RIGHTS_VIOLATIONS_INSTRUCTIONS,
+             anthropic_helper.build_case_prompt(description, "criminal", "state")),
+            (anthropic_helper.DOCUMENT_RECOMMENDATION_INSTRUCTIONS,
+             anthropic_helper.build_case_prompt(description, "criminal", "state")),
+            (anthropic_helper.CASE_LAW_INSTRUCTIONS,
+             anthropic_helper.build_case_prompt(description, "criminal", "state")),
+            (anthropic_helper.EVIDENCE_RELEVANCE_INSTRUCTIONS,
+             anthropic_helper.build_case_prompt(description, "criminal", "state", "EVIDENCE ITEMS", evidence)),
+            (anthropic_helper.EXHIBIT_ORGANIZATION_INSTRUCTIONS,
+             anthropic_helper.build_case_prompt(description, "criminal", "state",
+                                                "EVIDENCE RELEVANCE ANALYSIS", evidence)),
+        ])
+    return workload
+
+
+def run_mode(client, workload, caching):
+    """Stream every request in the workload and collect TTFT and usage"""
+    anthropic_helper.PROMPT_CACHING = caching
+    ttfts = []
+    totals = {"input_tokens": 0, "cache_write_tokens": 0, "cache_read_tokens": 0}
+
+    for instructions, prompt in workload:
+        request = anthropic_helper.build_message_request(prompt, json_format=True, instructions=instructions)
+        started = time.perf_counter()
+        ttft = None
+        with client.messages.stream(**request) as stream:
+            for event in stream:
+                if ttft is None and event.type == "content_block_delta":
+                    ttft = time.perf_counter() - started
+            final = stream.get_final_message()
+        ttfts.append(ttft)
+        # Counted the same way as the app's usage accounting
+        counts = ai_usage.token_counts('anthropic', final)
+        for key in totals:
+            totals[key] += counts[key]
+
+    billed = (totals["input_tokens"]
+              + totals["cache_write_tokens"] * CACHE_WRITE_COST
+              + totals["cache_read_tokens"] * CACHE_READ_COST)
+    return {
+        "requests": len(workload),
+        "ttft_ms_p50": round(statistics.median(ttfts) * 1000, 2),
+        "ttft_ms_mean": round(statistics.mean(ttfts) * 1000, 2),
+        "ttft_ms_max": round(max(ttfts) * 1000, 2),
+        "input_tokens": totals["input_tokens"],
+        "cache_write_tokens": totals["cache_write_tokens"],
+        "cache_read_tokens": totals["cache_read_tokens"],
+        "billed_input_token_equivalent": round(billed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5, help="distinct cases to analyze per mode")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=40.0,
+                        help="simulated prefill time per 1,000 uncached input tokens")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    original_caching = anthropic_helper.PROMPT_CACHING
+    results = {}
+    for caching in (False, True):
+        # Fresh server per mode so the cached run starts cold
+        server = MockAnthropicServer(("127.0.0.1", 0), args.ms_per_1k_tokens)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        client = Anthropic(api_key="mock-key", base_url=f"http://127.0.0.1:{server.server_port}", max_retries=0)
+        try:
+            results["cached" if caching else "uncached"] = run_mode(client, build_workload(args.rounds), caching)
+        finally:
+            server.shutdown()
+            server.server_close()
+    anthropic_helper.PROMPT_CACHING = original_caching
+
+    uncached, cached = results["uncached"], results["cached"]
+    results["savings"] = {
+        "ttft_p50_pct": round(100 * (1 - cached["ttft_ms_p50"] / uncached["ttft_ms_p50"]), 1),
+        "billed_input_pct": round(
+            100 * (1 - cached["billed_input_token_equivalent"] / uncached["billed_input_token_equivalent"]), 1),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<10}{'reqs':>6}{'ttft p50':>11}{'ttft mean':>11}{'input':>9}"
+          f"{'cache wr':>10}{'cache rd':>10}{'billed':>9}")
+    for mode in ("uncached", "cached"):
+        r = results[mode]
+        print(f"{mode:<10}{r['requests']:>6}{r['ttft_ms_p50']:>9.1f}ms{r['ttft_ms_mean']:>9.1f}ms"
+              f"{r['input_tokens']:>9}{r['cache_write_tokens']:>10}{r['cache_read_tokens']:>10}"
+              f"{r['billed_input_token_equivalent']:>9}")
+    print(f"\nTTFT p50 reduction: {results['savings']['ttft_p50_pct']}%  "
+          f"Billed input token reduction: {results['savings']['billed_input_pct']}%")
+
+
+if __name__ == "__main__":
+    main()
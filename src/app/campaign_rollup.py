@@ -0,0 +1,255 @@
+"""
+Hourly rollups of ad clicks and conversions.
+
+ad_click_rollup holds clicks and conversions by (hour, campaign_id, source,
+medium), so campaign reports read a few rows per hour however many raw
+AdClick rows there are. The rollup is incremental and never rescans
+ad_click:
+
+Clicks are counted by id. ad_click_rollup_state.last_click_id is the
+watermark; each run counts the ids above it in AD_CLICK_ROLLUP_CHUNK sized
+ranges, adding to the rollup rows and moving the watermark in the same
+transaction, so every click is counted exactly once. Batches from several
+writers can commit out of id order, so the highest id seen by a run is only
+counted once AD_CLICK_ROLLUP_DELAY seconds have passed, by which time
+transactions holding lower ids have committed.
+
+Conversions update old rows, so they are picked up by conversion_timestamp
+(indexed) up to AD_CLICK_ROLLUP_DELAY seconds ago, and added to the hour
+of the click that converted.
+
+The ad click writer in ad_click_buffer runs the rollup every
+AD_CLICK_ROLLUP_INTERVAL seconds; `flask rollup-ad-clicks` runs it on demand
+and report() serves the campaign admin view from the rollups alone.
+
+Environment:
+    AD_CLICK_ROLLUP_INTERVAL   seconds between rollups, 0 disables (default 60)
+    AD_CLICK_ROLLUP_DELAY      seconds before new clicks and conversions are counted (default 30)
+    AD_CLICK_ROLLUP_CHUNK      click ids counted per transaction (default 100000)
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+# report() dimension -> rollup column
+DIMENSIONS = {
+    'campaign': 'campaign_id',
+    'source': 'source',
+    'medium': 'medium',
+    'hour': 'hour'
+}
+METRICS = ('clicks', 'conversions')
+KEY_COLUMNS = ('hour', 'campaign_id', 'source', 'medium')
+
+# Arbitrary constant identifying the rollup's Postgres advisory lock
+ADVISORY_LOCK_KEY = 0x4144_434B
+STATE_ID = 1
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _tables():
+    from models import AdClick, AdClickRollup, AdClickRollupState
+    return AdClick.__table__, AdClickRollup.__table__, AdClickRollupState.__table__
+
+
+def _try_lock(connection):
+    """Take the rollup's advisory lock for this transaction (always succeeds off Postgres)"""
+    if connection.dialect.name != 'postgresql':
+        return True
+    return connection.execute(sa.select(sa.func.pg_try_advisory_xact_lock(ADVISORY_LOCK_KEY))).scalar()
+
+
+def _hour_of(connection, column):
+    """SQL truncating a timestamp column to the hour"""
+    if connection.dialect.name == 'postgresql':
+        return sa.func.date_trunc('hour', column)
+    return sa.func.strftime('%Y-%m-%d %H:00:00', column)
+
+
+def _as_datetime(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _counts(connection, condition, metric):
+    """Rollup rows holding the number of ad clicks matching condition, as `metric`, per key"""
+    clicks, _, _ = _tables()
+    hour = _hour_of(connection, clicks.c.timestamp)
+    dimensions = [hour, clicks.c.campaign_id, sa.func.coalesce(clicks.c.source, ''),
+                  sa.func.coalesce(clicks.c.medium, '')]
+    query = sa.select(*dimensions, sa.func.count()) \
+        .where(condition).where(clicks.c.timestamp.isnot(None)) \
+        .group_by(*dimensions)
+    return [{'hour': _as_datetime(row[0]), 'campaign_id': row[1], 'source': row[2], 'medium': row[3],
+             'clicks': 0, 'conversions': 0, metric: row[4]}
+            for row in connection.execute(query)]
+
+
+def _add(connection, rows):
+    """Add clicks and conversions to the rollup rows with the same keys, creating missing ones"""
+    if not rows:
+        return
+    _, rollups, _ = _tables()
+    if connection.dialect.name in ('postgresql', 'sqlite'):
+        if connection.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        statement = insert(rollups)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(KEY_COLUMNS),
+            set_={name: rollups.c[name] + statement.excluded[name] for name in METRICS})
+        connection.execute(statement, rows)
+        return
+    for row in rows:
+        key = sa.and_(*[rollups.c[name] == row[name] for name in KEY_COLUMNS])
+        result = connection.execute(rollups.update().where(key).values(
+            **{name: rollups.c[name] + row[name] for name in METRICS}))
+        if result.rowcount == 0:
+            connection.execute(rollups.insert(), [row])
+
+
+def _state(connection):
+    """The watermark row, created on the first run"""
+    _, _, states = _tables()
+    row = connection.execute(sa.select(states).where(states.c.id == STATE_ID)).first()
+    if row is None:
+        connection.execute(states.insert(), [{'id': STATE_ID, 'last_click_id': 0}])
+        row = connection.execute(sa.select(states).where(states.c.id == STATE_ID)).first()
+    return row._mapping
+
+
+def _save_state(connection, **values):
+    _, _, states = _tables()
+    connection.execute(states.update().where(states.c.id == STATE_ID).values(**values))
+
+
+def _roll_up_clicks(connection, now, delay, chunk):
+    """Count the next range of settled click ids; returns (clicks counted, more ranges waiting)"""
+    clicks, _, _ = _tables()
+    state = _state(connection)
+    last = state['last_click_id']
+    settled = state['pending_click_id']
+    if settled is None or state['pending_at'] > now - timedelta(seconds=delay):
+        settled = None
+
+    counted = 0
+    if settled is not None and settled > last:
+        end = min(settled, last + chunk)
+        rows = _counts(connection, sa.and_(clicks.c.id > last, clicks.c.id <= end), 'clicks')
+        _add(connection, rows)
+        counted = sum(row['clicks'] for row in rows)
+        last = end
+        _save_state(connection, last_click_id=last, updated_at=now)
+        if last < settled:
+            return counted, True
+
+    if settled is not None or state['pending_click_id'] is None:
+        # Everything seen so far is counted; remember the current highest id to count once it settles
+        highest = connection.execute(sa.select(sa.func.max(clicks.c.id))).scalar() or 0
+        _save_state(connection, pending_click_id=highest if highest > last else None, pending_at=now)
+    return counted, False
+
+
+def _roll_up_conversions(connection, now, delay):
+    """Count conversions made since the last run; returns how many"""
+    clicks, _, _ = _tables()
+    state = _state(connection)
+    through = now - timedelta(seconds=delay)
+    condition = sa.and_(clicks.c.converted.is_(True), clicks.c.conversion_timestamp <= through)
+    if state['conversions_through'] is not None:
+        if state['conversions_through'] >= through:
+            return 0
+        condition = sa.and_(condition, clicks.c.conversion_timestamp > state['conversions_through'])
+    rows = _counts(connection, condition, 'conversions')
+    _add(connection, rows)
+    _save_state(connection, conversions_through=through, updated_at=now)
+    return sum(row['conversions'] for row in rows)
+
+
+def run_rollup(now=None, delay=None, chunk=None):
+    """Count new clicks and conversions into ad_click_rollup; returns (clicks, conversions) counted"""
+    from app import db
+    now = now or datetime.utcnow()
+    delay = _setting('AD_CLICK_ROLLUP_DELAY', 30) if delay is None else delay
+    chunk = int(chunk or _setting('AD_CLICK_ROLLUP_CHUNK', 100000))
+
+    clicks = conversions = 0
+    more = True
+    while more:
+        # One transaction per range keeps a large backlog from holding locks for long
+        with db.engine.begin() as connection:
+            if not _try_lock(connection):
+                logging.info("Ad click rollup already running in another process")
+                return clicks, conversions
+            counted, more = _roll_up_clicks(connection, now, delay, chunk)
+            clicks += counted
+            if not more:
+                conversions = _roll_up_conversions(connection, now, delay)
+    if clicks or conversions:
+        logging.info(f"Ad click rollup: {clicks} clicks and {conversions} conversions counted")
+    return clicks, conversions
+
+
+def report(hours=168, group_by=('campaign', 'source', 'medium', 'hour'), campaign_id=None, limit=20, now=None):
+    """
+    Clicks, conversions and conversion rate for clicks in the last `hours`
+    hours, overall and grouped by each dimension in group_by (most clicks
+    first, hours in order). Reads only ad_click_rollup.
+    """
+    from app import db
+    from models import AdCampaign
+    _, rollups, states = _tables()
+    now = now or datetime.utcnow()
+    since = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+    condition = rollups.c.hour >= since
+    if campaign_id:
+        condition = sa.and_(condition, rollups.c.campaign_id == campaign_id)
+    metrics = [sa.func.coalesce(sa.func.sum(rollups.c[name]), 0).label(name) for name in METRICS]
+
+    def summarize(row, dimension=None):
+        summary = {}
+        if dimension:
+            key = _as_datetime(row[0]) if dimension == 'hour' else row[0]
+            summary[dimension] = key.isoformat() if isinstance(key, datetime) else key
+        summary.update({name: row._mapping[name] for name in METRICS})
+        summary['conversion_rate'] = round(summary['conversions'] / summary['clicks'], 4) if summary['clicks'] else 0.0
+        return summary
+
+    with db.engine.connect() as connection:
+        state = connection.execute(sa.select(states).where(states.c.id == STATE_ID)).first()
+        result = {
+            'since': since.isoformat(),
+            'hours': hours,
+            'campaign_id': campaign_id,
+            'updated_at': state.updated_at.isoformat() if state and state.updated_at else None,
+            'totals': summarize(connection.execute(sa.select(*metrics).where(condition)).one())
+        }
+        for dimension in group_by:
+            column = rollups.c[DIMENSIONS[dimension]]
+            query = sa.select(column, *metrics).where(condition).group_by(column)
+            if dimension == 'hour':
+                query = query.order_by(column)
+            else:
+                query = query.order_by(sa.desc('clicks')).limit(limit)
+            result[f'by_{dimension}'] = [summarize(row, dimension) for row in connection.execute(query)]
+
+    if result.get('by_campaign'):
+        names = dict(db.session.query(AdCampaign.campaign_id, AdCampaign.name).filter(
+            AdCampaign.campaign_id.in_([entry['campaign'] for entry in result['by_campaign']])))
+        for entry in result['by_campaign']:
+            entry['name'] = names.get(entry['campaign'])
+    return result
+
+
+def init_app(app):
+    """Register the rollup-ad-clicks command"""
+    @app.cli.command('rollup-ad-clicks')
+    def rollup_ad_clicks_command():
+        """Count new ad clicks and conversions into the hourly campaign rollups now."""
+        clicks, conversions = run_rollup()
+        print(f"{clicks} clicks and {conversions} conversions counted")
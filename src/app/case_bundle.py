@@ -0,0 +1,468 @@
+"""
+Case bundle export: everything for a case in one streamed ZIP.
+
+The bundle holds the case's generated documents (as PDFs, through
+document_render's cache), its evidence files, transcripts and their
+analyses, the current case_law / evidence_relevance / exhibit_organization /
+court_script analyses, and an EXHIBIT_INDEX.txt tying exhibit numbers to
+files, descriptions and exhibit groups.
+
+Entries are stored uncompressed (evidence is mostly already-compressed media)
+with their CRCs worked out before anything is sent. That fixes the size and
+position of every byte up front, so the archive is written on the fly from
+files and one database row at a time, with a Content-Length, and any byte
+range of it can be produced directly without building what comes before.
+Archives and members over 4GB use ZIP64 records.
+
+Planning reads each member once to checksum it. Database text is loaded
+again when streamed; evidence file checksums are cached by path, size and
+modification time, and rendered document checksums by their render key, so a
+resumed download does not re-read large files. Member timestamps come from
+the database (document_render touches cache files on every hit, so their
+mtimes say nothing about the content), and rendered documents are checked
+against their render key rather than the cache file's mtime, so concurrent
+downloads of the same document do not disturb each other.
+If a member changes while its bundle is being streamed the stream is cut
+off rather than sending a corrupt archive; the ETag (a hash of the entry
+list) changes too, so resumes with If-Range fall back to a full download.
+
+Environment:
+    CASE_BUNDLE_CHUNK_KB   size of the chunks written to the response (default 256)
+"""
+import os
+import re
+import json
+import zlib
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from app import db
+from models import Document, Evidence, LegalAnalysis, case_evidence
+import document_render
+
+CHUNK_SIZE = int(os.environ.get('CASE_BUNDLE_CHUNK_KB', 256)) * 1024
+ANALYSIS_TYPES = ('case_law', 'evidence_relevance', 'exhibit_organization', 'court_script')
+INDEX_NAME = 'EXHIBIT_INDEX.txt'
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# General purpose flag bit 11: names are UTF-8
+_UTF8_FLAG = 0x0800
+
+# CRC-32 of evidence files keyed by (path, size, mtime_ns), and of renders by ('render', key)
+_file_crcs = OrderedDict()
+_file_crcs_lock = threading.Lock()
+FILE_CRC_CACHE_SIZE = 4096
+
+
+class BundleChanged(Exception):
+    """A member's content changed between planning the bundle and streaming it"""
+
+
+class Entry:
+    """One archive member: its name, size, CRC-32, timestamp and a reader"""
+
+    def __init__(self, name, size, crc, modified, read):
+        self.name = name
+        self.size = size
+        self.crc = crc
+        self.modified = modified
+        # read(offset) yields the member's bytes from offset to the end
+        self.read = read
+
+
+def _chunks(data, offset=0):
+    for i in range(offset, len(data), CHUNK_SIZE):
+        yield data[i:i + CHUNK_SIZE]
+
+
+def file_crc(path, stat=None, key=None):
+    """CRC-32 of a file, cached under key (by default while its size and mtime are unchanged)"""
+    if key is None:
+        stat = stat or os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+    with _file_crcs_lock:
+        if key in _file_crcs:
+            _file_crcs.move_to_end(key)
+            return _file_crcs[key]
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(chunk, crc)
+    with _file_crcs_lock:
+        _file_crcs[key] = crc
+        while len(_file_crcs) > FILE_CRC_CACHE_SIZE:
+            _file_crcs.popitem(last=False)
+    return crc
+
+
+def file_entry(name, path):
+    stat = os.stat(path)
+    size = stat.st_size
+    mtime_ns = stat.st_mtime_ns
+
+    def read(offset):
+        try:
+            current = os.stat(path)
+            if current.st_size != size or current.st_mtime_ns != mtime_ns:
+                raise BundleChanged(name)
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            raise BundleChanged(name)
+        with f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    return Entry(name, size, file_crc(path, stat), datetime.utcfromtimestamp(stat.st_mtime), read)
+
+
+def rendered_entry(name, fmt, load, title, modified):
+    """
+    A document rendered through document_render's cache from the text load() returns.
+
+    Renders are content-addressed, so the member is identified by its render
+    key: streaming reloads the text, checks it still has the planned key and
+    renders it again if the cache file has been pruned meanwhile.
+    """
+    content = load() or ''
+    path, key = document_render.get_rendered(fmt, content, title)
+    size = os.path.getsize(path)
+    crc = file_crc(path, key=('render', key))
+    del content
+
+    def read(offset):
+        content = load() or ''
+        if document_render.cache_key(fmt, content, title) != key:
+            raise BundleChanged(name)
+        for _ in range(2):
+            try:
+                f = open(document_render.get_rendered(fmt, content, title)[0], 'rb')
+                break
+            except FileNotFoundError:
+                # Pruned between the lookup and the open
+                continue
+        else:
+            raise BundleChanged(name)
+        del content
+        with f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    return Entry(name, size, crc, modified, read)
+
+
+def data_entry(name, data, modified):
+    """A small member held in memory (the exhibit index)"""
+    return Entry(name, len(data), zlib.crc32(data), modified, lambda offset: _chunks(data, offset))
+
+
+def text_entry(name, load, modified):
+    """
+    A member loaded from the database by load(); None if there is nothing to export.
+
+    The text is loaded once here for its size and CRC and again when streamed,
+    so only one member's text is held at a time.
+    """
+    text = load()
+    if not text:
+        return None
+    data = text.encode('utf-8')
+    size, crc = len(data), zlib.crc32(data)
+    del data, text
+
+    def read(offset):
+        data = (load() or '').encode('utf-8')
+        if len(data) != size or zlib.crc32(data) != crc:
+            raise BundleChanged(name)
+        return _chunks(data, offset)
+
+    return Entry(name, size, crc, modified, read)
+
+
+def _dos_datetime(value):
+    # Timestamps come only from stored data so every request lays out the same bytes
+    value = max(value or datetime(1980, 1, 1), datetime(1980, 1, 1))
+    return ((value.hour << 11) | (value.minute << 5) | (value.second // 2),
+            ((value.year - 1980) << 9) | (value.month << 5) | value.day)
+
+
+class ZipBundle:
+    """
+    A stored ZIP whose layout is computed up front.
+
+    iter_bytes(start, stop) produces any byte range of the archive, reading
+    only the members that overlap it.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        # (start, length, produce(offset)) for each contiguous part of the archive
+        self._segments = []
+        central = []
+        position = 0
+        for entry in entries:
+            header = self._local_header(entry)
+            position = self._add_bytes(position, header)
+            self._segments.append((position, entry.size, entry.read))
+            central.append(self._central_header(entry, position - len(header)))
+            position += entry.size
+        directory = b''.join(central)
+        self._add_bytes(position, directory + self._end_records(len(entries), len(directory), position))
+        self.size = sum(length for _, length, _ in self._segments)
+
+        digest = hashlib.sha256()
+        for entry in entries:
+            key = f"{entry.name}\0{entry.size}\0{entry.crc}\0{_dos_datetime(entry.modified)}\0"
+            digest.update(key.encode('utf-8'))
+        self.etag = digest.hexdigest()
+
+    def _add_bytes(self, position, data):
+        self._segments.append((position, len(data), lambda offset, data=data: _chunks(data, offset)))
+        return position + len(data)
+
+    @staticmethod
+    def _local_header(entry):
+        name = entry.name.encode('utf-8')
+        time, date = _dos_datetime(entry.modified)
+        extra = b''
+        size = entry.size
+        if size >= ZIP64_LIMIT:
+            extra = struct.pack('<HHQQ', 0x0001, 16, size, size)
+            size = ZIP64_LIMIT
+        version = 45 if extra else 20
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, version, _UTF8_FLAG, 0, time, date,
+                           entry.crc, size, size, len(name), len(extra)) + name + extra
+
+    @staticmethod
+    def _central_header(entry, offset):
+        name = entry.name.encode('utf-8')
+        time, date = _dos_datetime(entry.modified)
+        zip64 = []
+        size = entry.size
+        if size >= ZIP64_LIMIT:
+            zip64 += [size, size]
+            size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            zip64.append(offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack(f'<HH{len(zip64)}Q', 0x0001, 8 * len(zip64), *zip64) if zip64 else b''
+        version = 45 if extra else 20
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, _UTF8_FLAG, 0, time, date,
+                           entry.crc, size, size, len(name), len(extra), 0, 0, 0, 0, offset) + name + extra
+
+    @staticmethod
+    def _end_records(count, directory_size, directory_offset):
+        records = b''
+        if count >= 0xFFFF or directory_size >= ZIP64_LIMIT or directory_offset >= ZIP64_LIMIT:
+            zip64_end_offset = directory_offset + directory_size
+            records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count,
+                                   directory_size, directory_offset)
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+            count = min(count, 0xFFFF)
+            directory_size = min(directory_size, ZIP64_LIMIT)
+            directory_offset = min(directory_offset, ZIP64_LIMIT)
+        return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count,
+                                     directory_size, directory_offset, 0)
+
+    def iter_bytes(self, start=0, stop=None):
+        """Yield the bytes of the archive from start up to (not including) stop"""
+        stop = self.size if stop is None else min(stop, self.size)
+        for segment_start, length, produce in self._segments:
+            segment_end = segment_start + length
+            if segment_end <= start or length == 0:
+                continue
+            if segment_start >= stop:
+                break
+            remaining = min(segment_end, stop) - max(segment_start, start)
+            for chunk in produce(max(0, start - segment_start)):
+                if len(chunk) >= remaining:
+                    yield chunk[:remaining]
+                    remaining = 0
+                    break
+                remaining -= len(chunk)
+                yield chunk
+            if remaining:
+                # The member is shorter than when it was planned
+                raise BundleChanged(f"segment at {segment_start}")
+
+
+def _safe_name(value, default='file'):
+    value = re.sub(r'[^\w.\- ]+', '_', value or '').strip(' ._')
+    return value[:120] or default
+
+
+class _Names:
+    """Hands out unique archive names"""
+
+    def __init__(self):
+        self.used = set()
+
+    def __call__(self, folder, name):
+        base, ext = os.path.splitext(name)
+        candidate, n = f"{folder}/{name}", 2
+        while candidate.lower() in self.used:
+            candidate, n = f"{folder}/{base}_{n}{ext}", n + 1
+        self.used.add(candidate.lower())
+        return candidate
+
+
+def _analysis_loader(analysis_id):
+    # Loads the version current when the bundle was planned, even if a newer one is saved meanwhile
+    def load():
+        analysis = db.session.get(LegalAnalysis, analysis_id)
+        if analysis is None:
+            return None
+        data = analysis.get_data()
+        return json.dumps(data, indent=2, sort_keys=True) if data is not None else None
+    return load
+
+
+def _column_loader(model, column, row_id):
+    return lambda: db.session.query(column).filter(model.id == row_id).scalar()
+
+
+def _json_loader(model, column, row_id):
+    def load():
+        value = db.session.query(column).filter(model.id == row_id).scalar()
+        if not value:
+            return None
+        try:
+            return json.dumps(json.loads(value), indent=2, sort_keys=True)
+        except (TypeError, ValueError):
+            return value
+    return load
+
+
+def build_bundle(case, upload_folder):
+    """Plan the bundle for a case; returns a ZipBundle"""
+    names = _Names()
+    entries = []
+    index = []
+
+    evidence_rows = (db.session.query(Evidence.id, Evidence.filename, Evidence.original_filename,
+                                      Evidence.description, Evidence.file_type, Evidence.evidence_type,
+                                      Evidence.link_url, Evidence.platform, Evidence.uploaded_at,
+                                      Evidence.transcript_status, Evidence.analysis_status)
+                     .join(case_evidence, case_evidence.c.evidence_id == Evidence.id)
+                     .filter(case_evidence.c.case_id == case.id)
+                     .order_by(Evidence.uploaded_at, Evidence.id)
+                     .yield_per(100))
+    exhibit_numbers = {}
+    for number, row in enumerate(evidence_rows, 1):
+        exhibit_numbers[row.id] = number
+        label = f"Exhibit_{number:03d}"
+        item = {'number': number, 'row': row, 'file': None, 'transcript': None, 'note': None}
+        path = os.path.join(upload_folder, row.filename) if row.filename else None
+        if row.evidence_type == 'link':
+            item['note'] = f"Link: {row.link_url}"
+        elif path and os.path.isfile(path):
+            item['file'] = names('evidence', f"{label}_{_safe_name(row.original_filename)}")
+            entries.append(file_entry(item['file'], path))
+        else:
+            item['note'] = 'File missing from storage'
+
+        if row.transcript_status == 'completed':
+            entry = text_entry(names('transcripts', f"{label}_transcript.txt"),
+                               _column_loader(Evidence, Evidence.transcript, row.id), row.uploaded_at)
+            if entry:
+                entries.append(entry)
+                item['transcript'] = entry.name
+        if row.analysis_status == 'completed':
+            entry = text_entry(names('transcripts', f"{label}_analysis.json"),
+                               _json_loader(Evidence, Evidence.transcript_analysis, row.id), row.uploaded_at)
+            if entry:
+                entries.append(entry)
+        index.append(item)
+
+    documents = []
+    document_rows = (db.session.query(Document.id, Document.doc_type, Document.filename, Document.created_at)
+                     .filter(Document.case_id == case.id).order_by(Document.id).yield_per(100))
+    for row in document_rows:
+        title = row.doc_type.replace('_', ' ').title()
+        name = os.path.splitext(_safe_name(row.filename, f"document_{row.id}"))[0]
+        load = _column_loader(Document, Document.content, row.id)
+        try:
+            entry = rendered_entry(names('documents', f"{name}.pdf"), 'pdf', load, title, row.created_at)
+        except Exception as e:
+            logging.error(f"Could not render document {row.id} for the case bundle, adding it as text: {str(e)}")
+            entry = text_entry(names('documents', f"{name}.txt"), load, row.created_at)
+        if entry:
+            entries.append(entry)
+            documents.append((title, row.created_at, entry.name))
+
+    analyses = []
+    exhibit_plan = None
+    for analysis_type in ANALYSIS_TYPES:
+        analysis = LegalAnalysis.get_by_case_and_type(case.id, analysis_type)
+        if analysis is None:
+            continue
+        entry = text_entry(names('analyses', f"{analysis_type}.json"),
+                           _analysis_loader(analysis.id), analysis.generated_at)
+        if entry:
+            entries.append(entry)
+            analyses.append((analysis_type, entry.name))
+        if analysis_type == 'exhibit_organization':
+            exhibit_plan = (analysis.get_data() or {}).get('exhibit_plan')
+
+    index_text = format_index(case, index, documents, analyses, exhibit_plan)
+    entries.insert(0, data_entry(INDEX_NAME, index_text.encode('utf-8'), case.updated_at or case.created_at))
+    return ZipBundle(entries)
+
+
+def format_index(case, exhibits, documents, analyses, exhibit_plan=None):
+    """The plain-text exhibit index placed at the top of the bundle"""
+    lines = [
+        f"CASE BUNDLE: {case.title}",
+        f"Court type: {case.court_type.replace('_', ' ').title()}    Issue: {case.issue_type.replace('_', ' ').title()}",
+        "",
+        "EXHIBITS",
+        "=" * 72
+    ]
+    if not exhibits:
+        lines.append("No evidence has been added to this case.")
+    for item in exhibits:
+        row = item['row']
+        lines.append(f"Exhibit {item['number']}: {row.original_filename} ({row.file_type})")
+        lines.append(f"    Description: {row.description}")
+        if row.uploaded_at:
+            lines.append(f"    Added: {row.uploaded_at.strftime('%B %d, %Y')}")
+        if item['file']:
+            lines.append(f"    File: {item['file']}")
+        if item['transcript']:
+            lines.append(f"    Transcript: {item['transcript']}")
+        if item['note']:
+            lines.append(f"    {item['note']}")
+        lines.append("")
+
+    if isinstance(exhibit_plan, list) and exhibit_plan:
+        lines += ["EXHIBIT GROUPS (from the exhibit organization analysis)", "=" * 72]
+        for group in exhibit_plan:
+            if not isinstance(group, dict):
+                continue
+            lines.append(group.get('exhibit_group') or 'Exhibit group')
+            if group.get('strategic_purpose'):
+                lines.append(f"    Purpose: {group['strategic_purpose']}")
+            items = group.get('evidence_items') or []
+            if items:
+                lines.append("    Evidence: " + "; ".join(str(i) for i in items))
+            if group.get('presentation_order'):
+                lines.append(f"    Order: {group['presentation_order']}")
+            lines.append("")
+
+    lines += ["DOCUMENTS", "=" * 72]
+    if not documents:
+        lines.append("No documents have been generated for this case.")
+    for title, created_at, name in documents:
+        created = f" ({created_at.strftime('%B %d, %Y')})" if created_at else ""
+        lines.append(f"{title}{created}: {name}")
+    lines += ["", "ANALYSES", "=" * 72]
+    if not analyses:
+        lines.append("No analyses have been run for this case.")
+    for analysis_type, name in analyses:
+        lines.append(f"{analysis_type.replace('_', ' ').title()}: {name}")
+    return "\n".join(lines) + "\n"
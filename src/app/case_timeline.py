@@ -29,11 +29,8 @@ def case_timeline(case_id):
     timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events')
     timeline_data = {}
     
-    if timeline_analysis and timeline_analysis.references:
-        try:
-            timeline_data = json.loads(timeline_analysis.references)
-        except json.JSONDecodeError:
-            timeline_data = {}
+    if timeline_analysis:
+        timeline_data = timeline_analysis.get_data(default={})
     
     # If no timeline data exists, create default structure with example events
     if not timeline_data or not timeline_data.get('events'):
@@ -78,13 +75,13 @@ def add_timeline_event(case_id):
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
         # Get existing timeline data
-        timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events')
+        timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events', with_payload=True)
         timeline_data = {}
         
         if timeline_analysis and timeline_analysis.references:
-            try:
-                timeline_data = json.loads(timeline_analysis.references)
-            except json.JSONDecodeError:
+            # Copied because the new event is appended to it
+            timeline_data = timeline_analysis.get_data(copy_result=True)
+            if timeline_data is None:
                 timeline_data = {
                     'courtType': case.court_type,
                     'issueType': case.issue_type,
@@ -119,8 +116,7 @@ def add_timeline_event(case_id):
         
         # Save updated timeline data
         if timeline_analysis:
-            timeline_analysis.references = json.dumps(timeline_data)
-            db.session.commit()
+            timeline_analysis.new_version(references=json.dumps(timeline_data))
         else:
             # Create new analysis record
             LegalAnalysis.create_analysis(
@@ -154,12 +150,11 @@ def get_timeline_events(case_id):
     # Get timeline data
     timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events')
     
-    if timeline_analysis and timeline_analysis.references:
-        try:
-            timeline_data = json.loads(timeline_analysis.references)
+    if timeline_analysis:
+        timeline_data = timeline_analysis.get_data()
+        if timeline_data is not None:
             return jsonify(timeline_data)
-        except json.JSONDecodeError:
-            return jsonify({'events': []})
+        return jsonify({'events': []})
     
     return jsonify({'events': []})
 
@@ -175,20 +170,21 @@ def delete_timeline_event(case_id, event_id):
         return jsonify({'error': 'Permission denied'}), 403
     
     # Get timeline data
-    timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events')
+    timeline_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'timeline_events', with_payload=True)
     
     if not timeline_analysis or not timeline_analysis.references:
         return jsonify({'error': 'Timeline not found'}), 404
     
     try:
-        timeline_data = json.loads(timeline_analysis.references)
+        timeline_data = timeline_analysis.get_data(copy_result=True)
+        if timeline_data is None:
+            raise ValueError("Timeline data is not valid JSON")
         
         # Remove event
         timeline_data['events'] = [e for e in timeline_data.get('events', []) if e.get('id') != event_id]
         
         # Save updated timeline data
-        timeline_analysis.references = json.dumps(timeline_data)
-        db.session.commit()
+        timeline_analysis.new_version(references=json.dumps(timeline_data))
         
         return jsonify({'success': True})
     
@@ -215,8 +211,7 @@ def save_timeline_analysis(case_id):
         speedy_trial_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'speedy_trial_analysis')
         
         if speedy_trial_analysis:
-            speedy_trial_analysis.content = analysis_content
-            db.session.commit()
+            speedy_trial_analysis.new_version(content=analysis_content)
         else:
             LegalAnalysis.create_analysis(
                 case_id=case_id,
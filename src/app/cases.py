@@ -8,6 +8,8 @@ from werkzeug.utils import secure_filename
 from models import Case, Evidence, db
 from forms import CaseForm, EvidenceForm
 from utils import allowed_file, get_file_type
+import prefetch
+import rate_limits
 
 cases = Blueprint('cases', __name__)
 
@@ -29,6 +31,7 @@ def new_case():
             issue_type=form.issue_type.data,
             description=form.description.data
         )
+        prefetch.enqueue_case(case)
         flash(f'Your case "{form.title.data}" has been created!', 'success')
         return redirect(url_for('cases.case_summary', case_id=case.id))
     
@@ -51,6 +54,7 @@ def case_summary(case_id):
 
 @cases.route('/case/<int:case_id>/evidence/upload', methods=['GET', 'POST'])
 @login_required
+@rate_limits.ai_limited(methods=('POST',))
 def upload_evidence(case_id):
     # Get the case and create the form outside the try block
     case = Case.get_case_by_id(case_id)
@@ -271,6 +275,7 @@ def upload_evidence(case_id):
     return render_template('upload_evidence.html', form=form, case=case)
 @cases.route('/evidence/transcript/<int:evidence_id>')
 @login_required
+@rate_limits.ai_limited(when=lambda: any(request.args.get(name) for name in ('process', 'regenerate', 'analyze')))
 def view_transcript(evidence_id):
     """Display transcript and analysis of an audio evidence item"""
     from audio_processor import transcribe_audio, analyze_transcript as audio_analyze_transcript
@@ -281,7 +286,8 @@ def view_transcript(evidence_id):
     # Rename the imported function to avoid name collision
     analyze_transcript = audio_analyze_transcript
     
-    evidence = Evidence.get_evidence_by_id(evidence_id)
+    # The transcript columns are deferred; load them with the row since the page shows them
+    evidence = Evidence.get_evidence_with_transcript(evidence_id)
     
     if not evidence:
         flash('Evidence item not found.', 'danger')
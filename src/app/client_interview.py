@@ -6,16 +6,34 @@ that can be used to challenge evidence and potentially win their case.
 
 import json
 import os
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
 from models import Case, User, LegalAnalysis, db
+import ai_usage
 import anthropic_helper
-from openai import OpenAI
+import provider_clients
+import prompt_budget
+import structured_output
+import rate_limits
 
 # Create blueprint
 client_interview = Blueprint('client_interview', __name__)
 
+MODEL = "gpt-4o"  # The newest OpenAI model
+ANALYSIS_SYSTEM_PROMPT = "You are an expert legal analyst identifying constitutional violations, fruit of the poisonous tree evidence, and speedy trial violations based on client interview answers. Provide detailed, strategic analysis with accurate, well-structured JSON only."
+CATEGORY_OUTPUT_TOKENS = 1500
+STRATEGY_OUTPUT_TOKENS = 1000
+# Concurrent model calls when several answer categories changed
+CATEGORY_WORKERS = int(os.environ.get('INTERVIEW_ANALYSIS_WORKERS', 4))
+# Bump when the category or strategy prompts change so cached sub-results are regenerated
+CATEGORY_PROMPT_VERSION = 1
+# Finding lists produced per category and merged into the stored analysis
+FINDING_SECTIONS = ("constitutional_violations", "speedy_trial_violations",
+                    "fruit_of_poisonous_tree", "systemic_bias_issues")
+
 # Constants
 INTERVIEW_QUESTIONS = {
     "initial_contact": [
@@ -106,6 +124,81 @@ INTERVIEW_QUESTIONS = {
     ]
 }
 
+CATEGORY_INSTRUCTIONS = """
+You are an expert legal analyst helping identify constitutional violations, evidence suppression opportunities,
+and speedy trial violations based on a client interview. The client may have been subjected to rights violations
+that they're not aware of, particularly in a system where public defenders are paid by the same entity as
+prosecutors and judges.
+
+You will be given one category of the client's interview answers. Based only on these answers, identify:
+1. Any Fourth Amendment violations that could lead to evidence suppression
+2. Any "fruit of the poisonous tree" evidence that stems from initial constitutional violations
+3. Any speedy trial rights violations based on timeline information
+4. Any systemic bias or conflict of interest issues in the legal representation
+Include the specific motions to file and the Supreme Court cases that support suppression or dismissal.
+Use empty lists for sections the answers give no basis for.
+
+Format your response as a JSON object with these sections:
+{
+  "constitutional_violations": [
+    {
+      "violation_type": "Fourth Amendment - Illegal Search",
+      "description": "Based on answers about the search, there appears to be a warrantless search without exception",
+      "supporting_case_law": ["Case v. Example", "Another v. Case"],
+      "recommended_action": "File Motion to Suppress all evidence obtained from the search",
+      "suppressible_evidence": ["Evidence items 1, 2 that should be suppressed"],
+      "motion_language": "Exact language to use in the suppression motion",
+      "probability_of_success": "High/Medium/Low"
+    }
+  ],
+  "speedy_trial_violations": [
+    {
+      "violation_description": "Based on timeline answers, 180+ days have passed without trial",
+      "jurisdiction_rule": "This jurisdiction requires trial within 90 days",
+      "supporting_case_law": ["Relevant speedy trial cases"],
+      "recommended_action": "File Motion to Dismiss for speedy trial violation",
+      "motion_language": "Exact language to use in the dismissal motion",
+      "probability_of_success": "High/Medium/Low"
+    }
+  ],
+  "fruit_of_poisonous_tree": [
+    {
+      "initial_violation": "The original constitutional violation",
+      "tainted_evidence": ["Evidence that stems from the initial violation"],
+      "suppression_argument": "Why this evidence should be suppressed as fruit",
+      "supporting_case_law": ["Wong Sun v. United States", "Other relevant cases"],
+      "motion_language": "Exact language to use in the suppression motion"
+    }
+  ],
+  "systemic_bias_issues": [
+    {
+      "bias_type": "Conflict of interest in legal representation",
+      "description": "Public defender paid by same entity as prosecutor",
+      "legal_basis": "Constitutional right to effective counsel",
+      "recommended_action": "File motion asserting conflict and requesting independent counsel"
+    }
+  ]
+}
+"""
+
+STRATEGY_INSTRUCTIONS = """
+You are an expert legal analyst. You will be given the violations identified from a client interview.
+Combine them into one overall defense strategy that will help the client navigate the legal system without
+relying on potentially compromised public defenders: which approach to lead with, which motions to file and
+in what order, and how strong the case is after applying these strategies.
+
+Format your response as a JSON object:
+{
+  "defense_strategy": {
+    "primary_approach": "Focus on suppressing evidence through Fourth Amendment challenge",
+    "secondary_approach": "Simultaneously pursue speedy trial dismissal",
+    "key_motions": ["Motion to Suppress", "Motion to Dismiss"],
+    "filing_priority": "File suppression motion first, then immediately file speedy trial motion",
+    "overall_assessment": "Assessment of case strength after applying these strategies"
+  }
+}
+"""
+
 @client_interview.route('/case/<int:case_id>/interview', methods=['GET', 'POST'])
 @login_required
 def case_interview(case_id):
@@ -119,20 +212,17 @@ def case_interview(case_id):
         return redirect(url_for('cases.dashboard'))
     
     # Check for existing interview answers
-    interview_results = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='interview_results'
-    ).first()
+    interview_results = LegalAnalysis.get_by_case_and_type(case_id, 'interview_results')
     
     # Initialize answers dict
     answers = {}
     
     # Load existing answers if available
     if interview_results:
-        try:
-            answers = json.loads(interview_results.content)
-        except:
+        answers = interview_results.get_data()
+        if answers is None:
             logging.error("Failed to parse interview results JSON")
+            answers = {}
     
     # Handle POST request - Save interview answers
     if request.method == 'POST':
@@ -150,8 +240,7 @@ def case_interview(case_id):
         
         # Save answers to database
         if interview_results:
-            interview_results.content = json.dumps(new_answers)
-            db.session.commit()
+            interview_results.new_version(content=json.dumps(new_answers))
         else:
             LegalAnalysis.create_analysis(
                 case_id=case_id,
@@ -176,6 +265,7 @@ def case_interview(case_id):
 
 @client_interview.route('/case/<int:case_id>/interview/analyze', methods=['GET'])
 @login_required
+@rate_limits.ai_limited()
 def analyze_interview(case_id):
     """Analyze interview answers to identify rights violations and defense strategies"""
     # Get case details
@@ -187,10 +277,7 @@ def analyze_interview(case_id):
         return redirect(url_for('cases.dashboard'))
     
     # Check for existing interview answers
-    interview_results = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='interview_results'
-    ).first()
+    interview_results = LegalAnalysis.get_by_case_and_type(case_id, 'interview_results')
     
     if not interview_results:
         flash('Please complete the interview before requesting analysis.', 'warning')
@@ -198,29 +285,38 @@ def analyze_interview(case_id):
     
     try:
         # Load interview answers
-        answers = json.loads(interview_results.content)
+        answers = interview_results.get_data()
+        if answers is None:
+            raise ValueError("Interview answers are not valid JSON")
         
-        # Check for existing analysis
-        analysis = LegalAnalysis.query.filter_by(
-            case_id=case_id, 
-            analysis_type='interview_analysis'
-        ).first()
+        # Check for existing analysis; its references hold the per-category cache
+        analysis = LegalAnalysis.get_by_case_and_type(case_id, 'interview_analysis', with_payload=True)
+        cache = analysis.get_data(field='references', default={}) if analysis else {}
         
-        # Perform new analysis if needed
-        if not analysis:
-            # Generate new analysis
-            analysis_result = generate_interview_analysis(case, answers)
-            
-            if analysis_result:
-                # Create new analysis record
+        # Re-analyze only the categories whose answers changed
+        analysis_result, cache, refreshed, failed = update_interview_analysis(case, answers, cache)
+        
+        if analysis_result is None or (analysis and failed and not refreshed):
+            flash('Failed to generate analysis. Please try again.', 'danger')
+        elif analysis and not refreshed:
+            flash('Interview analysis is already up to date.', 'info')
+        else:
+            content = json.dumps(analysis_result)
+            references = json.dumps(cache)
+            if analysis:
+                analysis.new_version(content=content, references=references)
+            else:
                 LegalAnalysis.create_analysis(
                     case_id=case_id,
                     analysis_type='interview_analysis',
-                    content=json.dumps(analysis_result)
+                    content=content,
+                    references=references
                 )
-                flash('Interview analysis has been generated successfully.', 'success')
+            if failed:
+                flash('Interview analysis was updated, but some answer categories could not be re-analyzed. '
+                      'Please try again.', 'warning')
             else:
-                flash('Failed to generate analysis. Please try again.', 'danger')
+                flash('Interview analysis has been generated successfully.', 'success')
         
         # Redirect to view the analysis
         return redirect(url_for('client_interview.view_analysis', case_id=case_id))
@@ -242,10 +338,7 @@ def view_analysis(case_id):
         return redirect(url_for('cases.dashboard'))
     
     # Check for existing analysis
-    analysis = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='interview_analysis'
-    ).first()
+    analysis = LegalAnalysis.get_by_case_and_type(case_id, 'interview_analysis')
     
     if not analysis:
         flash('No analysis found. Please complete the interview and generate an analysis.', 'warning')
@@ -253,7 +346,9 @@ def view_analysis(case_id):
     
     try:
         # Load analysis results
-        analysis_result = json.loads(analysis.content)
+        analysis_result = analysis.get_data()
+        if analysis_result is None:
+            raise ValueError("Saved analysis is not valid JSON")
         
         # Render the analysis template
         return render_template(
@@ -266,135 +361,174 @@ def view_analysis(case_id):
         flash(f'Error loading analysis: {str(e)}', 'danger')
         return redirect(url_for('client_interview.case_interview', case_id=case_id))
 
-def generate_interview_analysis(case, answers):
-    """Generate analysis of interview answers using AI"""
+def category_hash(case, category, category_answers):
+    """
+    Hash everything a category's analysis depends on: its questions and answers,
+    the case facts and the prompt version. An unchanged hash means the cached
+    sub-result can be reused.
+    """
+    material = {
+        "version": CATEGORY_PROMPT_VERSION,
+        "case": [case.title, case.issue_type, case.court_type, case.description],
+        "questions": [q["question"] for q in INTERVIEW_QUESTIONS.get(category, [])],
+        "answers": [str(answer).strip() for answer in category_answers]
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+def findings_hash(findings):
+    """Hash the merged findings the defense strategy is built from"""
+    material = {"version": CATEGORY_PROMPT_VERSION, "findings": findings}
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _run_analysis(prompt_for_model, instructions, output_tokens):
+    """Run a JSON analysis with Anthropic, falling back to OpenAI; returns a dict or None"""
+    if anthropic_helper.is_available():
+        prompt = prompt_for_model(anthropic_helper.DEFAULT_MODEL)
+        max_tokens = prompt_budget.max_tokens_for(prompt, anthropic_helper.DEFAULT_MODEL, output_tokens, instructions)
+        result = anthropic_helper.analyze_case_text(prompt, json_format=True, instructions=instructions,
+                                                    max_tokens=max_tokens)
+        if result and "error" not in result:
+            return result
+    
+    client = provider_clients.get_openai_client()
+    if client is None:
+        return None
+    
+    prompt = prompt_for_model(MODEL)
+    system_prompt = f"{ANALYSIS_SYSTEM_PROMPT}\n\n{instructions}"
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.2,
+        max_tokens=prompt_budget.max_tokens_for(prompt, MODEL, output_tokens, system_prompt)
+    )
+    content = response.choices[0].message.content
+    return structured_output.extract_json(content) if content else None
+
+def _case_section(builder, case):
+    builder.add("case", f"""CASE DETAILS:
+Title: {case.title}
+Issue Type: {case.issue_type}
+Court Type: {case.court_type}""", required=True)
+    builder.add("description", f"Description: {case.description}", priority=2, min_tokens=200)
+
+def create_category_prompt(case, category, category_answers, model=None):
+    """Create a token-budgeted prompt for analyzing one category of interview answers"""
+    builder = prompt_budget.PromptBuilder(model=model or MODEL, output_tokens=CATEGORY_OUTPUT_TOKENS)
+    _case_section(builder, case)
+    
+    formatted_answers = f"CLIENT INTERVIEW ANSWERS - {category.upper()} QUESTIONS:\n"
+    for question, answer in zip(INTERVIEW_QUESTIONS.get(category, []), category_answers):
+        formatted_answers += f"Q: {question['question']}\nA: {answer}\n"
+    builder.add("answers", formatted_answers, priority=3, min_tokens=100)
+    
+    return builder.build()
+
+def create_strategy_prompt(case, findings, model=None):
+    """Create a token-budgeted prompt for the overall defense strategy from merged findings"""
+    builder = prompt_budget.PromptBuilder(model=model or MODEL, output_tokens=STRATEGY_OUTPUT_TOKENS)
+    _case_section(builder, case)
+    builder.add("findings", "FINDINGS FROM THE CLIENT INTERVIEW:\n" + json.dumps(findings, indent=2),
+                priority=3, compact=prompt_budget.compact_json(findings), min_tokens=200)
+    return builder.build()
+
+def analyze_category(case, category, category_answers):
+    """Analyze one answer category; returns the finding lists or None on failure"""
+    if not any(str(answer).strip() for answer in category_answers):
+        # Nothing answered, nothing to analyze
+        return structured_output.apply_schema({}, 'interview_category')
+    
     try:
-        # Try Anthropic first if available
-        if anthropic_helper.is_available():
-            prompt = create_analysis_prompt(case, answers)
-            result = anthropic_helper.analyze_case_text(prompt, json_format=True)
-            if result:
-                return result
-        
-        # Fall back to OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            return {"error": "No AI provider available"}
-        
-        # Prepare the prompt
-        prompt = create_analysis_prompt(case, answers)
-        
-        # Call OpenAI API
-        client = OpenAI(api_key=api_key)
-        MODEL = "gpt-4o"  # The newest OpenAI model
-        
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are an expert legal analyst identifying constitutional violations, fruit of the poisonous tree evidence, and speedy trial violations based on client interview answers. Provide detailed, strategic analysis with accurate, well-structured JSON only."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2
+        result = _run_analysis(
+            lambda model: create_category_prompt(case, category, category_answers, model=model),
+            CATEGORY_INSTRUCTIONS,
+            CATEGORY_OUTPUT_TOKENS
         )
-        
-        # Extract and parse the response
-        content = response.choices[0].message.content
-        if content:
-            return json.loads(content)
-        else:
-            return {"error": "Empty response from AI provider"}
-            
     except Exception as e:
-        return {"error": f"Analysis generation failed: {str(e)}"}
+        logging.error(f"Error analyzing interview category {category}: {e}")
+        return None
+    if not result:
+        return None
+    return structured_output.apply_schema(result, 'interview_category')
 
-def create_analysis_prompt(case, answers):
-    """Create prompt for AI analysis of interview answers"""
-    # Format answers for the prompt
-    formatted_answers = ""
-    
-    for category, category_answers in answers.items():
-        formatted_answers += f"\n{category.upper()} QUESTIONS:\n"
-        
-        for i, answer in enumerate(category_answers):
-            if i < len(INTERVIEW_QUESTIONS.get(category, [])):
-                question = INTERVIEW_QUESTIONS[category][i]["question"]
-                formatted_answers += f"Q: {question}\nA: {answer}\n"
+def update_interview_analysis(case, answers, cache=None):
+    """
+    Bring the interview analysis up to date with the answers.
     
-    # Create the analysis prompt
-    prompt = f"""
-    You are an expert legal analyst helping identify constitutional violations, evidence suppression opportunities,
-    and speedy trial violations based on a client interview. The client may have been subjected to rights violations
-    that they're not aware of, particularly in a system where public defenders are paid by the same entity as
-    prosecutors and judges.
+    Only categories whose answer hash differs from the cache are sent to the
+    model, in parallel; the others reuse their cached sub-results. The finding
+    lists are merged in question order, and the defense strategy is rebuilt
+    only if the merged findings changed. Returns (analysis, cache, refreshed,
+    failed): the parts regenerated and the categories that could not be. The
+    analysis is None if nothing could be analyzed.
+    """
+    cache = cache or {}
+    cached_categories = cache.get("categories", {})
+    categories = {}
+    changed = []
+    refreshed = []
+    failed = []
     
-    CASE DETAILS:
-    Title: {case.title}
-    Issue Type: {case.issue_type}
-    Court Type: {case.court_type}
-    Description: {case.description}
+    for category in INTERVIEW_QUESTIONS:
+        category_answers = answers.get(category, [])
+        digest = category_hash(case, category, category_answers)
+        cached = cached_categories.get(category)
+        if cached and cached.get("hash") == digest:
+            categories[category] = cached
+        else:
+            changed.append((category, category_answers, digest))
     
-    CLIENT INTERVIEW ANSWERS:
-    {formatted_answers}
+    if changed:
+        logging.info(f"Re-analyzing interview categories for case {case.id}: {', '.join(c[0] for c in changed)}")
+        workers = max(1, min(len(changed), CATEGORY_WORKERS))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(ai_usage.bind(analyze_category), case, category, category_answers): (category, digest)
+                for category, category_answers, digest in changed
+            }
+            for future, (category, digest) in futures.items():
+                result = future.result()
+                if result is not None:
+                    categories[category] = {"hash": digest, "result": result}
+                    refreshed.append(category)
+                else:
+                    failed.append(category)
+                    if category in cached_categories:
+                        # Keep the stale result; its old hash makes the next run retry
+                        categories[category] = cached_categories[category]
     
-    Based on these answers, identify:
-    1. Any Fourth Amendment violations that could lead to evidence suppression
-    2. Any "fruit of the poisonous tree" evidence that stems from initial constitutional violations
-    3. Any speedy trial rights violations based on timeline information
-    4. Any systemic bias or conflict of interest issues in the legal representation
-    5. Specific motions the client should file to assert these rights
-    6. Supreme Court cases that support suppression or dismissal based on these violations
+    if not categories:
+        return None, cache, refreshed, failed
     
-    Format your response as a JSON object with these sections:
-    {{
-      "constitutional_violations": [
-        {{
-          "violation_type": "Fourth Amendment - Illegal Search",
-          "description": "Based on answers about the search, there appears to be a warrantless search without exception",
-          "supporting_case_law": ["Case v. Example", "Another v. Case"],
-          "recommended_action": "File Motion to Suppress all evidence obtained from the search",
-          "suppressible_evidence": ["Evidence items 1, 2 that should be suppressed"],
-          "motion_language": "Exact language to use in the suppression motion",
-          "probability_of_success": "High/Medium/Low"
-        }}
-      ],
-      "speedy_trial_violations": [
-        {{
-          "violation_description": "Based on timeline answers, 180+ days have passed without trial",
-          "jurisdiction_rule": "This jurisdiction requires trial within 90 days",
-          "supporting_case_law": ["Relevant speedy trial cases"],
-          "recommended_action": "File Motion to Dismiss for speedy trial violation",
-          "motion_language": "Exact language to use in the dismissal motion",
-          "probability_of_success": "High/Medium/Low"
-        }}
-      ],
-      "fruit_of_poisonous_tree": [
-        {{
-          "initial_violation": "The original constitutional violation",
-          "tainted_evidence": ["Evidence that stems from the initial violation"],
-          "suppression_argument": "Why this evidence should be suppressed as fruit",
-          "supporting_case_law": ["Wong Sun v. United States", "Other relevant cases"],
-          "motion_language": "Exact language to use in the suppression motion"
-        }}
-      ],
-      "systemic_bias_issues": [
-        {{
-          "bias_type": "Conflict of interest in legal representation",
-          "description": "Public defender paid by same entity as prosecutor",
-          "legal_basis": "Constitutional right to effective counsel",
-          "recommended_action": "File motion asserting conflict and requesting independent counsel"
-        }}
-      ],
-      "defense_strategy": {{
-        "primary_approach": "Focus on suppressing evidence through Fourth Amendment challenge",
-        "secondary_approach": "Simultaneously pursue speedy trial dismissal",
-        "key_motions": ["Motion to Suppress", "Motion to Dismiss"],
-        "filing_priority": "File suppression motion first, then immediately file speedy trial motion",
-        "overall_assessment": "Assessment of case strength after applying these strategies"
-      }}
-    }}
+    # Merge the per-category finding lists in question order
+    findings = {section: [] for section in FINDING_SECTIONS}
+    for category in INTERVIEW_QUESTIONS:
+        if category in categories:
+            for section in FINDING_SECTIONS:
+                findings[section].extend(categories[category]["result"].get(section, []))
     
-    Provide detailed, legally sound analysis that will help the client navigate the legal system without relying on potentially compromised public defenders.
-    """
+    strategy = cache.get("strategy")
+    digest = findings_hash(findings)
+    if not strategy or strategy.get("hash") != digest:
+        try:
+            result = _run_analysis(
+                lambda model: create_strategy_prompt(case, findings, model=model),
+                STRATEGY_INSTRUCTIONS,
+                STRATEGY_OUTPUT_TOKENS
+            )
+        except Exception as e:
+            logging.error(f"Error building defense strategy: {e}")
+            result = None
+        if result:
+            strategy = {"hash": digest, "result": structured_output.apply_schema(result, 'interview_strategy')}
+            refreshed.append("defense_strategy")
+        elif not strategy:
+            strategy = {"hash": None, "result": structured_output.apply_schema({}, 'interview_strategy')}
     
-    return prompt
+    analysis = dict(findings, defense_strategy=strategy["result"].get("defense_strategy", {}))
+    cache = {"categories": categories, "strategy": strategy}
+    return structured_output.apply_schema(analysis, 'interview_analysis'), cache, refreshed, failed
@@ -0,0 +1,277 @@
+"""
+Transparent compression for large text columns.
+
+CompressedText is a SQLAlchemy column type that stores text as zstd-compressed
+bytes, optionally with a dictionary trained on the column's typical content
+(analysis JSON repeats the same keys and boilerplate in every row, which a
+dictionary captures far better than per-row compression can).
+
+Stored format:
+    - values shorter than COMPRESSION_MIN_BYTES, and rows written before
+      compression was introduced, are plain UTF-8 with no header
+    - compressed values start with a 6-byte header: a zero byte flag, the codec
+      (1 = zstd, 2 = zlib) and the 4-byte id of the dictionary used (0 = none)
+
+Dictionaries live in the compression_dictionary table and are looked up by
+name; the newest dictionary for a name is used for writes while older ones
+stay available for reading rows compressed with them. A column either has a
+fixed dictionary name or, like LegalAnalysis, tags each value with one via
+tag() so every analysis type gets its own dictionary.
+The first dictionaries were trained by the migration that introduced
+compression; analysis_compactor trains them for new analysis types and on
+demand with `flask train-analysis-dictionaries`.
+
+zstandard is required to read zstd values. If it is not installed, new values
+are written with zlib instead and no dictionaries are used.
+
+Environment:
+    COMPRESSION_MIN_BYTES            smallest value worth compressing (default 256)
+    COMPRESSION_ZSTD_LEVEL           zstd compression level (default 6)
+    COMPRESSION_DICTIONARY_SIZE      trained dictionary size in bytes (default 65536)
+    COMPRESSION_DICTIONARY_REFRESH   seconds between dictionary reloads (default 300)
+"""
+import os
+import time
+import zlib
+import struct
+import logging
+import threading
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FLAG = 0
+CODEC_ZSTD = 1
+CODEC_ZLIB = 2
+HEADER = struct.Struct(">BBI")
+
+MIN_COMPRESS_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', 256))
+ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 6))
+DICTIONARY_SIZE = int(os.environ.get('COMPRESSION_DICTIONARY_SIZE', 64 * 1024))
+DICTIONARY_REFRESH_SECONDS = int(os.environ.get('COMPRESSION_DICTIONARY_REFRESH', 300))
+# Training needs enough samples to find repeated content
+MIN_TRAINING_SAMPLES = 20
+
+# Matches models.CompressionDictionary; declared here so loading dictionaries
+# does not import the models
+dictionary_table = sa.table(
+    'compression_dictionary',
+    sa.column('id', sa.Integer),
+    sa.column('name', sa.String),
+    sa.column('data', sa.LargeBinary),
+    sa.column('sample_count', sa.Integer),
+    sa.column('created_at', sa.DateTime),
+)
+
+_registry_lock = threading.Lock()
+# dictionary id -> (name, data)
+_dictionaries = {}
+# dictionary name -> id of the newest dictionary
+_active = {}
+_loaded_at = None
+
+# zstd (de)compressor objects are not safe to share between threads
+_local = threading.local()
+
+
+class Tagged(str):
+    """A str carrying the name of the dictionary it should be compressed with"""
+    dictionary = None
+
+
+def tag(text, dictionary):
+    """Mark text to be compressed with the named dictionary"""
+    if text is None or isinstance(text, Tagged) and text.dictionary == dictionary:
+        return text
+    tagged = Tagged(text)
+    tagged.dictionary = dictionary
+    return tagged
+
+
+def analysis_dictionary_name(analysis_type):
+    """Return the dictionary name used for a LegalAnalysis type"""
+    return f"analysis.{analysis_type}"
+
+
+def register_dictionary(dictionary_id, name, data):
+    """Make a dictionary available for reads, and for writes if it is the newest for its name"""
+    with _registry_lock:
+        _dictionaries[dictionary_id] = (name, bytes(data))
+        if dictionary_id >= _active.get(name, 0):
+            _active[name] = dictionary_id
+
+
+def load_dictionaries(connection=None, force=False):
+    """
+    Load dictionaries from the compression_dictionary table, at most once per
+    refresh interval unless forced. Uses the app's engine if no connection is given.
+    """
+    global _loaded_at
+    now = time.monotonic()
+    if not force and _loaded_at is not None and now - _loaded_at < DICTIONARY_REFRESH_SECONDS:
+        return
+    _loaded_at = now
+
+    try:
+        query = sa.select(dictionary_table.c.id, dictionary_table.c.name, dictionary_table.c.data)
+        if connection is not None:
+            rows = connection.execute(query).fetchall()
+        else:
+            from app import db
+            with db.engine.connect() as conn:
+                rows = conn.execute(query).fetchall()
+    except Exception as e:
+        logging.error(f"Could not load compression dictionaries: {e}")
+        return
+
+    for row in rows:
+        register_dictionary(row.id, row.name, row.data)
+
+
+def get_dictionary(name):
+    """Return (id, data) of the newest dictionary with this name, or None"""
+    if not name or zstandard is None:
+        return None
+    load_dictionaries()
+    dictionary_id = _active.get(name)
+    if dictionary_id is None:
+        return None
+    return dictionary_id, _dictionaries[dictionary_id][1]
+
+
+def _cached(kind, key, factory):
+    """Return this thread's compressor or decompressor for a dictionary (and level)"""
+    cache = getattr(_local, kind, None)
+    if cache is None:
+        cache = {}
+        setattr(_local, kind, cache)
+    obj = cache.get(key)
+    if obj is None:
+        obj = cache[key] = factory()
+    return obj
+
+
+def _zstd_dict(data):
+    return zstandard.ZstdCompressionDict(data, dict_type=zstandard.DICT_TYPE_FULLDICT)
+
+
+def compress(text, dictionary=None, level=None):
+    """
+    Compress text for storage. dictionary is an (id, data) pair or None; level
+    overrides COMPRESSION_ZSTD_LEVEL. Short values are returned as plain UTF-8.
+    """
+    raw = text.encode('utf-8')
+    if len(raw) < MIN_COMPRESS_BYTES:
+        return raw
+
+    if zstandard is None:
+        return HEADER.pack(FLAG, CODEC_ZLIB, 0) + zlib.compress(raw, 9 if level else 6)
+
+    level = level or ZSTD_LEVEL
+    dictionary_id = 0
+    if dictionary is not None:
+        dictionary_id, data = dictionary
+        compressor = _cached('compressors', (dictionary_id, level), lambda: zstandard.ZstdCompressor(
+            level=level, dict_data=_zstd_dict(data), write_content_size=True))
+    else:
+        compressor = _cached('compressors', (0, level), lambda: zstandard.ZstdCompressor(
+            level=level, write_content_size=True))
+    return HEADER.pack(FLAG, CODEC_ZSTD, dictionary_id) + compressor.compress(raw)
+
+
+def is_compressed(value):
+    """Return True if a stored value carries the compression header"""
+    return isinstance(value, (bytes, bytearray, memoryview)) and len(value) >= HEADER.size \
+        and value[0] == FLAG and value[1] in (CODEC_ZSTD, CODEC_ZLIB)
+
+
+def decompress(value, dictionaries=None):
+    """
+    Return the text of a stored value, compressed or plain. dictionaries maps
+    dictionary id to data; the loaded registry is used if it is not given.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not is_compressed(value):
+        return value.decode('utf-8')
+
+    _, codec, dictionary_id = HEADER.unpack_from(value)
+    body = value[HEADER.size:]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body).decode('utf-8')
+
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read compressed values")
+
+    if dictionary_id == 0:
+        decompressor = _cached('decompressors', 0, zstandard.ZstdDecompressor)
+    else:
+        if dictionaries is not None:
+            data = dictionaries.get(dictionary_id)
+        else:
+            if dictionary_id not in _dictionaries:
+                load_dictionaries(force=True)
+            data = _dictionaries.get(dictionary_id, (None, None))[1]
+        if data is None:
+            raise ValueError(f"Compression dictionary {dictionary_id} is not available")
+        decompressor = _cached('decompressors', dictionary_id,
+                               lambda: zstandard.ZstdDecompressor(dict_data=_zstd_dict(data)))
+    return decompressor.decompress(body).decode('utf-8')
+
+
+def train_dictionary(samples, size=DICTIONARY_SIZE):
+    """Train a zstd dictionary from sample texts; None if zstandard is missing or there are too few samples"""
+    samples = [s.encode('utf-8') for s in samples if s]
+    if zstandard is None or len(samples) < MIN_TRAINING_SAMPLES:
+        return None
+    # A dictionary much larger than the samples themselves only wastes space
+    size = min(size, max(1024, sum(len(s) for s in samples) // 10))
+    try:
+        return zstandard.train_dictionary(size, samples, level=ZSTD_LEVEL).as_bytes()
+    except zstandard.ZstdError as e:
+        logging.warning(f"Could not train compression dictionary: {e}")
+        return None
+
+
+def store_dictionary(connection, name, samples):
+    """
+    Train a dictionary from sample texts and insert it into compression_dictionary.
+    Returns its id, or None if no dictionary could be trained. It is used for
+    writes once the transaction commits and the registry is reloaded (other
+    processes reload it on their next refresh).
+    """
+    data = train_dictionary(samples)
+    if data is None:
+        return None
+    return connection.execute(dictionary_table.insert().values(
+        name=name, data=data, sample_count=len([s for s in samples if s]), created_at=datetime.utcnow()
+    ).returning(dictionary_table.c.id)).scalar()
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text column stored compressed. dictionary names the dictionary used for
+    values that are not tagged with one.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dictionary=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dictionary = dictionary
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        name = getattr(value, 'dictionary', None) or self.dictionary
+        return compress(value, get_dictionary(name))
+
+    def process_result_value(self, value, dialect):
+        return decompress(value)
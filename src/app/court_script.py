@@ -7,18 +7,65 @@ rights violations, and evidence suppression opportunities.
 import os
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models import Case, User, LegalAnalysis, db
+import ai_usage
 import anthropic_helper
-from openai import OpenAI
+import provider_clients
+import prompt_budget
+import script_skeletons
+import structured_output
+import rate_limits
 
 # Create blueprint
 court_script = Blueprint('court_script', __name__)
 
+MODEL = "gpt-4o"  # The newest OpenAI model
+SCRIPT_SYSTEM_PROMPT = "You are an expert legal strategist developing detailed court appearance scripts for self-represented litigants. Create comprehensive, step-by-step guidance for court proceedings with detailed instructions on what to do, what to say, when to say it, and how to assert constitutional rights effectively. Focus on challenging probable cause AND asserting speedy trial rights when applicable."
+# Only the case-specific sections are generated, each as its own short request;
+# the rest of the script comes from script_skeletons
+SECTION_OUTPUT_TOKENS = 1200
+SECTION_WORKERS = int(os.environ.get('COURT_SCRIPT_WORKERS', 3))
+# Most case-specific preparation steps added to the skeleton's
+MAX_CASE_PREPARATION = 3
+
+SCRIPT_SECTIONS = {
+    'proceeding': """Write the case-specific parts of a court appearance script for a self-represented litigant.
+The generic procedure is already written; do not repeat it.
+
+For each stage listed under STAGES NEEDING CASE-SPECIFIC WORDING, write the exact words the litigant should say at that stage, in formal courtroom language, tailored to the facts, charges and violations of this case. Also list up to three preparation steps specific to this case (particular documents, evidence or arguments to have ready).
+
+Respond with a JSON object:
+{
+  "what_to_say": {"<stage name exactly as listed>": "Exact script of what to say"},
+  "preparation": [
+    {"step": "Case-specific preparation step", "details": "What exactly to prepare", "importance": "Why it matters in this case"}
+  ]
+}""",
+    'rights': """List the constitutional and procedural rights a self-represented litigant should assert at this proceeding, based on the case details and any violations identified. Focus on challenging probable cause and asserting speedy trial rights when applicable, and give exact wording a non-lawyer can use.
+
+Respond with a JSON object:
+{
+  "asserting_rights": [
+    {"right": "Specific right to assert", "when_to_assert": "Timing of when to bring this up", "what_to_say": "Exact wording to use when asserting this right", "possible_responses": "How the court might respond and how to handle it"}
+  ]
+}""",
+    'challenges': """List the obstacles a self-represented litigant is likely to face at this proceeding given the case details, such as objections from the prosecution, rulings against them or pushback from the judge, and how to handle each.
+
+Respond with a JSON object:
+{
+  "potential_challenges": [
+    {"challenge": "Potential obstacle that might arise", "how_to_handle": "Step-by-step approach to addressing this challenge", "fallback_strategy": "What to do if the primary approach fails"}
+  ]
+}"""
+}
+
 @court_script.route('/case/<int:case_id>/court-script', methods=['GET', 'POST'])
 @login_required
+@rate_limits.ai_limited(methods=('POST',))
 def generate_script(case_id):
     """Generate or view court script for a specific case"""
     # Get case details
@@ -30,20 +77,14 @@ def generate_script(case_id):
         return redirect(url_for('cases.dashboard'))
     
     # Check for rights violation interview analysis
-    interview_analysis = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='interview_analysis'
-    ).first()
+    interview_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'interview_analysis')
     
     has_interview_analysis = (interview_analysis is not None)
     script = None
     selected_proceeding = None
     
     # Check for existing court script
-    court_script_analysis = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='court_script'
-    ).first()
+    court_script_analysis = LegalAnalysis.get_by_case_and_type(case_id, 'court_script')
     
     # Process form submission for generating new script
     if request.method == 'POST':
@@ -55,9 +96,8 @@ def generate_script(case_id):
             # Load interview analysis if available
             interview_data = None
             if interview_analysis:
-                try:
-                    interview_data = json.loads(interview_analysis.content)
-                except:
+                interview_data = interview_analysis.get_data()
+                if interview_data is None:
                     logging.error("Failed to parse interview analysis JSON")
             
             # Generate the court script
@@ -71,9 +111,10 @@ def generate_script(case_id):
             if script_content:
                 # Store or update the script
                 if court_script_analysis:
-                    court_script_analysis.content = json.dumps(script_content)
-                    court_script_analysis.references = json.dumps({"proceeding_type": proceeding_type})
-                    db.session.commit()
+                    court_script_analysis = court_script_analysis.new_version(
+                        content=json.dumps(script_content),
+                        references=json.dumps({"proceeding_type": proceeding_type})
+                    )
                 else:
                     court_script_analysis = LegalAnalysis.create_analysis(
                         case_id=case_id,
@@ -94,8 +135,8 @@ def generate_script(case_id):
     # Display existing script if available
     elif court_script_analysis:
         try:
-            script = json.loads(court_script_analysis.content)
-            script_info = json.loads(court_script_analysis.references)
+            script = court_script_analysis.get_data()
+            script_info = court_script_analysis.get_data('references')
             selected_proceeding = script_info.get('proceeding_type')
         except:
             logging.error("Failed to parse existing court script JSON")
@@ -110,54 +151,111 @@ def generate_script(case_id):
     )
 
 def create_court_script(case, proceeding_type, interview_analysis=None, additional_context=''):
-    """Generate a court script based on case details and analysis"""
+    """
+    Generate a court script for a case.
+    
+    The procedural parts come from the precomputed skeleton for the proceeding
+    and court type; only the case-specific sections are generated, as small
+    requests run in parallel. A section that cannot be generated keeps the
+    skeleton's generic text. Returns None if no section could be generated.
+    """
     try:
-        # Try Anthropic first if available
-        if anthropic_helper.is_available():
-            prompt = create_script_prompt(case, proceeding_type, interview_analysis, additional_context)
-            result = anthropic_helper.analyze_case_text(prompt, json_format=True)
-            if result:
-                return result
+        skeleton = script_skeletons.get_skeleton(proceeding_type, case.court_type)
+        stages = script_skeletons.slot_stages(skeleton)
+        violations_text = format_violations(interview_analysis)
         
-        # Fall back to OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            return None
-        
-        # Prepare the prompt
-        prompt = create_script_prompt(case, proceeding_type, interview_analysis, additional_context)
-        
-        # Call OpenAI API
-        client = OpenAI(api_key=api_key)
-        MODEL = "gpt-4o"  # The newest OpenAI model
+        with ThreadPoolExecutor(max_workers=max(1, min(len(SCRIPT_SECTIONS), SECTION_WORKERS))) as executor:
+            futures = {
+                section: executor.submit(ai_usage.bind(generate_section), case, proceeding_type, section, stages,
+                                         violations_text, additional_context)
+                for section in SCRIPT_SECTIONS
+            }
+            sections = {section: future.result() for section, future in futures.items()}
         
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": "You are an expert legal strategist developing detailed court appearance scripts for self-represented litigants. Create comprehensive, step-by-step guidance for court proceedings with detailed instructions on what to do, what to say, when to say it, and how to assert constitutional rights effectively. Focus on challenging probable cause AND asserting speedy trial rights when applicable."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2
-        )
-        
-        # Extract and parse the response
-        content = response.choices[0].message.content
-        if content:
-            return json.loads(content)
-        else:
+        failed = [section for section, result in sections.items() if result is None]
+        if len(failed) == len(sections):
             return None
-            
+        if failed:
+            logging.warning(f"Court script for case {case.id} uses generic text for: {', '.join(failed)}")
+        
+        return assemble_script(skeleton, sections)
+    
     except Exception as e:
         logging.error(f"Court script generation failed: {str(e)}")
         return None
 
-def create_script_prompt(case, proceeding_type, analysis_data, additional_context):
-    """Create prompt for generating court script"""
-    # Get proceeding-specific guidance to include in the prompt
-    proceeding_guidance = get_proceeding_guidance(proceeding_type)
+def _run_section(prompt_for_model, instructions):
+    """Run one section request with Anthropic, falling back to OpenAI; returns a dict or None"""
+    if anthropic_helper.is_available():
+        prompt = prompt_for_model(anthropic_helper.DEFAULT_MODEL)
+        max_tokens = prompt_budget.max_tokens_for(prompt, anthropic_helper.DEFAULT_MODEL, SECTION_OUTPUT_TOKENS, instructions)
+        result = anthropic_helper.analyze_case_text(prompt, json_format=True, instructions=instructions,
+                                                    max_tokens=max_tokens)
+        if result and "error" not in result:
+            return result
+    
+    client = provider_clients.get_openai_client()
+    if client is None:
+        return None
+    
+    prompt = prompt_for_model(MODEL)
+    system_prompt = f"{SCRIPT_SYSTEM_PROMPT}\n\n{instructions}"
+    response = client.chat.completions.create(
+        model=MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.2,
+        max_tokens=prompt_budget.max_tokens_for(prompt, MODEL, SECTION_OUTPUT_TOKENS, system_prompt)
+    )
+    content = response.choices[0].message.content
+    return structured_output.extract_json(content) if content else None
+
+def generate_section(case, proceeding_type, section, stages, violations_text, additional_context):
+    """Generate one case-specific section of the script; returns its fields or None on failure"""
+    try:
+        result = _run_section(
+            lambda model: create_section_prompt(case, proceeding_type, section, stages, violations_text,
+                                                additional_context, model=model),
+            SCRIPT_SECTIONS[section]
+        )
+    except Exception as e:
+        logging.error(f"Error generating court script section {section}: {e}")
+        return None
+    if not result:
+        return None
+    return structured_output.apply_schema(result, f'court_script_{section}')
+
+def assemble_script(skeleton, sections):
+    """Fill the generated sections into a skeleton, keeping its generic text where a section is missing"""
+    script = skeleton
+    
+    proceeding = sections.get('proceeding')
+    if proceeding:
+        # Case-specific preparation goes after the skeleton's first step (gathering documents)
+        case_preparation = [step for step in proceeding["preparation"] if isinstance(step, dict)]
+        script["preparation"][1:1] = case_preparation[:MAX_CASE_PREPARATION]
+        what_to_say = proceeding["what_to_say"]
+        for stage in script["main_proceeding"]:
+            if stage.get("slot") and isinstance(what_to_say.get(stage["stage"]), str) and what_to_say[stage["stage"]].strip():
+                stage["what_to_say"] = what_to_say[stage["stage"]]
     
-    # Format any constitutional violations from the interview analysis
+    rights = sections.get('rights')
+    if rights and rights["asserting_rights"]:
+        script["asserting_rights"] = rights["asserting_rights"]
+    
+    challenges = sections.get('challenges')
+    if challenges and challenges["potential_challenges"]:
+        script["potential_challenges"] = challenges["potential_challenges"]
+    
+    for stage in script["main_proceeding"]:
+        stage.pop("slot", None)
+    return structured_output.apply_schema(script, 'court_script')
+
+def format_violations(analysis_data):
+    """Format the violations from an interview analysis for a prompt"""
     violations_text = ""
     if analysis_data and isinstance(analysis_data, dict):
         # Format constitutional violations
@@ -181,86 +279,31 @@ def create_script_prompt(case, proceeding_type, analysis_data, additional_contex
             for evidence in analysis_data["fruit_of_poisonous_tree"]:
                 violations_text += f"- Initial violation: {evidence.get('initial_violation', '')}\n"
                 violations_text += f"  Tainted evidence: {', '.join(evidence.get('tainted_evidence', ['']))}\n"
+    return violations_text
+
+def create_section_prompt(case, proceeding_type, section, stages, violations_text, additional_context, model=None):
+    """Create a token-budgeted prompt carrying the case details for one script section"""
+    proceeding_name = proceeding_type.replace('_', ' ')
     
-    # Create the full prompt
-    prompt = f"""
-    Create a comprehensive, step-by-step court appearance script for a self-represented litigant appearing at a {proceeding_type.replace('_', ' ')} proceeding.
-    
-    CASE DETAILS:
-    Title: {case.title}
-    Court Type: {case.court_type}
-    Issue Type: {case.issue_type}
-    Description: {case.description}
-    
-    {violations_text}
-    
-    ADDITIONAL CONTEXT FROM LITIGANT:
-    {additional_context if additional_context else "No additional context provided."}
-    
-    PROCEEDING-SPECIFIC GUIDANCE:
-    {proceeding_guidance}
-    
-    Create a detailed court script that includes:
-    1. Preparation before court (documents to bring, how to dress, what to prepare)
-    2. Entering the courtroom (where to sit, how to address the court)
-    3. Main proceeding (with each stage broken down into what to expect, what to say, what to do)
-    4. How to assert constitutional rights and challenge evidence effectively
-    5. How to handle potential challenges or pushback
-    6. How to conclude the proceeding professionally
-    
-    Format your response as a JSON object with these sections:
-    {{
-      "script_title": "Court Appearance Script: [PROCEEDING TYPE]",
-      "preparation": [
-        {{
-          "step": "Gather essential documents",
-          "details": "Specific documents to bring and how to organize them",
-          "importance": "Explanation of why this preparation step matters"
-        }}
-      ],
-      "courtroom_entrance": [
-        {{
-          "action": "Specific action to take when entering",
-          "explanation": "Explanation of why this matters"
-        }}
-      ],
-      "main_proceeding": [
-        {{
-          "stage": "Name of this stage of the proceeding",
-          "what_to_expect": "Detailed explanation of what will happen",
-          "what_to_say": "Exact script of what to say, including formal language",
-          "what_to_do": "Physical actions to take during this stage",
-          "tips": "Strategic advice for this stage"
-        }}
-      ],
-      "asserting_rights": [
-        {{
-          "right": "Specific right to assert",
-          "when_to_assert": "Timing of when to bring this up",
-          "what_to_say": "Exact wording to use when asserting this right",
-          "possible_responses": "How the court might respond and how to handle it"
-        }}
-      ],
-      "potential_challenges": [
-        {{
-          "challenge": "Potential obstacle that might arise",
-          "how_to_handle": "Step-by-step approach to addressing this challenge",
-          "fallback_strategy": "What to do if the primary approach fails"
-        }}
-      ],
-      "conclusion": [
-        {{
-          "action": "Actions to take at conclusion",
-          "what_to_say": "Final statements if applicable",
-          "next_steps": "What to do immediately after the proceeding"
-        }}
-      ]
-    }}
-    
-    Ensure the script is specific to a {proceeding_type.replace('_', ' ')} proceeding, addresses the identified constitutional violations (if any), and provides clear, actionable guidance that a non-lawyer can follow in court.
-    """
-    
-    return prompt
+    # The case description is kept longest; guidance and litigant context are
+    # shortened first if needed
+    builder = prompt_budget.PromptBuilder(model=model or MODEL, output_tokens=SECTION_OUTPUT_TOKENS)
+    builder.add("intro", f"""PROCEEDING: {proceeding_name}
+
+CASE DETAILS:
+Title: {case.title}
+Court Type: {case.court_type}
+Issue Type: {case.issue_type}""", required=True)
+    builder.add("description", f"Description: {case.description}", priority=4, min_tokens=200)
+    builder.add("violations", violations_text, priority=3)
+    builder.add("additional_context", f"""ADDITIONAL CONTEXT FROM LITIGANT:
+{additional_context if additional_context else "No additional context provided."}""", priority=2)
+    if section == 'proceeding':
+        builder.add("stages", "STAGES NEEDING CASE-SPECIFIC WORDING:\n" + "\n".join(f"- {stage}" for stage in stages),
+                    required=True)
+    builder.add("guidance", f"""PROCEEDING-SPECIFIC GUIDANCE:
+{get_proceeding_guidance(proceeding_type)}""", priority=1)
+    return builder.build()
 
 def get_proceeding_guidance(proceeding_type):
     """Get guidance specific to the type of court proceeding"""
@@ -0,0 +1,353 @@
+"""
+PDF and DOCX rendering for generated documents.
+
+Documents are plain text, so both formats are written directly with the
+standard library: PDF pages are laid out in 10pt Courier on US Letter with
+word wrapping and page numbers, and DOCX files are a minimal WordprocessingML
+package with one paragraph per line.
+
+Rendered files are cached on disk under a hash of the format, title and
+content, so repeat downloads are served straight from the file (and can be
+streamed and answered with 304s by send_file). Renders run in a process pool
+so page layout of long documents does not hold up web workers; identical
+renders requested at the same time share one job. If the pool cannot be
+used, rendering falls back to the calling process.
+
+Each process keeps a running estimate of the cache size, counted by its last
+scan plus the renders it has written since, and only scans the cache to prune
+it when the estimate goes over the limit or every
+DOCUMENT_RENDER_PRUNE_INTERVAL seconds (to pick up renders by other
+processes), not on every render.
+
+Environment:
+    DOCUMENT_RENDER_CACHE_DIR   where rendered files are kept (default <tempdir>/document_renders)
+    DOCUMENT_RENDER_CACHE_MB    size the cache is pruned back to, oldest first (default 500)
+    DOCUMENT_RENDER_PRUNE_INTERVAL  seconds between cache scans while it looks under its size (default 300)
+    DOCUMENT_RENDER_WORKERS     render processes; 0 renders in the web worker (default 2)
+    DOCUMENT_RENDER_TIMEOUT     seconds to wait for a render (default 30)
+"""
+import io
+import os
+import re
+import time
+import zlib
+import hashlib
+import logging
+import tempfile
+import textwrap
+import threading
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+CACHE_DIR = os.environ.get('DOCUMENT_RENDER_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'document_renders'))
+CACHE_MAX_BYTES = int(float(os.environ.get('DOCUMENT_RENDER_CACHE_MB', 500)) * 1024 * 1024)
+RENDER_WORKERS = int(os.environ.get('DOCUMENT_RENDER_WORKERS', 2))
+RENDER_TIMEOUT = float(os.environ.get('DOCUMENT_RENDER_TIMEOUT', 30))
+PRUNE_INTERVAL = float(os.environ.get('DOCUMENT_RENDER_PRUNE_INTERVAL', 300))
+# Part of every cache key; bump when the output of a renderer changes
+RENDERER_VERSION = 1
+
+MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+}
+
+# PDF page layout in points: US Letter, one-inch margins, 10pt Courier (6pt per character)
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+MARGIN = 72
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+CHARS_PER_LINE = (PAGE_WIDTH - 2 * MARGIN) // 6
+LINES_PER_PAGE = (PAGE_HEIGHT - 2 * MARGIN) // LINE_HEIGHT
+
+# Characters XML 1.0 does not allow
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+# Fixed timestamp for DOCX zip entries so identical input renders identical bytes
+_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = {}
+_pending_lock = threading.Lock()
+# Estimated bytes in the cache (None until the first scan) and when it was last scanned
+_cache_bytes = None
+_last_prune = 0.0
+_size_lock = threading.Lock()
+_prune_lock = threading.Lock()
+
+
+def wrap_lines(text, width=CHARS_PER_LINE):
+    """Split text into lines of at most width characters, keeping indentation"""
+    lines = []
+    for line in text.expandtabs(4).splitlines():
+        line = line.rstrip()
+        if len(line) <= width:
+            lines.append(line)
+            continue
+        indent = line[:len(line) - len(line.lstrip())]
+        if len(indent) > width // 2:
+            indent = ''
+        lines.extend(textwrap.wrap(line, width, subsequent_indent=indent, break_long_words=True,
+                                   break_on_hyphens=False) or [''])
+    return lines
+
+
+def _pdf_string(value):
+    """Encode a PDF literal string in the font's WinAnsi encoding"""
+    data = value.encode('cp1252', errors='replace')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def render_pdf(text, title=''):
+    """Render plain text as a paginated PDF; returns bytes"""
+    lines = wrap_lines(text)
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+
+    # Objects 1-4 are fixed; each page adds a page object and a content stream
+    objects = [None, None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>',
+               b'<< /Title ' + _pdf_string(title) + b' /Producer (Due Process AI) >>']
+    page_refs = []
+    for number, page in enumerate(pages, 1):
+        # The ' operator moves down a line before showing text, so start one line above the first
+        stream = [b'BT', b'/F1 %d Tf' % FONT_SIZE, b'%d TL' % LINE_HEIGHT,
+                  b'%d %d Td' % (MARGIN, PAGE_HEIGHT - MARGIN - FONT_SIZE + LINE_HEIGHT)]
+        for line in page:
+            stream.append(_pdf_string(line) + b" '")
+        stream.append(b'ET')
+        footer = f"Page {number} of {len(pages)}"
+        stream.append(b'BT /F1 8 Tf %d %d Td ' % ((PAGE_WIDTH - len(footer) * 4.8) // 2, MARGIN // 2)
+                      + _pdf_string(footer) + b' Tj ET')
+        data = zlib.compress(b'\n'.join(stream))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(data) + data + b'\nendstream')
+        content_ref = len(objects)
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >> '
+                       b'/Contents %d 0 R >>' % (PAGE_WIDTH, PAGE_HEIGHT, content_ref))
+        page_refs.append(len(objects))
+    objects[0] = b'<< /Type /Catalog /Pages 2 0 R >>'
+    objects[1] = (b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % ref for ref in page_refs)
+                  + b'] /Count %d >>' % len(page_refs))
+
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R /Info 4 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _xml_text(value):
+    return escape(_XML_INVALID.sub('', value))
+
+
+def render_docx(text, title=''):
+    """Render plain text as a DOCX file, one paragraph per line; returns bytes"""
+    run_props = ('<w:rPr><w:rFonts w:ascii="Courier New" w:hAnsi="Courier New" w:cs="Courier New"/>'
+                 '<w:sz w:val="20"/></w:rPr>')
+    paragraphs = []
+    for line in text.expandtabs(4).splitlines():
+        run = f'<w:r>{run_props}<w:t xml:space="preserve">{_xml_text(line)}</w:t></w:r>' if line else ''
+        paragraphs.append(f'<w:p><w:pPr><w:spacing w:after="0"/></w:pPr>{run}</w:p>')
+
+    parts = {
+        '[Content_Types].xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '<Override PartName="/docProps/core.xml" ContentType="application/'
+            'vnd.openxmlformats-package.core-properties+xml"/>'
+            '</Types>'),
+        '_rels/.rels': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+            'relationships/officeDocument" Target="word/document.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/'
+            'relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+            '</Relationships>'),
+        'docProps/core.xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+            'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:title>{_xml_text(title)}</dc:title><dc:creator>Due Process AI</dc:creator>'
+            '</cp:coreProperties>'),
+        'word/document.xml': (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+            + ''.join(paragraphs)
+            + '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+            '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" w:footer="720" '
+            'w:gutter="0"/></w:sectPr></w:body></w:document>')
+    }
+
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in parts.items():
+            archive.writestr(zipfile.ZipInfo(name, date_time=_ZIP_DATE), xml.encode('utf-8'),
+                             compress_type=zipfile.ZIP_DEFLATED)
+    return out.getvalue()
+
+
+RENDERERS = {'pdf': render_pdf, 'docx': render_docx}
+
+
+def cache_key(fmt, content, title=''):
+    """Hash identifying one rendering of content in a format"""
+    digest = hashlib.sha256(f"{RENDERER_VERSION}\0{fmt}\0{title}\0".encode('utf-8'))
+    digest.update(content.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_path(key, fmt):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.{fmt}")
+
+
+def _render_to_file(fmt, content, title, path):
+    """Render and write atomically to path; runs in a pool process"""
+    data = RENDERERS[fmt](content, title)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return len(data)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None and RENDER_WORKERS > 0:
+            # spawn rather than fork: web workers may be running threads
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _render(fmt, content, title, path):
+    pool = _get_pool()
+    if pool is not None:
+        try:
+            return pool.submit(_render_to_file, fmt, content, title, path).result(timeout=RENDER_TIMEOUT)
+        except (BrokenProcessPool, OSError) as e:
+            logging.error(f"Document render pool failed, rendering in process: {e}")
+            _reset_pool()
+    return _render_to_file(fmt, content, title, path)
+
+
+def get_rendered(fmt, content, title=''):
+    """
+    Return (path, key) of the rendered file, rendering it if it is not cached.
+
+    Concurrent requests for the same rendering wait on a single render.
+    Raises ValueError for an unsupported format.
+    """
+    if fmt not in RENDERERS:
+        raise ValueError(f"Unsupported document format: {fmt}")
+    key = cache_key(fmt, content, title)
+    path = cache_path(key, fmt)
+    if os.path.exists(path):
+        try:
+            # Mark as recently used for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return path, key
+
+    with _pending_lock:
+        event = _pending.get(key)
+        owner = event is None
+        if owner:
+            event = _pending[key] = threading.Event()
+    if not owner:
+        event.wait(RENDER_TIMEOUT)
+        if os.path.exists(path):
+            return path, key
+
+    try:
+        size = _render(fmt, content, title, path)
+    finally:
+        if owner:
+            with _pending_lock:
+                _pending.pop(key, None)
+            event.set()
+    _note_render(size)
+    return path, key
+
+
+def _note_render(size):
+    """Add a new render to the size estimate; prune when it is over the limit or stale"""
+    global _cache_bytes
+    with _size_lock:
+        if _cache_bytes is not None:
+            _cache_bytes += size
+        due = (_cache_bytes is None or _cache_bytes > CACHE_MAX_BYTES
+               or time.monotonic() - _last_prune >= PRUNE_INTERVAL)
+    if due:
+        prune_cache()
+
+
+def prune_cache(max_bytes=None):
+    """Delete the least recently used renders until the cache is under its size limit"""
+    global _cache_bytes, _last_prune
+    # One scan at a time; renders arriving meanwhile are counted by the next
+    if not _prune_lock.acquire(blocking=False):
+        return 0
+    try:
+        removed, total = _prune(CACHE_MAX_BYTES if max_bytes is None else max_bytes)
+    finally:
+        _prune_lock.release()
+    with _size_lock:
+        _cache_bytes = total
+        _last_prune = time.monotonic()
+    return removed
+
+
+def _prune(max_bytes):
+    """Scan the cache and prune it; returns (files removed, bytes left)"""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return 0, total
+    removed = 0
+    # Go a little under the limit so every new render does not trigger a prune
+    target = max_bytes * 0.9
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    return removed, total
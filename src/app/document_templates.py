@@ -0,0 +1,210 @@
+"""
+Compiled templates for the filing toolkit documents.
+
+Each form's text lives in templates/documents/<form_type>.txt and is wrapped
+by templates/documents/_document.txt, which adds the strategic explanation
+header and the filing advice footer. Templates are compiled once by a
+dedicated Jinja2 environment (plain text, no autoescaping, no reloading).
+
+Everything that depends only on (form_type, state, court_type) is rendered
+once and cached as a list of literal segments with slots for the
+case-specific fields (CASE_FIELDS); generating a document then just joins
+the cached segments with the case's values. render_documents generates
+several forms for one case in one pass.
+
+Environment:
+    DOCUMENT_TEMPLATE_CACHE_SIZE   rendered boilerplate entries kept (default 512)
+"""
+import os
+import re
+from datetime import datetime
+from functools import lru_cache
+
+from flask_login import current_user
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'documents')
+LAYOUT_TEMPLATE = '_document.txt'
+CACHE_SIZE = int(os.environ.get('DOCUMENT_TEMPLATE_CACHE_SIZE', 512))
+
+# Form type -> template file with the body of that form
+FORM_TEMPLATES = {
+    'motion_to_quash': 'motion_to_quash.txt',
+    'civil_cover_sheet': 'civil_cover_sheet.txt',
+    'section_1983': 'section_1983.txt',
+    'habeas_corpus': 'habeas_corpus.txt',
+    'discovery_request': 'discovery_request.txt',
+    'motion_to_dismiss': 'motion_to_dismiss.txt',
+    'answer_complaint': 'answer_complaint.txt'
+}
+
+# Fields filled in per case; everything else in a template is boilerplate
+CASE_FIELDS = ('title', 'issue_type', 'description_excerpt', 'username', 'username_upper',
+               'deadline_line', 'generated_at')
+# Stand-in rendered for each case field so its position can be found in the output
+_SLOT = '\x00{}\x00'
+_SLOT_RE = re.compile(r'\x00(\w+)\x00')
+
+DOCUMENT_EXPLANATIONS = {
+    'motion_to_quash': {
+        'purpose': 'This motion challenges the legal validity of a search warrant, arrest warrant, or subpoena. It seeks to invalidate evidence obtained through these means.',
+        'importance': 'A successful motion to quash prevents the prosecution from using potentially damaging evidence against you, and may lead to case dismissal if the evidence is central to their case.',
+        'tactical_considerations': 'The timing of this motion is critical - it must be filed before trial and ideally as early as possible in the proceedings to prevent the evidence from influencing other aspects of your case.',
+        'filing_advice': 'This motion should be filed immediately after receiving discovery that reveals potential Fourth Amendment violations. Attach any relevant evidence showing the warrant was defective.',
+        'next_steps': 'The court will likely schedule a hearing where you must be prepared to argue the specific legal defects in the warrant. Be ready to cite relevant case law.',
+        'potential_challenges': 'The prosecution may argue "good faith exception" or other exceptions to the warrant requirement. Counter by demonstrating how the specific facts of your case do not qualify for these exceptions.'
+    },
+    'civil_cover_sheet': {
+        'purpose': 'This administrative document provides the court with essential case information and helps determine proper case assignment and statistical tracking.',
+        'importance': 'While seemingly routine, errors on this form can cause delays or even improper jurisdiction assignment, potentially jeopardizing your case.',
+        'tactical_considerations': 'Selecting the proper jurisdiction, nature of suit, and demand amount can impact how your case proceeds and which judge might be assigned to your case.',
+        'filing_advice': 'Complete this form with absolute accuracy. For civil rights cases, ensure you select the correct nature of suit code (typically 440 for civil rights or 550 for prisoner petitions).',
+        'next_steps': 'This document is typically filed with your initial complaint. The court clerk will use it to process your case opening.',
+        'potential_challenges': 'The clerk may reject filings with incomplete or incorrect cover sheets. Double-check every field before submission.'
+    },
+    'section_1983': {
+        'purpose': 'This federal civil rights complaint allows you to sue government officials or entities that violated your constitutional rights while acting "under color of law."',
+        'importance': 'This powerful legal tool provides monetary damages and injunctive relief against government actors who violated your constitutional rights.',
+        'tactical_considerations': 'Individual capacity claims allow for monetary damages, while official capacity claims are essentially against the government entity itself and may be limited by sovereign immunity.',
+        'filing_advice': 'Be extremely specific about which constitutional rights were violated, which defendants violated them, and how. Link each defendant to specific actions that violated specific rights.',
+        'next_steps': 'After filing, defendants will likely file motions to dismiss, often claiming qualified immunity. Be prepared with specific case law showing your rights were "clearly established."',
+        'potential_challenges': 'Qualified immunity is a major hurdle - you must show the defendant violated "clearly established" law that a reasonable person would have known about.'
+    },
+    'habeas_corpus': {
+        'purpose': 'This petition challenges the legality of your detention or imprisonment, arguing that your confinement violates constitutional rights or statutory law.',
+        'importance': 'This is often your last chance to challenge a conviction after direct appeals have been exhausted, especially when new evidence emerges or constitutional violations are discovered.',
+        'tactical_considerations': 'Strict filing deadlines apply - federal habeas petitions under 28 U.S.C. § 2254 typically must be filed within one year of conviction finality.',
+        'filing_advice': 'Focus on constitutional violations that affected the outcome of your case, exhaust all state remedies first, and be mindful of procedural rules like the one-year filing deadline.',
+        'next_steps': 'The court may dismiss the petition, order the government to respond, or schedule an evidentiary hearing. Be prepared for a potentially lengthy process.',
+        'potential_challenges': 'Procedural defaults, failure to exhaust state remedies, and deference to state court findings are common obstacles.'
+    },
+    'discovery_request': {
+        'purpose': 'This document formally requests evidence and information from the opposing party, including documents, answers to written questions, and physical evidence.',
+        'importance': 'Effective discovery is crucial for building your case, identifying weaknesses in the opposition\'s position, and uncovering evidence of rights violations.',
+        'tactical_considerations': 'Specific, targeted requests are more likely to yield useful information and survive objections than overly broad "fishing expeditions."',
+        'filing_advice': 'Be precise in your requests. For criminal cases, focus on Brady material (exculpatory evidence), chain of custody documents, and anything that could reveal Fourth Amendment violations.',
+        'next_steps': 'The opposing party must respond within a set timeframe (typically 30 days). Be prepared to file motions to compel if they object unreasonably.',
+        'potential_challenges': 'Expect objections based on relevance, privilege, or burden. Be ready to explain why each item requested is directly relevant to your case.'
+    },
+    'motion_to_dismiss': {
+        'purpose': 'This motion asks the court to dismiss a case before trial, arguing that even if all allegations were true, there is no legal basis for the case to proceed.',
+        'importance': 'A successful motion to dismiss ends the case early, saving time, resources, and preventing the stress of continued litigation.',
+        'tactical_considerations': 'This is typically filed at the earliest stages of litigation, before significant discovery or other proceedings occur.',
+        'filing_advice': 'Focus on legal defects rather than factual disputes. Common grounds include lack of jurisdiction, failure to state a claim, statutory immunity, or expiration of statute of limitations.',
+        'next_steps': 'The court may schedule oral arguments or rule based on the papers. If denied, the case proceeds to discovery; if granted, the case may end or the plaintiff may be given leave to amend.',
+        'potential_challenges': 'Courts often interpret complaints in the light most favorable to the non-moving party, making dismissal relatively difficult at early stages.'
+    },
+    'answer_complaint': {
+        'purpose': 'This formal response to a civil complaint addresses each allegation, asserts defenses, and preserves your rights in the litigation.',
+        'importance': 'Failing to properly answer can result in default judgment against you. This document shapes the entire direction of your defense.',
+        'tactical_considerations': 'Strict deadlines apply - typically 21 days after service. Missing this deadline could result in default judgment.',
+        'filing_advice': 'Respond to each numbered paragraph in the complaint with an admission, denial, or statement that you lack sufficient information. Then list all applicable affirmative defenses.',
+        'next_steps': 'After filing, the case typically moves to the discovery phase where both parties exchange information and evidence.',
+        'potential_challenges': 'Failing to raise certain defenses in your answer may waive them forever. Consult comprehensive lists of affirmative defenses to ensure none are missed.'
+    }
+}
+
+# Used for form types without their own explanation
+DEFAULT_EXPLANATION = {
+    'purpose': 'This document serves a specific legal purpose in your case.',
+    'importance': 'The document may be important for preserving your rights.',
+    'tactical_considerations': 'Consider the timing and content carefully when filing this document.',
+    'filing_advice': 'Ensure all required elements are included and the document is filed according to court rules.',
+    'next_steps': 'After filing, monitor for responses from other parties or the court.',
+    'potential_challenges': 'Be prepared to address any objections or challenges to your filing.'
+}
+
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=False,
+    keep_trailing_newline=True,
+    auto_reload=False,
+    undefined=StrictUndefined
+)
+
+
+def get_explanation(form_type):
+    """Return the purpose, importance and filing advice for a form type"""
+    return DOCUMENT_EXPLANATIONS.get(form_type, DEFAULT_EXPLANATION)
+
+
+def _boilerplate_context(form_type, state, court_type):
+    context = {
+        'form_type': form_type,
+        'form_title': form_type.replace('_', ' ').title(),
+        'state': state,
+        'court_type': court_type,
+        'court_title': court_type.replace('_', ' ').title(),
+        'explanation': get_explanation(form_type)
+    }
+    context.update({name: _SLOT.format(name) for name in CASE_FIELDS})
+    return context
+
+
+def _split(rendered):
+    """Split rendered text into a tuple of alternating literals and case field names"""
+    return tuple(_SLOT_RE.split(rendered))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _document_segments(form_type, state, court_type):
+    context = _boilerplate_context(form_type, state, court_type)
+    context['body_template'] = FORM_TEMPLATES.get(form_type)
+    return _split(_env.get_template(LAYOUT_TEMPLATE).render(context))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _body_segments(form_type, state, court_type):
+    context = _boilerplate_context(form_type, state, court_type)
+    return _split(_env.get_template(FORM_TEMPLATES[form_type]).render(context))
+
+
+def _fill(segments, fields):
+    """Join cached segments, substituting the case fields at odd positions"""
+    return ''.join(fields[part] if i % 2 else part for i, part in enumerate(segments))
+
+
+def case_fields(case, deadline_date=None):
+    """Return the case-specific values the document templates need"""
+    username = current_user.username if hasattr(current_user, 'username') else '[YOUR NAME]'
+    return {
+        'title': case.title,
+        'issue_type': case.issue_type.replace('_', ' ').title(),
+        'description_excerpt': (case.description or '')[0:100],
+        'username': username,
+        'username_upper': username.upper() if hasattr(current_user, 'username') else username,
+        'deadline_line': f"DEADLINE DATE: {deadline_date.strftime('%B %d, %Y')}\n\n" if deadline_date else '',
+        'generated_at': datetime.utcnow().strftime('%B %d, %Y at %H:%M:%S UTC')
+    }
+
+
+def render_document(form_type, case, state, court_type, deadline_date=None, fields=None):
+    """Render a complete document (explanation header, form body and filing advice)"""
+    if fields is None:
+        fields = case_fields(case, deadline_date)
+    return _fill(_document_segments(form_type, state, court_type), fields)
+
+
+def render_body(form_type, case, state, court_type):
+    """Render just the body of a form, without the explanation header and footer"""
+    return _fill(_body_segments(form_type, state, court_type), case_fields(case))
+
+
+def render_documents(form_types, case, state, court_type, deadline_date=None):
+    """Render several forms for one case in one pass; returns {form_type: content}"""
+    fields = case_fields(case, deadline_date)
+    return {form_type: render_document(form_type, case, state, court_type, fields=fields)
+            for form_type in form_types}
+
+
+def cache_info():
+    """Return hit and miss counts of the boilerplate caches"""
+    return {'documents': _document_segments.cache_info()._asdict(),
+            'bodies': _body_segments.cache_info()._asdict()}
+
+
+def clear_cache():
+    """Drop compiled templates and cached boilerplate (after editing template files)"""
+    _document_segments.cache_clear()
+    _body_segments.cache_clear()
+    _env.cache.clear()
@@ -1,13 +1,17 @@
 import os
-from io import BytesIO
+import re
+import logging
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, redirect, url_for, flash, send_file, current_app, session
+from flask import (Blueprint, render_template, redirect, url_for, flash, send_file, current_app, session, abort,
+                   request, Response, stream_with_context)
 from flask_login import login_required, current_user
 from wtforms.validators import DataRequired
 from wtforms import SelectField
 from models import Case, Document
 from forms import FilingToolkitForm
 from utils import generate_document, generate_filename
+import document_render
+import case_bundle
 
 documents = Blueprint('documents', __name__)
 
@@ -107,6 +111,10 @@ def filing_toolkit():
     
     return render_template('filing_toolkit.html', form=form, user_cases=user_cases)
 
+def _can_download(document):
+    return (document.user_id == current_user.id or current_user.is_moderator()
+            or current_user.is_legal_assistant())
+
 @documents.route('/download/<int:document_id>')
 @login_required
 def download_document(document_id):
@@ -121,55 +129,103 @@ def download_document(document_id):
         
         print(f"Found document: {document.id}, filename: {document.filename}")  # Debug logging
         
-        if document.user_id != current_user.id and not current_user.is_moderator() and not current_user.is_legal_assistant():
+        if not _can_download(document):
             flash('You do not have permission to download this document.', 'danger')
             return redirect(url_for('documents.filing_toolkit'))
         
-        # Create PDF in memory
-        pdf_bytes = BytesIO()
-        # This would be replaced with actual PDF generation logic
-        pdf_bytes.write(document.content.encode())
-        pdf_bytes.seek(0)
-        
-        print(f"Serving document file: {document.filename}")  # Debug logging
-        
-        try:
-            # Instead of trying to generate a PDF, let's return a simple HTML page with the content
-            # This will help us test if the document generation is working
-            content_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>{document.filename}</title>
-                <style>
-                    body {{ font-family: Arial, sans-serif; margin: 40px; }}
-                    h1 {{ color: #333; }}
-                    pre {{ background: #f5f5f5; padding: 15px; border-radius: 5px; white-space: pre-wrap; }}
-                </style>
-            </head>
-            <body>
-                <h1>Document: {document.filename}</h1>
-                <p>Generated for Case #{document.case_id}, {document.state} {document.court_type}</p>
-                <h2>Document Content:</h2>
-                <pre>{document.content}</pre>
-                <hr>
-                <p><a href="{url_for('documents.filing_toolkit')}">Return to Filing Toolkit</a></p>
-            </body>
-            </html>
-            """
-            return content_html
-        except Exception as e:
-            print(f"ERROR rendering document: {str(e)}")
-            # Fallback to basic file download if HTML rendering fails
-            return send_file(
-                pdf_bytes,
-                as_attachment=True,
-                download_name=document.filename,
-                mimetype='application/pdf'
-            )
+        logging.debug(f"Serving document preview: {document.filename}")
+        return render_template('document_preview.html', document=document,
+                               formats=sorted(document_render.MIMETYPES))
     except Exception as e:
         print(f"ERROR in download_document: {str(e)}")  # Debug logging
         import traceback
         traceback.print_exc()
         flash(f'Error downloading document: {str(e)}', 'danger')
         return redirect(url_for('documents.filing_toolkit'))
+
+@documents.route('/download/<int:document_id>/<fmt>')
+@login_required
+def download_rendered_document(document_id, fmt):
+    """Stream the document as a PDF or DOCX file, rendering it once per content version"""
+    if fmt not in document_render.MIMETYPES:
+        abort(404)
+    document = Document.get_document_by_id(document_id)
+    if not document:
+        flash('Document not found.', 'danger')
+        return redirect(url_for('documents.filing_toolkit'))
+    if not _can_download(document):
+        flash('You do not have permission to download this document.', 'danger')
+        return redirect(url_for('documents.filing_toolkit'))
+
+    title = document.doc_type.replace('_', ' ').title()
+    try:
+        path, key = document_render.get_rendered(fmt, document.content, title)
+    except Exception as e:
+        logging.error(f"Error rendering document {document_id} as {fmt}: {str(e)}")
+        flash('The document could not be rendered. Please try again.', 'danger')
+        return redirect(url_for('documents.download_document', document_id=document_id))
+
+    # send_file streams from disk and answers conditional and range requests;
+    # the render key doubles as the ETag since it hashes the content
+    response = send_file(path, mimetype=document_render.MIMETYPES[fmt], as_attachment=True,
+                         download_name=f"{os.path.splitext(document.filename)[0]}.{fmt}",
+                         conditional=True, etag=key)
+    response.cache_control.private = True
+    return response
+
+@documents.route('/case/<int:case_id>/bundle.zip')
+@login_required
+def export_case_bundle(case_id):
+    """Stream a ZIP of the case's documents, evidence, transcripts and analyses"""
+    case = Case.get_case_by_id(case_id)
+    if not case:
+        flash('Case not found.', 'danger')
+        return redirect(url_for('cases.dashboard'))
+    if case.user_id != current_user.id and not current_user.is_moderator() and not current_user.is_legal_assistant():
+        flash('You do not have permission to export this case.', 'danger')
+        return redirect(url_for('cases.dashboard'))
+
+    try:
+        bundle = case_bundle.build_bundle(case, current_app.config['UPLOAD_FOLDER'])
+    except Exception as e:
+        logging.error(f"Error building bundle for case {case_id}: {str(e)}")
+        flash('The case bundle could not be prepared. Please try again.', 'danger')
+        return redirect(url_for('cases.case_summary', case_id=case_id))
+
+    safe_title = re.sub(r'[^\w-]+', '_', case.title).strip('_') or 'case'
+    filename = f"{safe_title}_{case_id}_bundle.zip"
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{bundle.etag}"',
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    }
+    if request.if_none_match.contains(bundle.etag):
+        return Response(status=304, headers=headers)
+
+    start, stop, status = 0, bundle.size, 200
+    # Resume a single range, unless If-Range names an older version of the bundle
+    byte_range = request.range
+    if_range = request.if_range
+    if byte_range and len(byte_range.ranges) == 1 and (
+            (if_range.etag is None and if_range.date is None) or if_range.etag == bundle.etag):
+        bounds = byte_range.range_for_length(bundle.size)
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{bundle.size}'
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{bundle.size}'
+
+    def generate():
+        try:
+            yield from bundle.iter_bytes(start, stop)
+        except case_bundle.BundleChanged as e:
+            # Cutting the response short makes the client see an incomplete download
+            logging.error(f"Case {case_id} bundle changed while streaming ({e}); aborting the download")
+            raise
+
+    response = Response(stream_with_context(generate()), status=status, mimetype='application/zip',
+                        headers=headers, direct_passthrough=True)
+    response.content_length = stop - start
+    return response
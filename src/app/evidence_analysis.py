@@ -5,6 +5,9 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import login_required, current_user
 from models import Case, Evidence, LegalAnalysis, db
 import anthropic_helper
+import provider_clients
+import prompt_budget
+import rate_limits
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,8 +15,12 @@ logging.basicConfig(level=logging.INFO)
 # Create blueprint
 evidence_ai = Blueprint('evidence_ai', __name__)
 
+MODEL = "gpt-4o"  # The newest OpenAI model
+EVIDENCE_OUTPUT_TOKENS = 3000
+
 @evidence_ai.route('/case/<int:case_id>/evidence/analysis', methods=['GET', 'POST'])
 @login_required
+@rate_limits.ai_limited(methods=('POST',))
 def evidence_analysis(case_id):
     """Display and process AI-powered evidence analysis"""
     # Get case details
@@ -28,16 +35,10 @@ def evidence_analysis(case_id):
     evidence_items = case.get_evidence()
     
     # Check for existing evidence relevance analysis
-    evidence_relevance = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='evidence_relevance'
-    ).first()
+    evidence_relevance = LegalAnalysis.get_by_case_and_type(case_id, 'evidence_relevance')
     
     # Check for existing exhibit organization
-    exhibit_org = LegalAnalysis.query.filter_by(
-        case_id=case_id, 
-        analysis_type='exhibit_organization'
-    ).first()
+    exhibit_org = LegalAnalysis.get_by_case_and_type(case_id, 'exhibit_organization')
     
     # Initialize analysis data
     relevance_analysis = None
@@ -45,15 +46,13 @@ def evidence_analysis(case_id):
     
     # Load existing analyses if available
     if evidence_relevance:
-        try:
-            relevance_analysis = json.loads(evidence_relevance.content)
-        except:
+        relevance_analysis = evidence_relevance.get_data()
+        if relevance_analysis is None:
             app.logger.error("Failed to parse evidence relevance JSON")
     
     if exhibit_org:
-        try:
-            exhibit_organization = json.loads(exhibit_org.content)
-        except:
+        exhibit_organization = exhibit_org.get_data()
+        if exhibit_organization is None:
             app.logger.error("Failed to parse exhibit organization JSON")
     
     # Handle POST request - Generate new analysis
@@ -96,8 +95,7 @@ def evidence_analysis(case_id):
                 if ai_result:
                     # Save or update the analysis in the database
                     if evidence_relevance:
-                        evidence_relevance.content = json.dumps(ai_result)
-                        db.session.commit()
+                        evidence_relevance.new_version(content=json.dumps(ai_result))
                     else:
                         LegalAnalysis.create_analysis(
                             case_id=case_id,
@@ -133,8 +131,7 @@ def evidence_analysis(case_id):
                 if ai_result:
                     # Save or update the analysis in the database
                     if exhibit_org:
-                        exhibit_org.content = json.dumps(ai_result)
-                        db.session.commit()
+                        exhibit_org.new_version(content=json.dumps(ai_result))
                     else:
                         LegalAnalysis.create_analysis(
                             case_id=case_id,
@@ -186,19 +183,18 @@ def analyze_evidence_relevance(case_id, description, issue_type, court_type, evi
         
         # Fall back to OpenAI
         # Prepare the prompt for OpenAI
-        prompt = f"""You are an expert evidence suppression specialist helping individuals identify "fruit of the poisonous tree" opportunities.
+        builder = prompt_budget.PromptBuilder(model=MODEL, output_tokens=EVIDENCE_OUTPUT_TOKENS)
+        builder.add("intro", """You are an expert evidence suppression specialist helping individuals identify "fruit of the poisonous tree" opportunities.
         Your goal is to find every possible piece of evidence that could be suppressed because it stems from an initial 
-        illegal search, seizure, or other constitutional violation.
-        
-        CASE DETAILS:
-        Description: {description}
+        illegal search, seizure, or other constitutional violation.""", required=True)
+        builder.add("case", f"""        CASE DETAILS:
         Issue Type: {issue_type}
-        Court Type: {court_type}
-        
-        EVIDENCE ITEMS:
-        {json.dumps(evidence_descriptions, indent=2)}
-        
-        For each piece of evidence, determine:
+        Court Type: {court_type}""", required=True)
+        builder.add("description", f"        Description: {description}", priority=2, min_tokens=200)
+        builder.add("evidence", f"""        EVIDENCE ITEMS:
+        {json.dumps(evidence_descriptions, indent=2)}""", priority=1,
+                    compact=f"        EVIDENCE ITEMS:\n{prompt_budget.compact_json(evidence_descriptions)}")
+        builder.add("format", """        For each piece of evidence, determine:
         1. Is it a "poisonous tree" itself (direct constitutional violation)?
         2. Is it "fruit" (evidence derived from an initial violation)?
         3. Which Supreme Court cases support suppression?
@@ -206,9 +202,9 @@ def analyze_evidence_relevance(case_id, description, issue_type, court_type, evi
         5. How suppressing this evidence impacts other evidence in the case?
         
         Format your response as a JSON object structured like this:
-        {{
+        {
           "evidence_analysis": [
-            {{
+            {
               "evidence_id": 1,
               "suppressible": "High/Medium/Low chance",
               "suppression_basis": "The Fourth Amendment violation that makes this evidence illegal",
@@ -216,18 +212,17 @@ def analyze_evidence_relevance(case_id, description, issue_type, court_type, evi
               "suppression_motion_language": "Exact language to use in motion",
               "connected_evidence": [2, 3],
               "strategic_value": "How important suppressing this is to the case"
-            }},
+            },
             ...additional evidence analyses...
           ]
-        }}
+        }
         
         Provide detailed, legally sound analysis for each piece of evidence that could help strengthen the case.
-        """
+""", required=True)
+        prompt = builder.build()
         
-        # Call OpenAI API
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        MODEL = "gpt-4o"  # The newest OpenAI model
+        # Call OpenAI API using the shared, pooled client
+        client = provider_clients.get_openai_client()
         
         response = client.chat.completions.create(
             model=MODEL,
@@ -236,7 +231,8 @@ def analyze_evidence_relevance(case_id, description, issue_type, court_type, evi
                 {"role": "user", "content": prompt}
             ],
             response_format={"type": "json_object"},
-            temperature=0.2
+            temperature=0.2,
+            max_tokens=builder.max_tokens
         )
         
         # Extract and parse the response
@@ -272,17 +268,17 @@ def organize_exhibits(case_id, description, issue_type, court_type, relevance_an
         
         # Fall back to OpenAI
         # Prepare the prompt for OpenAI
-        prompt = f"""You are an expert legal strategist tasked with organizing evidence into effective exhibits for a legal case.
-        
-        CASE DETAILS:
-        Description: {description}
+        builder = prompt_budget.PromptBuilder(model=MODEL, output_tokens=EVIDENCE_OUTPUT_TOKENS)
+        builder.add("intro", "You are an expert legal strategist tasked with organizing evidence into effective exhibits for a legal case.",
+                    required=True)
+        builder.add("case", f"""        CASE DETAILS:
         Issue Type: {issue_type}
-        Court Type: {court_type}
-        
-        EVIDENCE RELEVANCE ANALYSIS:
-        {json.dumps(relevance_analysis, indent=2)}
-        
-        Based on the relevance analysis of each piece of evidence, create a strategic organization plan that:
+        Court Type: {court_type}""", required=True)
+        builder.add("description", f"        Description: {description}", priority=2, min_tokens=200)
+        builder.add("relevance", f"""        EVIDENCE RELEVANCE ANALYSIS:
+        {json.dumps(relevance_analysis, indent=2)}""", priority=1,
+                    compact=f"        EVIDENCE RELEVANCE ANALYSIS:\n{prompt_budget.compact_json(relevance_analysis)}")
+        builder.add("format", """        Based on the relevance analysis of each piece of evidence, create a strategic organization plan that:
         1. Groups related evidence into logical exhibit categories
         2. Arranges exhibits in the most compelling order for presentation
         3. Suggests effective labeling for each exhibit
@@ -290,9 +286,9 @@ def organize_exhibits(case_id, description, issue_type, court_type, relevance_an
         5. Provides guidance on how to introduce and use each exhibit for maximum impact
         
         Format your response as a JSON object structured like this:
-        {{
+        {
           "exhibit_plan": [
-            {{
+            {
               "exhibit_group": "A: Timeline Evidence",
               "strategic_purpose": "Establishes clear chronology of events leading to the dispute",
               "evidence_items": [3, 1, 5],
@@ -303,18 +299,17 @@ def organize_exhibits(case_id, description, issue_type, court_type, relevance_an
                 "Highlight the sequence of communications",
                 "Emphasize time between incidents and responses"
               ]
-            }},
+            },
             ...additional exhibit groups...
           ]
-        }}
+        }
         
         Create a comprehensive, strategic exhibit organization that would maximize persuasiveness and clarity in court.
-        """
+""", required=True)
+        prompt = builder.build()
         
-        # Call OpenAI API
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-        MODEL = "gpt-4o"  # The newest OpenAI model
+        # Call OpenAI API using the shared, pooled client
+        client = provider_clients.get_openai_client()
         
         response = client.chat.completions.create(
             model=MODEL,
@@ -323,7 +318,8 @@ def organize_exhibits(case_id, description, issue_type, court_type, relevance_an
                 {"role": "user", "content": prompt}
             ],
             response_format={"type": "json_object"},
-            temperature=0.2
+            temperature=0.2,
+            max_tokens=builder.max_tokens
         )
         
         # Extract and parse the response
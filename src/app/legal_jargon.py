@@ -4,8 +4,9 @@ import os
 import re
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from flask_login import login_required, current_user
-from openai import OpenAI
 import anthropic_helper
+import provider_clients
+import rate_limits
 
 legal_jargon = Blueprint('legal_jargon', __name__)
 
@@ -13,17 +14,9 @@ legal_jargon = Blueprint('legal_jargon', __name__)
 POPULAR_TERMS_CACHE = None
 POPULAR_TERMS_CACHE_TIME = None
 
-# Initialize OpenAI client if API key is available
-try:
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key:
-        openai_client = OpenAI(api_key=openai_api_key)
-    else:
-        openai_client = None
-        logging.warning("OPENAI_API_KEY not found in environment variables")
-except Exception as e:
-    openai_client = None
-    logging.error(f"Error initializing OpenAI client: {str(e)}")
+# OpenAI client comes from the shared registry
+if not provider_clients.get_api_key("openai"):
+    logging.warning("OPENAI_API_KEY not found in environment variables")
 
 # Import our comprehensive dictionary of legal terms
 from legal_terms_database import LEGAL_TERMS
@@ -35,6 +28,7 @@ COMMON_LEGAL_TERMS = LEGAL_TERMS
 
 @legal_jargon.route('/legal-translator', methods=['GET', 'POST'])
 @login_required
+@rate_limits.ai_limited(methods=('POST',))
 def translator():
     """Page for translating legal jargon to plain language with fun explanations"""
     result = None
@@ -56,6 +50,7 @@ def translator():
 
 @legal_jargon.route('/api/translate-term', methods=['POST'])
 @login_required
+@rate_limits.ai_limited()
 def api_translate_term():
     """AJAX endpoint for translating legal terms"""
     try:
@@ -163,7 +158,7 @@ def get_term_explanation(term):
     # Try to get explanation from OpenAI if the client is initialized
     explanation = None
     try:
-        if openai_client is not None:
+        if provider_clients.get_openai_client() is not None:
             explanation = get_openai_explanation(term)
             if explanation:
                 # Store the AI-generated explanation in the database
@@ -217,6 +212,7 @@ def get_term_explanation(term):
 def get_openai_explanation(term):
     """Get explanation from OpenAI"""
     # Check if OpenAI client is available
+    openai_client = provider_clients.get_openai_client()
     if not openai_client:
         logging.warning("OpenAI client not available when called in get_openai_explanation")
         return None
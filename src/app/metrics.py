@@ -0,0 +1,292 @@
+"""
+Request metrics in the Prometheus text format.
+
+init_app() adds request hooks that record, per endpoint:
+    http_request_duration_seconds   histogram by endpoint, method and status
+    http_requests_in_flight         gauge by endpoint
+    http_request_db_queries         histogram of SQL statements per request
+and serves them, with anything else registered here, on /metrics.
+
+Metrics live in process memory. Under gunicorn each worker has its own, so
+set METRICS_DIR to a directory shared by the workers: each process then
+writes a snapshot there every METRICS_WRITE_SECONDS and /metrics merges them.
+Counters and histograms of exited workers are kept so totals never go
+backwards; their gauges are dropped.
+
+Environment:
+    METRICS_DIR             directory for per-process snapshots (default unset: this process only)
+    METRICS_WRITE_SECONDS   seconds between snapshots (default 5)
+    METRICS_TOKEN           if set, /metrics requires "Authorization: Bearer <token>"; if
+                            unset, /metrics only answers direct requests from loopback
+"""
+import os
+import json
+import time
+import logging
+import ipaddress
+import threading
+
+from flask import request, g, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; AI endpoints routinely take tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+        with _lock:
+            _registry[name] = self
+
+    def snapshot(self):
+        with _lock:
+            return {"kind": self.kind, "help": self.help, "labels": list(self.label_names),
+                    "values": [[list(key), value] for key, value in self.values.items()]}
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with _lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def observe(self, value, *labels):
+        with _lock:
+            # [count per bucket (not cumulative)..., count above the last bucket, sum]
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def snapshot(self):
+        data = super().snapshot()
+        data["buckets"] = list(self.buckets)
+        return data
+
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint, method and status',
+                            ('endpoint', 'method', 'status'))
+IN_FLIGHT = Gauge('http_requests_in_flight', 'Requests being handled by endpoint', ('endpoint',))
+REQUEST_QUERIES = Histogram('http_request_db_queries', 'SQL statements executed per request by endpoint',
+                            ('endpoint',), buckets=QUERY_BUCKETS)
+
+
+def _render(snapshots):
+    """Render merged metric snapshots in the Prometheus text format"""
+    lines = []
+    for name in sorted(snapshots):
+        data = snapshots[name]
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['kind']}")
+        for labels, value in sorted(data["values"].items()):
+            if data["kind"] != "histogram":
+                lines.append(f"{name}{_labels(data['labels'], labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(data["buckets"] + [float('inf')], value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(data['labels'], labels, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(data['labels'], labels)} {_number(value[-1])}")
+            lines.append(f"{name}_count{_labels(data['labels'], labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _merge(target, snapshot, include_gauges=True):
+    """Add one process snapshot into merged metrics"""
+    for name, data in snapshot.items():
+        if data["kind"] == "gauge" and not include_gauges:
+            continue
+        merged = target.setdefault(name, {**data, "values": {}})
+        for labels, value in data["values"]:
+            labels = tuple(labels)
+            if data["kind"] == "histogram":
+                current = merged["values"].get(labels)
+                merged["values"][labels] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged["values"][labels] = merged["values"].get(labels, 0) + value
+
+
+def snapshot():
+    """Return this process's metrics"""
+    with _lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+_last_write = 0.0
+
+
+def write_snapshot(force=False):
+    """Write this process's snapshot to METRICS_DIR, at most every METRICS_WRITE_SECONDS"""
+    global _last_write
+    directory = os.environ.get('METRICS_DIR')
+    now = time.monotonic()
+    if not directory or (not force and now - _last_write < float(os.environ.get('METRICS_WRITE_SECONDS', 5))):
+        return
+    _last_write = now
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot(), f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.error(f"Could not write metrics snapshot: {e}")
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def render():
+    """Render all metrics, merged across processes when METRICS_DIR is set"""
+    merged = {}
+    _merge(merged, snapshot())
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        write_snapshot(force=True)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            names = []
+        for filename in names:
+            pid, ext = os.path.splitext(filename)
+            if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    _merge(merged, json.load(f), include_gauges=_alive(int(pid)))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Skipping metrics snapshot {filename}: {e}")
+    return _render(merged)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    # Statements run by background threads are not part of any request
+    if has_request_context():
+        g.metrics_queries = g.get('metrics_queries', 0) + 1
+
+
+def _endpoint():
+    # Unmatched paths share one label so 404 scans cannot blow up cardinality
+    return request.endpoint or 'unmatched'
+
+
+def _is_local_request():
+    """True for a request made from this host and not relayed by a proxy"""
+    # A proxy on the same host connects from loopback on behalf of remote clients
+    if request.headers.get('X-Forwarded-For') or request.headers.get('Forwarded'):
+        return False
+    try:
+        return ipaddress.ip_address(request.remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def init_app(app):
+    """Record request metrics for the app and serve them on /metrics"""
+    if 'metrics' in app.extensions:
+        return
+    app.extensions['metrics'] = True
+
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        IN_FLIGHT.inc(_endpoint())
+
+    @app.after_request
+    def _record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _record_request(exc=None):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        endpoint = _endpoint()
+        status = g.pop('metrics_status', 500 if exc else 200)
+        IN_FLIGHT.dec(endpoint)
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint, request.method, str(status))
+        REQUEST_QUERIES.observe(g.pop('metrics_queries', 0), endpoint)
+        write_snapshot()
+
+    def metrics_view():
+        token = os.environ.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        if not token and not _is_local_request():
+            return Response("Forbidden: set METRICS_TOKEN to scrape remotely\n", status=403, mimetype="text/plain")
+        return Response(render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
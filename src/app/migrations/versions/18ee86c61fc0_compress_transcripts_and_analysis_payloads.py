@@ -0,0 +1,165 @@
+"""Compress transcripts and LegalAnalysis payloads
+
+Revision ID: 18ee86c61fc0
+Revises: 7234b68b8056
+Create Date: 2025-06-09 15:41:08.227390
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+import compression
+
+
+# revision identifiers, used by Alembic.
+revision = '18ee86c61fc0'
+down_revision = '7234b68b8056'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+# Most recent rows per dictionary used for training
+TRAINING_ROWS = 2000
+
+# table -> [(column, nullable)]
+COMPRESSED_COLUMNS = {
+    'legal_analysis': [('content', False), ('references', True)],
+    'evidence': [('transcript', True), ('transcript_analysis', True)],
+}
+
+legal_analysis = sa.table(
+    'legal_analysis',
+    sa.column('id', sa.Integer),
+    sa.column('analysis_type', sa.String),
+    sa.column('content', sa.LargeBinary),
+    sa.column('references', sa.LargeBinary),
+)
+evidence = sa.table(
+    'evidence',
+    sa.column('id', sa.Integer),
+    sa.column('transcript', sa.LargeBinary),
+    sa.column('transcript_analysis', sa.LargeBinary),
+)
+
+
+def _alter_types(to_binary):
+    """Switch the compressed columns between TEXT and bytes, converting existing values as UTF-8"""
+    for table_name, columns in COMPRESSED_COLUMNS.items():
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for column, nullable in columns:
+                if to_binary:
+                    batch_op.alter_column(column, existing_type=sa.Text(), type_=sa.LargeBinary(),
+                                          existing_nullable=nullable,
+                                          postgresql_using=f'convert_to("{column}", \'UTF8\')')
+                else:
+                    batch_op.alter_column(column, existing_type=sa.LargeBinary(), type_=sa.Text(),
+                                          existing_nullable=nullable,
+                                          postgresql_using=f'convert_from("{column}", \'UTF8\')')
+
+
+def _train(bind, dictionary_table, name, query, dictionaries):
+    """Train a dictionary from the texts returned by query and store it"""
+    samples = []
+    for row in bind.execute(query):
+        samples.extend(compression.decompress(value, dictionaries) for value in row if value is not None)
+    data = compression.train_dictionary(samples)
+    if data is None:
+        return None
+    result = bind.execute(dictionary_table.insert().values(
+        name=name, data=data, sample_count=len(samples), created_at=datetime.utcnow()))
+    return result.inserted_primary_key[0], data
+
+
+def _rewrite(bind, table, columns, dictionary_for_row, dictionaries):
+    """Rewrite every row's compressed columns in id order, BATCH_SIZE rows at a time"""
+    extra = [table.c.analysis_type] if 'analysis_type' in table.c else []
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(table.c.id, *extra, *[table.c[column] for column in columns])
+            .where(table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            values = {}
+            for column in columns:
+                value = getattr(row, column)
+                if value is None:
+                    continue
+                text = compression.decompress(value, dictionaries)
+                dictionary = dictionary_for_row(row, column)
+                values[column] = compression.compress(text, dictionary) if dictionary is not False \
+                    else text.encode('utf-8')
+            if values:
+                bind.execute(table.update().where(table.c.id == row.id).values(**values))
+        last_id = rows[-1].id
+
+
+def upgrade():
+    dictionary_table = op.create_table(
+        'compression_dictionary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('sample_count', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('compression_dictionary', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_compression_dictionary_name'), ['name'], unique=False)
+
+    _alter_types(to_binary=True)
+
+    bind = op.get_bind()
+    # Existing values are still plain UTF-8, so no dictionaries are needed to read them
+    dictionaries = {}
+    by_name = {}
+
+    # One dictionary per analysis type, trained on both payload columns
+    analysis_types = [row[0] for row in bind.execute(sa.select(legal_analysis.c.analysis_type).distinct())]
+    for analysis_type in analysis_types:
+        name = compression.analysis_dictionary_name(analysis_type)
+        trained = _train(bind, dictionary_table, name,
+                         sa.select(legal_analysis.c.content, legal_analysis.c.references)
+                         .where(legal_analysis.c.analysis_type == analysis_type)
+                         .order_by(legal_analysis.c.id.desc()).limit(TRAINING_ROWS),
+                         dictionaries)
+        if trained:
+            by_name[name] = trained
+    for column in ('transcript', 'transcript_analysis'):
+        name = f"evidence.{column}"
+        trained = _train(bind, dictionary_table, name,
+                         sa.select(evidence.c[column]).where(evidence.c[column].isnot(None))
+                         .order_by(evidence.c.id.desc()).limit(TRAINING_ROWS),
+                         dictionaries)
+        if trained:
+            by_name[name] = trained
+
+    _rewrite(bind, legal_analysis, ['content', 'references'],
+             lambda row, column: by_name.get(compression.analysis_dictionary_name(row.analysis_type)),
+             dictionaries)
+    _rewrite(bind, evidence, ['transcript', 'transcript_analysis'],
+             lambda row, column: by_name.get(f"evidence.{column}"),
+             dictionaries)
+
+
+def downgrade():
+    bind = op.get_bind()
+    dictionary_table = sa.table('compression_dictionary', sa.column('id', sa.Integer), sa.column('data', sa.LargeBinary))
+    dictionaries = {row.id: bytes(row.data) for row in bind.execute(sa.select(dictionary_table.c.id, dictionary_table.c.data))}
+
+    # Store every value as plain UTF-8 again before switching back to TEXT
+    _rewrite(bind, legal_analysis, ['content', 'references'], lambda row, column: False, dictionaries)
+    _rewrite(bind, evidence, ['transcript', 'transcript_analysis'], lambda row, column: False, dictionaries)
+
+    _alter_types(to_binary=False)
+
+    with op.batch_alter_table('compression_dictionary', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_compression_dictionary_name'))
+    op.drop_table('compression_dictionary')
@@ -0,0 +1,28 @@
+"""Add first-party click ids to ad clicks for conversion attribution
+
+Revision ID: 4c8e2f61d0b9
+Revises: b71d5e0c94a2
+Create Date: 2025-06-26 10:37:45.082614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e2f61d0b9'
+down_revision = 'b71d5e0c94a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ad_click', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('click_id', sa.String(length=32), nullable=True))
+        batch_op.create_index(batch_op.f('ix_ad_click_click_id'), ['click_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('ad_click', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ad_click_click_id'))
+        batch_op.drop_column('click_id')
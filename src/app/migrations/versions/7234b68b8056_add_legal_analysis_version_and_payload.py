@@ -0,0 +1,79 @@
+"""Add version and JSON payload columns to LegalAnalysis
+
+Revision ID: 7234b68b8056
+Revises: 6aaf07275b8f
+Create Date: 2025-06-02 10:14:37.512904
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7234b68b8056'
+down_revision = '6aaf07275b8f'
+branch_labels = None
+depends_on = None
+
+# Must match LegalAnalysis.PAYLOAD_FIELDS
+PAYLOAD_FIELDS = {
+    'case_law': 'references',
+    'document_recommendations': 'references',
+    'timeline_events': 'references',
+}
+
+BATCH_SIZE = 500
+
+
+def upgrade():
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+        batch_op.add_column(sa.Column('payload', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'),
+                                      nullable=True))
+
+    # Backfill payload from the existing text columns in batches. Rows whose
+    # payload is not valid JSON are left NULL and read from the text column.
+    bind = op.get_bind()
+    legal_analysis = sa.table(
+        'legal_analysis',
+        sa.column('id', sa.Integer),
+        sa.column('analysis_type', sa.String),
+        sa.column('content', sa.Text),
+        sa.column('references', sa.Text),
+        sa.column('payload', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')),
+    )
+
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(legal_analysis.c.id, legal_analysis.c.analysis_type,
+                      legal_analysis.c.content, legal_analysis.c.references)
+            .where(legal_analysis.c.id > last_id)
+            .order_by(legal_analysis.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        for row in rows:
+            raw = row.references if PAYLOAD_FIELDS.get(row.analysis_type) == 'references' else row.content
+            try:
+                payload = json.loads(raw) if raw else None
+            except ValueError:
+                payload = None
+            if payload is not None:
+                bind.execute(
+                    legal_analysis.update()
+                    .where(legal_analysis.c.id == row.id)
+                    .values(payload=payload)
+                )
+        last_id = rows[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.drop_column('payload')
+        batch_op.drop_column('version')
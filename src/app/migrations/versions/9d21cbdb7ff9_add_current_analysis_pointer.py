@@ -0,0 +1,71 @@
+"""Add current analysis pointer and compaction tracking to LegalAnalysis
+
+Revision ID: 9d21cbdb7ff9
+Revises: 18ee86c61fc0
+Create Date: 2025-06-12 11:27:45.604118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d21cbdb7ff9'
+down_revision = '18ee86c61fc0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'current_analysis',
+        sa.Column('case_id', sa.Integer(), nullable=False),
+        sa.Column('analysis_type', sa.String(length=50), nullable=False),
+        sa.Column('analysis_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['case_id'], ['case.id'], ),
+        sa.ForeignKeyConstraint(['analysis_id'], ['legal_analysis.id'], ),
+        sa.PrimaryKeyConstraint('case_id', 'analysis_type')
+    )
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('compacted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_legal_analysis_case_type_generated',
+                              ['case_id', 'analysis_type', 'generated_at'], unique=False)
+
+    # Point each (case, type) at its latest version, as get_by_case_and_type used to pick it
+    legal_analysis = sa.table(
+        'legal_analysis',
+        sa.column('id', sa.Integer),
+        sa.column('case_id', sa.Integer),
+        sa.column('analysis_type', sa.String),
+        sa.column('generated_at', sa.DateTime),
+    )
+    current_analysis = sa.table(
+        'current_analysis',
+        sa.column('case_id', sa.Integer),
+        sa.column('analysis_type', sa.String),
+        sa.column('analysis_id', sa.Integer),
+        sa.column('updated_at', sa.DateTime),
+    )
+    latest = legal_analysis.alias('latest')
+    keys = sa.select(legal_analysis.c.case_id, legal_analysis.c.analysis_type).distinct().subquery()
+    latest_id = (
+        sa.select(latest.c.id)
+        .where(latest.c.case_id == keys.c.case_id)
+        .where(latest.c.analysis_type == keys.c.analysis_type)
+        .order_by(latest.c.generated_at.desc(), latest.c.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    op.execute(current_analysis.insert().from_select(
+        ['case_id', 'analysis_type', 'analysis_id', 'updated_at'],
+        sa.select(keys.c.case_id, keys.c.analysis_type, latest_id, sa.func.now())
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.drop_index('ix_legal_analysis_case_type_generated')
+        batch_op.drop_column('compacted_at')
+
+    op.drop_table('current_analysis')
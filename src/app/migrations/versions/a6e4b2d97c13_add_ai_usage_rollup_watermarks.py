@@ -0,0 +1,45 @@
+"""Add the AI usage rollup watermarks so late events are still counted
+
+Revision ID: a6e4b2d97c13
+Revises: d5a0c3e8b214
+Create Date: 2025-06-28 09:41:52.183027
+
+"""
+from datetime import timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e4b2d97c13'
+down_revision = 'd5a0c3e8b214'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    states = op.create_table(
+        'ai_usage_rollup_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_event_id', sa.Integer(), nullable=False),
+        sa.Column('rolled_through', sa.DateTime(), nullable=True),
+        sa.Column('pending_event_id', sa.Integer(), nullable=True),
+        sa.Column('pending_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Existing rollups counted every event of the hours up to the latest one
+    bind = op.get_bind()
+    rollups = sa.table('ai_usage_rollup', sa.column('hour', sa.DateTime))
+    events = sa.table('ai_usage_event', sa.column('id', sa.Integer), sa.column('hour', sa.DateTime))
+    last_hour = bind.execute(sa.select(sa.func.max(rollups.c.hour))).scalar()
+    if last_hour is not None:
+        through = last_hour + timedelta(hours=1)
+        last_event_id = bind.execute(sa.select(sa.func.max(events.c.id)).where(events.c.hour < through)).scalar()
+        op.bulk_insert(states, [{'id': 1, 'last_event_id': last_event_id or 0, 'rolled_through': through}])
+
+
+def downgrade():
+    op.drop_table('ai_usage_rollup_state')
@@ -0,0 +1,58 @@
+"""Add hourly ad click rollups and their watermarks
+
+Revision ID: b71d5e0c94a2
+Revises: e8a42d19c7f5
+Create Date: 2025-06-24 14:12:08.517390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d5e0c94a2'
+down_revision = 'e8a42d19c7f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ad_click_rollup',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('campaign_id', sa.String(length=50), nullable=False),
+        sa.Column('source', sa.String(length=50), nullable=False),
+        sa.Column('medium', sa.String(length=50), nullable=False),
+        sa.Column('clicks', sa.Integer(), nullable=False),
+        sa.Column('conversions', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ad_click_rollup', schema=None) as batch_op:
+        batch_op.create_index('ix_ad_click_rollup_hour_campaign', ['hour', 'campaign_id', 'source', 'medium'],
+                              unique=True)
+
+    op.create_table(
+        'ad_click_rollup_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_click_id', sa.Integer(), nullable=False),
+        sa.Column('pending_click_id', sa.Integer(), nullable=True),
+        sa.Column('pending_at', sa.DateTime(), nullable=True),
+        sa.Column('conversions_through', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('ad_click', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ad_click_conversion_timestamp'), ['conversion_timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ad_click', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ad_click_conversion_timestamp'))
+
+    op.drop_table('ad_click_rollup_state')
+
+    with op.batch_alter_table('ad_click_rollup', schema=None) as batch_op:
+        batch_op.drop_index('ix_ad_click_rollup_hour_campaign')
+    op.drop_table('ad_click_rollup')
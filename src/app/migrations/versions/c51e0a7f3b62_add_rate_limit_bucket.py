@@ -0,0 +1,30 @@
+"""Add rate limit buckets for AI requests
+
+Revision ID: c51e0a7f3b62
+Revises: 9d21cbdb7ff9
+Create Date: 2025-06-16 10:12:33.481907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c51e0a7f3b62'
+down_revision = '9d21cbdb7ff9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rate_limit_bucket',
+        sa.Column('key', sa.String(length=100), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('refilled_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limit_bucket')
@@ -0,0 +1,89 @@
+"""Drop the JSON payload copy of LegalAnalysis rows stored compressed
+
+Revision ID: d5a0c3e8b214
+Revises: 4c8e2f61d0b9
+Create Date: 2025-06-27 11:05:19.640158
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import compression
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a0c3e8b214'
+down_revision = '4c8e2f61d0b9'
+branch_labels = None
+depends_on = None
+
+# Must match LegalAnalysis.PAYLOAD_FIELDS
+PAYLOAD_FIELDS = {
+    'case_law': 'references',
+    'document_recommendations': 'references',
+    'timeline_events': 'references',
+}
+
+BATCH_SIZE = 500
+
+legal_analysis = sa.table(
+    'legal_analysis',
+    sa.column('id', sa.Integer),
+    sa.column('analysis_type', sa.String),
+    sa.column('content', sa.LargeBinary),
+    sa.column('references', sa.LargeBinary),
+    sa.column('payload', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')),
+    sa.column('compacted_at', sa.DateTime),
+)
+
+
+def _field(row):
+    return 'references' if PAYLOAD_FIELDS.get(row.analysis_type) == 'references' else 'content'
+
+
+def _batches(bind, columns, condition):
+    """Yield rows matching condition in id order, BATCH_SIZE rows at a time"""
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(legal_analysis.c.id, legal_analysis.c.analysis_type, *columns)
+            .where(legal_analysis.c.id > last_id).where(condition)
+            .order_by(legal_analysis.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1].id
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Only the header bytes are needed to tell compressed values apart
+    heads = [sa.func.substr(legal_analysis.c[name], 1, compression.HEADER.size).label(name)
+             for name in ('content', 'references')]
+    for rows in _batches(bind, heads, legal_analysis.c.payload.isnot(None)):
+        ids = [row.id for row in rows if compression.is_compressed(getattr(row, _field(row)))]
+        if ids:
+            bind.execute(legal_analysis.update().where(legal_analysis.c.id.in_(ids)).values(payload=sa.null()))
+
+
+def downgrade():
+    bind = op.get_bind()
+    dictionary_table = sa.table('compression_dictionary', sa.column('id', sa.Integer), sa.column('data', sa.LargeBinary))
+    dictionaries = {row.id: bytes(row.data) for row in bind.execute(sa.select(dictionary_table.c.id, dictionary_table.c.data))}
+
+    # Compacted versions never had a payload copy kept
+    condition = sa.and_(legal_analysis.c.payload.is_(None), legal_analysis.c.compacted_at.is_(None))
+    for rows in _batches(bind, [legal_analysis.c.content, legal_analysis.c.references], condition):
+        for row in rows:
+            raw = compression.decompress(getattr(row, _field(row)), dictionaries)
+            try:
+                payload = json.loads(raw) if raw else None
+            except ValueError:
+                payload = None
+            if payload is not None:
+                bind.execute(legal_analysis.update().where(legal_analysis.c.id == row.id).values(payload=payload))
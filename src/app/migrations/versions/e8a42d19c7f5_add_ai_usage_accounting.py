@@ -0,0 +1,75 @@
+"""Add AI provider usage events and hourly rollups
+
+Revision ID: e8a42d19c7f5
+Revises: c51e0a7f3b62
+Create Date: 2025-06-18 09:41:52.305716
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8a42d19c7f5'
+down_revision = 'c51e0a7f3b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ai_usage_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('feature', sa.String(length=100), nullable=False),
+        sa.Column('provider', sa.String(length=20), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('case_id', sa.Integer(), nullable=True),
+        sa.Column('input_tokens', sa.Integer(), nullable=True),
+        sa.Column('output_tokens', sa.Integer(), nullable=True),
+        sa.Column('cache_read_tokens', sa.Integer(), nullable=True),
+        sa.Column('cache_write_tokens', sa.Integer(), nullable=True),
+        sa.Column('latency_ms', sa.Integer(), nullable=False),
+        sa.Column('outcome', sa.String(length=20), nullable=False),
+        sa.Column('error', sa.String(length=100), nullable=True),
+        sa.Column('fallback_path', sa.String(length=100), nullable=True),
+        sa.Column('cost_usd', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ai_usage_event', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ai_usage_event_hour'), ['hour'], unique=False)
+
+    op.create_table(
+        'ai_usage_rollup',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('hour', sa.DateTime(), nullable=False),
+        sa.Column('feature', sa.String(length=100), nullable=False),
+        sa.Column('provider', sa.String(length=20), nullable=False),
+        sa.Column('model', sa.String(length=100), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('case_id', sa.Integer(), nullable=True),
+        sa.Column('requests', sa.Integer(), nullable=True),
+        sa.Column('errors', sa.Integer(), nullable=True),
+        sa.Column('fallbacks', sa.Integer(), nullable=True),
+        sa.Column('input_tokens', sa.Integer(), nullable=True),
+        sa.Column('output_tokens', sa.Integer(), nullable=True),
+        sa.Column('cache_read_tokens', sa.Integer(), nullable=True),
+        sa.Column('cache_write_tokens', sa.Integer(), nullable=True),
+        sa.Column('latency_ms', sa.Integer(), nullable=True),
+        sa.Column('cost_usd', sa.Float(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('ai_usage_rollup', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ai_usage_rollup_hour'), ['hour'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('ai_usage_rollup', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ai_usage_rollup_hour'))
+    op.drop_table('ai_usage_rollup')
+
+    with op.batch_alter_table('ai_usage_event', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_ai_usage_event_hour'))
+    op.drop_table('ai_usage_event')
@@ -0,0 +1,74 @@
+"""Drop the LegalAnalysis JSON payload copy; project() reads the parse cache
+
+Revision ID: f2b7c4e19a63
+Revises: a6e4b2d97c13
+Create Date: 2025-06-29 10:12:44.508316
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import compression
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7c4e19a63'
+down_revision = 'a6e4b2d97c13'
+branch_labels = None
+depends_on = None
+
+# Must match LegalAnalysis.PAYLOAD_FIELDS
+PAYLOAD_FIELDS = {
+    'case_law': 'references',
+    'document_recommendations': 'references',
+    'timeline_events': 'references',
+}
+
+BATCH_SIZE = 500
+
+
+def upgrade():
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.drop_column('payload')
+
+
+def downgrade():
+    json_type = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+    with op.batch_alter_table('legal_analysis', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payload', json_type, nullable=True))
+
+    # Restore the copy where it was kept: payloads stored uncompressed
+    bind = op.get_bind()
+    legal_analysis = sa.table(
+        'legal_analysis',
+        sa.column('id', sa.Integer),
+        sa.column('analysis_type', sa.String),
+        sa.column('content', sa.LargeBinary),
+        sa.column('references', sa.LargeBinary),
+        sa.column('payload', json_type),
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(legal_analysis.c.id, legal_analysis.c.analysis_type,
+                      legal_analysis.c.content, legal_analysis.c.references)
+            .where(legal_analysis.c.id > last_id)
+            .order_by(legal_analysis.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            field = 'references' if PAYLOAD_FIELDS.get(row.analysis_type) == 'references' else 'content'
+            raw = getattr(row, field)
+            if not raw or compression.is_compressed(raw):
+                continue
+            try:
+                payload = json.loads(bytes(raw).decode('utf-8'))
+            except ValueError:
+                continue
+            bind.execute(legal_analysis.update().where(legal_analysis.c.id == row.id).values(payload=payload))
+        last_id = rows[-1].id
@@ -1,8 +1,19 @@
+import os
 import json
+import copy
+import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import deferred, undefer_group
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+import structured_output
+import compression
+from compression import CompressedText
 
 # User roles
 ROLE_USER = 'user'        # General users (litigants)
@@ -232,9 +243,11 @@ class Case(db.Model):
     description = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    ai_analysis = db.Column(db.Text, nullable=True)  # AI-generated case analysis
-    legal_strategy = db.Column(db.Text, nullable=True)  # AI-generated legal strategy
-    precedent_cases = db.Column(db.Text, nullable=True)  # Related case law
+    # Large AI outputs are deferred so list and summary views don't load them;
+    # use get_case_with_analysis() when they are needed
+    ai_analysis = deferred(db.Column(db.Text, nullable=True), group='ai_output')  # AI-generated case analysis
+    legal_strategy = deferred(db.Column(db.Text, nullable=True), group='ai_output')  # AI-generated legal strategy
+    precedent_cases = deferred(db.Column(db.Text, nullable=True), group='ai_output')  # Related case law
     success_probability = db.Column(db.Float, nullable=True)  # AI-calculated probability of success
     
     # Relationships
@@ -260,6 +273,11 @@ class Case(db.Model):
     def get_case_by_id(cls, case_id):
         return cls.query.get(case_id)
     
+    @classmethod
+    def get_case_with_analysis(cls, case_id):
+        """Load a case together with its deferred AI output columns"""
+        return cls.query.options(undefer_group('ai_output')).filter_by(id=case_id).first()
+    
     @classmethod
     def get_cases_by_user(cls, user_id):
         return cls.query.filter_by(user_id=user_id).all()
@@ -283,9 +301,12 @@ class Evidence(db.Model):
     link_url = db.Column(db.String(512))  # URL for social media or external links
     platform = db.Column(db.String(50))  # Social media platform (YouTube, Facebook, etc.)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
-    transcript = db.Column(db.Text)  # For audio file transcripts
+    # Transcripts can be hundreds of KB, so they are deferred; use
+    # get_evidence_with_transcript() when they are needed
+    transcript = deferred(db.Column(CompressedText('evidence.transcript')), group='transcript')  # For audio file transcripts
     transcript_status = db.Column(db.String(50))  # 'pending', 'completed', 'failed'
-    transcript_analysis = db.Column(db.Text)  # JSON analysis of audio transcripts
+    transcript_analysis = deferred(db.Column(CompressedText('evidence.transcript_analysis')),
+                                   group='transcript')  # JSON analysis of audio transcripts
     analysis_status = db.Column(db.String(50))  # 'pending', 'completed', 'failed'
     processed_at = db.Column(db.DateTime)  # When transcript was processed
     
@@ -372,6 +393,11 @@ class Evidence(db.Model):
     def get_evidence_by_id(cls, evidence_id):
         return cls.query.get(evidence_id)
     
+    @classmethod
+    def get_evidence_with_transcript(cls, evidence_id):
+        """Load an evidence item together with its deferred transcript columns"""
+        return cls.query.options(undefer_group('transcript')).filter_by(id=evidence_id).first()
+    
     @classmethod
     def get_evidence_by_case(cls, case_id):
         case = Case.query.get(case_id)
@@ -379,13 +405,43 @@ class Evidence(db.Model):
             return case.evidence_items
         return []
 
+# Parsed LegalAnalysis payloads shared across requests, keyed by (id, version, field)
+ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 256))
+_parsed_cache = OrderedDict()
+_parsed_cache_lock = threading.Lock()
+
 class LegalAnalysis(db.Model):
-    """AI-powered legal analysis that replaces attorney expertise."""
+    """
+    AI-powered legal analysis that replaces attorney expertise.
+    
+    Rows are append-only versions: saving an analysis adds a new row and moves
+    the CurrentAnalysis pointer for its (case, type) to it. Old versions are
+    pruned and compacted by analysis_compactor.
+    """
+    __table_args__ = (
+        db.Index('ix_legal_analysis_case_type_generated', 'case_id', 'analysis_type', 'generated_at'),
+    )
+    
+    # Which text column holds the JSON payload for each analysis type
+    PAYLOAD_FIELDS = {
+        'case_law': 'references',
+        'document_recommendations': 'references',
+        'timeline_events': 'references',
+        'interview_results': 'content',
+        'interview_analysis': 'content',
+        'court_script': 'content',
+        'evidence_relevance': 'content',
+        'exhibit_organization': 'content'
+    }
+    
     id = db.Column(db.Integer, primary_key=True)
     case_id = db.Column(db.Integer, db.ForeignKey('case.id'), nullable=False)
     analysis_type = db.Column(db.String(50), nullable=False)  # Type: 'case_law', 'strategy', 'risk', etc.
-    content = db.Column(db.Text, nullable=False)  # Analysis content
-    references = db.Column(db.Text, nullable=True)  # Citations and references
+    # Payload columns are deferred: get_data() serves them from the parse cache
+    # without loading them, and get_by_case_and_type(..., with_payload=True) loads them eagerly
+    # Stored compressed with a dictionary per analysis type (tagged in _sync_analysis_version)
+    content = deferred(db.Column(CompressedText(), nullable=False), group='payload')  # Analysis content
+    references = deferred(db.Column(CompressedText(), nullable=True), group='payload')  # Citations and references
     generated_at = db.Column(db.DateTime, default=datetime.utcnow)
     confidence_score = db.Column(db.Float, nullable=True)  # AI confidence level
     
@@ -394,6 +450,11 @@ class LegalAnalysis(db.Model):
     probability_factors = db.Column(db.Text, nullable=True)  # Factors influencing probability as JSON
     probability_suggestions = db.Column(db.Text, nullable=True)  # Improvement suggestions as JSON
     
+    # Bumped whenever content or references change; part of the parse cache key
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # Set once an old version has been compacted by analysis_compactor
+    compacted_at = db.Column(db.DateTime, nullable=True)
+    
     # Relationship back to the case
     case = db.relationship('Case', backref=db.backref('analysis', lazy='dynamic'))
     
@@ -499,16 +560,221 @@ class LegalAnalysis(db.Model):
             probability_suggestions=probability_suggestions
         )
         db.session.add(new_analysis)
+        db.session.flush()
+        CurrentAnalysis.point_to(new_analysis)
         db.session.commit()
         return new_analysis
     
+    def new_version(self, **changes):
+        """Save a new version of this analysis with the given fields changed and make it current"""
+        fields = {
+            'content': self.content,
+            'references': self.references,
+            'confidence_score': self.confidence_score,
+            'success_probability': self.success_probability,
+            'probability_factors': self.probability_factors,
+            'probability_suggestions': self.probability_suggestions
+        }
+        fields.update(changes)
+        return LegalAnalysis.create_analysis(self.case_id, self.analysis_type, **fields)
+    
+    @classmethod
+    def get_by_case_and_type(cls, case_id, analysis_type, with_payload=False):
+        """Return the current version of an analysis via its CurrentAnalysis pointer"""
+        query = cls.query.join(CurrentAnalysis, CurrentAnalysis.analysis_id == cls.id).filter(
+            CurrentAnalysis.case_id == case_id,
+            CurrentAnalysis.analysis_type == analysis_type
+        )
+        if with_payload:
+            query = query.options(undefer_group('payload'))
+        return query.first()
+    
     @classmethod
-    def get_by_case_and_type(cls, case_id, analysis_type):
-        return cls.query.filter_by(case_id=case_id, analysis_type=analysis_type).order_by(cls.generated_at.desc()).first()
+    def get_history(cls, case_id, analysis_type):
+        """Return all retained versions of an analysis, newest first"""
+        return cls.query.filter_by(case_id=case_id, analysis_type=analysis_type).order_by(
+            cls.generated_at.desc(), cls.id.desc()).all()
     
     @classmethod
     def get_all_by_case(cls, case_id):
         return db.session.query(cls).filter_by(case_id=case_id).order_by(cls.analysis_type, cls.generated_at.desc()).all()
+    
+    def payload_field(self):
+        """Name of the column holding this analysis type's JSON payload"""
+        return self.PAYLOAD_FIELDS.get(self.analysis_type, 'content')
+    
+    def get_data(self, field=None, default=None, copy_result=False):
+        """
+        Return the parsed JSON in content or references (the type's payload field by
+        default), validated against the analysis type's schema.
+        
+        Parsed objects are cached per row version and shared across requests, so
+        treat the result as read-only or pass copy_result=True before mutating it.
+        Returns default if the column is empty or not valid JSON.
+        """
+        field = field or self.payload_field()
+        
+        # Check the cache first so a hit never loads the deferred column
+        key = (self.id, self.version, field) if self.id is not None else None
+        data = None
+        if key is not None:
+            with _parsed_cache_lock:
+                data = _parsed_cache.get(key)
+                if data is not None:
+                    _parsed_cache.move_to_end(key)
+        
+        if data is None:
+            raw = getattr(self, field)
+            if not raw:
+                return default
+            try:
+                data = json.loads(raw)
+            except (TypeError, ValueError):
+                logging.warning(f"LegalAnalysis {self.id} has invalid JSON in {field}")
+                return default
+            if isinstance(data, dict) and field == self.payload_field():
+                structured_output.apply_schema(data, self.analysis_type)
+            if key is not None:
+                with _parsed_cache_lock:
+                    _parsed_cache[key] = data
+                    while len(_parsed_cache) > ANALYSIS_CACHE_SIZE:
+                        _parsed_cache.popitem(last=False)
+        
+        return copy.deepcopy(data) if copy_result else data
+    
+    @classmethod
+    def project(cls, case_id, analysis_type, *path):
+        """
+        Fetch a sub-field of the latest analysis payload, e.g.
+        project(case_id, 'case_law', 'winning_strategy', 'primary_approach'),
+        by walking its cached parse. Returns None if any key along the path is missing.
+        """
+        analysis = cls.get_by_case_and_type(case_id, analysis_type)
+        value = analysis.get_data() if analysis else None
+        for key in path:
+            if isinstance(value, dict):
+                value = value.get(key)
+            elif isinstance(value, list) and isinstance(key, int) and -len(value) <= key < len(value):
+                value = value[key]
+            else:
+                return None
+        return value
+
+
+@event.listens_for(LegalAnalysis, 'before_insert')
+@event.listens_for(LegalAnalysis, 'before_update')
+def _sync_analysis_version(mapper, connection, target):
+    """
+    Bump the version when content or references change, and tag changed text
+    with the analysis type's compression dictionary
+    """
+    state = db.inspect(target)
+    changed_fields = [field for field in ('content', 'references')
+                      if getattr(state.attrs, field).history.has_changes()]
+    if state.persistent:
+        if not changed_fields:
+            return
+        target.version = (target.version or 1) + 1
+    
+    dictionary = compression.analysis_dictionary_name(target.analysis_type)
+    for field in changed_fields:
+        value = getattr(target, field)
+        if isinstance(value, str):
+            setattr(target, field, compression.tag(value, dictionary))
+
+
+class CurrentAnalysis(db.Model):
+    """Pointer to the current LegalAnalysis version for each case and analysis type."""
+    __tablename__ = 'current_analysis'
+    case_id = db.Column(db.Integer, db.ForeignKey('case.id'), primary_key=True)
+    analysis_type = db.Column(db.String(50), primary_key=True)
+    analysis_id = db.Column(db.Integer, db.ForeignKey('legal_analysis.id'), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @classmethod
+    def point_to(cls, analysis):
+        """Make analysis the current version for its case and type (caller commits)"""
+        key = (analysis.case_id, analysis.analysis_type)
+        pointer = db.session.get(cls, key)
+        if pointer is None:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(cls(case_id=key[0], analysis_type=key[1], analysis_id=analysis.id))
+                return
+            except IntegrityError:
+                # Another request created the pointer first; update it instead
+                pointer = db.session.get(cls, key)
+        pointer.analysis_id = analysis.id
+
+
+class CompressionDictionary(db.Model):
+    """Trained zstd dictionary used by CompressedText columns (see compression.py)."""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, index=True)  # E.g. 'analysis.case_law', 'evidence.transcript'
+    data = db.Column(db.LargeBinary, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=True)  # Rows the dictionary was trained on
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RateLimitBucket(db.Model):
+    """Token bucket shared by all workers for rate limiting AI requests (see rate_limits.py)."""
+    key = db.Column(db.String(100), primary_key=True)  # E.g. 'user:42', 'tier:free'
+    tokens = db.Column(db.Float, nullable=False)
+    refilled_at = db.Column(db.Float, nullable=False)  # Unix time the tokens were last brought up to date
+
+
+class AIUsageEvent(db.Model):
+    """One AI provider call, appended by ai_usage's buffered writer. Rows are never updated."""
+    __tablename__ = 'ai_usage_event'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    hour = db.Column(db.DateTime, nullable=False, index=True)  # created_at truncated to the hour, for rollups
+    feature = db.Column(db.String(100), nullable=False)  # E.g. 'court_script.generate_script', 'prefetch.case_law'
+    provider = db.Column(db.String(20), nullable=False)  # 'openai' or 'anthropic'
+    model = db.Column(db.String(100), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    case_id = db.Column(db.Integer, nullable=True)
+    input_tokens = db.Column(db.Integer, default=0)  # Uncached input
+    output_tokens = db.Column(db.Integer, default=0)
+    cache_read_tokens = db.Column(db.Integer, default=0)
+    cache_write_tokens = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Integer, nullable=False)
+    outcome = db.Column(db.String(20), nullable=False)  # ok, truncated, error
+    error = db.Column(db.String(100), nullable=True)  # Exception class name for errors
+    fallback_path = db.Column(db.String(100), nullable=True)  # Providers tried so far, e.g. 'openai>anthropic'
+    cost_usd = db.Column(db.Float, default=0.0)  # Estimated from ai_usage.PRICES
+
+
+class AIUsageRollup(db.Model):
+    """Hourly totals of AIUsageEvent by feature, user, case and model."""
+    __tablename__ = 'ai_usage_rollup'
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False, index=True)
+    feature = db.Column(db.String(100), nullable=False)
+    provider = db.Column(db.String(20), nullable=False)
+    model = db.Column(db.String(100), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    case_id = db.Column(db.Integer, nullable=True)
+    requests = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+    fallbacks = db.Column(db.Integer, default=0)  # Calls made after another provider was tried
+    input_tokens = db.Column(db.Integer, default=0)
+    output_tokens = db.Column(db.Integer, default=0)
+    cache_read_tokens = db.Column(db.Integer, default=0)
+    cache_write_tokens = db.Column(db.Integer, default=0)
+    latency_ms = db.Column(db.Integer, default=0)  # Total; divide by requests for the average
+    cost_usd = db.Column(db.Float, default=0.0)
+
+
+class AIUsageRollupState(db.Model):
+    """Watermarks of the AI usage rollup: which events it has counted."""
+    __tablename__ = 'ai_usage_rollup_state'
+    id = db.Column(db.Integer, primary_key=True)  # Always 1
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)  # Events up to this id and
+    rolled_through = db.Column(db.DateTime, nullable=True)  # before this hour are counted
+    pending_event_id = db.Column(db.Integer, nullable=True)  # Highest id seen at pending_at, counted once settled
+    pending_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
 
 
 class Document(db.Model):
@@ -649,6 +915,7 @@ class AdCampaign(db.Model):
 class AdClick(db.Model):
     """Model for tracking ad clicks and conversions"""
     id = db.Column(db.Integer, primary_key=True)
+    click_id = db.Column(db.String(32), unique=True, index=True, nullable=True)  # First-party id kept in the session (see attribution.py)
     campaign_id = db.Column(db.String(50), nullable=False)
     source = db.Column(db.String(50), nullable=True)  # utm_source
     medium = db.Column(db.String(50), nullable=True)  # utm_medium
@@ -658,7 +925,33 @@ class AdClick(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     converted = db.Column(db.Boolean, default=False)
     conversion_type = db.Column(db.String(50), nullable=True)  # registration, premium, etc.
-    conversion_timestamp = db.Column(db.DateTime, nullable=True)
+    conversion_timestamp = db.Column(db.DateTime, nullable=True, index=True)  # Rollups pick up conversions by this
     
     def __repr__(self):
         return f'<AdClick {self.id} - {self.campaign_id}>'
+
+
+class AdClickRollup(db.Model):
+    """Hourly clicks and conversions by campaign, source and medium, maintained by campaign_rollup."""
+    __tablename__ = 'ad_click_rollup'
+    __table_args__ = (
+        db.Index('ix_ad_click_rollup_hour_campaign', 'hour', 'campaign_id', 'source', 'medium', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)  # Hour of the click; conversions count toward their click's hour
+    campaign_id = db.Column(db.String(50), nullable=False)
+    source = db.Column(db.String(50), nullable=False)  # '' when the click had none
+    medium = db.Column(db.String(50), nullable=False)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    conversions = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AdClickRollupState(db.Model):
+    """Watermarks of the ad click rollup: how far into ad_click it has counted."""
+    __tablename__ = 'ad_click_rollup_state'
+    id = db.Column(db.Integer, primary_key=True)  # Always 1
+    last_click_id = db.Column(db.Integer, nullable=False, default=0)  # Clicks with ids up to this are counted
+    pending_click_id = db.Column(db.Integer, nullable=True)  # Highest id seen at pending_at, counted once settled
+    pending_at = db.Column(db.DateTime, nullable=True)
+    conversions_through = db.Column(db.DateTime, nullable=True)  # Conversions up to this time are counted
+    updated_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,283 @@
+"""
+Speculative pre-generation of analyses for new cases.
+
+When enabled, creating a case queues the analyses users usually open next
+(case law, document recommendations and a court script generated without an
+interview) so they are ready by the time the user clicks through, instead of
+running a long model call inline.
+
+Prefetching only uses spare capacity:
+- jobs run one at a time on a background thread in each process, in priority
+  order (case law first)
+- a job only starts, and each of its provider calls is only made, once the
+  process has had no interactive request in flight for
+  PREFETCH_IDLE_SECONDS, so a running job pauses between calls while users
+  are active
+- provider calls go through rate_limits' fair queue as a low weight
+  background sender, so user calls waiting with them go first
+- an estimated token budget per hour, the case owner's tier bucket and a cap
+  on prefetched cases per user per day keep prefetching from using up the
+  provider quota; jobs over budget are dropped and the analysis is generated
+  on demand as before
+- an analysis that already exists when a job starts or finishes is left alone
+
+The queue is in memory, so queued jobs are lost on restart.
+
+Environment:
+    PREFETCH_ENABLED                    set to 1 to prefetch analyses for new cases (default off)
+    PREFETCH_ANALYSES                   comma-separated analyses to prefetch (default all three)
+    PREFETCH_COURT_SCRIPT_PROCEEDING    proceeding type of the prefetched court script (default arraignment)
+    PREFETCH_TOKENS_PER_HOUR            estimated tokens prefetching may use per hour (default 200000)
+    PREFETCH_CASES_PER_USER_DAY         new cases prefetched per user per day (default 5)
+    PREFETCH_QUEUE_SIZE                 most queued jobs; further jobs are dropped (default 100)
+    PREFETCH_IDLE_SECONDS               idle time required before a job starts (default 1)
+"""
+import os
+import json
+import time
+import queue
+import logging
+import itertools
+import threading
+from collections import deque
+
+from flask import current_app, request, g
+
+import ai_usage
+import rate_limits
+import prompt_budget
+
+# Lower runs first
+PRIORITIES = {
+    'case_law': 0,
+    'document_recommendations': 1,
+    'court_script': 2
+}
+# Rough instruction and output tokens per analysis, on top of the case description
+# sent with each request (the court script makes three requests)
+ESTIMATED_TOKENS = {
+    'case_law': 3000,
+    'document_recommendations': 3000,
+    'court_script': 6000
+}
+REQUESTS_PER_ANALYSIS = {'court_script': 3}
+# Placeholder entries the AI helpers return when no provider could answer
+PLACEHOLDER_TYPES = {"AI Analysis Limited", "Incomplete Information", "System Error", "API limit reached",
+                     "Alternative AI Provider Required", "API Configuration Required"}
+
+_jobs = None
+_sequence = itertools.count()
+_thread = None
+_thread_pid = None
+_lock = threading.Lock()
+
+# Interactive requests in flight in this process, and when the last one ended
+_interactive = 0
+_last_interactive = 0.0
+# (time, tokens) of prefetch jobs run in the last hour
+_spent = deque()
+# user id -> times of their prefetched cases in the last day
+_user_cases = {}
+
+
+def get_config():
+    """Return the prefetch settings from the environment"""
+    analyses = os.environ.get('PREFETCH_ANALYSES', ','.join(PRIORITIES))
+    return {
+        "enabled": os.environ.get('PREFETCH_ENABLED', '0') == '1',
+        "analyses": [a.strip() for a in analyses.split(',') if a.strip() in PRIORITIES],
+        "court_script_proceeding": os.environ.get('PREFETCH_COURT_SCRIPT_PROCEEDING', 'arraignment'),
+        "tokens_per_hour": int(os.environ.get('PREFETCH_TOKENS_PER_HOUR', 200000)),
+        "cases_per_user_day": int(os.environ.get('PREFETCH_CASES_PER_USER_DAY', 5)),
+        "queue_size": int(os.environ.get('PREFETCH_QUEUE_SIZE', 100)),
+        "idle_seconds": float(os.environ.get('PREFETCH_IDLE_SECONDS', 1))
+    }
+
+
+def estimate_tokens(case, analysis_type):
+    """Estimate the provider tokens an analysis of this case will use"""
+    description_tokens = prompt_budget.count_tokens(case.description or "")
+    return ESTIMATED_TOKENS[analysis_type] + description_tokens * REQUESTS_PER_ANALYSIS.get(analysis_type, 1)
+
+
+def _within_user_limit(user_id, config, now):
+    """Record a prefetched case for the user if they are under the daily cap"""
+    times = _user_cases.setdefault(user_id, deque())
+    while times and now - times[0] > 86400:
+        times.popleft()
+    if len(times) >= config["cases_per_user_day"]:
+        return False
+    times.append(now)
+    return True
+
+
+def _take_budget(tokens, config, now):
+    """Reserve tokens from this hour's budget; False if they do not fit"""
+    with _lock:
+        while _spent and now - _spent[0][0] > 3600:
+            _spent.popleft()
+        if sum(spent for _, spent in _spent) + tokens > config["tokens_per_hour"]:
+            return False
+        _spent.append((now, tokens))
+        return True
+
+
+def enqueue_case(case):
+    """Queue the configured analyses for a newly created case; returns the number queued"""
+    config = get_config()
+    if not config["enabled"] or not config["analyses"]:
+        return 0
+
+    with _lock:
+        if not _within_user_limit(case.user_id, config, time.monotonic()):
+            logging.info(f"Prefetch skipped for case {case.id}: daily limit reached for user {case.user_id}")
+            return 0
+        global _jobs
+        if _jobs is None:
+            _jobs = queue.PriorityQueue(maxsize=config["queue_size"])
+
+    queued = 0
+    for analysis_type in config["analyses"]:
+        try:
+            _jobs.put_nowait((PRIORITIES[analysis_type], next(_sequence), case.id, analysis_type))
+            queued += 1
+        except queue.Full:
+            logging.warning(f"Prefetch queue full; {analysis_type} for case {case.id} will be generated on demand")
+            break
+
+    if queued:
+        start(current_app._get_current_object())
+    return queued
+
+
+def _usable(result, section, name_field):
+    """True if a helper result has real entries in section rather than placeholders"""
+    if not isinstance(result, dict):
+        return False
+    entries = result.get(section)
+    if not isinstance(entries, list) or not entries:
+        return False
+    return not any(isinstance(entry, dict) and entry.get(name_field) in PLACEHOLDER_TYPES for entry in entries)
+
+
+def _prefetch_case_law(case, config):
+    from ai_helpers import analyze_case_description
+    from ai_analysis import save_case_law_analysis
+    result = analyze_case_description(case.description, case.issue_type, case.court_type)
+    if not _usable(result, 'rights_assessment', 'right_violated'):
+        return None
+    return lambda: save_case_law_analysis(case, result)
+
+
+def _prefetch_document_recommendations(case, config):
+    from ai_helpers import recommend_documents
+    from ai_analysis import save_document_recommendations
+    result = recommend_documents(case.description, case.issue_type, case.court_type)
+    if not _usable(result, 'document_recommendations', 'document_type'):
+        return None
+    return lambda: save_document_recommendations(case, result)
+
+
+def _prefetch_court_script(case, config):
+    from court_script import create_court_script
+    from models import LegalAnalysis
+    proceeding_type = config["court_script_proceeding"]
+    script = create_court_script(case, proceeding_type)
+    if not script:
+        return None
+    return lambda: LegalAnalysis.create_analysis(
+        case_id=case.id,
+        analysis_type='court_script',
+        content=json.dumps(script),
+        references=json.dumps({"proceeding_type": proceeding_type, "prefetched": True})
+    )
+
+
+GENERATORS = {
+    'case_law': _prefetch_case_law,
+    'document_recommendations': _prefetch_document_recommendations,
+    'court_script': _prefetch_court_script
+}
+
+
+def run_job(case_id, analysis_type, config=None):
+    """Generate and store one analysis unless it already exists or is over budget; returns True if stored"""
+    from models import Case, LegalAnalysis, User, db
+    config = config or get_config()
+    case = Case.get_case_by_id(case_id)
+    if case is None or LegalAnalysis.get_by_case_and_type(case_id, analysis_type) is not None:
+        return False
+
+    if not _take_budget(estimate_tokens(case, analysis_type), config, time.monotonic()):
+        logging.info(f"Prefetch budget exhausted; {analysis_type} for case {case_id} will be generated on demand")
+        return False
+
+    user = db.session.get(User, case.user_id)
+    tier = rate_limits.get_tier(user) if user is not None else 'free'
+    allowed, _ = rate_limits.check_tier(tier, REQUESTS_PER_ANALYSIS.get(analysis_type, 1))
+    if not allowed:
+        logging.info(f"Prefetch over the {tier} tier limit; {analysis_type} for case {case_id} will be generated on demand")
+        return False
+
+    wait = lambda: _wait_for_idle(config["idle_seconds"])
+    with ai_usage.feature(f"prefetch.{analysis_type}", case_id=case_id, user_id=case.user_id), \
+            rate_limits.scheduled_as("prefetch", rate_limits.background_weight(), wait=wait):
+        save = GENERATORS[analysis_type](case, config)
+    # The user may have generated it themselves while the job ran
+    if save is None or LegalAnalysis.get_by_case_and_type(case_id, analysis_type) is not None:
+        return False
+    save()
+    logging.info(f"Prefetched {analysis_type} for case {case_id}")
+    return True
+
+
+def _wait_for_idle(idle_seconds):
+    """Block until no interactive request is in flight and none has ended for idle_seconds"""
+    while _interactive > 0 or time.monotonic() - _last_interactive < idle_seconds:
+        time.sleep(0.2)
+
+
+def _run_forever(app):
+    while True:
+        _, _, case_id, analysis_type = _jobs.get()
+        try:
+            config = get_config()
+            _wait_for_idle(config["idle_seconds"])
+            with app.app_context():
+                run_job(case_id, analysis_type, config)
+        except Exception as e:
+            logging.error(f"Error prefetching {analysis_type} for case {case_id}: {e}")
+        finally:
+            _jobs.task_done()
+
+
+def start(app):
+    """Start the prefetch worker for this process if it is not already running"""
+    global _thread, _thread_pid
+    with _lock:
+        # Threads do not survive a fork, so each worker process starts its own
+        if _thread is not None and _thread_pid == os.getpid():
+            return
+        _thread = threading.Thread(target=_run_forever, args=(app,), name="analysis-prefetch", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def init_app(app):
+    """Track interactive requests so prefetch jobs only run while the process is idle"""
+    @app.before_request
+    def _interactive_started():
+        global _interactive
+        if request.endpoint != 'static':
+            g.prefetch_counted = True
+            with _lock:
+                _interactive += 1
+
+    @app.teardown_request
+    def _interactive_finished(exc=None):
+        global _interactive, _last_interactive
+        # Not counted if an earlier before_request handler ended the request
+        if g.pop('prefetch_counted', False):
+            with _lock:
+                _interactive -= 1
+                _last_interactive = time.monotonic()
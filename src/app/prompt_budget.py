@@ -0,0 +1,231 @@
+"""
+Token-budgeted prompt assembly.
+
+Prompts are built from named sections with priorities. When the assembled
+prompt would exceed the input budget, the lowest-priority sections are first
+replaced with their compact form (if one was given), then truncated, and
+finally dropped, until the prompt fits. The output budget (max_tokens) is
+chosen from what is left of the model's context window.
+
+Token counts use tiktoken when it is installed and fall back to a conservative
+character-based estimate otherwise.
+
+Environment:
+    PROMPT_MAX_INPUT_TOKENS   cap on prompt size regardless of model (default 12000)
+"""
+import os
+import json
+import math
+import logging
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_MODEL = "gpt-4o"
+
+# Context window and maximum output tokens per model
+MODEL_LIMITS = {
+    "gpt-4o": {"context": 128000, "max_output": 16384},
+    "gpt-4o-mini": {"context": 128000, "max_output": 16384},
+    "claude-3-5-sonnet-20241022": {"context": 200000, "max_output": 8192},
+    "claude-3-opus-20240229": {"context": 200000, "max_output": 4096}
+}
+DEFAULT_LIMITS = {"context": 16000, "max_output": 4096}
+
+MAX_INPUT_TOKENS = int(os.environ.get('PROMPT_MAX_INPUT_TOKENS', 12000))
+MIN_OUTPUT_TOKENS = 512
+# Headroom for chat formatting and tokenizer differences between providers
+SAFETY_MARGIN_TOKENS = 256
+# Characters per token when no tokenizer is available (errs on the high side)
+CHARS_PER_TOKEN = 3.5
+
+TRUNCATION_MARKER = "\n[... {omitted} tokens omitted to fit the prompt budget ...]\n"
+
+
+def get_model_limits(model):
+    """Return the context window and output limits for a model"""
+    if model in MODEL_LIMITS:
+        return MODEL_LIMITS[model]
+    for name, limits in MODEL_LIMITS.items():
+        if model and model.startswith(name):
+            return limits
+    return DEFAULT_LIMITS
+
+
+@lru_cache(maxsize=16)
+def _get_encoding(model):
+    """Load the tiktoken encoding for an OpenAI model, or None"""
+    if tiktoken is None or not model or model.startswith("claude"):
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logging.warning(f"Could not load tokenizer for {model}: {e}")
+        return None
+
+
+def count_tokens(text, model=DEFAULT_MODEL):
+    """Count the tokens in text for the given model"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens, model=DEFAULT_MODEL):
+    """
+    Shorten text to at most max_tokens, keeping the beginning and the end
+    (where facts and conclusions usually are) and marking the cut. Budgets
+    where the marker would take more than half the room get a plain cut of
+    the beginning instead.
+    """
+    tokens = count_tokens(text, model)
+    if tokens <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    ratio = max_tokens / tokens
+    marker_tokens = count_tokens(TRUNCATION_MARKER.format(omitted=tokens), model)
+    keep_chars = int(len(text) * ratio) if max_tokens >= 2 * marker_tokens else 0
+    while keep_chars > 0:
+        head_chars = keep_chars * 2 // 3
+        tail_chars = keep_chars - head_chars
+        omitted = tokens - count_tokens(text[:head_chars] + text[len(text) - tail_chars:], model)
+        candidate = (text[:head_chars].rstrip()
+                     + TRUNCATION_MARKER.format(omitted=omitted)
+                     + text[len(text) - tail_chars:].lstrip())
+        if count_tokens(candidate, model) <= max_tokens:
+            return candidate
+        keep_chars = int(keep_chars * 0.9) - 1
+
+    keep_chars = int(len(text) * ratio)
+    while keep_chars > 0:
+        candidate = text[:keep_chars].rstrip()
+        if count_tokens(candidate, model) <= max_tokens:
+            return candidate
+        keep_chars = int(keep_chars * 0.9) - 1
+    return ""
+
+
+def compact_json(data):
+    """Render data as JSON without indentation, for use as a section's compact form"""
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+
+def choose_max_tokens(prompt_tokens, model=DEFAULT_MODEL, desired=2000):
+    """Pick max_tokens for a request from what remains of the context window"""
+    limits = get_model_limits(model)
+    available = limits["context"] - prompt_tokens - SAFETY_MARGIN_TOKENS
+    return max(MIN_OUTPUT_TOKENS, min(desired, limits["max_output"], available))
+
+
+def max_tokens_for(prompt, model=DEFAULT_MODEL, desired=2000, system_prompt=None):
+    """Pick max_tokens for a prompt string (and optional system prompt)"""
+    prompt_tokens = count_tokens(prompt, model) + count_tokens(system_prompt, model)
+    return choose_max_tokens(prompt_tokens, model, desired)
+
+
+class PromptSection:
+    """A named piece of a prompt with a priority (higher is kept longer)"""
+
+    def __init__(self, name, text, priority=0, required=False, compact=None, min_tokens=64):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.required = required
+        self.compact = compact
+        self.min_tokens = min_tokens
+
+
+class PromptBuilder:
+    """
+    Assemble a prompt from sections within a token budget.
+
+    Usage:
+        builder = PromptBuilder(model="gpt-4o", output_tokens=3000)
+        builder.add("instructions", INSTRUCTIONS, required=True)
+        builder.add("evidence", json.dumps(items, indent=2), priority=1, compact=compact_json(items))
+        prompt = builder.build()
+        max_tokens = builder.max_tokens
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, max_input_tokens=None, output_tokens=2000, separator="\n\n"):
+        self.model = model or DEFAULT_MODEL
+        self.output_tokens = output_tokens
+        self.separator = separator
+        self.sections = []
+
+        limits = get_model_limits(self.model)
+        window_budget = limits["context"] - min(output_tokens, limits["max_output"]) - SAFETY_MARGIN_TOKENS
+        self.budget = min(max_input_tokens or MAX_INPUT_TOKENS, window_budget)
+
+        # Populated by build()
+        self.input_tokens = 0
+        self.max_tokens = output_tokens
+        self.reduced_sections = []
+
+    def add(self, name, text, priority=0, required=False, compact=None, min_tokens=64):
+        """Add a section; sections are emitted in the order they are added"""
+        self.sections.append(PromptSection(name, text, priority, required, compact, min_tokens))
+        return self
+
+    def build(self):
+        """Fit the sections into the budget and return the prompt text"""
+        texts = [section.text for section in self.sections]
+        counts = [count_tokens(text, self.model) for text in texts]
+        total = sum(counts)
+        self.reduced_sections = []
+
+        if total > self.budget:
+            # Lowest priority first; among equals, later sections go first
+            order = sorted(
+                (i for i, section in enumerate(self.sections) if not section.required),
+                key=lambda i: (self.sections[i].priority, -i)
+            )
+            for i in order:
+                if total <= self.budget:
+                    break
+                section = self.sections[i]
+
+                if section.compact is not None:
+                    compact_count = count_tokens(section.compact, self.model)
+                    if compact_count < counts[i]:
+                        texts[i] = section.compact
+                        total += compact_count - counts[i]
+                        counts[i] = compact_count
+                        self.reduced_sections.append(section.name)
+                        if total <= self.budget:
+                            break
+
+                target = counts[i] - (total - self.budget)
+                if target >= section.min_tokens:
+                    texts[i] = truncate_to_tokens(texts[i], target, self.model)
+                else:
+                    texts[i] = ""
+                new_count = count_tokens(texts[i], self.model)
+                total += new_count - counts[i]
+                counts[i] = new_count
+                if section.name not in self.reduced_sections:
+                    self.reduced_sections.append(section.name)
+
+            if total > self.budget:
+                logging.warning(
+                    f"Prompt still exceeds budget after reduction ({total} > {self.budget} tokens)"
+                )
+            else:
+                logging.info(
+                    f"Prompt reduced to fit {self.budget} tokens; sections shortened: {', '.join(self.reduced_sections)}"
+                )
+
+        prompt = self.separator.join(text for text in texts if text)
+        self.input_tokens = count_tokens(prompt, self.model)
+        self.max_tokens = choose_max_tokens(self.input_tokens, self.model, self.output_tokens)
+        return prompt
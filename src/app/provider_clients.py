@@ -0,0 +1,230 @@
+"""
+Shared AI provider clients.
+
+OpenAI and Anthropic clients are created lazily on first use and reused across
+requests so their keep-alive connection pools survive between calls. Clients
+are rebuilt automatically when the API key changes (e.g. rotated from the
+settings page) or when the process has forked (gunicorn preload), since a
+connection pool must never be shared between parent and child processes.
+
+Pool limits and timeouts are configured through environment variables:
+    PROVIDER_MAX_CONNECTIONS       (default 20)
+    PROVIDER_MAX_KEEPALIVE         (default 10)
+    PROVIDER_KEEPALIVE_EXPIRY      seconds (default 30)
+    PROVIDER_CONNECT_TIMEOUT       seconds (default 10)
+    PROVIDER_TIMEOUT               seconds (default 120)
+    PROVIDER_MAX_RETRIES           (default 2)
+
+Base URLs, e.g. to point every client at a proxy or at the mock provider in
+benchmarks/mock_provider.py for load testing:
+    OPENAI_BASE_URL                OpenAI API base URL including /v1 (default the SDK's)
+    ANTHROPIC_BASE_URL             Anthropic API base URL (default the SDK's)
+    AI_MOCK_URL                    root URL of a mock provider; sets both base URLs and
+                                   supplies placeholder API keys when none are configured
+
+Other modules wrap every new client through add_instrumentation() (usage
+accounting, the rate limiter's fair queue); app_factory registers them, so
+this module never imports the web layer.
+"""
+import os
+import logging
+import threading
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+PROVIDERS = {
+    "openai": "OPENAI_API_KEY",
+    "anthropic": "ANTHROPIC_API_KEY"
+}
+BASE_URLS = {
+    "openai": "OPENAI_BASE_URL",
+    "anthropic": "ANTHROPIC_BASE_URL"
+}
+# Path of each provider's API under the mock provider's root URL
+MOCK_PATHS = {
+    "openai": "/v1",
+    "anthropic": ""
+}
+MOCK_API_KEY = "mock-key"
+
+_lock = threading.Lock()
+# provider -> {"client": ..., "api_key": ..., "pid": ...}
+_clients = {}
+# fn(client, provider) -> client, applied to every new client in order
+_instrumentation = []
+
+
+def _env_number(name, default, cast=float):
+    """Read a numeric setting from the environment, falling back to the default"""
+    try:
+        return cast(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        logging.error(f"Invalid value for {name}, using default {default}")
+        return cast(default)
+
+
+def get_pool_config():
+    """Return the connection pool and timeout settings for provider clients"""
+    return {
+        "max_connections": _env_number("PROVIDER_MAX_CONNECTIONS", 20, int),
+        "max_keepalive": _env_number("PROVIDER_MAX_KEEPALIVE", 10, int),
+        "keepalive_expiry": _env_number("PROVIDER_KEEPALIVE_EXPIRY", 30),
+        "connect_timeout": _env_number("PROVIDER_CONNECT_TIMEOUT", 10),
+        "timeout": _env_number("PROVIDER_TIMEOUT", 120),
+        "max_retries": _env_number("PROVIDER_MAX_RETRIES", 2, int)
+    }
+
+
+def get_base_url(provider):
+    """Return the configured base URL for a provider, or None for the SDK default"""
+    mock_url = os.environ.get("AI_MOCK_URL")
+    if mock_url:
+        return mock_url.rstrip("/") + MOCK_PATHS[provider]
+    return os.environ.get(BASE_URLS[provider]) or None
+
+
+def get_api_key(provider):
+    """Return the provider's API key; a placeholder when using the mock provider"""
+    api_key = os.environ.get(PROVIDERS[provider])
+    if not api_key and os.environ.get("AI_MOCK_URL"):
+        return MOCK_API_KEY
+    return api_key
+
+
+def _build_http_client(config):
+    """Build a pooled keep-alive HTTP client, or None to use the SDK default"""
+    if httpx is None:
+        return None
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive"],
+            keepalive_expiry=config["keepalive_expiry"]
+        ),
+        timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"])
+    )
+
+
+def _build_client(provider, api_key, base_url=None):
+    """Construct a new SDK client for the provider"""
+    config = get_pool_config()
+    kwargs = {
+        "api_key": api_key,
+        "max_retries": config["max_retries"],
+        "timeout": config["timeout"]
+    }
+    if base_url:
+        kwargs["base_url"] = base_url
+    http_client = _build_http_client(config)
+    if http_client is not None:
+        kwargs["http_client"] = http_client
+
+    if provider == "openai":
+        from openai import OpenAI
+        client = OpenAI(**kwargs)
+    elif provider == "anthropic":
+        from anthropic import Anthropic
+        client = Anthropic(**kwargs)
+    else:
+        raise ValueError(f"Unknown provider: {provider}")
+    for instrument in _instrumentation:
+        client = instrument(client, provider)
+    return client
+
+
+def add_instrumentation(instrument):
+    """
+    Apply instrument(client, provider) to every shared client, wrapping those
+    registered before it. Existing clients are rebuilt on next use.
+    """
+    with _lock:
+        if instrument in _instrumentation:
+            return
+        _instrumentation.append(instrument)
+    reset_clients()
+
+
+def _close(client):
+    """Close a client's connection pool, ignoring errors"""
+    try:
+        client.close()
+    except Exception as e:
+        logging.debug(f"Error closing provider client: {e}")
+
+
+def get_client(provider):
+    """
+    Return the shared client for a provider, or None if no API key is configured.
+    The client is rebuilt if the key or base URL has changed or the process
+    has forked.
+    """
+    api_key = get_api_key(provider)
+    if not api_key:
+        return None
+    base_url = get_base_url(provider)
+
+    pid = os.getpid()
+    entry = _clients.get(provider)
+    if entry and entry["api_key"] == api_key and entry["base_url"] == base_url and entry["pid"] == pid:
+        return entry["client"]
+
+    with _lock:
+        entry = _clients.get(provider)
+        if entry and entry["api_key"] == api_key and entry["base_url"] == base_url and entry["pid"] == pid:
+            return entry["client"]
+
+        # Only close pools this process created; a forked child must not
+        # touch sockets it inherited from the parent
+        if entry and entry["pid"] == pid:
+            _close(entry["client"])
+
+        try:
+            client = _build_client(provider, api_key, base_url)
+        except Exception as e:
+            logging.error(f"Error initializing {provider} client: {e}")
+            _clients.pop(provider, None)
+            return None
+
+        _clients[provider] = {"client": client, "api_key": api_key, "base_url": base_url, "pid": pid}
+        logging.debug(f"Created shared {provider} client" + (f" for {base_url}" if base_url else ""))
+        return client
+
+
+def get_openai_client():
+    """Return the shared OpenAI client, or None if OPENAI_API_KEY is not set"""
+    return get_client("openai")
+
+
+def get_anthropic_client():
+    """Return the shared Anthropic client, or None if ANTHROPIC_API_KEY is not set"""
+    return get_client("anthropic")
+
+
+def set_api_key(provider, api_key):
+    """Rotate a provider's API key; the shared client is rebuilt on next use"""
+    os.environ[PROVIDERS[provider]] = api_key
+    reset_clients(provider)
+
+
+def reset_clients(provider=None):
+    """Close and discard shared clients (all providers if none is given)"""
+    with _lock:
+        providers = [provider] if provider else list(_clients)
+        for name in providers:
+            entry = _clients.pop(name, None)
+            if entry and entry["pid"] == os.getpid():
+                _close(entry["client"])
+
+
+def _after_fork_in_child():
+    """Drop inherited clients without closing the parent's sockets"""
+    global _lock
+    _lock = threading.Lock()
+    _clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,438 @@
+"""
+Per-user rate limits and fair scheduling for AI endpoints.
+
+Every request to an AI endpoint goes through two gates before it reaches a
+provider:
+
+1. Token buckets. Each user has a bucket sized by their tier, and each tier
+   can also have a shared bucket so one tier as a whole cannot exhaust the
+   provider quota. Buckets live in the rate_limit_bucket table so all workers
+   share them, and are updated with a single conditional UPDATE so concurrent
+   workers cannot overspend. If the table cannot be used (or
+   RATE_LIMIT_BACKEND=local) each process keeps its own buckets instead.
+
+2. A weighted fair queue around each provider call. app_factory registers
+   instrument() with provider_clients, so each process makes at most
+   AI_CONCURRENT_CALLS provider calls at once; when all are busy, waiting
+   calls are served in order of virtual finish time, so a user who sends many
+   requests waits behind users who have sent few, and higher tiers get a
+   larger share.
+   ai_limited names the sender of the calls a view makes and scheduled_as
+   names those of background work; other calls (e.g. CLI commands) are
+   scheduled as background calls. Background senders get AI_BACKGROUND_WEIGHT.
+
+   The queue orders calls within one process, so it only has anything to
+   order with threaded workers (e.g. gunicorn --threads N or -k gthread).
+   With sync workers each process serves one request at a time and the
+   queue never waits.
+
+A request refused by the buckets gets a 429 with a Retry-After header, as does
+a request whose provider call could not get a slot within AI_QUEUE_TIMEOUT,
+if the view lets ProviderBusy propagate. Views that handle the error and fall
+back get their tokens back.
+
+Tiers are premium (premium role, staff roles or an active subscription),
+fee_waiver (approved fee waiver, which grants premium access, so it gets
+premium limits by default) and free.
+
+Environment:
+    RATE_LIMIT_ENABLED                 set to 0 to disable rate limiting (default on)
+    RATE_LIMIT_BACKEND                 db or local (default db)
+    RATE_LIMIT_<TIER>_BURST            requests a user can make at once
+    RATE_LIMIT_<TIER>_PER_HOUR         sustained requests per user per hour
+    RATE_LIMIT_<TIER>_TIER_PER_MINUTE  requests per minute for the whole tier, 0 for no limit
+    RATE_LIMIT_<TIER>_WEIGHT           share of provider capacity in the fair queue
+    AI_CONCURRENT_CALLS                requests per process calling providers at once (default 4)
+    AI_QUEUE_TIMEOUT                   seconds a provider call waits in the fair queue (default 30)
+    AI_BACKGROUND_WEIGHT               fair queue share of calls made outside limited views (default 0.25)
+"""
+import os
+import math
+import time
+import heapq
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from flask import request, g, jsonify, render_template
+from flask_login import current_user
+
+import ai_usage
+
+TIER_DEFAULTS = {
+    'premium': {"burst": 20, "per_hour": 120, "tier_per_minute": 0, "weight": 3},
+    'fee_waiver': {"burst": 20, "per_hour": 120, "tier_per_minute": 0, "weight": 3},
+    'free': {"burst": 5, "per_hour": 20, "tier_per_minute": 30, "weight": 1}
+}
+STAFF_ROLES = ('premium', 'legal', 'moderator')
+ACTIVE_SUBSCRIPTION_STATUSES = ('active', 'trialing')
+
+# Matches models.RateLimitBucket; declared here so the limiter does not import the models
+bucket_table = sa.table(
+    'rate_limit_bucket',
+    sa.column('key', sa.String),
+    sa.column('tokens', sa.Float),
+    sa.column('refilled_at', sa.Float),
+)
+
+_local_lock = threading.Lock()
+# key -> [tokens, refilled_at], used when the database is not
+_local_buckets = {}
+
+# The sender provider calls are scheduled as; set by ai_limited for its view
+_sender = contextvars.ContextVar('ai_queue_sender', default=None)
+
+
+class ProviderBusy(Exception):
+    """No provider call slot became free within AI_QUEUE_TIMEOUT"""
+
+    def __init__(self, timeout):
+        super().__init__(f"No AI provider slot free within {timeout:.0f}s")
+        self.timeout = timeout
+
+
+def is_enabled():
+    return os.environ.get('RATE_LIMIT_ENABLED', '1') != '0'
+
+
+def get_tier_limits(tier):
+    """Return the limits for a tier, with environment overrides"""
+    limits = dict(TIER_DEFAULTS.get(tier, TIER_DEFAULTS['free']))
+    for name, default in limits.items():
+        value = os.environ.get(f"RATE_LIMIT_{tier.upper()}_{name.upper()}")
+        if value is not None:
+            limits[name] = type(default)(value)
+    return limits
+
+
+def get_tier(user):
+    """Return the rate limit tier of a user, cached for the request"""
+    cached = g.get('rate_limit_tier')
+    if cached is not None:
+        return cached
+
+    tier = 'free'
+    if user.role in STAFF_ROLES:
+        tier = 'premium'
+    else:
+        from models import Subscription
+        subscription = Subscription.query.filter_by(user_id=user.id) \
+            .order_by(Subscription.created_at.desc()).first()
+        if subscription is not None:
+            if subscription.fee_waiver_approved:
+                tier = 'fee_waiver'
+            elif subscription.status in ACTIVE_SUBSCRIPTION_STATUSES:
+                tier = 'premium'
+    g.rate_limit_tier = tier
+    return tier
+
+
+def _level(tokens, refilled_at, capacity, rate, now):
+    """Bucket level after refilling at rate tokens per second since refilled_at"""
+    return min(capacity, tokens + max(0.0, now - refilled_at) * rate)
+
+
+def _take_local(key, capacity, rate, cost, now):
+    with _local_lock:
+        bucket = _local_buckets.setdefault(key, [capacity, now])
+        level = _level(bucket[0], bucket[1], capacity, rate, now)
+        if level >= cost:
+            _local_buckets[key] = [level - cost, now]
+            return True, 0.0
+        return False, (cost - level) / rate
+
+
+def _take_db(key, capacity, rate, cost, now):
+    from app import db
+    refilled = bucket_table.c.tokens + (now - bucket_table.c.refilled_at) * rate
+    level = sa.case((refilled > capacity, capacity), else_=refilled)
+
+    for _ in range(2):
+        with db.engine.begin() as connection:
+            # Refill and spend in one statement so concurrent workers cannot both
+            # spend the same tokens
+            result = connection.execute(
+                bucket_table.update()
+                .where(bucket_table.c.key == key)
+                .where(level >= cost)
+                .values(tokens=level - cost, refilled_at=now)
+            )
+            if result.rowcount:
+                return True, 0.0
+
+            row = connection.execute(
+                sa.select(bucket_table.c.tokens, bucket_table.c.refilled_at).where(bucket_table.c.key == key)
+            ).first()
+            if row is not None:
+                return False, (cost - _level(row.tokens, row.refilled_at, capacity, rate, now)) / rate
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(bucket_table.insert().values(key=key, tokens=capacity - cost, refilled_at=now))
+            return True, 0.0
+        except IntegrityError:
+            # Another worker created the bucket first; spend from theirs
+            continue
+    return False, 1.0
+
+
+def _refund_db(key, capacity, cost):
+    from app import db
+    refunded = bucket_table.c.tokens + cost
+    with db.engine.begin() as connection:
+        connection.execute(bucket_table.update().where(bucket_table.c.key == key)
+                           .values(tokens=sa.case((refunded > capacity, capacity), else_=refunded)))
+
+
+def _refund_local(key, capacity, cost):
+    with _local_lock:
+        if key in _local_buckets:
+            _local_buckets[key][0] = min(capacity, _local_buckets[key][0] + cost)
+
+
+def take(key, capacity, rate, cost=1):
+    """Spend cost tokens from a bucket; returns (allowed, seconds until enough tokens are available)"""
+    now = time.time()
+    if os.environ.get('RATE_LIMIT_BACKEND', 'db') == 'db':
+        try:
+            return _take_db(key, capacity, rate, cost, now)
+        except Exception as e:
+            logging.error(f"Rate limit bucket {key} unavailable in the database, using local bucket: {e}")
+    return _take_local(key, capacity, rate, cost, now)
+
+
+def refund(key, capacity, cost=1):
+    """Return tokens to a bucket for a request that was not served"""
+    if os.environ.get('RATE_LIMIT_BACKEND', 'db') == 'db':
+        try:
+            return _refund_db(key, capacity, cost)
+        except Exception as e:
+            logging.error(f"Could not refund rate limit bucket {key}: {e}")
+    _refund_local(key, capacity, cost)
+
+
+def _buckets(user_key, tier):
+    """Return the (key, capacity, rate per second) buckets a request must take from"""
+    limits = get_tier_limits(tier)
+    buckets = [(user_key, limits["burst"], limits["per_hour"] / 3600.0)]
+    if limits["tier_per_minute"] > 0:
+        buckets.append((f"tier:{tier}", limits["tier_per_minute"], limits["tier_per_minute"] / 60.0))
+    return buckets
+
+
+def check_tier(tier, cost=1):
+    """
+    Spend from a tier's shared bucket only, for background work done on behalf
+    of its users; returns (allowed, retry_after seconds)
+    """
+    limits = get_tier_limits(tier)
+    if not is_enabled() or limits["tier_per_minute"] <= 0:
+        return True, 0.0
+    return take(f"tier:{tier}", limits["tier_per_minute"], limits["tier_per_minute"] / 60.0, cost)
+
+
+def check(user_key, tier, cost=1):
+    """Spend from every bucket for a request; returns (allowed, retry_after seconds)"""
+    taken = []
+    for key, capacity, rate in _buckets(user_key, tier):
+        allowed, retry_after = take(key, capacity, rate, cost)
+        if not allowed:
+            for taken_key, taken_capacity in taken:
+                refund(taken_key, taken_capacity, cost)
+            return False, retry_after
+        taken.append((key, capacity))
+    return True, 0.0
+
+
+class FairQueue:
+    """
+    Weighted fair queue over a fixed number of slots. Each request gets a
+    virtual finish time of max(queue time, sender's last finish) + cost / weight
+    and waiting requests are admitted in finish-time order.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self._free = slots
+        self._condition = threading.Condition()
+        self._virtual_time = 0.0
+        self._finish = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    def acquire(self, sender, weight, cost=1, timeout=None):
+        """Wait for a slot; returns False if none was free within timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            finish = max(self._virtual_time, self._finish.get(sender, 0.0)) + cost / max(weight, 0.001)
+            self._finish[sender] = finish
+            ticket = (finish, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+
+            while not (self._free > 0 and self._waiting[0] == ticket):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    # Not served, so the sender should not wait behind it next time
+                    refunded = self._finish.get(sender, 0.0) - cost / max(weight, 0.001)
+                    if refunded > self._virtual_time:
+                        self._finish[sender] = refunded
+                    else:
+                        self._finish.pop(sender, None)
+                    self._condition.notify_all()
+                    return False
+                self._condition.wait(remaining)
+
+            heapq.heappop(self._waiting)
+            self._free -= 1
+            self._virtual_time = finish
+            if len(self._finish) > 10000:
+                # Senders behind the virtual clock are treated as new anyway
+                self._finish = {s: f for s, f in self._finish.items() if f > self._virtual_time}
+            self._condition.notify_all()
+            return True
+
+    def release(self):
+        with self._condition:
+            self._free += 1
+            self._condition.notify_all()
+
+
+provider_queue = FairQueue(int(os.environ.get('AI_CONCURRENT_CALLS', 4)))
+
+
+def _queue_timeout():
+    return float(os.environ.get('AI_QUEUE_TIMEOUT', 30))
+
+
+def background_weight():
+    return float(os.environ.get('AI_BACKGROUND_WEIGHT', 0.25))
+
+
+@contextmanager
+def scheduled_as(key, weight, wait=None):
+    """
+    Schedule the provider calls made in this block as sender key with weight.
+    wait, if given, is called before each call, e.g. to let background work
+    yield to interactive requests between its calls. Yields the sender.
+    """
+    sender = {"key": key, "weight": weight, "busy": False, "wait": wait}
+    token = _sender.set(sender)
+    try:
+        yield sender
+    finally:
+        _sender.reset(token)
+
+
+@contextmanager
+def provider_slot(cost=1):
+    """Hold a fair queue slot for one provider call; raises ProviderBusy on timeout"""
+    if not is_enabled():
+        yield
+        return
+    sender = _sender.get()
+    if sender is None:
+        sender = {"key": "background", "weight": background_weight()}
+    if sender.get("wait"):
+        sender["wait"]()
+    timeout = _queue_timeout()
+    if not provider_queue.acquire(sender["key"], sender["weight"], cost, timeout=timeout):
+        sender["busy"] = True
+        logging.warning(f"AI queue full; provider call for {sender['key']} timed out")
+        raise ProviderBusy(timeout)
+    try:
+        yield
+    finally:
+        provider_queue.release()
+
+
+def _scheduled(create):
+    @wraps(create)
+    def scheduled_create(*args, **kwargs):
+        with provider_slot():
+            return create(*args, **kwargs)
+    return scheduled_create
+
+
+def _scheduled_stream(stream):
+    # The slot is held until the stream is closed, not just while it opens
+    @wraps(stream)
+    @contextmanager
+    def scheduled_stream(*args, **kwargs):
+        with provider_slot():
+            with stream(*args, **kwargs) as message_stream:
+                yield message_stream
+    return scheduled_stream
+
+
+def instrument(client, provider):
+    """
+    Schedule every call through a provider client's API methods in the fair
+    queue. Apply over ai_usage.instrument so recorded latency excludes the wait.
+    """
+    for path in ai_usage.TRACKED_METHODS.get(provider, ()):
+        *parents, name = path.split('.')
+        scheduled = _scheduled_stream if name == 'stream' else _scheduled
+        try:
+            owner = client
+            for attr in parents:
+                owner = getattr(owner, attr)
+            setattr(owner, name, scheduled(getattr(owner, name)))
+        except AttributeError as e:
+            logging.warning(f"Cannot schedule {provider} {path}: {e}")
+    return client
+
+
+def too_many_requests(retry_after, message=None):
+    """Build a 429 response, JSON for API requests and a page otherwise"""
+    retry_after = max(1, int(math.ceil(retry_after)))
+    message = message or "You're sending AI requests faster than your plan allows."
+    if request.path.startswith('/api/') or request.is_json or request.accept_mimetypes.best == 'application/json':
+        response = jsonify({'error': message, 'rate_limited': True, 'retry_after': retry_after})
+    else:
+        response = render_template('errors/429.html', message=message, retry_after=retry_after)
+    return response, 429, {'Retry-After': str(retry_after)}
+
+
+def ai_limited(cost=1, methods=None, when=None):
+    """
+    Rate limit a view that calls AI providers and schedule its provider calls
+    as the current user's. methods limits it to those HTTP methods (e.g. POST
+    on pages that only generate on submit); when, a function of no arguments,
+    limits it to requests for which it returns true. Apply below login_required.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not is_enabled() or (methods and request.method not in methods) or (when and not when()):
+                return view(*args, **kwargs)
+
+            if current_user.is_authenticated:
+                user_key = f"user:{current_user.id}"
+                tier = get_tier(current_user)
+            else:
+                user_key = f"ip:{request.remote_addr}"
+                tier = 'free'
+
+            allowed, retry_after = check(user_key, tier, cost)
+            if not allowed:
+                logging.info(f"Rate limited {user_key} ({tier}) on {request.endpoint}; retry after {retry_after:.0f}s")
+                return too_many_requests(retry_after)
+
+            with scheduled_as(user_key, get_tier_limits(tier)["weight"]) as sender:
+                try:
+                    return view(*args, **kwargs)
+                except ProviderBusy as e:
+                    return too_many_requests(e.timeout, "AI services are busy right now. Please try again shortly.")
+                finally:
+                    if sender["busy"]:
+                        # A provider call was not served, so give the tokens back
+                        for key, capacity, _ in _buckets(user_key, tier):
+                            refund(key, capacity, cost)
+        return wrapped
+    return decorator
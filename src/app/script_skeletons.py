@@ -0,0 +1,377 @@
+"""
+Precomputed court script skeletons.
+
+The procedural parts of a court appearance script (preparing, entering the
+courtroom, the stages of each proceeding, concluding) do not depend on the
+case, so they are written once here per proceeding type and court type. The
+case-specific parts are marked as slots and filled in by court_script with
+small, parallel model requests; the defaults here are used when a slot cannot
+be filled.
+"""
+import copy
+
+PROCEEDING_NAMES = {
+    'arraignment': "Arraignment",
+    'bail_hearing': "Bail Hearing",
+    'preliminary_hearing': "Preliminary Hearing",
+    'motion_hearing': "Motion Hearing",
+    'suppression_hearing': "Suppression Hearing",
+    'trial': "Trial",
+    'sentencing': "Sentencing"
+}
+
+PREPARATION = [
+    {
+        "step": "Gather essential documents",
+        "details": "Bring your charging documents, any court notices, your ID, copies of every motion you have filed, and any evidence you intend to reference. Keep them in a folder in the order you expect to need them.",
+        "importance": "Being able to find a document immediately shows the court you are prepared and keeps you from losing your place."
+    },
+    {
+        "step": "Prepare a one-page outline",
+        "details": "Write down the points you must make, the rights you intend to assert, and the case citations that support them.",
+        "importance": "Court moves quickly; an outline keeps you from forgetting an argument that must be raised on the record."
+    },
+    {
+        "step": "Dress and arrive appropriately",
+        "details": "Wear clean, conservative clothing and arrive at least 30 minutes early to clear security and find the courtroom.",
+        "importance": "First impressions matter to the judge, and arriving late can result in a warrant or a missed hearing."
+    }
+]
+
+PROCEEDING_PREPARATION = {
+    'arraignment': "Review the charges listed on your complaint or indictment and prepare your plea of not guilty and your written discovery request.",
+    'bail_hearing': "Collect proof of residence, employment, family responsibilities and community ties, and prepare a written release plan.",
+    'preliminary_hearing': "List the elements of each charge and the questions you will ask each witness about them.",
+    'motion_hearing': "Bring three copies of your motion and of every case you cite: one for the judge, one for the prosecutor, one for you.",
+    'suppression_hearing': "Build a timeline of the stop, search and seizure and mark each point where a warrant or exception was required.",
+    'trial': "Prepare your opening statement, witness questions, exhibit list and proposed jury instructions.",
+    'sentencing': "Gather character letters, proof of employment, treatment or education, and a written sentencing proposal."
+}
+
+COURTROOM_ENTRANCE = [
+    {
+        "action": "Check in with the clerk or bailiff",
+        "explanation": "Tell them your name and case number and that you are representing yourself so you are called at the right time."
+    },
+    {
+        "action": "Sit quietly in the gallery until your case is called",
+        "explanation": "Silence your phone and observe how the judge handles other cases; it tells you what to expect."
+    },
+    {
+        "action": "When called, stand at the defense table and state your name for the record",
+        "explanation": "Say: \"Good morning, Your Honor. [Your name], appearing pro se.\" Always address the judge as \"Your Honor\" and stand when speaking."
+    }
+]
+
+COURT_ENTRANCE_NOTES = {
+    'federal': {
+        "action": "Allow extra time for federal security screening",
+        "explanation": "Federal courthouses screen strictly and prohibit many electronic devices; check the court's local rules on phones before you go."
+    },
+    'appellate': {
+        "action": "Confirm your argument time with the clerk",
+        "explanation": "Appellate courts strictly limit argument time; know how many minutes you have and whether you reserved time for rebuttal."
+    },
+    'municipal': {
+        "action": "Expect a crowded docket",
+        "explanation": "Municipal courts hear many cases in one session; be ready to state your request in a sentence or two when called."
+    }
+}
+
+# Stages of each proceeding. Stages with "slot": True get a case-specific
+# what_to_say from the model; the text here is the fallback.
+STAGES = {
+    'arraignment': [
+        {
+            "stage": "Reading of the charges",
+            "what_to_expect": "The judge or clerk reads the charges against you and may ask if you understand them.",
+            "what_to_say": "Your Honor, I have received a copy of the charges and I understand them.",
+            "what_to_do": "Listen carefully and write down each charge and statute number.",
+            "tips": "If anything is unclear, ask the court to clarify before you enter a plea."
+        },
+        {
+            "stage": "Entering a plea",
+            "what_to_expect": "You will be asked how you plead to each charge.",
+            "what_to_say": "Your Honor, I plead not guilty to all charges, and I do not waive my right to a speedy trial.",
+            "what_to_do": "Stand and speak clearly; do not discuss the facts of the case.",
+            "tips": "A not guilty plea preserves all of your rights and defenses.",
+            "slot": True
+        },
+        {
+            "stage": "Discovery and scheduling",
+            "what_to_expect": "The court sets the next dates and may address discovery.",
+            "what_to_say": "Your Honor, I request full discovery, including all exculpatory evidence under Brady v. Maryland.",
+            "what_to_do": "Write down every date and deadline the judge gives.",
+            "tips": "Ask for deadlines to be stated on the record.",
+            "slot": True
+        }
+    ],
+    'bail_hearing': [
+        {
+            "stage": "Prosecution's position on release",
+            "what_to_expect": "The prosecutor argues for detention or a bail amount.",
+            "what_to_say": "",
+            "what_to_do": "Take notes on each reason given so you can answer it.",
+            "tips": "Do not interrupt; you will get your turn."
+        },
+        {
+            "stage": "Your argument for release",
+            "what_to_expect": "The judge asks for your response.",
+            "what_to_say": "Your Honor, I am not a flight risk or a danger to the community. I have strong ties here and will appear at every court date.",
+            "what_to_do": "Hand up your supporting documents through the bailiff.",
+            "tips": "Focus on ties to the community, employment and your ability to pay.",
+            "slot": True
+        },
+        {
+            "stage": "Proposed conditions",
+            "what_to_expect": "The judge decides release conditions or bail.",
+            "what_to_say": "If the court has concerns, I propose release on my own recognizance with regular check-ins.",
+            "what_to_do": "Offer specific alternatives to detention.",
+            "tips": "If bail is set beyond your means, ask the court to consider your ability to pay.",
+            "slot": True
+        }
+    ],
+    'preliminary_hearing': [
+        {
+            "stage": "Prosecution presents evidence",
+            "what_to_expect": "The prosecutor calls witnesses to show probable cause.",
+            "what_to_say": "",
+            "what_to_do": "Note every inconsistency and every element the testimony does not address.",
+            "tips": "Object to hearsay that does not fall within an exception."
+        },
+        {
+            "stage": "Cross-examination",
+            "what_to_expect": "You may question each prosecution witness.",
+            "what_to_say": "Officer, you did not have a warrant when you searched the vehicle, correct?",
+            "what_to_do": "Ask short, leading questions that can be answered yes or no.",
+            "tips": "Use the hearing to lock in testimony you can use at trial.",
+            "slot": True
+        },
+        {
+            "stage": "Argument on probable cause",
+            "what_to_expect": "Both sides argue whether the case should proceed.",
+            "what_to_say": "Your Honor, the evidence presented does not establish probable cause for each element of the charged offense.",
+            "what_to_do": "Go element by element through what was and was not shown.",
+            "tips": "Keep it brief; the standard is low, so focus on missing elements.",
+            "slot": True
+        }
+    ],
+    'motion_hearing': [
+        {
+            "stage": "Presenting your motion",
+            "what_to_expect": "As the moving party you usually argue first.",
+            "what_to_say": "Your Honor, I move for the relief stated in my motion on the following grounds.",
+            "what_to_do": "Refer to your motion by title and page, and cite your strongest case first.",
+            "tips": "Be concise and stick to the legal basis.",
+            "slot": True
+        },
+        {
+            "stage": "Prosecution's response",
+            "what_to_expect": "The prosecutor argues against your motion.",
+            "what_to_say": "",
+            "what_to_do": "Write down each counter-argument.",
+            "tips": "Do not interrupt; object only to improper statements."
+        },
+        {
+            "stage": "Your reply",
+            "what_to_expect": "You may respond to the prosecution's arguments.",
+            "what_to_say": "Your Honor, the prosecution's argument does not address the constitutional violation at the center of this motion.",
+            "what_to_do": "Answer their strongest point directly.",
+            "tips": "End by restating exactly what you are asking the court to order.",
+            "slot": True
+        }
+    ],
+    'suppression_hearing': [
+        {
+            "stage": "Establishing the warrantless search",
+            "what_to_expect": "The court hears how the evidence was obtained.",
+            "what_to_say": "Your Honor, the search was conducted without a warrant, so the burden is on the prosecution to prove an exception applies.",
+            "what_to_do": "Make the court note that no warrant was obtained.",
+            "tips": "Once a warrantless search is shown, the prosecution must justify it.",
+            "slot": True
+        },
+        {
+            "stage": "Questioning the officers",
+            "what_to_expect": "Officers testify about the stop, search and seizure.",
+            "what_to_say": "Officer, what specific facts did you observe before you decided to search?",
+            "what_to_do": "Walk through your timeline and pin down each decision point.",
+            "tips": "Use inconsistencies with the police report to challenge credibility.",
+            "slot": True
+        },
+        {
+            "stage": "Argument for suppression",
+            "what_to_expect": "Both sides argue whether the evidence should be excluded.",
+            "what_to_say": "Your Honor, the evidence is fruit of the poisonous tree under Wong Sun v. United States and must be suppressed.",
+            "what_to_do": "Connect each piece of evidence to the initial violation.",
+            "tips": "Explain why each exception the prosecution relies on does not apply.",
+            "slot": True
+        }
+    ],
+    'trial': [
+        {
+            "stage": "Opening statement",
+            "what_to_expect": "Each side previews its case.",
+            "what_to_say": "The evidence will show that the prosecution cannot prove every element of this charge beyond a reasonable doubt.",
+            "what_to_do": "Speak to the judge or jury, not the prosecutor.",
+            "tips": "Keep it simple and tell a clear story.",
+            "slot": True
+        },
+        {
+            "stage": "Prosecution's case and cross-examination",
+            "what_to_expect": "The prosecution calls witnesses; you may cross-examine each.",
+            "what_to_say": "Objection, Your Honor, hearsay.",
+            "what_to_do": "Object promptly with a specific legal ground and ask short, leading questions.",
+            "tips": "Objections preserve issues for appeal.",
+            "slot": True
+        },
+        {
+            "stage": "Defense case",
+            "what_to_expect": "You may present witnesses and evidence, and decide whether to testify.",
+            "what_to_say": "",
+            "what_to_do": "Introduce exhibits by having them marked and identified.",
+            "tips": "You have a right not to testify; the jury may not hold it against you."
+        },
+        {
+            "stage": "Closing argument",
+            "what_to_expect": "Each side summarizes the evidence.",
+            "what_to_say": "The prosecution has not proven its case beyond a reasonable doubt, and you must find me not guilty.",
+            "what_to_do": "Go through the elements and the gaps in the evidence.",
+            "tips": "End with the reasonable doubt standard.",
+            "slot": True
+        }
+    ],
+    'sentencing': [
+        {
+            "stage": "Presentence report and prosecution recommendation",
+            "what_to_expect": "The court reviews the presentence report and hears the prosecution's recommendation.",
+            "what_to_say": "Your Honor, I would like to correct the following errors in the presentence report.",
+            "what_to_do": "Point out any factual errors before sentence is imposed.",
+            "tips": "Errors not raised now are hard to fix later."
+        },
+        {
+            "stage": "Mitigation",
+            "what_to_expect": "You present the reasons for a lesser sentence.",
+            "what_to_say": "Your Honor, I ask the court to consider my circumstances and the steps I have taken since the charges.",
+            "what_to_do": "Hand up character letters and proof of treatment, education or employment.",
+            "tips": "Propose specific alternatives to incarceration.",
+            "slot": True
+        },
+        {
+            "stage": "Allocution",
+            "what_to_expect": "The judge asks if you wish to speak before sentence is imposed.",
+            "what_to_say": "Your Honor, I take this seriously and I am committed to meeting every condition the court sets.",
+            "what_to_do": "Stand, speak sincerely, and keep it brief.",
+            "tips": "Do not argue guilt at this stage if it could affect an appeal.",
+            "slot": True
+        }
+    ]
+}
+
+DEFAULT_STAGES = [
+    {
+        "stage": "Hearing on the matter before the court",
+        "what_to_expect": "The judge hears from both sides on the issue scheduled for today.",
+        "what_to_say": "Your Honor, I am representing myself and I am prepared to proceed.",
+        "what_to_do": "Follow your outline and address the judge directly.",
+        "tips": "Ask the court to explain any procedure you do not understand.",
+        "slot": True
+    }
+]
+
+# Used when the case-specific rights and challenges cannot be generated
+DEFAULT_ASSERTING_RIGHTS = [
+    {
+        "right": "Right to a speedy trial",
+        "when_to_assert": "At every appearance, especially when a continuance is requested",
+        "what_to_say": "Your Honor, I object to any continuance and I assert my right to a speedy trial.",
+        "possible_responses": "If the court grants a continuance anyway, ask that the delay be attributed to the prosecution on the record."
+    },
+    {
+        "right": "Right to discovery and exculpatory evidence",
+        "when_to_assert": "At the first appearance and whenever evidence has not been provided",
+        "what_to_say": "Your Honor, I request all discovery, including any exculpatory evidence under Brady v. Maryland.",
+        "possible_responses": "If the prosecution says it is not ready, ask the court to set a deadline."
+    }
+]
+
+DEFAULT_POTENTIAL_CHALLENGES = [
+    {
+        "challenge": "The judge suggests you should not represent yourself",
+        "how_to_handle": "Respectfully state that you understand the risks and are choosing to exercise your right to self-representation under Faretta v. California.",
+        "fallback_strategy": "Ask for standby counsel while keeping control of your defense."
+    },
+    {
+        "challenge": "You are cut off before finishing an argument",
+        "how_to_handle": "Ask: \"Your Honor, may I briefly complete my point for the record?\"",
+        "fallback_strategy": "File your argument in writing afterwards so it is in the record."
+    }
+]
+
+CONCLUSION = {
+    "action": "Confirm the outcome and next date",
+    "what_to_say": "Thank you, Your Honor. May I confirm the next court date and any deadlines?",
+    "next_steps": "Get a copy of any order, calendar every deadline, and request the transcript if you may need it later."
+}
+
+PROCEEDING_NEXT_STEPS = {
+    'arraignment': "Follow up in writing on your discovery request and calendar your speedy trial deadline.",
+    'bail_hearing': "Comply strictly with every release condition; violations can lead to detention.",
+    'preliminary_hearing': "Order the hearing transcript and use the testimony to prepare suppression motions.",
+    'motion_hearing': "If the motion is denied, make sure your objection is on the record for appeal.",
+    'suppression_hearing': "If evidence is suppressed, consider a motion to dismiss if the remaining evidence is insufficient.",
+    'trial': "If convicted, note the deadline for post-trial motions and the notice of appeal.",
+    'sentencing': "Note the deadline for filing an appeal and the start date of any sentence or conditions."
+}
+
+
+def _build_skeleton(proceeding_type, court_type):
+    """Assemble the skeleton for one proceeding type and court type"""
+    preparation = copy.deepcopy(PREPARATION)
+    if proceeding_type in PROCEEDING_PREPARATION:
+        preparation.insert(1, {
+            "step": f"Prepare for the {PROCEEDING_NAMES[proceeding_type].lower()}",
+            "details": PROCEEDING_PREPARATION[proceeding_type],
+            "importance": "This is what the court will expect you to have ready at this proceeding."
+        })
+
+    entrance = copy.deepcopy(COURTROOM_ENTRANCE)
+    if court_type in COURT_ENTRANCE_NOTES:
+        entrance.insert(0, dict(COURT_ENTRANCE_NOTES[court_type]))
+
+    conclusion = dict(CONCLUSION)
+    if proceeding_type in PROCEEDING_NEXT_STEPS:
+        conclusion["next_steps"] = f"{PROCEEDING_NEXT_STEPS[proceeding_type]} {conclusion['next_steps']}"
+
+    name = PROCEEDING_NAMES.get(proceeding_type, proceeding_type.replace('_', ' ').title())
+    return {
+        "script_title": f"Court Appearance Script: {name}",
+        "preparation": preparation,
+        "courtroom_entrance": entrance,
+        "main_proceeding": copy.deepcopy(STAGES.get(proceeding_type, DEFAULT_STAGES)),
+        "asserting_rights": copy.deepcopy(DEFAULT_ASSERTING_RIGHTS),
+        "potential_challenges": copy.deepcopy(DEFAULT_POTENTIAL_CHALLENGES),
+        "conclusion": [conclusion]
+    }
+
+
+COURT_TYPES = ('federal', 'state', 'appellate', 'municipal', 'other')
+
+# Built once at import for every proceeding and court type
+SKELETONS = {
+    (proceeding_type, court_type): _build_skeleton(proceeding_type, court_type)
+    for proceeding_type in PROCEEDING_NAMES
+    for court_type in COURT_TYPES
+}
+
+
+def get_skeleton(proceeding_type, court_type):
+    """Return a fresh copy of the skeleton for a proceeding type and court type"""
+    skeleton = SKELETONS.get((proceeding_type, court_type))
+    if skeleton is None:
+        skeleton = SKELETONS.get((proceeding_type, 'other')) or _build_skeleton(proceeding_type, court_type)
+    return copy.deepcopy(skeleton)
+
+
+def slot_stages(skeleton):
+    """Return the names of the main proceeding stages whose wording is case-specific"""
+    return [stage["stage"] for stage in skeleton["main_proceeding"] if stage.get("slot")]
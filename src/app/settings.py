@@ -1,9 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, abort
 from flask_login import login_required, current_user
 import os
 import sys
 
 import anthropic_helper
+import provider_clients
+import sql_profiler
 
 settings_bp = Blueprint('settings', __name__)
 
@@ -18,12 +20,9 @@ def settings():
             
             if anthropic_key:
                 # In a real deployment, you would store this securely in a database
-                # For the demo, we'll set it as an environment variable
-                os.environ['ANTHROPIC_API_KEY'] = anthropic_key
-                
-                # Reinitialize the Anthropic helper with the new key
-                import importlib
-                importlib.reload(anthropic_helper)
+                # For the demo, we'll set it as an environment variable.
+                # The shared Anthropic client is rebuilt with the new key on next use.
+                provider_clients.set_api_key('anthropic', anthropic_key)
                 
                 flash('Anthropic API key set successfully! Claude AI is now available as a backup.', 'success')
             else:
@@ -38,3 +37,22 @@ def settings():
         'settings.html',
         anthropic_configured=anthropic_configured
     )
+
+@settings_bp.route('/admin/sql-profile', methods=['GET', 'POST'])
+@login_required
+def sql_profile():
+    """Slowest SQL statements and requests with too many statements (moderators only)"""
+    if not current_user.is_moderator():
+        abort(403)
+    
+    if request.method == 'POST':
+        sql_profiler.reset()
+        flash('SQL profile cleared.', 'success')
+        return redirect(url_for('settings.sql_profile'))
+    
+    return render_template(
+        'sql_profile.html',
+        profiler_config=sql_profiler.get_config(),
+        slowest=sql_profiler.slowest(),
+        flagged=sql_profiler.flagged_requests()
+    )
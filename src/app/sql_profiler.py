@@ -0,0 +1,181 @@
+"""
+SQL statement profiler and slow-query log.
+
+init_app() hooks SQLAlchemy engine events to time every statement and
+attribute it to the Flask endpoint and user of the request that ran it
+(statements from background threads are attributed to "background").
+
+- Statements slower than SQL_SLOW_QUERY_MS are logged as warnings.
+- The slowest SQL_PROFILER_KEEP statements are kept in memory, along with the
+  most recent requests that issued more than SQL_N_PLUS_ONE_THRESHOLD
+  statements (usually an N+1 query in a loop), for the admin page at
+  /admin/sql-profile.
+
+Only the shape of the parameters (their count and types) is recorded, never
+their values, since they can contain case details. The profile is per
+process.
+
+Environment:
+    SQL_PROFILER_ENABLED        set to 0 to disable profiling (default on)
+    SQL_SLOW_QUERY_MS           statements at least this slow are logged (default 200)
+    SQL_PROFILER_KEEP           slowest statements and flagged requests kept (default 50)
+    SQL_N_PLUS_ONE_THRESHOLD    statements per request that trigger a warning (default 50)
+"""
+import os
+import re
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+from flask import request, g, session, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MAX_STATEMENT_LENGTH = 2000
+
+_lock = threading.Lock()
+_sequence = itertools.count()
+# Min-heap of (duration, sequence, entry) so the fastest kept statement is dropped first
+_slowest = []
+_flagged = deque(maxlen=int(os.environ.get('SQL_PROFILER_KEEP', 50)))
+
+
+def get_config():
+    """Return the profiler settings from the environment"""
+    return {
+        "enabled": os.environ.get('SQL_PROFILER_ENABLED', '1') != '0',
+        "slow_ms": float(os.environ.get('SQL_SLOW_QUERY_MS', 200)),
+        "keep": int(os.environ.get('SQL_PROFILER_KEEP', 50)),
+        "n_plus_one_threshold": int(os.environ.get('SQL_N_PLUS_ONE_THRESHOLD', 50))
+    }
+
+
+def _shape(value):
+    """Describe parameters by count and type without their values"""
+    if isinstance(value, dict):
+        return {key: type(item).__name__ for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and isinstance(value[0], (dict, list, tuple)):
+            # executemany: one shape for the batch
+            return {"rows": len(value), "each": _shape(value[0])}
+        return [type(item).__name__ for item in value]
+    return type(value).__name__
+
+
+def normalize(statement):
+    """Collapse whitespace and literals so repeats of one query group together"""
+    statement = re.sub(r"'[^']*'", "?", statement)
+    statement = re.sub(r"\b\d+\b", "?", statement)
+    statement = re.sub(r"\(\s*\?(\s*,\s*\?)*\s*\)", "(?)", statement)
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def _attribution():
+    """Return (endpoint, user id) of the current request"""
+    if not has_request_context():
+        return "background", None
+    # Read the id from the session rather than current_user, which may
+    # itself have to run a query to load the user
+    return request.endpoint or request.path, session.get('_user_id')
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['sql_profiler_start'] = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('sql_profiler_start', None)
+    if start is None:
+        return
+    duration_ms = (time.perf_counter() - start) * 1000
+    config = get_config()
+    if not config["enabled"]:
+        return
+
+    endpoint, user_id = _attribution()
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_duration_ms = g.get('sql_duration_ms', 0.0) + duration_ms
+        repeats = g.setdefault('sql_repeats', Counter())
+        repeats[normalize(statement)] += 1
+
+    entry = {
+        "statement": statement[:MAX_STATEMENT_LENGTH],
+        "parameters": _shape(parameters),
+        "executemany": executemany,
+        "duration_ms": round(duration_ms, 2),
+        "rows": cursor.rowcount if cursor is not None else -1,
+        "endpoint": endpoint,
+        "user_id": user_id,
+        "at": datetime.utcnow().isoformat()
+    }
+    if duration_ms >= config["slow_ms"]:
+        logging.warning(f"Slow query ({duration_ms:.0f} ms) on {endpoint} for user {user_id}: "
+                        f"{normalize(statement)[:500]}")
+
+    with _lock:
+        item = (duration_ms, next(_sequence), entry)
+        if len(_slowest) < config["keep"]:
+            heapq.heappush(_slowest, item)
+        elif duration_ms > _slowest[0][0]:
+            heapq.heapreplace(_slowest, item)
+
+
+def _end_request(exc=None):
+    count = g.pop('sql_statements', 0)
+    duration_ms = g.pop('sql_duration_ms', 0.0)
+    repeats = g.pop('sql_repeats', None)
+    config = get_config()
+    if not config["enabled"] or count <= config["n_plus_one_threshold"]:
+        return
+
+    endpoint, user_id = _attribution()
+    top = repeats.most_common(3) if repeats else []
+    logging.warning(f"{endpoint} issued {count} SQL statements ({duration_ms:.0f} ms) for user {user_id}; "
+                    f"possible N+1. Most repeated: "
+                    + "; ".join(f"{times}x {statement[:200]}" for statement, times in top))
+    with _lock:
+        _flagged.append({
+            "endpoint": endpoint,
+            "path": request.path,
+            "user_id": user_id,
+            "statements": count,
+            "duration_ms": round(duration_ms, 2),
+            "repeated": [{"statement": statement, "count": times} for statement, times in top],
+            "at": datetime.utcnow().isoformat()
+        })
+
+
+def slowest():
+    """Return the slowest statements seen by this process, slowest first"""
+    with _lock:
+        return [entry for _, _, entry in sorted(_slowest, reverse=True)]
+
+
+def flagged_requests():
+    """Return recent requests over the statement threshold, newest first"""
+    with _lock:
+        return list(reversed(_flagged))
+
+
+def reset():
+    """Clear the collected profile"""
+    with _lock:
+        _slowest.clear()
+        _flagged.clear()
+
+
+def init_app(app):
+    """Profile SQL statements and flag requests that issue too many"""
+    if 'sql_profiler' in app.extensions:
+        return
+    app.extensions['sql_profiler'] = True
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_execute)
+    app.teardown_request(_end_request)
@@ -9,6 +9,7 @@ import stripe
 from flask import Blueprint, render_template, redirect, url_for, request, flash, session, jsonify
 from flask_login import current_user, login_required
 from models import db, User, Subscription
+import attribution
 
 # Initialize Stripe with API key
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
@@ -113,6 +114,7 @@ def subscription_success():
                 subscription.start_date = datetime.utcnow()
             
             db.session.commit()
+            attribution.mark_conversion('premium')
             
             flash("Thank you for subscribing to Premium! Your account has been upgraded.", "success")
             return render_template('subscription_success.html')
@@ -0,0 +1,380 @@
+"""
+Structured output handling for LLM JSON responses.
+
+- extract_json: finds the first complete JSON object in model output (which
+  may be wrapped in prose or markdown fences) with a single linear scan.
+- SCHEMAS / apply_schema: the expected top-level fields of each analysis type,
+  defined once, with aliases, light type coercion and default filling.
+- StreamingJSONParser: consumes a streamed response chunk by chunk and can
+  return the complete part of the JSON and check it against a schema before
+  the response has finished. anthropic_helper streams JSON requests through
+  it to stop at the end of the object and keep the completed fields of a
+  truncated response.
+"""
+import json
+import copy
+import logging
+
+import tracing
+
+_OPENERS = {"{": "}", "[": "]"}
+_CLOSERS = {"}", "]"}
+
+
+class Field:
+    """Expected top-level field of a structured response"""
+
+    def __init__(self, type, default, aliases=(), normalize=None):
+        self.type = type
+        self.default = default
+        self.aliases = aliases
+        # Applied to numeric values after coercion
+        self.normalize = normalize
+
+    def get_default(self):
+        """Return a fresh copy of the default (callables are invoked)"""
+        if callable(self.default):
+            return self.default()
+        return copy.deepcopy(self.default)
+
+
+def probability(value, percent=False):
+    """A probability on the 0-1 scale, from a fraction or a percentage (75, "75%")"""
+    if percent or value > 1:
+        value /= 100.0
+    return min(1.0, max(0.0, value))
+
+
+SCHEMAS = {
+    # anthropic_helper analyses
+    "rights_violations": {
+        "rights_violations": Field(list, [], aliases=("violations",))
+    },
+    "recommended_documents": {
+        "recommended_documents": Field(list, [], aliases=("documents",))
+    },
+    "relevant_cases": {
+        "relevant_cases": Field(list, [], aliases=("cases", "case_law"))
+    },
+    "evidence_relevance": {
+        "evidence_analysis": Field(list, [], aliases=("analysis",))
+    },
+    "exhibit_organization": {
+        "exhibit_plan": Field(list, [], aliases=("exhibits", "plan"))
+    },
+    # Stored LegalAnalysis types
+    "case_law": {
+        "rights_assessment": Field(list, []),
+        "case_law_suggestions": Field(list, []),
+        "winning_strategy": Field(dict, {})
+    },
+    "document_recommendations": {
+        "document_recommendations": Field(list, [])
+    },
+    "interview_analysis": {
+        "constitutional_violations": Field(list, []),
+        "speedy_trial_violations": Field(list, []),
+        "fruit_of_poisonous_tree": Field(list, []),
+        "systemic_bias_issues": Field(list, []),
+        "defense_strategy": Field(dict, {})
+    },
+    # Per-category interview sub-results and the strategy built from them (client_interview)
+    "interview_category": {
+        "constitutional_violations": Field(list, []),
+        "speedy_trial_violations": Field(list, []),
+        "fruit_of_poisonous_tree": Field(list, []),
+        "systemic_bias_issues": Field(list, [])
+    },
+    "interview_strategy": {
+        "defense_strategy": Field(dict, {})
+    },
+    "court_script": {
+        "script_title": Field(str, "Court Appearance Script"),
+        "preparation": Field(list, []),
+        "courtroom_entrance": Field(list, []),
+        "main_proceeding": Field(list, []),
+        "asserting_rights": Field(list, []),
+        "potential_challenges": Field(list, []),
+        "conclusion": Field(list, [])
+    },
+    # Case-specific sections filled into a court script skeleton (court_script)
+    "court_script_proceeding": {
+        "preparation": Field(list, []),
+        "what_to_say": Field(dict, {})
+    },
+    "court_script_rights": {
+        "asserting_rights": Field(list, [])
+    },
+    "court_script_challenges": {
+        "potential_challenges": Field(list, [])
+    },
+    "success_probability": {
+        "success_probability": Field(float, 0.5, normalize=probability),
+        "key_factors": Field(list, [], aliases=("probability_factors",)),
+        "improvement_suggestions": Field(list, [])
+    },
+    # Evidence transcript analysis (audio_processor)
+    "transcript_analysis": {
+        "key_points": Field(list, ["No key points identified"]),
+        "legal_claims": Field(list, ["No specific legal claims identified"]),
+        "relevance": Field(str, "The relevance to the case could not be determined."),
+        "actionable_insights": Field(str, "No specific actionable insights could be determined.")
+    }
+}
+
+
+@tracing.traced("parse.extract_json")
+def extract_json(text, allow_array=False):
+    """
+    Return the first complete JSON object in text, or None.
+
+    Runs in a single pass: brackets are matched with a stack while skipping
+    string contents, and a candidate is only parsed once its outermost bracket
+    closes. A candidate that fails to parse is skipped past, never rescanned.
+    """
+    if not text:
+        return None
+    if not isinstance(text, str):
+        text = str(text)
+
+    stripped = text.strip()
+    if stripped[:1] in ("{", "[") and stripped[-1:] in ("}", "]"):
+        try:
+            value = json.loads(stripped)
+            if isinstance(value, dict) or (allow_array and isinstance(value, list)):
+                return value
+        except ValueError:
+            pass
+
+    stack = []
+    start = None
+    in_string = False
+    escaped = False
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            if stack:
+                in_string = True
+        elif char in _OPENERS:
+            if not stack:
+                if char == "[" and not allow_array:
+                    continue
+                start = i
+            stack.append(_OPENERS[char])
+        elif char in _CLOSERS and stack:
+            if char != stack[-1]:
+                # Mismatched bracket: abandon this candidate
+                stack = []
+                start = None
+                continue
+            stack.pop()
+            if not stack:
+                try:
+                    return json.loads(text[start:i + 1])
+                except ValueError:
+                    start = None
+
+    return None
+
+
+def _default_for(name, field, defaults):
+    """Return the per-call override for a field if given, else the schema default"""
+    override = defaults.get(name)
+    if override is None:
+        return field.get_default()
+    return override() if callable(override) else copy.deepcopy(override)
+
+
+def apply_schema(data, analysis_type, defaults=None):
+    """
+    Fill in and normalize the top-level fields of a parsed response in place.
+
+    Missing fields are taken from an alias or filled with their default;
+    a bare value where a list is expected is wrapped in a list, and numeric
+    strings are converted for numeric fields (probabilities to the 0-1
+    scale, so 75 and "75%" both become 0.75). `defaults` overrides schema
+    defaults (values or callables) for this call. Returns the data.
+    """
+    schema = SCHEMAS.get(analysis_type)
+    if schema is None or not isinstance(data, dict):
+        return data
+    defaults = defaults or {}
+
+    for name, field in schema.items():
+        if name not in data:
+            for alias in field.aliases:
+                if alias in data:
+                    data[name] = data.pop(alias)
+                    break
+
+        value = data.get(name)
+        if value is None:
+            data[name] = _default_for(name, field, defaults)
+            continue
+
+        if field.type is float:
+            if not isinstance(value, bool) and isinstance(value, (int, float, str)):
+                text = str(value).strip()
+                try:
+                    number = float(text.rstrip("%"))
+                except ValueError:
+                    pass
+                else:
+                    data[name] = field.normalize(number, text.endswith("%")) if field.normalize else number
+                    continue
+        elif isinstance(value, field.type):
+            continue
+        elif field.type is list and isinstance(value, (str, dict)):
+            data[name] = [value]
+            continue
+
+        logging.warning(f"{analysis_type}: field '{name}' has unexpected type {type(value).__name__}, using default")
+        data[name] = _default_for(name, field, defaults)
+
+    return data
+
+
+def check_types(data, analysis_type):
+    """Return a list of fields present in data whose type does not match the schema"""
+    schema = SCHEMAS.get(analysis_type, {})
+    errors = []
+    for name, field in schema.items():
+        if name in data and data[name] is not None:
+            expected = (int, float) if field.type is float else field.type
+            if not isinstance(data[name], expected):
+                errors.append(f"{name}: expected {field.type.__name__}, got {type(data[name]).__name__}")
+    return errors
+
+
+def parse_response(text, analysis_type=None, defaults=None):
+    """Extract JSON from model output and apply the schema; None if no JSON is found"""
+    data = extract_json(text)
+    if data is None:
+        return None
+    if analysis_type:
+        apply_schema(data, analysis_type, defaults)
+    return data
+
+
+class StreamingJSONParser:
+    """
+    Incremental parser for a JSON object arriving in chunks.
+
+    Each character is examined once. Where a value has just completed (before
+    a comma, after a closed container) and the document could be cut and
+    closed without leaving an unfinished object behind, the position and the
+    open-bracket stack are recorded, so partial() returns only values received
+    in full: a list holds its completed elements, never an empty placeholder
+    for the one still arriving.
+    """
+
+    def __init__(self, analysis_type=None):
+        self.analysis_type = analysis_type
+        self.buffer = []
+        self.length = 0
+        self.started = False
+        self.complete = False
+        # Number of top-level fields whose values have been fully received
+        self.fields_completed = 0
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._safe_end = None
+        self._safe_closers = ""
+
+    def feed(self, chunk):
+        """Consume the next chunk of streamed text; returns True once the object is complete"""
+        if self.complete or not chunk:
+            return self.complete
+
+        for char in chunk:
+            if not self.started:
+                if char != "{":
+                    continue
+                self.started = True
+
+            self.buffer.append(char)
+            self.length += 1
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in _OPENERS:
+                self._stack.append(_OPENERS[char])
+                if len(self._stack) == 1:
+                    self._mark_safe(self.length)
+            elif char in _CLOSERS and self._stack:
+                self._stack.pop()
+                if not self._stack:
+                    self.fields_completed += 1
+                    self.complete = True
+                    break
+                self._mark_safe(self.length)
+            elif char == ",":
+                if len(self._stack) == 1:
+                    self.fields_completed += 1
+                self._mark_safe(self.length - 1)
+
+        return self.complete
+
+    def _mark_safe(self, end):
+        # Cutting inside a nested object would return it with fields missing
+        if "}" in self._stack[1:]:
+            return
+        self._safe_end = end
+        self._safe_closers = "".join(reversed(self._stack))
+
+    def text(self):
+        """Return the JSON text received so far"""
+        return "".join(self.buffer)
+
+    def result(self):
+        """Parse the complete object, applying the schema; None if not complete or invalid"""
+        if not self.complete:
+            return None
+        try:
+            data = json.loads(self.text())
+        except ValueError:
+            return None
+        return apply_schema(data, self.analysis_type) if self.analysis_type else data
+
+    def partial(self):
+        """Return the fields completed so far as a dict (without default filling)"""
+        if self.complete:
+            try:
+                return json.loads(self.text())
+            except ValueError:
+                return None
+        if self._safe_end is None:
+            return {}
+        candidate = "".join(self.buffer[:self._safe_end])
+        try:
+            return json.loads(candidate + self._safe_closers)
+        except ValueError:
+            return None
+
+    def errors(self):
+        """Return schema type errors among the fields completed so far"""
+        if not self.analysis_type:
+            return []
+        data = self.partial()
+        if not isinstance(data, dict):
+            return []
+        return check_types(data, self.analysis_type)
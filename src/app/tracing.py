@@ -0,0 +1,401 @@
+"""
+Tracing spans for the AI pipelines.
+
+Each request gets a root span, and the stages inside it (provider attempts,
+JSON parsing, fallback hops and analysis writes) get child spans with their
+duration, outcome and attributes such as the model and token counts, so a
+slow case_ai_analysis can be broken down afterwards.
+
+Spans follow the OpenTelemetry data model (W3C trace and span ids, parent
+span, start and end times in Unix nanoseconds, attributes, status) and an
+incoming `traceparent` header is continued. The exporter is chosen with
+TRACING_EXPORTER:
+    file           one JSON span per line in TRACING_FILE (default), written in
+                   batches by a background thread in each process
+    console        the same lines through logging
+    opentelemetry  hand spans to the opentelemetry API, so whatever SDK and
+                   exporter the process configured receives them (the
+                   opentelemetry packages are optional and only needed here)
+    none           tracing off
+
+With the opentelemetry exporter an incoming traceparent becomes the remote
+parent of the request span, so the SDK continues the caller's trace.
+
+Code outside a request can open its own root span with span(). Functions
+handed to other threads keep their parent span when wrapped with
+ai_usage.bind().
+
+Environment:
+    TRACING_EXPORTER        file, console, opentelemetry or none (default file)
+    TRACING_FILE            span file for the file exporter (default traces.jsonl in the temp directory)
+    TRACING_MAX_FILE_MB     size at which the span file is rotated to <file>.1 (default 50)
+    TRACING_FLUSH_SECONDS   seconds between span file writes (default 1)
+    TRACING_MAX_BUFFER      spans kept waiting for the writer; more are dropped (default 10000)
+"""
+import os
+import re
+import json
+import time
+import atexit
+import logging
+import secrets
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+# Span file lines written at once by the writer; more wake it early
+BATCH_SIZE = 500
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+_file_lock = threading.Lock()
+
+# Span file lines waiting for this process's writer
+_buffer = []
+_buffer_lock = threading.Lock()
+_wake = threading.Event()
+_dropped = 0
+_thread = None
+_thread_pid = None
+_thread_lock = threading.Lock()
+
+
+def get_exporter():
+    exporter = os.environ.get('TRACING_EXPORTER', 'file').lower()
+    if exporter == 'opentelemetry' and otel_trace is None:
+        return 'none'
+    return exporter
+
+
+def _attribute(value):
+    """Coerce a value to a type span attributes accept"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class Span:
+    """A timed pipeline stage"""
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {}
+        self.events = []
+        self.status = "UNSET"
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.set_attributes(attributes or {})
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = _attribute(value)
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, attributes=None):
+        self.events.append({"name": name, "timeUnixNano": time.time_ns(),
+                            "attributes": {k: _attribute(v) for k, v in (attributes or {}).items()}})
+
+    def record_exception(self, exc):
+        self.add_event("exception", {"exception.type": type(exc).__name__, "exception.message": str(exc)[:500]})
+        self.set_error(type(exc).__name__)
+
+    def set_error(self, message=None):
+        self.status = "ERROR"
+        self.status_message = message
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.status == "UNSET":
+            self.status = "OK"
+        _export(self)
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 2),
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": {"code": self.status, "message": self.status_message}
+        }
+
+
+class _OtelSpan:
+    """Span interface over an opentelemetry span"""
+
+    def __init__(self, span):
+        self._span = span
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self._span.set_attribute(key, _attribute(value))
+
+    def set_attributes(self, attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name, attributes=None):
+        self._span.add_event(name, {k: _attribute(v) for k, v in (attributes or {}).items()})
+
+    def record_exception(self, exc):
+        self._span.record_exception(exc)
+        self.set_error(type(exc).__name__)
+
+    def set_error(self, message=None):
+        self._span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, message))
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, attributes):
+        pass
+
+    def add_event(self, name, attributes=None):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+    def set_error(self, message=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _file_path():
+    return os.environ.get('TRACING_FILE') or os.path.join(tempfile.gettempdir(), 'traces.jsonl')
+
+
+def _setting(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _export(span):
+    global _dropped
+    line = json.dumps(span.to_dict(), default=str)
+    if get_exporter() == 'console':
+        logging.info(f"span {line}")
+        return
+    _start_writer()
+    with _buffer_lock:
+        if len(_buffer) >= _setting('TRACING_MAX_BUFFER', 10000):
+            _dropped += 1
+            return
+        _buffer.append(line)
+        if len(_buffer) >= BATCH_SIZE:
+            _wake.set()
+
+
+def flush():
+    """Write buffered spans to the span file; returns the number written"""
+    global _dropped
+    with _buffer_lock:
+        lines = _buffer[:]
+        _buffer.clear()
+        dropped, _dropped = _dropped, 0
+    if dropped:
+        logging.warning(f"Dropped {dropped} trace spans while the buffer was full")
+    if not lines:
+        return 0
+    path = _file_path()
+    max_bytes = _setting('TRACING_MAX_FILE_MB', 50) * 1024 * 1024
+    try:
+        with _file_lock:
+            if os.path.exists(path) and os.path.getsize(path) > max_bytes:
+                os.replace(path, path + ".1")
+            with open(path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+    except OSError as e:
+        logging.error(f"Could not write {len(lines)} trace spans to {path}: {e}")
+        return 0
+    return len(lines)
+
+
+def _run_forever():
+    while True:
+        _wake.wait(_setting('TRACING_FLUSH_SECONDS', 1))
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            logging.error(f"Error writing trace spans: {e}")
+
+
+def _start_writer():
+    """Start the span writer for this process if it is not already running"""
+    global _thread, _thread_pid
+    if _thread_pid == os.getpid():
+        return
+    with _thread_lock:
+        # Threads do not survive a fork, so each worker process starts its own
+        if _thread_pid == os.getpid():
+            return
+        if _thread_pid is not None:
+            # Spans buffered before the fork are the parent's to write
+            with _buffer_lock:
+                _buffer.clear()
+        _thread = threading.Thread(target=_run_forever, name="trace-writer", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def _flush_at_exit():
+    if _thread_pid == os.getpid():
+        try:
+            flush()
+        except Exception as e:
+            logging.error(f"Error writing trace spans at exit: {e}")
+
+
+atexit.register(_flush_at_exit)
+
+
+def current_span():
+    """Return the active span, or a no-op span if there is none"""
+    return _current.get() or NOOP_SPAN
+
+
+def set_attribute(key, value):
+    """Set an attribute on the active span"""
+    current_span().set_attribute(key, value)
+
+
+def _otel_parent(trace_id, parent_id, trace_flags):
+    """An opentelemetry context whose current span is the remote parent, or None"""
+    if not (trace_id and parent_id) or isinstance(_current.get(), _OtelSpan):
+        return None
+    parent = otel_trace.SpanContext(trace_id=int(trace_id, 16), span_id=int(parent_id, 16), is_remote=True,
+                                    trace_flags=otel_trace.TraceFlags(trace_flags))
+    return otel_trace.set_span_in_context(otel_trace.NonRecordingSpan(parent))
+
+
+@contextmanager
+def span(name, attributes=None, trace_id=None, parent_id=None, trace_flags=1):
+    """
+    Time the block as a child of the active span (or as a new root span, the
+    child of a remote parent if trace_id and parent_id are given). An
+    exception leaving the block marks the span as failed; setting an
+    'outcome' attribute other than 'ok' does too.
+    """
+    exporter = get_exporter()
+    if exporter == 'none':
+        yield NOOP_SPAN
+        return
+
+    if exporter == 'opentelemetry':
+        tracer = otel_trace.get_tracer("due_process_ai")
+        with tracer.start_as_current_span(name, context=_otel_parent(trace_id, parent_id, trace_flags),
+                                          record_exception=False, set_status_on_exception=False) as otel_span:
+            wrapped = _OtelSpan(otel_span)
+            wrapped.set_attributes(attributes or {})
+            token = _current.set(wrapped)
+            try:
+                yield wrapped
+            except BaseException as e:
+                wrapped.record_exception(e)
+                raise
+            finally:
+                _current.reset(token)
+        return
+
+    parent = _current.get()
+    if trace_id is None and isinstance(parent, Span):
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    current = Span(name, trace_id or secrets.token_hex(16), parent_id, attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        outcome = current.attributes.get("outcome")
+        if outcome not in (None, "ok") and current.status != "ERROR":
+            current.set_error(str(outcome))
+        current.end()
+
+
+def traced(name=None, **attributes):
+    """Decorator running the function inside a span named after it"""
+    def decorator(fn):
+        span_name = name or f"{fn.__module__}.{fn.__name__}"
+
+        @wraps(fn)
+        def wrapped(*args, **kwargs):
+            with span(span_name, attributes):
+                return fn(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def _start_request_span():
+    from flask import request, g
+    attributes = {
+        "http.method": request.method,
+        "http.route": request.url_rule.rule if request.url_rule else None,
+        "http.target": request.path,
+        "flask.endpoint": request.endpoint
+    }
+    trace_id = parent_id = None
+    trace_flags = 1
+    match = TRACEPARENT.match(request.headers.get('traceparent', ''))
+    if match:
+        trace_id, parent_id, flags = match.groups()
+        trace_flags = int(flags, 16)
+    manager = span(f"{request.method} {request.endpoint or 'unmatched'}", attributes, trace_id, parent_id,
+                   trace_flags)
+    g.tracing_request_span = (manager, manager.__enter__())
+
+
+def _end_request_span(response):
+    from flask import g
+    entry = g.get('tracing_request_span')
+    if entry is not None:
+        entry[1].set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            entry[1].set_error(f"HTTP {response.status_code}")
+    return response
+
+
+def _close_request_span(exc=None):
+    from flask import g
+    entry = g.pop('tracing_request_span', None)
+    if entry is None:
+        return
+    manager, request_span = entry
+    if exc is not None:
+        request_span.record_exception(exc)
+    manager.__exit__(None, None, None)
+
+
+def init_app(app):
+    """Open a root span for every request"""
+    if 'tracing' in app.extensions:
+        return
+    app.extensions['tracing'] = True
+
+    app.before_request(_start_request_span)
+    app.after_request(_end_request_span)
+    app.teardown_request(_close_request_span)